@@ -0,0 +1,75 @@
+"""
+Compare the threaded and asyncio download engines against a local MockEdgarServer.
+
+    python benchmarks/bench_download_engines.py --num_files 2000 --file_size 8192 --num_workers 16
+"""
+import time
+import shutil
+import argparse
+import tempfile
+
+from tqdm.auto import tqdm
+
+from secutils.edgar import File, SECContainer, DocumentDownloaderThread
+from secutils.aio import download_docs_async
+from secutils.ratelimit import RateLimiter
+from secutils.mock_edgar import MockEdgarServer
+
+
+def make_files(base_url, n):
+    files = []
+    for i in range(n):
+        partial_url = f'edgar/data/{1000 + i}/0001000{i:06d}-17-000001.txt'
+        f = File(form_type='10-K', company_name='BENCH CO', cik_number=str(1000 + i),
+                 date_filed='2017-2-9', partial_url=partial_url)
+        f.file_download_url = base_url + partial_url
+        files.append(f)
+    return files
+
+
+def run_threads(files, output_dir, num_workers):
+    sec_container = SECContainer()
+    sec_container.to_visit = set(files)
+    sec_container.downloaded = set()
+    sec_container.download_error = set()
+    limiter = RateLimiter(max_rps=1e9)
+    with tqdm(total=len(files), disable=True) as pbar:
+        sec_container.pbar = pbar
+        threads = [DocumentDownloaderThread(i, f'thread-{i}', output_dir, None, limiter) for i in range(num_workers)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+    return len(sec_container.downloaded)
+
+
+def run_async(files, output_dir, max_connections):
+    downloaded, _ = download_docs_async(files, output_dir, rate_limiter=RateLimiter(max_rps=1e9),
+                                        max_connections=max_connections)
+    return len(downloaded)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_files', default=2000, type=int)
+    parser.add_argument('--file_size', default=8192, type=int)
+    parser.add_argument('--num_workers', default=16, type=int, help='threads / pooled connections')
+    args = parser.parse_args()
+
+    with MockEdgarServer(file_size=args.file_size) as server:
+        for engine in ['thread', 'async']:
+            output_dir = tempfile.mkdtemp()
+            files = make_files(server.base_url, args.num_files)
+            connections = server.num_connections
+            start = time.perf_counter()
+            if engine == 'thread':
+                num_downloaded = run_threads(files, output_dir, args.num_workers)
+            else:
+                num_downloaded = run_async(files, output_dir, args.num_workers)
+            elapsed = time.perf_counter() - start
+            shutil.rmtree(output_dir)
+            print(f'{engine:>6}: {num_downloaded} files in {elapsed:.2f}s - '
+                  f'{num_downloaded / elapsed:.0f} files/s - '
+                  f'{server.num_connections - connections} connections opened')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+End-to-end download throughput of `python -m secutils.download_sec` against a local MockEdgarServer.
+
+Each run starts a fresh mock server serving synthetic master.zip quarters and filings, points a
+download_sec process at it with SECUTILS_EDGAR_URL and reports files/s, bytes/s, p50/p99 filing
+latency (first request until the body was sent, so throttled retries count) and the process' CPU
+time and peak RSS. Every combination of --engines, --num_workers and --max_rps is run; results are
+written as JSON that a later run can be compared against.
+
+    python benchmarks/bench_download_pipeline.py --index_rows 2000 --file_size 8192 --latency 0.02 \\
+        --throttle_rate 0.01 --engines thread async --num_workers 8 32 --output results.json
+    python benchmarks/bench_download_pipeline.py ... --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+
+import numpy as np
+
+import secutils
+from secutils.mock_edgar import MockEdgarServer
+
+# keys of a run that identify its configuration when comparing results
+RUN_KEYS = ('engine', 'num_workers', 'max_rps')
+# (metric, True if higher is better) shown by --compare
+COMPARED = (('files_per_second', True), ('bytes_per_second', True), ('latency_p50_ms', False),
+            ('latency_p99_ms', False), ('cpu_seconds', False), ('max_rss_mb', False), ('stored_mb', False))
+
+
+def download_command(args, engine, num_workers, max_rps, output_dir, cache_dir):
+    command = [sys.executable, '-m', 'secutils.download_sec', '--output_dir', output_dir, '--cache_dir', cache_dir,
+               '--start_year', str(args.year), '--end_year', str(args.year), '--quarters'] + \
+              [str(quarter) for quarter in args.quarters] + \
+              ['--engine', engine, '--num_workers', str(num_workers), '--max_rps', str(max_rps),
+               '--max_connections', str(num_workers), '--log_level', 'ERROR']
+    command += ['--compression', args.compression] if args.compression else []
+    return command + (['--form_types'] + args.form_types if args.form_types else [])
+
+
+def run_once(args, engine, num_workers, max_rps):
+    """run download_sec once against a fresh mock server - returns the run's metrics"""
+    output_dir, cache_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+    env = dict(os.environ)
+    # run the checked out package even when secutils is not installed
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(secutils.__file__)),
+                                                      env.get('PYTHONPATH')]))
+    try:
+        with MockEdgarServer(file_size=args.file_size, latency=args.latency, throttle_rate=args.throttle_rate,
+                             index_rows=args.index_rows, seed=args.seed) as server, \
+                tempfile.TemporaryFile() as log:
+            env['SECUTILS_EDGAR_URL'] = server.base_url
+            start = time.perf_counter()
+            process = subprocess.Popen(download_command(args, engine, num_workers, max_rps, output_dir, cache_dir),
+                                       env=env, stdout=log, stderr=log)
+            _, status, usage = os.wait4(process.pid, 0)
+            wall_seconds = time.perf_counter() - start
+            # reaped by wait4 for its resource usage - tell Popen not to wait on it again
+            process.returncode = status
+            if status != 0:
+                log.seek(0)
+                raise RuntimeError(f'download_sec exited with status {status}:\n{log.read()[-4000:].decode()}')
+            latencies = np.array(server.latencies) * 1000
+            num_files = len(latencies)
+            first, last = server.first_filing_at or start, server.last_filing_at or start
+            download_seconds = max(last - first, 1e-9)
+            # ru_maxrss is in KiB on Linux and bytes on macOS
+            max_rss = usage.ru_maxrss / 2 ** 20 if sys.platform == 'darwin' else usage.ru_maxrss / 2 ** 10
+            cpu_seconds = usage.ru_utime + usage.ru_stime
+            return {
+                'engine': engine,
+                'num_workers': num_workers,
+                'max_rps': max_rps,
+                'files': num_files,
+                'bytes': server.num_filing_bytes,
+                'wall_seconds': round(wall_seconds, 3),
+                'index_seconds': round(first - start, 3),
+                'download_seconds': round(download_seconds, 3),
+                'files_per_second': round(num_files / download_seconds, 1),
+                'bytes_per_second': round(server.num_filing_bytes / download_seconds),
+                'latency_p50_ms': round(float(np.percentile(latencies, 50)), 2) if num_files else None,
+                'latency_p99_ms': round(float(np.percentile(latencies, 99)), 2) if num_files else None,
+                'cpu_seconds': round(cpu_seconds, 2),
+                'cpu_utilization': round(cpu_seconds / wall_seconds, 2),
+                'max_rss_mb': round(max_rss, 1),
+                'stored_mb': round(stored_bytes(output_dir) / 2 ** 20, 2),
+                'requests': server.num_requests,
+                'throttled': server.num_throttled,
+                'connections': server.num_connections,
+            }
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def stored_bytes(output_dir):
+    """bytes of the downloaded filings on disk"""
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(output_dir)
+               for name in names if '.sqlite' not in name)
+
+
+def best_of(runs):
+    """the repeat with the highest files/s"""
+    return max(runs, key=lambda run: run['files_per_second'])
+
+
+def compare(results, baseline):
+    """print the change of every compared metric against the matching run of a baseline"""
+    previous = {tuple(run[key] for key in RUN_KEYS): run for run in baseline['runs']}
+    for run in results['runs']:
+        key = tuple(run[key] for key in RUN_KEYS)
+        if key not in previous:
+            print(f'{key}: not in baseline')
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED:
+            old, new = previous[key][metric], run[metric]
+            if old and new is not None:
+                change = (new - old) / old * 100
+                better = change > 0 if higher_is_better else change < 0
+                changes.append(f'{metric} {old:g} -> {new:g} ({change:+.1f}%{"" if better or not change else " worse"})')
+        print(f'{key}:\n    ' + '\n    '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index_rows', default=2000, type=int, help='filings in each synthetic quarter')
+    parser.add_argument('--year', default=2017, type=int)
+    parser.add_argument('--quarters', default=[1], nargs='+', type=int)
+    parser.add_argument('--form_types', nargs='+', default=None)
+    parser.add_argument('--file_size', default=8192, type=int, help='bytes per filing')
+    parser.add_argument('--latency', default=0.0, type=float, help='seconds the server delays every response')
+    parser.add_argument('--throttle_rate', default=0.0, type=float, help='fraction of requests answered with 429')
+    parser.add_argument('--engines', default=['thread', 'async'], nargs='+', choices=['thread', 'async'])
+    parser.add_argument('--num_workers', default=[8], nargs='+', type=int,
+                        help='download threads (thread engine) / pooled connections (async engine)')
+    parser.add_argument('--max_rps', default=[1e6], nargs='+', type=float, help='request budgets to compare')
+    parser.add_argument('--repeat', default=1, type=int, help='runs per configuration - the fastest is kept')
+    parser.add_argument('--compression', default=None, choices=['gzip', 'zstd'], help='store filings compressed')
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--output', default=None, help='write the results to this json file')
+    parser.add_argument('--compare', default=None, help='json results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    runs = []
+    for engine, num_workers, max_rps in itertools.product(args.engines, args.num_workers, args.max_rps):
+        run = best_of([run_once(args, engine, num_workers, max_rps) for _ in range(args.repeat)])
+        runs.append(run)
+        print(f'{engine:>6} workers={num_workers:<4} max_rps={max_rps:<9g} {run["files"]} files - '
+              f'{run["files_per_second"]:.0f} files/s - {run["bytes_per_second"] / 2 ** 20:.1f} MiB/s - '
+              f'p50 {run["latency_p50_ms"]} ms - p99 {run["latency_p99_ms"]} ms - '
+              f'cpu {run["cpu_seconds"]}s - rss {run["max_rss_mb"]} MiB - {run["throttled"]} throttled')
+
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    results = {'config': config, 'python': platform.python_version(), 'platform': platform.platform(),
+               'cpu_count': os.cpu_count(), 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'runs': runs}
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as infile:
+            compare(results, json.load(infile))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Compare a multi-quarter CIK / form type / date query against EdgarIndex with loading every cached
+quarter and masking it, as a loop of FormIDX objects does.
+
+    python benchmarks/bench_edgar_index.py --num_quarters 20 --num_lines 300000 --num_ciks 500
+"""
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from secutils.edgar import parse_master_index
+from secutils.edgar_index import EdgarIndex
+from secutils.index_cache import IndexCache, _apply_filters, _filters
+
+from bench_parse_index import synthetic_index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_quarters', default=20, type=int)
+    parser.add_argument('--num_lines', default=300000, type=int)
+    parser.add_argument('--num_ciks', default=500, type=int)
+    parser.add_argument('--cache_format', default='pickle')
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = IndexCache(cache_dir, args.cache_format)
+        periods = [(2000 + i // 4, i % 4 + 1) for i in range(args.num_quarters)]
+        for i, (year, quarter) in enumerate(periods):
+            cache.save(year, quarter, parse_master_index(synthetic_index(args.num_lines, seed=i).encode('utf-8')))
+        ciks = random.Random(0).sample(range(1000, 1800000), args.num_ciks)
+
+        index = EdgarIndex.for_cache_dir(cache_dir)
+        start = time.perf_counter()
+        index.update(cache)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scanned = [_apply_filters(cache.load(year, quarter), _filters(['8-K'], ciks)) for year, quarter in periods]
+        scan_time = time.perf_counter() - start
+
+        # first query opens and maps the partitions
+        start = time.perf_counter()
+        result = index.query(ciks=ciks, form_types=['8-K'])
+        cold_time = time.perf_counter() - start
+        start = time.perf_counter()
+        result = index.query(ciks=ciks, form_types=['8-K'], date_range=('2000-01-01', '2019-12-31'))
+        warm_time = time.perf_counter() - start
+        index.close()
+        assert len(result) == sum(len(df) for df in scanned)
+
+        print(f'quarters: {args.num_quarters} x {args.num_lines} rows - {args.num_ciks} CIKs - {len(result)} matches')
+        print(f'       build index: {build_time:.2f}s')
+        print(f'load + mask ({args.cache_format}): {scan_time * 1000:.0f} ms')
+        print(f'  EdgarIndex cold: {cold_time * 1000:.1f} ms')
+        print(f'  EdgarIndex warm: {warm_time * 1000:.1f} ms')
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main()
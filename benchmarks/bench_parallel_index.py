@@ -0,0 +1,58 @@
+"""
+Compare preparing several quarterly indices serially against the process pool, and the size of a
+packed index against a pickled DataFrame.
+
+    python benchmarks/bench_parallel_index.py --num_quarters 8 --num_lines 300000 --workers 4
+"""
+import io
+import time
+import pickle
+import zipfile
+import argparse
+
+from secutils.edgar import parse_master_index, read_master_zip
+from secutils.parallel import IndexParsePool, pack_index
+
+from bench_parse_index import synthetic_index
+
+
+def master_zip(text: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as outfile:
+        outfile.writestr('master.idx', text.encode('utf-8'))
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_quarters', default=8, type=int)
+    parser.add_argument('--num_lines', default=300000, type=int)
+    parser.add_argument('--workers', default=None, type=int)
+    args = parser.parse_args()
+
+    archives = [master_zip(synthetic_index(args.num_lines, seed=i)) for i in range(args.num_quarters)]
+
+    start = time.perf_counter()
+    serial = [parse_master_index(read_master_zip(content)) for content in archives]
+    serial_time = time.perf_counter() - start
+
+    with IndexParsePool(args.workers) as pool:
+        # warm the workers up so process start-up is not timed
+        pool.submit_zip(archives[0]).result()
+        start = time.perf_counter()
+        futures = [pool.submit_zip(content) for content in archives]
+        parallel = [future.result() for future in futures]
+        parallel_time = time.perf_counter() - start
+        workers = pool.max_workers
+    assert [len(df) for df in serial] == [packed['num_rows'] for packed in parallel]
+
+    frame_size = len(pickle.dumps(serial[0]))
+    packed_size = len(pickle.dumps(pack_index(serial[0])))
+    print(f'quarters: {args.num_quarters} x {args.num_lines} lines - workers: {workers}')
+    print(f'  serial: {serial_time:.2f}s')
+    print(f'    pool: {parallel_time:.2f}s ({serial_time / parallel_time:.1f}x)')
+    print(f'transfer: pickled DataFrame {frame_size / 2 ** 20:.1f} MiB - packed {packed_size / 2 ** 20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare the vectorized master.idx parser against the original per-line parser on a synthetic index,
+and the tiered decoder against running ftfy over the whole file.
+
+    python benchmarks/bench_parse_index.py --num_lines 1000000
+"""
+import time
+import random
+import argparse
+import tracemalloc
+
+import ftfy
+import pandas as pd
+
+from secutils.edgar import FormIDX, INDEX_HEADER, _strip_column
+from secutils.utils import decode_text, DecodeStats
+
+FORM_TYPES = ['10-K', '10-Q', '8-K', '4', 'S-1', 'S-1/A', 'DEF 14A', 'SC 13G']
+
+
+def synthetic_index(num_lines: int, seed: int=0) -> str:
+    rng = random.Random(seed)
+    lines = ['Description:           Master Index of EDGAR Dissemination Feed',
+             'Last Data Received:    June 30, 2017', '', INDEX_HEADER, '-' * 80]
+    for i in range(num_lines):
+        cik = rng.randint(1000, 1800000)
+        lines.append(f'{cik}|COMPANY {i} INC|{rng.choice(FORM_TYPES)}|2017-0{rng.randint(4, 6)}-{rng.randint(10, 28)}|'
+                     f'edgar/data/{cik}/{cik:010d}-17-{i:06d}.txt')
+    return '\n'.join(lines) + '\n'
+
+
+def legacy_parse(lines):
+    """original FormIDX._parse_index_lines plus the row-wise strip in _filter_form_type"""
+    split_line = lambda x: x.replace('\n', '').replace('\r', '').replace('\t', '').split('|')
+    master_index = pd.DataFrame([split_line(line) for line in lines if line.count('|')==4])
+    master_index.columns = ['CIK', 'Company Name', 'Form Type', 'Date Filed', 'Filename']
+    master_index = master_index.iloc[1:]
+    master_index['fname'] = master_index['Filename'].apply(lambda x: x.split('/')[-1])
+    master_index['Form Type'] = master_index['Form Type'].apply(lambda x: x.strip())
+    return master_index
+
+
+def vectorized_parse(text):
+    master_index = FormIDX.__new__(FormIDX)._parse_index_buffer(text)
+    master_index['Form Type'] = _strip_column(master_index['Form Type'])
+    return master_index
+
+
+def measure(fn, arg):
+    # time and trace separately - tracemalloc slows allocation-heavy code down considerably
+    start = time.perf_counter()
+    result = fn(arg)
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_lines', default=1000000, type=int)
+    args = parser.parse_args()
+
+    text = synthetic_index(args.num_lines)
+    legacy, legacy_time, legacy_peak = measure(lambda t: legacy_parse(t.split('\n')), text)
+    vectorized, vector_time, vector_peak = measure(vectorized_parse, text)
+    assert legacy.shape == vectorized.shape, (legacy.shape, vectorized.shape)
+    assert (legacy.values == vectorized.values).all()
+    print(f'lines: {args.num_lines}')
+    print(f'    legacy: {legacy_time:.2f}s - peak {legacy_peak / 2 ** 20:.0f} MiB')
+    print(f'vectorized: {vector_time:.2f}s - peak {vector_peak / 2 ** 20:.0f} MiB')
+    print(f'   speedup: {legacy_time / vector_time:.1f}x')
+
+    # a handful of non-ASCII company names, as in real indices
+    raw = text.replace('COMPANY 7 INC', 'CAFÃ© 7 INC').replace('COMPANY 9 INC', 'NAÏVE 9 INC').encode('utf-8')
+    start = time.perf_counter()
+    full = ftfy.fix_text(raw.decode('utf-8'))
+    full_time = time.perf_counter() - start
+    stats = DecodeStats()
+    start = time.perf_counter()
+    tiered = decode_text(raw, stats)
+    tiered_time = time.perf_counter() - start
+    assert full == tiered
+    print(f' ftfy full: {full_time:.2f}s')
+    print(f'   tiered: {tiered_time:.3f}s - {stats}')
+
+
+if __name__ == '__main__':
+    main()
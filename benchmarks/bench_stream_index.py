@@ -0,0 +1,60 @@
+"""
+Compare peak memory and time of parsing a master.zip held in memory against streaming master.idx out
+of the archive spooled on disk.
+
+    python benchmarks/bench_stream_index.py --num_lines 1000000
+"""
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from secutils.edgar import _parse_index_buffer, parse_master_zip, read_master_zip
+from secutils.index_cache import type_master_index
+from secutils.utils import decode_text
+
+from bench_parallel_index import master_zip
+from bench_parse_index import synthetic_index
+
+
+def parse_in_memory(content: bytes):
+    # the previous path - the whole archive, master.idx and its decoded text are held at once
+    return type_master_index(_parse_index_buffer(decode_text(read_master_zip(content))))
+
+
+def measure(func, *args):
+    # tracemalloc slows allocation down - time a separate untraced run
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_lines', default=1000000, type=int)
+    args = parser.parse_args()
+
+    content = master_zip(synthetic_index(args.num_lines))
+    with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as spool:
+        spool.write(content)
+    try:
+        in_memory, memory_time, memory_peak = measure(parse_in_memory, content)
+        del content
+        streamed, stream_time, stream_peak = measure(parse_master_zip, spool.name)
+    finally:
+        os.remove(spool.name)
+    assert len(in_memory) == len(streamed)
+
+    print(f'lines: {args.num_lines}')
+    print(f'in memory: {memory_time:.2f}s - peak {memory_peak / 2 ** 20:.0f} MiB')
+    print(f' streamed: {stream_time:.2f}s - peak {stream_peak / 2 ** 20:.0f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,431 @@
+import os
+import ssl
+import time
+import socket
+import asyncio
+import logging
+from pathlib import Path
+from collections import defaultdict, deque
+from email.parser import Parser
+from http.client import HTTPMessage
+from urllib.parse import urlsplit
+from typing import AsyncIterable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from secutils.edgar import File, build_dir_structure
+from secutils.ratelimit import RateLimiter, shared_rate_limiter
+from secutils.storage import AtomicDownload, CHUNK_SIZE
+from secutils.packs import PackWriter, shared_pack_writer
+from secutils.manifest import DownloadManifest
+from secutils.retry import RetryPolicy
+from secutils.metrics import shared_metrics, response_status
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_MAX_IN_FLIGHT = 1000
+
+
+class _Connection(object):
+    """single keep-alive HTTP/1.1 connection owned by an AsyncConnectionPool"""
+
+    def __init__(self, key: Tuple[str, str, int], reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.num_requests = 0
+
+    def is_closing(self) -> bool:
+        # StreamWriter.is_closing needs Python 3.7 - its transport's is available on 3.6
+        return self.writer.transport.is_closing() or self.reader.at_eof()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class AsyncResponse(object):
+    """
+    HTTP response whose body is streamed off the pooled connection. The connection goes back to the
+    pool once the body is fully consumed (or is dropped if the response is abandoned part way).
+    """
+
+    def __init__(self, pool: 'AsyncConnectionPool', conn: _Connection, status: int,
+                 reason: str, headers: HTTPMessage, method: str) -> None:
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._pool = pool
+        self._conn = conn
+        self._method = method
+        self._released = False
+
+    @property
+    def code(self) -> int:
+        return self.status
+
+    def _has_body(self) -> bool:
+        return not (self._method == 'HEAD' or self.status in (204, 304) or 100 <= self.status < 200)
+
+    def _keep_alive(self) -> bool:
+        return self.headers.get('Connection', '').lower() != 'close'
+
+    async def _read(self, coro):
+        return await asyncio.wait_for(coro, self._pool.timeout)
+
+    async def iter_chunks(self, chunk_size: int=CHUNK_SIZE):
+        """yield the body in chunks of at most chunk_size bytes"""
+        reader = self._conn.reader
+        reusable = self._keep_alive()
+        try:
+            if not self._has_body():
+                pass
+            elif 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+                while True:
+                    size_line = await self._read(reader.readline())
+                    size = int(size_line.split(b';')[0].strip(), 16)
+                    if size == 0:
+                        # consume optional trailers up to the terminating blank line
+                        while (await self._read(reader.readline())) not in (b'\r\n', b'\n', b''):
+                            pass
+                        break
+                    while size > 0:
+                        chunk = await self._read(reader.readexactly(min(size, chunk_size)))
+                        size -= len(chunk)
+                        yield chunk
+                    await self._read(reader.readline())
+            elif self.headers.get('Content-Length') is not None:
+                remaining = int(self.headers['Content-Length'])
+                while remaining > 0:
+                    chunk = await self._read(reader.read(min(remaining, chunk_size)))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(chunk, remaining)
+                    remaining -= len(chunk)
+                    yield chunk
+            else:
+                # body delimited by connection close
+                reusable = False
+                while True:
+                    chunk = await self._read(reader.read(chunk_size))
+                    if not chunk:
+                        break
+                    yield chunk
+        except BaseException:
+            reusable = False
+            raise
+        finally:
+            self.release(reusable)
+
+    async def read(self) -> bytes:
+        return b''.join([chunk async for chunk in self.iter_chunks()])
+
+    def release(self, reusable: bool=False) -> None:
+        """hand the connection back to the pool - only reusable once the body is fully consumed"""
+        if not self._released:
+            self._released = True
+            self._pool._release(self._conn, reusable)
+
+
+class AsyncConnectionPool(object):
+    """
+    Bounded pool of keep-alive HTTP/1.1 connections for use on a single event loop. At most
+    max_connections sockets are open at once; any number of coroutines may wait on the pool.
+
+    Parameters
+    -------
+    max_connections: maximum number of concurrently open connections
+    timeout: seconds to wait on connect or any single read before failing the request
+    user_agent: User-Agent header sent with every request
+
+    Example:
+    --------
+    >>> pool = AsyncConnectionPool(max_connections=10)
+    >>> response = await pool.request('https://www.sec.gov/Archives/edgar/data/1000230/0001437749-17-020936.txt')
+    >>> body = await response.read()
+    >>> await pool.close()
+    """
+
+    def __init__(self, max_connections: int=DEFAULT_MAX_CONNECTIONS, timeout: float=30.0,
+                 user_agent: str='secutils') -> None:
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.num_connects = 0
+        self.num_requests = 0
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._idle = defaultdict(deque)
+        self._ssl_context = None
+
+    def _get_ssl_context(self) -> ssl.SSLContext:
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    async def _connect(self, key: Tuple[str, str, int]) -> _Connection:
+        scheme, host, port = key
+        ssl_context = self._get_ssl_context() if scheme == 'https' else None
+        start = time.perf_counter()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context), self.timeout)
+        shared_metrics().observe_stage('connect', time.perf_counter() - start)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.num_connects += 1
+        return _Connection(key, reader, writer)
+
+    async def _acquire(self, key: Tuple[str, str, int]) -> Tuple[_Connection, bool]:
+        await self._semaphore.acquire()
+        idle = self._idle[key]
+        while idle:
+            conn = idle.pop()
+            if not conn.is_closing():
+                return conn, True
+            conn.close()
+        try:
+            return await self._connect(key), False
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def _release(self, conn: _Connection, reusable: bool) -> None:
+        if reusable and not conn.is_closing():
+            self._idle[conn.key].append(conn)
+        else:
+            conn.close()
+        self._semaphore.release()
+
+    async def request(self, url: str, method: str='GET',
+                      headers: Optional[Dict[str, str]]=None) -> AsyncResponse:
+        """send a request and return once the status line and headers have been read"""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        target = parts.path or '/'
+        if parts.query:
+            target = f'{target}?{parts.query}'
+        request_headers = {
+            'Host': parts.netloc,
+            'User-Agent': self.user_agent,
+            'Accept-Encoding': 'identity',
+            'Connection': 'keep-alive',
+        }
+        request_headers.update(headers or {})
+        head = f'{method} {target} HTTP/1.1\r\n'
+        head += ''.join(f'{k}: {v}\r\n' for k, v in request_headers.items()) + '\r\n'
+
+        conn, reused = await self._acquire(key)
+        try:
+            try:
+                return await self._send(conn, head, method)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+            # the server closed an idle keep-alive connection - retry once on a fresh one
+            conn.close()
+            conn = await self._connect(key)
+            return await self._send(conn, head, method)
+        except BaseException:
+            self._release(conn, False)
+            raise
+
+    async def _send(self, conn: _Connection, head: str, method: str) -> AsyncResponse:
+        conn.writer.write(head.encode('latin-1'))
+        await conn.writer.drain()
+        status_line = await asyncio.wait_for(conn.reader.readline(), self.timeout)
+        if not status_line:
+            raise asyncio.IncompleteReadError(status_line, None)
+        version, status, *reason = status_line.decode('latin-1').strip().split(' ', 2)
+        header_lines = []
+        while True:
+            line = await asyncio.wait_for(conn.reader.readline(), self.timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line.decode('latin-1'))
+        headers = Parser(_class=HTTPMessage).parsestr(''.join(header_lines))
+        conn.num_requests += 1
+        self.num_requests += 1
+        return AsyncResponse(self, conn, int(status), reason[0] if reason else '', headers, method)
+
+    async def close(self) -> None:
+        for idle in self._idle.values():
+            while idle:
+                idle.pop().close()
+
+
+class AsyncHTTPError(Exception):
+    """non-200 response returned to download_docs_async callers, mirrors urllib's HTTPError"""
+
+    def __init__(self, url: str, code: int, reason: str, headers: HTTPMessage) -> None:
+        super(AsyncHTTPError, self).__init__(f'HTTP Error {code}: {reason}')
+        self.url = url
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+
+
+async def download_file_async(pool: AsyncConnectionPool, sec_file: File, output_dir: str,
+                              cache_dir: Optional[str]=None,
+                              manifest: Optional[DownloadManifest]=None,
+                              compression: Optional[str]=None, pack: bool=False) -> Union[str, Exception]:
+    """async counterpart of File.download_file - streams the body to a .part file over a pooled connection"""
+    msg, download = await download_url_async(pool, sec_file.file_download_url,
+                                             os.path.join(output_dir, sec_file.file_name), compression,
+                                             shared_pack_writer(output_dir) if pack else None)
+    if msg == '200':
+        sec_file._record_download(download, cache_dir, manifest)
+    return msg
+
+
+async def download_url_async(pool: AsyncConnectionPool, url: str, path: str, compression: Optional[str]=None,
+                             pack: Optional[PackWriter]=None) -> Tuple[Union[str, Exception], AtomicDownload]:
+    """async counterpart of secutils.edgar.download_url"""
+    download = AtomicDownload(path, compression=compression, pack=pack)
+    response = None
+    try:
+        response = await pool.request(url, headers=download.range_headers())
+        if response.status == 416 and download.range_complete(response.headers):
+            await response.read()
+        elif response.status not in (200, 206):
+            # drain the (small) error body so the connection can be reused
+            await response.read()
+            return AsyncHTTPError(url, response.status, response.reason, response.headers), download
+        else:
+            download.start(response.status, response.headers)
+            async for chunk in response.iter_chunks(CHUNK_SIZE):
+                download.write(chunk)
+        download.commit()
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+        if response is not None:
+            # body was not fully consumed - the connection cannot be reused
+            response.release(False)
+        return e, download
+    finally:
+        download.close()
+    return '200', download
+
+
+async def _download_docs_async(files: Union[Iterable[File], AsyncIterable[File]], output_dir: Path, cache_dir: Optional[str],
+                               rate_limiter: RateLimiter, max_connections: int, max_in_flight: int,
+                               pbar=None, manifest: Optional[DownloadManifest]=None,
+                               on_result: Optional[Callable]=None,
+                               retry_policy: Optional[RetryPolicy]=None,
+                               selector: Optional['DocumentSelector']=None,
+                               compression: Optional[str]=None, pack: bool=False) -> Tuple[List[File], List[File]]:
+    retry_policy = retry_policy or RetryPolicy()
+    metrics = shared_metrics()
+    pool = AsyncConnectionPool(max_connections=max_connections)
+    downloaded, download_error = [], []
+    # workers pull from one shared iterator so records (e.g. from a FileBatch) are created as consumed
+    if hasattr(files, '__aiter__'):
+        file_iter = files.__aiter__()
+    else:
+        file_iter = iter(files)
+    next_lock = asyncio.Lock()
+
+    async def next_file() -> Optional[File]:
+        if not hasattr(file_iter, '__anext__'):
+            return next(file_iter, None)
+        # an async generator cannot be advanced by several coroutines at once
+        async with next_lock:
+            try:
+                return await file_iter.__anext__()
+            except StopAsyncIteration:
+                return None
+
+    async def download(sec_file: File) -> None:
+        form_dir = build_dir_structure(output_dir, sec_file)
+        attempt = throttles = 0
+        while True:
+            await asyncio.sleep(rate_limiter.reserve())
+            start = time.perf_counter()
+            try:
+                if selector is not None:
+                    urlmsg = await selector.download_async(pool, sec_file, form_dir, rate_limiter, cache_dir, manifest)
+                else:
+                    urlmsg = await download_file_async(pool, sec_file, form_dir, cache_dir, manifest, compression, pack)
+            except Exception as e:
+                # never let one bad file take down every download scheduled on the loop
+                logger.exception(f'Unexpected error downloading {sec_file.file_download_url}')
+                urlmsg = e
+            metrics.observe_stage('download', time.perf_counter() - start)
+            metrics.responses.inc('filing', response_status(urlmsg))
+            if urlmsg == '200':
+                rate_limiter.success()
+                metrics.files.inc('downloaded')
+                downloaded.append(sec_file)
+                if pbar is not None:
+                    pbar.update(1)
+                break
+            throttled = retry_policy.is_throttled(urlmsg)
+            if throttled:
+                throttles += 1
+                if retry_policy.should_retry_throttled(urlmsg, throttles):
+                    rate_limiter.backoff(urlmsg.headers.get('Retry-After'))
+                    continue
+            else:
+                attempt += 1
+            if throttled or not retry_policy.should_retry(urlmsg, attempt):
+                setattr(sec_file, 'error_message', str(urlmsg))
+                metrics.files.inc('failed')
+                download_error.append(sec_file)
+                break
+            await asyncio.sleep(retry_policy.delay(attempt))
+        if on_result is not None:
+            try:
+                on_result(sec_file, urlmsg)
+            except Exception:
+                # a failing callback must not take down the other downloads on the loop
+                logger.exception(f'on_result failed for {sec_file.file_download_url}')
+
+    async def worker() -> None:
+        sec_file = await next_file()
+        while sec_file is not None:
+            await download(sec_file)
+            sec_file = await next_file()
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(max_in_flight)])
+    finally:
+        await pool.close()
+    logger.info(f'Async engine opened {pool.num_connects} connections for {pool.num_requests} requests')
+    return downloaded, download_error
+
+
+def download_docs_async(files: Union[Iterable[File], AsyncIterable[File]], output_dir: Path, cache_dir: Optional[str]=None,
+                        rate_limiter: Optional[RateLimiter]=None, max_connections: int=DEFAULT_MAX_CONNECTIONS,
+                        max_in_flight: int=DEFAULT_MAX_IN_FLIGHT, pbar=None,
+                        manifest: Optional[DownloadManifest]=None,
+                        on_result: Optional[Callable]=None,
+                        retry_policy: Optional[RetryPolicy]=None,
+                        selector: Optional['DocumentSelector']=None,
+                        compression: Optional[str]=None, pack: bool=False) -> Tuple[List[File], List[File]]:
+    """
+    Download files on a single thread with an asyncio event loop. Up to max_in_flight downloads are
+    scheduled at once and share a bounded pool of max_connections keep-alive connections.
+
+    Args:
+        files: File objects to download - an iterable or async iterable, consumed lazily
+        output_dir: root output directory - files land in build_dir_structure's layout
+        cache_dir: directory holding success.txt download log
+        rate_limiter: shared request budget - defaults to the process-wide limiter
+        max_connections: size of the keep-alive connection pool
+        max_in_flight: maximum number of concurrently scheduled downloads
+        pbar: optional tqdm progress bar updated per successful download
+        manifest: download manifest updated as each file completes
+        on_result: optional callback(sec_file, urlmsg) invoked on the event loop after every download
+        retry_policy: attempts and backoff for failed downloads - defaults to RetryPolicy()
+        selector: optional secutils.documents.DocumentSelector - only its documents of each filing are downloaded
+        compression: optional 'gzip' or 'zstd' - filings are stored compressed (see secutils.compression)
+        pack: append filings to per-quarter packs instead of a file each (see secutils.packs)
+    Returns:
+        tuple of (downloaded files, files that errored)
+    """
+    rate_limiter = rate_limiter or shared_rate_limiter()
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_download_docs_async(
+            files, output_dir, cache_dir, rate_limiter, max_connections, max_in_flight, pbar, manifest, on_result, retry_policy,
+            selector, compression, pack))
+    finally:
+        loop.close()
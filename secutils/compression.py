@@ -0,0 +1,349 @@
+import io
+import os
+import zlib
+import bisect
+import struct
+import logging
+from typing import IO, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+    _HAS_ZSTANDARD = True
+except ImportError:
+    zstandard = None
+    _HAS_ZSTANDARD = False
+
+# uncompressed bytes per independently compressed frame - the granularity of seeks and of resumed downloads
+FRAME_SIZE = 1024 * 1024
+_READ_SIZE = 64 * 1024
+
+# seek index written after the last frame: (uncompressed offset, compressed offset) of every frame followed
+# by the uncompressed size, the number of frames and a magic number
+_INDEX_ENTRY = struct.Struct('<QQ')
+_INDEX_FOOTER = struct.Struct('<QI4s')
+_INDEX_MAGIC = b'SIDX'
+
+# (uncompressed offset, compressed offset) of a frame
+Frame = Tuple[int, int]
+
+
+class Codec(object):
+    """
+    compression format of stored filings. A file is a sequence of independently compressed frames that the
+    format's standard tools (gunzip, zstd -d) decompress as a whole, followed by a seek index hidden in a
+    frame those tools skip - an empty gzip member or a zstd skippable frame.
+    """
+    name = None
+    suffix = None
+    default_level = None
+    # bytes of the index frame before and after its payload
+    index_header_size = 0
+    index_footer_size = 0
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def __init__(self, level: Optional[int]=None) -> None:
+        self.level = level if level is not None else self.default_level
+
+    def compress_frame(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress_frame(self, frame: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompressobj(self):
+        """streaming decompressor of a single frame - exposes eof and unused_data"""
+        raise NotImplementedError
+
+    def index_frame(self, payload: bytes) -> Optional[bytes]:
+        """frame holding the seek index - None when the payload does not fit one"""
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    """gzip members via zlib - the index is the FEXTRA field of a final empty member"""
+    name = 'gzip'
+    suffix = '.gz'
+    default_level = 1
+    errors = (zlib.error,)
+    # header, XLEN and the 'SI' subfield header - then the empty deflate block, CRC32 and ISIZE
+    index_header_size = 16
+    index_footer_size = 10
+
+    def compress_frame(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress_frame(self, frame: bytes) -> bytes:
+        return zlib.decompress(frame, 31)
+
+    def decompressobj(self):
+        return zlib.decompressobj(31)
+
+    def index_frame(self, payload: bytes) -> Optional[bytes]:
+        if len(payload) + 4 > 0xffff:
+            return None
+        return (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff' + struct.pack('<H', len(payload) + 4) +
+                b'SI' + struct.pack('<H', len(payload)) + payload + b'\x03\x00' + b'\x00' * 8)
+
+
+class ZstdCodec(Codec):
+    """zstandard frames - the index is a skippable frame"""
+    name = 'zstd'
+    suffix = '.zst'
+    default_level = 3
+    errors = (zstandard.ZstdError,) if _HAS_ZSTANDARD else ()
+    index_header_size = 8
+    index_footer_size = 0
+
+    @classmethod
+    def available(cls) -> bool:
+        return _HAS_ZSTANDARD
+
+    def compress_frame(self, data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress_frame(self, frame: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(frame)
+
+    def decompressobj(self):
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    def index_frame(self, payload: bytes) -> Optional[bytes]:
+        return struct.pack('<II', 0x184D2A5E, len(payload)) + payload
+
+
+CODECS = {codec.name: codec for codec in [GzipCodec, ZstdCodec]}
+
+
+def get_codec(name: str, level: Optional[int]=None) -> Codec:
+    if name not in CODECS:
+        raise ValueError(f'Unknown compression: {name} - expected one of {list(CODECS)}')
+    codec = CODECS[name]
+    if not codec.available():
+        raise ImportError(f'Compression {name} requires zstandard - pip install zstandard')
+    return codec(level)
+
+
+def codec_for_path(path: str) -> Optional[Codec]:
+    """codec of a stored filing from its suffix - None for uncompressed files"""
+    for codec in CODECS.values():
+        if path.endswith(codec.suffix):
+            return codec()
+    return None
+
+
+def strip_compression_suffix(name: str) -> str:
+    """0001437749-17-020936.txt.gz -> 0001437749-17-020936.txt"""
+    for codec in CODECS.values():
+        if name.endswith(codec.suffix):
+            return name[:-len(codec.suffix)]
+    return name
+
+
+class FrameWriter(object):
+    """
+    Compresses a stream written in arbitrary chunks into frames of frame_size uncompressed bytes and
+    records where each frame starts. finish() writes the seek index.
+
+    Parameters
+    -------
+    outfile: binary file positioned where the next frame goes
+    codec: compression of the frames
+    frame_size: uncompressed bytes per frame
+    frames: frames already in outfile - when appending to a partial file
+    """
+
+    def __init__(self, outfile: IO[bytes], codec: Codec, frame_size: int=FRAME_SIZE,
+                 frames: Optional[List[Frame]]=None, size: int=0, compressed_size: int=0) -> None:
+        self.outfile = outfile
+        self.codec = codec
+        self.frame_size = frame_size
+        self.frames = list(frames or [])
+        self.size = size
+        self.compressed_size = compressed_size
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+        while len(self._buffer) >= self.frame_size:
+            self._write_frame(bytes(self._buffer[:self.frame_size]))
+            del self._buffer[:self.frame_size]
+
+    def _write_frame(self, data: bytes) -> None:
+        frame = self.codec.compress_frame(data)
+        self.outfile.write(frame)
+        self.frames.append((self.size, self.compressed_size))
+        self.size += len(data)
+        self.compressed_size += len(frame)
+
+    def flush_frame(self) -> None:
+        """compress what is buffered as a (short) frame - everything written so far is then on disk"""
+        if self._buffer:
+            self._write_frame(bytes(self._buffer))
+            self._buffer = bytearray()
+
+    def finish(self) -> None:
+        self.flush_frame()
+        payload = b''.join(_INDEX_ENTRY.pack(*frame) for frame in self.frames)
+        index = self.codec.index_frame(payload + _INDEX_FOOTER.pack(self.size, len(self.frames), _INDEX_MAGIC))
+        if index is None:
+            # readers fall back to scanning the frames
+            logger.debug(f'Seek index of {len(self.frames)} frames does not fit a {self.codec.name} index frame')
+            return
+        self.outfile.write(index)
+        self.compressed_size += len(index)
+
+
+def scan_frames(path: Union[str, IO[bytes]], codec: Codec, hash=None) -> Tuple[List[Frame], int, int]:
+    """
+    frames of a compressed file (a path or a binary file object) found by decompressing it - for partial
+    downloads and files without a seek index. Scanning stops at the first incomplete or corrupt frame.
+    hash is updated with the content of the complete frames.
+
+    Returns:
+        tuple of (frames, uncompressed size of the complete frames, compressed size of the complete frames)
+    """
+    if isinstance(path, str):
+        with open(path, 'rb') as infile:
+            return scan_frames(infile, codec, hash)
+    infile = path
+    infile.seek(0)
+    frames = []  # type: List[Frame]
+    size = valid_size = pos = 0
+    decompressor, pending = None, []
+    for chunk in iter(lambda: infile.read(_READ_SIZE), b''):
+        while chunk:
+            if decompressor is None:
+                decompressor, pending = codec.decompressobj(), []
+            try:
+                out = decompressor.decompress(chunk)
+            except codec.errors:
+                return frames, size, valid_size
+            pending.append(out)
+            if not decompressor.eof:
+                pos += len(chunk)
+                break
+            unused = decompressor.unused_data
+            pos += len(chunk) - len(unused)
+            data = b''.join(pending)
+            # empty members - e.g. a gzip seek index - hold no content
+            if data:
+                frames.append((size, valid_size))
+                size += len(data)
+                if hash is not None:
+                    hash.update(data)
+            valid_size, decompressor, chunk = pos, None, unused
+    return frames, size, valid_size
+
+
+def read_seek_index(infile: IO[bytes], codec: Codec) -> Optional[Tuple[List[Frame], int, int]]:
+    """(frames, uncompressed size, offset of the index frame) from the end of a file - None without an index"""
+    infile.seek(0, os.SEEK_END)
+    file_size = infile.tell()
+    footer_end = file_size - codec.index_footer_size
+    if footer_end - _INDEX_FOOTER.size - codec.index_header_size < 0:
+        return None
+    infile.seek(footer_end - _INDEX_FOOTER.size)
+    size, count, magic = _INDEX_FOOTER.unpack(infile.read(_INDEX_FOOTER.size))
+    payload_start = footer_end - _INDEX_FOOTER.size - count * _INDEX_ENTRY.size
+    if magic != _INDEX_MAGIC or payload_start - codec.index_header_size < 0:
+        return None
+    infile.seek(payload_start)
+    payload = infile.read(count * _INDEX_ENTRY.size)
+    frames = [_INDEX_ENTRY.unpack_from(payload, i * _INDEX_ENTRY.size) for i in range(count)]
+    return frames, size, payload_start - codec.index_header_size
+
+
+class CompressedReader(io.RawIOBase):
+    """
+    Seekable reader of a compressed filing. A seek decompresses only the frame holding the new position,
+    found through the seek index - files without one are scanned once when opened.
+
+    Parameters
+    -------
+    path: path of a .gz or .zst filing written by secutils, or a seekable binary file object
+    codec: compression of the file - from its suffix by default, required for file objects
+
+    Example:
+    --------
+    >>> from secutils.compression import CompressedReader
+    >>> with CompressedReader('/mnt/sda/sec/10-K/2017/Q4/0001437749-17-020936.txt.gz') as reader:
+    ...     reader.seek(50 * 2 ** 20)
+    ...     chunk = reader.read(4096)
+    """
+
+    def __init__(self, path: Union[str, IO[bytes]], codec: Optional[Codec]=None) -> None:
+        super(CompressedReader, self).__init__()
+        self.path = path if isinstance(path, str) else getattr(path, 'name', None)
+        self.codec = codec or (codec_for_path(path) if isinstance(path, str) else None)
+        if self.codec is None:
+            raise ValueError(f'{path} is not a compressed filing')
+        self._file = open(path, 'rb') if isinstance(path, str) else path
+        index = read_seek_index(self._file, self.codec)
+        if index is not None:
+            self.frames, self.size, self._frames_end = index
+        else:
+            self.frames, self.size, self._frames_end = scan_frames(self._file, self.codec)
+        self._starts = [frame[0] for frame in self.frames]
+        self._pos = 0
+        self._frame_index = None  # type: Optional[int]
+        self._frame = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int=os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f'Negative seek position {offset}')
+        self._pos = offset
+        return self._pos
+
+    def _load_frame(self, index: int) -> bytes:
+        if index != self._frame_index:
+            start = self.frames[index][1]
+            end = self.frames[index + 1][1] if index + 1 < len(self.frames) else self._frames_end
+            self._file.seek(start)
+            self._frame = self.codec.decompress_frame(self._file.read(end - start))
+            self._frame_index = index
+        return self._frame
+
+    def readinto(self, buffer) -> int:
+        """fill buffer across as many frames as needed - short only at the end of the file"""
+        view = memoryview(buffer).cast('B')
+        num_read = 0
+        while num_read < len(view) and self._pos < self.size:
+            index = bisect.bisect_right(self._starts, self._pos) - 1
+            frame = self._load_frame(index)
+            offset = self._pos - self.frames[index][0]
+            num_bytes = min(len(view) - num_read, len(frame) - offset)
+            view[num_read:num_read + num_bytes] = frame[offset:offset + num_bytes]
+            num_read += num_bytes
+            self._pos += num_bytes
+        return num_read
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+        super(CompressedReader, self).close()
+
+
+def open_filing(path: str) -> IO[bytes]:
+    """open a stored filing for reading - compressed filings are decompressed transparently and stay seekable"""
+    if codec_for_path(path) is None:
+        return open(path, 'rb')
+    return io.BufferedReader(CompressedReader(path))
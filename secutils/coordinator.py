@@ -0,0 +1,505 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import socket
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from tqdm.auto import tqdm
+
+from secutils.edgar import File, FormIDX
+from secutils.aio import DEFAULT_MAX_CONNECTIONS
+from secutils.dispatch import DownloadJob
+from secutils.retry import DeadLetterFile, RetryPolicy, error_status
+from secutils.index_cache import IndexCache, quarter_closed, OPEN_QUARTER_MAX_AGE
+from secutils.manifest import DownloadManifest, accession_from_name
+from secutils.ratelimit import RateLimiter, shared_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+WORK_QUEUE_NAME = 'work_queue.sqlite'
+DEFAULT_LEASE_SECONDS = 300.0
+# a quarter whose index could not be prepared this many times is given up on
+MAX_PERIOD_ATTEMPTS = 3
+
+STATUS_PENDING = 'pending'
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+
+def queue_signature(form_types: Optional[Iterable[str]]=None, ciks: Optional[Iterable[int]]=None,
+                    selector: Optional['DocumentSelector']=None) -> Optional[str]:
+    """
+    short digest of the filters that decide which files a quarter expands into - None without any.
+    Runs with different filters over one output_dir need separate queues: a quarter expanded for 10-Ks
+    holds no 8-Ks
+    """
+    filters = {
+        'form_types': sorted(set(form_types)) if form_types else None,
+        'ciks': sorted({int(cik) for cik in ciks}) if ciks else None,
+        'documents': [selector.types, selector.filenames] if selector is not None else None,
+    }
+    if not any(filters.values()):
+        return None
+    return hashlib.sha1(json.dumps(filters, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+class WorkQueue(object):
+    """
+    Shared SQLite queue coordinating any number of download processes or hosts over one output_dir.
+    Quarters are added as periods; a worker leases a period, expands its index into file rows and
+    marks it expanded in one transaction, so every index is fetched once across the cluster. Files
+    are then leased in batches - each claim runs in a write transaction, so batches are disjoint.
+    Leases carry an expiry that a heartbeat thread keeps renewing while the owner is alive; the rows
+    of a crashed worker become claimable again once their lease runs out. Results are acknowledged in
+    batches to keep write transactions on a network filesystem rare.
+
+    The database stays in rollback journal mode - WAL needs shared memory between the processes and
+    does not work across hosts sharing an NFS volume. Lease expiry compares wall clocks of different
+    hosts, so lease_seconds should be far larger than their clock skew.
+
+    Parameters
+    -------
+    path: path of the sqlite database - usually <output_dir>/work_queue.sqlite
+    worker_id: unique name of this worker - defaults to <hostname>-<pid>-<random>
+    lease_seconds: seconds a claim stays valid without a heartbeat
+    heartbeat_interval: seconds between lease renewals - defaults to a third of lease_seconds
+    timeout: seconds to wait on a database locked by another worker
+
+    Example:
+    --------
+    >>> from secutils.coordinator import WorkQueue
+    >>> work_queue = WorkQueue.for_output_dir('/mnt/nfs/sec', form_types=['10-K'])
+    >>> work_queue.add_periods([(2017, 1), (2017, 2)])
+    >>> work_queue.start_heartbeat()
+    >>> files = work_queue.claim(100)
+    >>> work_queue.ack(files[0], ok=True)
+    >>> work_queue.close()
+    """
+
+    def __init__(self, path: str, worker_id: Optional[str]=None, lease_seconds: float=DEFAULT_LEASE_SECONDS,
+                 heartbeat_interval: Optional[float]=None, timeout: float=60.0) -> None:
+        self.path = path
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval or lease_seconds / 3
+        self.num_claimed = 0
+        self.num_reclaimed = 0
+        self._lock = threading.Lock()
+        self._acks = []  # type: List[Tuple[str, Optional[str], float, str]]
+        self._stop = threading.Event()
+        self._heartbeat = None  # type: Optional[threading.Thread]
+        # autocommit - transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        with self._transaction():
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS periods (
+                    year INTEGER NOT NULL,
+                    quarter INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    num_files INTEGER,
+                    expanded_at REAL,
+                    error TEXT,
+                    PRIMARY KEY (year, quarter)
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    accession TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    form_type TEXT,
+                    company_name TEXT,
+                    cik INTEGER,
+                    date_filed TEXT,
+                    status TEXT NOT NULL,
+                    owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at REAL
+                )""")
+            self._conn.execute('CREATE INDEX IF NOT EXISTS files_status ON files (status, lease_expires)')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    started_at REAL,
+                    heartbeat_at REAL,
+                    stopped_at REAL
+                )""")
+            now = time.time()
+            self._conn.execute('INSERT OR REPLACE INTO workers VALUES (?, ?, ?, NULL)', (self.worker_id, now, now))
+
+    @classmethod
+    def for_output_dir(cls, output_dir: str, form_types: Optional[Iterable[str]]=None,
+                       ciks: Optional[Iterable[int]]=None, selector: Optional['DocumentSelector']=None,
+                       **kwargs) -> 'WorkQueue':
+        """
+        the queue of a run over output_dir - work_queue.sqlite, or work_queue-<queue_signature>.sqlite for a
+        run with filters, so runs with different form types, CIKs or documents never share expanded quarters
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        signature = queue_signature(form_types, ciks, selector)
+        name = WORK_QUEUE_NAME if signature is None else WORK_QUEUE_NAME.replace('.sqlite', f'-{signature}.sqlite')
+        return cls(os.path.join(output_dir, name), **kwargs)
+
+    def _transaction(self) -> '_Transaction':
+        return _Transaction(self._conn, self._lock)
+
+    def add_periods(self, periods: Iterable[Tuple[int, int]]) -> int:
+        """
+        queue quarters to expand. Known quarters are left as they are, except that a quarter expanded before
+        it closed is queued again for the filings published since. Returns the number of quarters queued
+        """
+        rows = [(int(year), int(quarter), STATUS_PENDING) for year, quarter in periods]
+        with self._transaction():
+            before = self._conn.total_changes
+            self._conn.executemany('INSERT OR IGNORE INTO periods (year, quarter, status) VALUES (?, ?, ?)', rows)
+            expanded = self._conn.execute('SELECT year, quarter, expanded_at FROM periods WHERE status = ?',
+                                          (STATUS_DONE,)).fetchall()
+            wanted = {row[:2] for row in rows}
+            # nodes joining the same run moments apart do not each re-expand the open quarter
+            stale = time.time() - OPEN_QUARTER_MAX_AGE
+            reopen = [(STATUS_PENDING, year, quarter) for year, quarter, expanded_at in expanded
+                      if (year, quarter) in wanted and expanded_at < stale and not quarter_closed(year, quarter, expanded_at)]
+            self._conn.executemany('UPDATE periods SET status = ?, attempts = 0 WHERE year = ? AND quarter = ?', reopen)
+            return self._conn.total_changes - before
+
+    def claim_period(self) -> Optional[Tuple[int, int]]:
+        """lease the next quarter whose index has not been expanded - None when there is none to take"""
+        now = time.time()
+        with self._transaction():
+            row = self._conn.execute(
+                'SELECT year, quarter FROM periods WHERE status = ? OR (status = ? AND lease_expires < ?) '
+                'ORDER BY year, quarter LIMIT 1', (STATUS_PENDING, STATUS_LEASED, now)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE periods SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 '
+                               'WHERE year = ? AND quarter = ?',
+                               (STATUS_LEASED, self.worker_id, now + self.lease_seconds) + tuple(row))
+        return row[0], row[1]
+
+    def expand_period(self, period: Tuple[int, int], files: Iterable[File]) -> int:
+        """add the files of a leased quarter and mark it expanded - files queued by another quarter are kept"""
+        now = time.time()
+        rows = [(accession_from_name(sec_file.file_name), sec_file.file_name, sec_file.file_download_url,
+                 sec_file.form_type, sec_file.company_name, int(sec_file.cik_number),
+                 sec_file.date_filed.strftime('%Y-%m-%d'), STATUS_PENDING, now) for sec_file in files]
+        with self._transaction():
+            before = self._conn.total_changes
+            self._conn.executemany('INSERT OR IGNORE INTO files (accession, file_name, url, form_type, company_name, '
+                                   'cik, date_filed, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            num_added = self._conn.total_changes - before
+            self._conn.execute('UPDATE periods SET status = ?, owner = NULL, lease_expires = NULL, num_files = ?, '
+                               'expanded_at = ? WHERE year = ? AND quarter = ?',
+                               (STATUS_DONE, len(rows), now) + tuple(period))
+        return num_added
+
+    def release_period(self, period: Tuple[int, int], error: str) -> bool:
+        """
+        give back a quarter whose index could not be prepared - it is retried by any worker until it has
+        failed MAX_PERIOD_ATTEMPTS times. Returns True if the quarter was given up on
+        """
+        with self._transaction():
+            attempts = self._conn.execute('SELECT attempts FROM periods WHERE year = ? AND quarter = ?',
+                                          tuple(period)).fetchone()[0]
+            status = STATUS_FAILED if attempts >= MAX_PERIOD_ATTEMPTS else STATUS_PENDING
+            self._conn.execute('UPDATE periods SET status = ?, owner = NULL, lease_expires = NULL, error = ? '
+                               'WHERE year = ? AND quarter = ?', (status, error) + tuple(period))
+        return status == STATUS_FAILED
+
+    def claim(self, num_files: int) -> List[File]:
+        """lease up to num_files files - expired leases of crashed workers are taken over first"""
+        now = time.time()
+        columns = 'rowid, file_name, url, form_type, company_name, cik, date_filed'
+        with self._transaction():
+            rows = self._conn.execute(f'SELECT {columns} FROM files WHERE status = ? AND lease_expires < ? LIMIT ?',
+                                      (STATUS_LEASED, now, num_files)).fetchall()
+            num_reclaimed = len(rows)
+            if len(rows) < num_files:
+                rows += self._conn.execute(f'SELECT {columns} FROM files WHERE status = ? ORDER BY rowid LIMIT ?',
+                                           (STATUS_PENDING, num_files - len(rows))).fetchall()
+            self._conn.executemany('UPDATE files SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 '
+                                   'WHERE rowid = ?',
+                                   [(STATUS_LEASED, self.worker_id, now + self.lease_seconds, row[0]) for row in rows])
+        if num_reclaimed:
+            logger.info(f'Took over {num_reclaimed} files from expired leases')
+        self.num_claimed += len(rows)
+        self.num_reclaimed += num_reclaimed
+        return [_file_from_row(row[1:]) for row in rows]
+
+    def ack(self, sec_file: File, ok: bool, error: Optional[str]=None) -> None:
+        """record the result of a claimed file - written with the next flush"""
+        status = STATUS_DONE if ok else STATUS_FAILED
+        with self._lock:
+            self._acks.append((status, error, time.time(), accession_from_name(sec_file.file_name)))
+
+    def flush(self) -> int:
+        """write the buffered results - returns the number written"""
+        with self._lock:
+            acks, self._acks = self._acks, []
+        if not acks:
+            return 0
+        with self._transaction():
+            self._conn.executemany('UPDATE files SET status = ?, owner = NULL, lease_expires = NULL, error = ?, '
+                                   'updated_at = ? WHERE accession = ?', acks)
+        return len(acks)
+
+    def heartbeat(self) -> None:
+        """flush results and renew the leases this worker holds"""
+        self.flush()
+        now = time.time()
+        expires = now + self.lease_seconds
+        with self._transaction():
+            for table in ('files', 'periods'):
+                self._conn.execute(f'UPDATE {table} SET lease_expires = ? WHERE owner = ? AND status = ?',
+                                   (expires, self.worker_id, STATUS_LEASED))
+            self._conn.execute('UPDATE workers SET heartbeat_at = ? WHERE worker_id = ?', (now, self.worker_id))
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except sqlite3.Error as e:
+                # the next beat retries - leases only lapse after several missed beats
+                logger.warning(f'Work queue heartbeat failed: {e}')
+
+    def start_heartbeat(self) -> 'WorkQueue':
+        if self._heartbeat is None:
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='work-queue-heartbeat', daemon=True)
+            self._heartbeat.start()
+        return self
+
+    def stop_heartbeat(self) -> None:
+        if self._heartbeat is not None:
+            self._stop.set()
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def is_idle(self) -> bool:
+        """True when nothing is left to claim or waiting on another worker's lease"""
+        with self._lock:
+            for table in ('periods', 'files'):
+                row = self._conn.execute(f'SELECT 1 FROM {table} WHERE status IN (?, ?) LIMIT 1',
+                                         (STATUS_PENDING, STATUS_LEASED)).fetchone()
+                if row is not None:
+                    return False
+        return True
+
+    def counts(self) -> Dict[str, int]:
+        """number of files in each status"""
+        with self._lock:
+            return dict(self._conn.execute('SELECT status, COUNT(*) FROM files GROUP BY status').fetchall())
+
+    def release(self) -> int:
+        """hand back every lease this worker holds - returns the number of files released"""
+        with self._transaction():
+            self._conn.execute('UPDATE periods SET status = ?, owner = NULL, lease_expires = NULL '
+                               'WHERE owner = ? AND status = ?', (STATUS_PENDING, self.worker_id, STATUS_LEASED))
+            before = self._conn.total_changes
+            self._conn.execute('UPDATE files SET status = ?, owner = NULL, lease_expires = NULL '
+                               'WHERE owner = ? AND status = ?', (STATUS_PENDING, self.worker_id, STATUS_LEASED))
+            return self._conn.total_changes - before
+
+    def close(self) -> None:
+        self.stop_heartbeat()
+        self.flush()
+        num_released = self.release()
+        if num_released:
+            logger.info(f'Released {num_released} unfinished files back to the work queue')
+        with self._transaction():
+            self._conn.execute('UPDATE workers SET stopped_at = ? WHERE worker_id = ?', (time.time(), self.worker_id))
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> 'WorkQueue':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class _Transaction(object):
+    """BEGIN IMMEDIATE ... COMMIT under the connection lock - takes the database write lock up front"""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock) -> None:
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, *exc) -> None:
+        try:
+            self.conn.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+        finally:
+            self.lock.release()
+
+
+def _file_from_row(row: Tuple) -> File:
+    file_name, url, form_type, company_name, cik, date_filed = row
+    sec_file = File(form_type=form_type, company_name=company_name, cik_number=str(cik),
+                    date_filed=date_filed, partial_url=file_name)
+    sec_file.file_download_url = url
+    return sec_file
+
+
+class CoordinatedDownload(object):
+    """
+    Download worker for one process of a multi-node run sharing a WorkQueue. The worker keeps its
+    DownloadJob fed with leased batches and expands a leased quarter's index whenever no files are
+    waiting, so indices are prepared once across the cluster and work spreads over every node. Every
+    node adds the same periods, so all hosts can run the same command. The run ends once no period
+    or file is pending or leased anywhere.
+
+    Parameters
+    -------
+    work_queue: shared queue - usually WorkQueue.for_output_dir(output_dir, form_types, ciks, selector) with the
+        same filters as this download
+    periods: (year, quarter) pairs to download - added to the queue unless already known
+    output_dir: root download directory
+    cache_dir: index cache directory
+    form_types: form types to download
+    ciks: CIKs to download
+    seen_files: file names already downloaded
+    num_workers: number of download threads (thread engine)
+    engine: thread or async
+    rate_limiter: request budget of this node
+    manifest: download manifest updated as files complete
+    cache_format: index cache storage format
+    max_connections: keep-alive connection pool size (async engine)
+    index_factory: callable building a FormIDX-like object with a to_batch() method
+    retry_policy: attempts and backoff for failed downloads
+    dead_letter: records files that failed permanently
+    batch_size: files leased per claim - defaults to twice the job's queue capacity
+    poll_interval: seconds to wait before claiming again while other workers hold every lease
+    selector: optional secutils.documents.DocumentSelector - only its documents of each filing are downloaded
+    compression: optional 'gzip' or 'zstd' - filings are stored compressed (see secutils.compression)
+    pack: append filings to per-quarter packs instead of a file each (see secutils.packs). Hosts serialize
+        appends to a shared pack with flock, which some network filesystems do not honour
+
+    Example:
+    --------
+    >>> from itertools import product
+    >>> from secutils.coordinator import CoordinatedDownload, WorkQueue
+    >>> work_queue = WorkQueue.for_output_dir('/mnt/nfs/sec', form_types=['10-K'])
+    >>> download = CoordinatedDownload(work_queue, list(product(range(1995, 2020), [1, 2, 3, 4])), '/mnt/nfs/sec',
+    ...                                form_types=['10-K'])
+    >>> num_downloaded, download_error = download.run()
+    """
+
+    def __init__(self, work_queue: WorkQueue, periods: List[Tuple[int, int]], output_dir: Path,
+                 cache_dir: Optional[str]=None, form_types: Optional[List[str]]=None,
+                 ciks: Optional[List[int]]=None, seen_files: Optional[Set[str]]=None, num_workers: int=4,
+                 engine: str='thread', rate_limiter: Optional[RateLimiter]=None,
+                 manifest: Optional[DownloadManifest]=None, cache_format: str='auto',
+                 max_connections: int=DEFAULT_MAX_CONNECTIONS, index_factory: Callable=FormIDX,
+                 retry_policy: Optional[RetryPolicy]=None, dead_letter: Optional[DeadLetterFile]=None,
+                 batch_size: Optional[int]=None, poll_interval: float=5.0, show_progress: bool=True,
+                 selector: Optional['DocumentSelector']=None, compression: Optional[str]=None,
+                 pack: bool=False) -> None:
+        self.work_queue = work_queue
+        self.periods = list(periods)
+        self.cache_dir = cache_dir
+        self.form_types = form_types
+        self.ciks = ciks
+        self.seen_files = seen_files
+        self.cache_format = cache_format
+        self.index_cache = IndexCache(cache_dir, cache_format) if cache_dir else None
+        self.index_factory = index_factory
+        self.poll_interval = poll_interval
+        self.job = DownloadJob(output_dir, cache_dir=cache_dir, num_workers=num_workers, engine=engine,
+                               rate_limiter=rate_limiter or shared_rate_limiter(), manifest=manifest,
+                               max_connections=max_connections, on_result=self._record, name='coordinated',
+                               retry_policy=retry_policy, dead_letter=dead_letter, selector=selector,
+                               compression=compression, pack=pack)
+        # claims stay small so idle nodes find work - the job's bounded queue holds the rest back
+        self.batch_size = batch_size or 8 * max(1, num_workers)
+        self._lock = threading.Lock()
+        self._pbar = tqdm(total=0, desc='Downloading', disable=not show_progress)
+
+    def _expand(self, period: Tuple[int, int]) -> None:
+        yr, qtr = period
+        logger.info(f'Preparing index - Year: {yr} - Quarter: {qtr}')
+        kwargs = {'index_cache': self.index_cache} if self.index_cache is not None else {}
+        # index requests share the download job's request budget and retry policy
+        kwargs.update(rate_limiter=self.job.rate_limiter, retry_policy=self.job.retry_policy)
+        try:
+            batch = self.index_factory(year=yr, quarter=qtr, seen_files=self.seen_files, cache_dir=self.cache_dir,
+                                       form_types=self.form_types, ciks=self.ciks, cache_format=self.cache_format,
+                                       **kwargs).to_batch()
+        except Exception as e:
+            given_up = self.work_queue.release_period(period, str(e))
+            log = logger.error if given_up else logger.warning
+            log(f'Unable to prepare index - Year: {yr} - Quarter: {qtr}: {e}')
+            return
+        num_added = self.work_queue.expand_period(period, batch)
+        logger.info(f'Queued {num_added} files - Year: {yr} - Quarter: {qtr}')
+
+    def _feed(self) -> None:
+        while True:
+            files = self.work_queue.claim(self.batch_size)
+            if files:
+                with self._lock:
+                    self._pbar.total += len(files)
+                self.job.submit_many(files)
+                continue
+            period = self.work_queue.claim_period()
+            if period is not None:
+                self._expand(period)
+                continue
+            # results still buffered here keep our own leases alive until they are flushed
+            self.work_queue.flush()
+            if self.work_queue.is_idle():
+                return
+            time.sleep(self.poll_interval)
+
+    def _record(self, sec_file: File, urlmsg) -> None:
+        ok = urlmsg == '200'
+        self.work_queue.ack(sec_file, ok, None if ok else error_status(urlmsg)[1])
+        with self._lock:
+            if ok:
+                self._pbar.update(1)
+
+    def run(self) -> Tuple[int, List[File]]:
+        """
+        download until the shared queue is drained
+
+        Returns:
+            tuple of (number of files downloaded by this worker, files that errored)
+        """
+        num_added = self.work_queue.add_periods(self.periods)
+        logger.info(f'Worker {self.work_queue.worker_id} joined work queue {self.work_queue.path} - '
+                    f'{num_added} new quarters')
+        self.work_queue.start_heartbeat()
+        self.job.start()
+        try:
+            self._feed()
+        finally:
+            self.job.close()
+            stats = self.job.join()
+            self._pbar.close()
+            self.work_queue.stop_heartbeat()
+            self.work_queue.flush()
+        logger.info(f'Work queue {self.work_queue.counts()} - claimed {self.work_queue.num_claimed} files - '
+                    f'{self.work_queue.num_reclaimed} from expired leases')
+        return stats.num_downloaded, stats.errors
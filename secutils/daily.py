@@ -0,0 +1,215 @@
+import os
+import re
+import json
+import time
+import logging
+from datetime import date, datetime, timedelta
+from urllib.error import HTTPError, URLError
+from typing import Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+import requests
+
+from secutils.edgar import FileBatch, FileUtils, parse_master_index
+from secutils.index_cache import IndexCache, type_master_index, _apply_filters, _filters
+from secutils.ratelimit import RateLimiter, shared_rate_limiter
+from secutils.retry import RetryPolicy, error_status
+from secutils.utils import ValidateFields
+
+logger = logging.getLogger(__name__)
+
+DAILY_SYNC_NAME = 'daily_sync.json'
+_DAILY_MASTER = re.compile(r'^master\.(\d{8})\.idx$')
+
+
+def _quarter_of(day: date) -> Tuple[int, int]:
+    return day.year, (day.month - 1) // 3 + 1
+
+
+def _quarters_between(start: date, end: date) -> List[Tuple[int, int]]:
+    quarters = []
+    year, quarter = _quarter_of(start)
+    while (year, quarter) <= _quarter_of(end):
+        quarters.append((year, quarter))
+        year, quarter = (year + 1, 1) if quarter == 4 else (year, quarter + 1)
+    return quarters
+
+
+class DailyIndexSync(object):
+    """
+    Incremental sync from EDGAR's daily-index. Only the daily master index files published after the
+    stored high-water mark are fetched; their rows are merged into the cached quarterly index (when
+    one exists) and the new filings that pass the form type, CIK and seen file filters are returned as a
+    FileBatch for the usual download workers and build_dir_structure layout. The high-water mark is
+    only advanced by commit(), once the caller has handled the batch.
+
+    Index requests are retried by the RetryPolicy and throttled ones are paced by the shared limiter. A
+    listing or daily index that still fails does not stop the sync - it is recorded in failures and
+    under 'failed' in the state file, and the high-water mark stops short of it so the next sync fetches
+    it again.
+
+    Parameters
+    -------
+    state_path: json file holding the high-water mark - usually <cache_dir>/daily_sync.json
+    cache_dir: index cache directory - cached quarters are extended with the daily rows
+    form_types: form types to download
+    ciks: CIKs to download
+    seen_files: file names already downloaded
+    cache_format: index cache storage format
+    start_date: first day to sync when no high-water mark is stored - defaults to the start of the current quarter
+    rate_limiter: shared request budget - defaults to the process-wide limiter
+    timeout: seconds to wait for an index response
+    retry_policy: attempts and backoff for failed index requests - defaults to RetryPolicy()
+
+    Example:
+    --------
+    >>> from secutils.daily import DailyIndexSync
+    >>> sync = DailyIndexSync('/mnt/sda/sec/cache/daily_sync.json', cache_dir='/mnt/sda/sec/cache', form_types=['8-K'])
+    >>> batch = sync.prepare()
+    >>> DownloadJob(output_dir='/mnt/sda/sec').run(batch)
+    >>> sync.commit()
+    """
+    daily_index_url = FileUtils.base_url + 'edgar/daily-index/{year}/QTR{quarter}/'
+
+    def __init__(self, state_path: str, cache_dir: Optional[str]=None, form_types: Optional[List[str]]=None,
+                 ciks: Optional[List[int]]=None, seen_files: Optional[Set[str]]=None, cache_format: str='auto',
+                 start_date: Optional[date]=None, rate_limiter: Optional[RateLimiter]=None,
+                 timeout: float=60.0, retry_policy: Optional[RetryPolicy]=None) -> None:
+        self.state_path = state_path
+        self.index_cache = IndexCache(cache_dir, cache_format) if cache_dir else None
+        self.form_types = form_types
+        self.ciks = [ValidateFields.validate_cik(cik) for cik in ciks] if ciks else None
+        self.seen_files = seen_files
+        self.start_date = start_date
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.num_index_bytes = 0
+        # index requests of the last prepare() that failed permanently
+        self.failures = []  # type: List[Dict[str, object]]
+        self._pending_mark = None  # type: Optional[date]
+
+    @property
+    def high_water_mark(self) -> Optional[date]:
+        """last daily index that has been synced"""
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, 'r') as infile:
+            return datetime.strptime(json.load(infile)['last_date'], '%Y-%m-%d').date()
+
+    def _get(self, url: str) -> Optional[requests.Response]:
+        """
+        GET retried by the RetryPolicy - None for a 404. Raises HTTPError / URLError once the policy gives up
+        """
+        attempt = throttles = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = requests.get(url, timeout=self.timeout)
+            except (requests.RequestException, OSError) as e:
+                error = URLError(e)
+            else:
+                if response.status_code == 404:
+                    return None
+                if response.status_code == 200:
+                    self.rate_limiter.success()
+                    self.num_index_bytes += len(response.content)
+                    return response
+                error = HTTPError(url, response.status_code, response.reason, response.headers, None)
+            throttled = self.retry_policy.is_throttled(error)
+            if throttled:
+                # throttling is paced by the shared limiter and has its own budget instead of using up attempts
+                throttles += 1
+                if self.retry_policy.should_retry_throttled(error, throttles):
+                    self.rate_limiter.backoff(error.headers.get('Retry-After'))
+                    continue
+            else:
+                attempt += 1
+            if throttled or not self.retry_policy.should_retry(error, attempt):
+                raise error
+            time.sleep(self.retry_policy.delay(attempt))
+
+    def _fail(self, url: str, day: date, error: Exception) -> None:
+        status, reason = error_status(error)
+        self.failures.append({'url': url, 'date': day.strftime('%Y-%m-%d'), 'status': status, 'reason': reason})
+        logger.warning(f'Unable to fetch {url} - {reason}')
+
+    def list_daily_files(self, year: int, quarter: int) -> List[Tuple[date, str]]:
+        """(date, url) of every daily master index published for the quarter"""
+        base_url = self.daily_index_url.format(year=year, quarter=quarter)
+        response = self._get(base_url + 'index.json')
+        if response is None:
+            return []
+        files = []
+        for item in response.json()['directory']['item']:
+            match = _DAILY_MASTER.match(item['name'])
+            if match:
+                files.append((datetime.strptime(match.group(1), '%Y%m%d').date(), base_url + item['name']))
+        return sorted(files)
+
+    def prepare(self, today: Optional[date]=None) -> FileBatch:
+        """fetch daily indices newer than the high-water mark and return their new, filtered filings"""
+        today = today or date.today()
+        mark = self.high_water_mark
+        if mark is None:
+            mark = (self.start_date or date(today.year, 3 * (_quarter_of(today)[1] - 1) + 1, 1)) - timedelta(days=1)
+        self._pending_mark = mark
+        self.failures = []
+        new_rows = []
+        for year, quarter in _quarters_between(mark, today):
+            daily = []
+            try:
+                daily_files = self.list_daily_files(year, quarter)
+            except (HTTPError, URLError) as e:
+                self._fail(self.daily_index_url.format(year=year, quarter=quarter) + 'index.json',
+                           max(mark, date(year, 3 * quarter - 2, 1)), e)
+                daily_files = []
+            for day, url in daily_files:
+                if not mark < day <= today:
+                    continue
+                try:
+                    response = self._get(url)
+                except (HTTPError, URLError) as e:
+                    self._fail(url, day, e)
+                    continue
+                if response is None:
+                    continue
+                daily.append(parse_master_index(response.content))
+                if not self.failures:
+                    # never past a failed index - the next sync fetches it again
+                    self._pending_mark = max(self._pending_mark, day)
+                logger.info(f'Fetched daily index {day} - {len(daily[-1])} filings')
+            if daily:
+                master_index = pd.concat(daily, ignore_index=True)
+                self._merge_into_cache(year, quarter, master_index)
+                new_rows.append(master_index)
+        logger.info(f'Daily sync fetched {self.num_index_bytes / 1024:.0f} KiB of index data since {mark}')
+        if self.failures:
+            logger.warning(f'{len(self.failures)} daily index requests failed - the next sync retries them')
+        if not new_rows:
+            return FileBatch.empty()
+        master_index = type_master_index(pd.concat(new_rows, ignore_index=True))
+        master_index = _apply_filters(master_index, _filters(self.form_types, self.ciks))
+        if self.seen_files:
+            master_index = master_index.loc[~master_index['fname'].isin(self.seen_files)]
+        return FileBatch(master_index)
+
+    def _merge_into_cache(self, year: int, quarter: int, master_index: pd.DataFrame) -> None:
+        # a quarter that was never cached is left to FormIDX - a cache holding only daily rows would
+        # later be mistaken for the complete quarterly index
+        if self.index_cache is None or not self.index_cache.exists(year, quarter):
+            return
+        cached = self.index_cache.load(year, quarter)
+        merged = pd.concat([cached, master_index], ignore_index=True).drop_duplicates('Filename', keep='first')
+        if len(merged) > len(cached):
+            self.index_cache.save(year, quarter, type_master_index(merged))
+            logger.info(f'Merged {len(merged) - len(cached)} daily filings into cached index {year} Q{quarter}')
+
+    def commit(self) -> None:
+        """persist the high-water mark reached by the last prepare()"""
+        if self._pending_mark is None:
+            return
+        tmp_path = f'{self.state_path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as outfile:
+            json.dump({'last_date': self._pending_mark.strftime('%Y-%m-%d'), 'failed': self.failures}, outfile)
+        os.replace(tmp_path, self.state_path)
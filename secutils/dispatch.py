@@ -0,0 +1,278 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional
+
+from secutils.edgar import File, download_with_backoff
+from secutils.aio import download_docs_async, DEFAULT_MAX_CONNECTIONS
+from secutils.manifest import DownloadManifest
+from secutils.ratelimit import RateLimiter, shared_rate_limiter
+from secutils.retry import DeadLetterFile, RetryPolicy, error_status
+from secutils.metrics import shared_metrics
+from secutils.compression import get_codec
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the work queue for a consumer
+_DONE = None
+# seconds between checks for a failed async engine while waiting on the work queue
+_POLL_SECONDS = 0.1
+
+
+class WorkerStats(object):
+    """counters owned and written by a single worker - aggregated by DownloadJob.stats without locking"""
+    __slots__ = ('num_downloaded', 'num_errors', 'busy_seconds', 'errors')
+
+    def __init__(self) -> None:
+        self.num_downloaded = 0
+        self.num_errors = 0
+        self.busy_seconds = 0.0
+        self.errors = []  # type: List[File]
+
+    def record(self, sec_file: File, urlmsg, elapsed: float=0.0) -> None:
+        self.busy_seconds += elapsed
+        if urlmsg == '200':
+            self.num_downloaded += 1
+        else:
+            self.num_errors += 1
+            self.errors.append(sec_file)
+
+    def __add__(self, other: 'WorkerStats') -> 'WorkerStats':
+        total = WorkerStats()
+        for stats in (self, other):
+            total.num_downloaded += stats.num_downloaded
+            total.num_errors += stats.num_errors
+            total.busy_seconds += stats.busy_seconds
+            total.errors.extend(stats.errors)
+        return total
+
+
+class DownloadJob(object):
+    """
+    Self-contained download job - owns a thread-safe work queue, its workers and their stats, so any
+    number of jobs (e.g. one per form type) can run side by side in one process. Files are handed out
+    through a bounded queue.Queue; each worker counts its own results in a WorkerStats that is only
+    summed when stats are read.
+
+    Parameters
+    -------
+    output_dir: root download directory
+    cache_dir: directory holding success.txt download log
+    num_workers: number of download threads (thread engine)
+    engine: thread or async
+    rate_limiter: request budget - defaults to the process-wide limiter shared by every job
+    manifest: download manifest updated as files complete
+    max_connections: keep-alive connection pool size (async engine)
+    max_queued: maximum number of submitted files waiting for a worker - submit blocks beyond it
+    on_result: optional callback(sec_file, urlmsg) invoked from the worker after every download
+    retry_policy: attempts and backoff for failed downloads - defaults to RetryPolicy()
+    dead_letter: records files that failed permanently and resolves them once downloaded
+    name: job name used for worker thread names
+    selector: optional secutils.documents.DocumentSelector - only its documents of each filing are downloaded
+    compression: optional 'gzip' or 'zstd' - filings are stored compressed (see secutils.compression)
+    pack: append filings to per-quarter packs instead of a file each (see secutils.packs)
+
+    Example:
+    --------
+    >>> from secutils.dispatch import DownloadJob
+    >>> job = DownloadJob(output_dir='/mnt/sda/sec', num_workers=8, name='10-K')
+    >>> job.start()
+    >>> job.submit_many(FormIDX(year=2017, quarter=1, form_types=['10-K']).to_batch())
+    >>> job.close()
+    >>> job.join()
+    >>> job.stats.num_downloaded
+    """
+
+    def __init__(self, output_dir: Path, cache_dir: Optional[str]=None, num_workers: int=4,
+                 engine: str='thread', rate_limiter: Optional[RateLimiter]=None,
+                 manifest: Optional[DownloadManifest]=None, max_connections: int=DEFAULT_MAX_CONNECTIONS,
+                 max_queued: int=0, on_result: Optional[Callable]=None, name: str='job',
+                 retry_policy: Optional[RetryPolicy]=None, dead_letter: Optional[DeadLetterFile]=None,
+                 selector: Optional['DocumentSelector']=None, compression: Optional[str]=None,
+                 pack: bool=False) -> None:
+        if engine not in ('thread', 'async'):
+            raise ValueError(f'Unknown download engine: {engine}')
+        if pack and selector is not None:
+            raise ValueError('Selected documents are stored in a directory per filing and cannot be packed')
+        if compression is not None:
+            # fail before any download - unknown codec or zstandard not installed
+            get_codec(compression)
+        self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.num_workers = num_workers
+        self.engine = engine
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.manifest = manifest
+        self.max_connections = max_connections
+        self.on_result = on_result
+        self.name = name
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.dead_letter = dead_letter
+        self.selector = selector
+        self.compression = compression
+        self.pack = pack
+        self.num_consumers = num_workers if engine == 'thread' else 1
+        self._queue = queue.Queue(maxsize=max_queued or 4 * max(1, num_workers))
+        self._worker_stats = [WorkerStats() for _ in range(self.num_consumers)]
+        self._threads = []  # type: List[threading.Thread]
+        self._closed = False
+        # set when the async engine's event loop died - the remaining files are failed and submit raises
+        self.error = None  # type: Optional[Exception]
+        # files handed to the async engine without a result yet - failed with it if its event loop dies
+        self._in_flight = {}  # type: Dict[int, File]
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def stats(self) -> WorkerStats:
+        """aggregate of every worker's stats"""
+        return sum(self._worker_stats, WorkerStats())
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, sec_file: File) -> None:
+        if self._closed:
+            raise RuntimeError(f'DownloadJob {self.name} is closed')
+        if self.error is not None:
+            raise RuntimeError(f'DownloadJob {self.name} failed: {self.error}')
+        self._queue.put(sec_file)
+
+    def submit_many(self, files: Iterable[File]) -> None:
+        for sec_file in files:
+            self.submit(sec_file)
+
+    def close(self) -> None:
+        """signal that no more files will be submitted - workers exit once the queue is drained"""
+        if not self._closed:
+            self._closed = True
+            for _ in range(self.num_consumers):
+                self._queue.put(_DONE)
+
+    def start(self) -> 'DownloadJob':
+        if self.engine == 'async':
+            targets = [(self._async_worker, self._worker_stats[0])]
+        else:
+            targets = [(self._thread_worker, stats) for stats in self._worker_stats]
+        self._threads = [threading.Thread(target=target, args=(stats,), name=f'{self.name}-worker-{i}', daemon=True)
+                         for i, (target, stats) in enumerate(targets)]
+        [thread.start() for thread in self._threads]
+        # read when metrics are collected - nothing is recorded per submit
+        shared_metrics().queue_depth.set_function(lambda: self.queue_depth, self.name)
+        return self
+
+    def join(self) -> WorkerStats:
+        [thread.join() for thread in self._threads]
+        # drop the callback so the gauge does not keep the finished job alive
+        shared_metrics().queue_depth.set(0, self.name)
+        return self.stats
+
+    def run(self, files: Iterable[File]) -> WorkerStats:
+        """download every file and wait for the job to finish"""
+        self.start()
+        try:
+            self.submit_many(files)
+        finally:
+            self.close()
+        return self.join()
+
+    def _iter_queue(self) -> Iterator[File]:
+        while True:
+            sec_file = self._queue.get()
+            if sec_file is _DONE:
+                return
+            yield sec_file
+
+    def _get_async(self) -> Optional[File]:
+        """
+        work queue get for the async engine's executor thread. Gives up without taking a file once the engine
+        has failed - the thread outlives a dead event loop - and tracks every file it takes
+        """
+        while self.error is None:
+            try:
+                sec_file = self._queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if sec_file is not _DONE:
+                with self._in_flight_lock:
+                    self._in_flight[id(sec_file)] = sec_file
+            return sec_file
+        return _DONE
+
+    async def _aiter_queue(self) -> AsyncIterator[File]:
+        # wait for files on an executor thread so the event loop keeps serving in-flight downloads
+        loop = asyncio.get_event_loop()
+        while True:
+            sec_file = await loop.run_in_executor(None, self._get_async)
+            if sec_file is _DONE:
+                return
+            yield sec_file
+
+    def _result(self, stats: WorkerStats, sec_file: File, urlmsg, elapsed: float=0.0) -> None:
+        with self._in_flight_lock:
+            self._in_flight.pop(id(sec_file), None)
+        stats.record(sec_file, urlmsg, elapsed)
+        try:
+            if self.dead_letter is not None:
+                if urlmsg == '200':
+                    self.dead_letter.resolve(sec_file)
+                else:
+                    status, reason = error_status(urlmsg)
+                    self.dead_letter.record(sec_file, reason, status)
+            if self.on_result is not None:
+                self.on_result(sec_file, urlmsg)
+        except Exception:
+            # the download itself is counted - a failing callback or dead letter file must not stop the worker
+            logger.exception(f'Unable to record the result of {sec_file.file_download_url}')
+
+    def _fail_remaining(self, stats: WorkerStats, error: Exception) -> None:
+        """
+        fail the files the dead async engine held and every file still queued. The event loop's reader may
+        have taken the end-of-queue marker, so the queue is drained until the job is closed and empty
+        """
+        with self._in_flight_lock:
+            in_flight, self._in_flight = list(self._in_flight.values()), {}
+        while True:
+            if in_flight:
+                sec_file = in_flight.pop()
+            else:
+                try:
+                    sec_file = self._queue.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    if self._closed:
+                        return
+                    continue
+                if sec_file is _DONE:
+                    return
+            setattr(sec_file, 'error_message', str(error))
+            self._result(stats, sec_file, error)
+
+    def _thread_worker(self, stats: WorkerStats) -> None:
+        for sec_file in self._iter_queue():
+            start = time.monotonic()
+            try:
+                urlmsg = download_with_backoff(sec_file, self.output_dir, self.cache_dir, self.rate_limiter,
+                                               self.manifest, self.retry_policy, self.selector, self.compression,
+                                               self.pack)
+            except Exception as e:
+                # never let one bad file take the worker down
+                logger.exception(f'Unexpected error downloading {sec_file.file_download_url}')
+                setattr(sec_file, 'error_message', str(e))
+                urlmsg = e
+            self._result(stats, sec_file, urlmsg, time.monotonic() - start)
+
+    def _async_worker(self, stats: WorkerStats) -> None:
+        try:
+            download_docs_async(self._aiter_queue(), self.output_dir, self.cache_dir, self.rate_limiter,
+                                max_connections=self.max_connections, manifest=self.manifest,
+                                on_result=lambda sec_file, urlmsg: self._result(stats, sec_file, urlmsg),
+                                retry_policy=self.retry_policy, selector=self.selector,
+                                compression=self.compression, pack=self.pack)
+        except Exception as e:
+            # the only consumer is gone - fail whatever is still queued so submitters never block on a full queue
+            logger.exception(f'Async download worker of {self.name} failed - failing its remaining files')
+            self.error = e
+            self._fail_remaining(stats, e)
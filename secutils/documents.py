@@ -0,0 +1,253 @@
+import os
+import json
+import asyncio
+import logging
+from html.parser import HTMLParser
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin
+from urllib.request import urlopen
+from http.client import HTTPException
+from typing import Dict, Iterable, List, Optional, Union
+
+from secutils.edgar import File, download_url
+from secutils.aio import AsyncConnectionPool, AsyncHTTPError, download_url_async
+from secutils.manifest import DownloadManifest
+from secutils.ratelimit import RateLimiter
+from secutils.storage import DOCUMENTS_NAME, _fsync_dir
+from secutils.compression import get_codec
+from secutils.submission import _match_any
+from secutils.utils import decode_text
+
+logger = logging.getLogger(__name__)
+
+# columns of the document tables on a filing's <accession>-index.htm page
+_INDEX_COLUMNS = {'seq': 'sequence', 'description': 'description', 'document': 'filename', 'type': 'type',
+                  'size': 'size'}
+# inline XBRL documents are linked through the viewer - /ix?doc=/Archives/edgar/data/...
+_IX_VIEWER = '/ix?doc='
+
+
+class FilingDocument(object):
+    """one row of a filing's index page - a document that can be downloaded on its own"""
+    __slots__ = ('sequence', 'description', 'filename', 'type', 'size', 'url')
+
+    def __init__(self, sequence: Optional[int], description: str, filename: str, type: str,
+                 size: Optional[int], url: str) -> None:
+        self.sequence = sequence
+        self.description = description
+        self.filename = filename
+        self.type = type
+        self.size = size
+        self.url = url
+
+    def __repr__(self) -> str:
+        return f'FilingDocument(sequence={self.sequence}, type={self.type!r}, filename={self.filename!r})'
+
+    def as_dict(self) -> Dict[str, object]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _FilingIndexParser(HTMLParser):
+    """collects the rows of every 'tableFile' table - document and data files"""
+
+    def __init__(self) -> None:
+        super(_FilingIndexParser, self).__init__()
+        self.rows = []  # type: List[Dict[str, str]]
+        self._in_table = False
+        self._columns = []  # type: List[Optional[str]]
+        self._row = None  # type: Optional[List[str]]
+        self._href = None  # type: Optional[str]
+        self._cell = None  # type: Optional[List[str]]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'table' and 'tableFile' in (attrs.get('class') or '').split():
+            self._in_table, self._columns = True, []
+        elif not self._in_table:
+            return
+        elif tag == 'tr':
+            self._row, self._href = [], None
+        elif tag in ('td', 'th') and self._row is not None:
+            self._cell = []
+        elif tag == 'a' and self._cell is not None and self._href is None:
+            self._href = attrs.get('href')
+
+    def handle_endtag(self, tag):
+        if not self._in_table:
+            return
+        if tag == 'table':
+            self._in_table = False
+        elif tag in ('td', 'th') and self._cell is not None:
+            self._row.append(' '.join(''.join(self._cell).split()))
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            if not self._columns:
+                self._columns = [_INDEX_COLUMNS.get(cell.lower()) for cell in self._row]
+            else:
+                row = {name: value for name, value in zip(self._columns, self._row) if name}
+                row['href'] = self._href
+                self.rows.append(row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def parse_filing_index(html: str, index_url: str) -> List[FilingDocument]:
+    """documents listed on a filing's <accession>-index.htm page, including the complete submission"""
+    parser = _FilingIndexParser()
+    parser.feed(html)
+    parser.close()
+    documents = []
+    for row in parser.rows:
+        href = row.get('href')
+        if not href or not row.get('filename'):
+            continue
+        if href.startswith(_IX_VIEWER):
+            href = href[len(_IX_VIEWER):]
+        sequence, size = row.get('sequence', ''), row.get('size', '')
+        documents.append(FilingDocument(int(sequence) if sequence.isdigit() else None, row.get('description', ''),
+                                        row['filename'].split()[0], row.get('type', ''),
+                                        int(size) if size.isdigit() else None, urljoin(index_url, href)))
+    return documents
+
+
+def filing_index_url(sec_file: File) -> str:
+    """<base>/edgar/data/<cik>/<accession without dashes>/<accession>-index.htm of a filing"""
+    base, _, name = sec_file.file_download_url.rpartition('/')
+    accession = os.path.splitext(name)[0]
+    return f'{base}/{accession.replace("-", "")}/{accession}-index.htm'
+
+
+class DocumentSelector(object):
+    """
+    Downloads only some documents of each filing - e.g. the main 10-K and its EX-21 - instead of the
+    full-submission .txt with every exhibit, XBRL file and uuencoded graphic. The filing's index page is
+    fetched, the documents matching the patterns are downloaded into
+    <output_dir>/<form_type>/<year>/<quarter>/<accession>/ and a documents.json describing them is
+    written last. The filing is then recorded under its full-submission name, so seen-file filtering,
+    scan_output_dir and the manifest treat it as downloaded.
+
+    Every request - the index page and each document - is paced by the rate limiter. Documents completed
+    by an earlier attempt are not downloaded again when a filing is retried.
+
+    Parameters
+    -------
+    types: case-insensitive glob patterns on the document type, e.g. ['10-K', 'EX-21*']
+    filenames: case-insensitive glob patterns on the document file name, e.g. ['*.htm']
+        With neither, only the primary document (sequence 1) is downloaded.
+    timeout: seconds before a request of the thread engine times out
+    compression: optional 'gzip' or 'zstd' - documents are stored compressed (see secutils.compression)
+
+    Example:
+    --------
+    >>> from secutils.documents import DocumentSelector
+    >>> from secutils.dispatch import DownloadJob
+    >>> job = DownloadJob('/mnt/sda/sec', selector=DocumentSelector(types=['10-K', 'EX-21*']))
+    >>> job.run(FormIDX(year=2017, quarter=1, form_types=['10-K']).to_batch())
+    """
+
+    def __init__(self, types: Optional[Iterable[str]]=None, filenames: Optional[Iterable[str]]=None,
+                 timeout: float=60.0, compression: Optional[str]=None) -> None:
+        self.types = [types] if isinstance(types, str) else (list(types) if types is not None else None)
+        self.filenames = [filenames] if isinstance(filenames, str) else (list(filenames) if filenames is not None else None)
+        self.timeout = timeout
+        self.compression = compression
+        self._suffix = get_codec(compression).suffix if compression else ''
+
+    def select(self, documents: Iterable[FilingDocument]) -> List[FilingDocument]:
+        if self.types is None and self.filenames is None:
+            return [document for document in documents if document.sequence == 1]
+        return [document for document in documents
+                if (self.types is None or _match_any(document.type, self.types)) and
+                (self.filenames is None or _match_any(document.filename, self.filenames))]
+
+    def _selected(self, sec_file: File, html: bytes, index_url: str) -> List[FilingDocument]:
+        selected = self.select(parse_filing_index(decode_text(html), index_url))
+        if not selected:
+            logger.warning(f'No documents of {sec_file.file_name} match {self.types or ""} {self.filenames or ""}')
+        return selected
+
+    def download(self, sec_file: File, output_dir: str, rate_limiter: RateLimiter,
+                 cache_dir: Optional[str]=None, manifest: Optional[DownloadManifest]=None) -> Union[str, Exception]:
+        """
+        download the selected documents of sec_file into output_dir/<accession>/ - the first request is
+        expected to be paid for by the caller, like File.download_file
+        """
+        index_url = filing_index_url(sec_file)
+        try:
+            with urlopen(index_url, timeout=self.timeout) as response:
+                html = response.read()
+        except (HTTPError, URLError, HTTPException, OSError) as e:
+            return e
+        filing_dir = _filing_dir(sec_file, output_dir)
+        selected = self._selected(sec_file, html, index_url)
+        for document in selected:
+            path = os.path.join(filing_dir, document.filename)
+            if os.path.exists(path + self._suffix):
+                continue
+            rate_limiter.acquire()
+            msg, _ = download_url(document.url, path, self.timeout, self.compression)
+            if msg != '200':
+                return msg
+        _complete(sec_file, filing_dir, selected, cache_dir, manifest, self.compression)
+        return '200'
+
+    async def download_async(self, pool: AsyncConnectionPool, sec_file: File, output_dir: str,
+                             rate_limiter: RateLimiter, cache_dir: Optional[str]=None,
+                             manifest: Optional[DownloadManifest]=None) -> Union[str, Exception]:
+        """async counterpart of download over the engine's pooled connections"""
+        index_url = filing_index_url(sec_file)
+        response = None
+        try:
+            response = await pool.request(index_url)
+            html = await response.read()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            if response is not None:
+                response.release(False)
+            return e
+        if response.status != 200:
+            return AsyncHTTPError(index_url, response.status, response.reason, response.headers)
+        filing_dir = _filing_dir(sec_file, output_dir)
+        selected = self._selected(sec_file, html, index_url)
+        for document in selected:
+            path = os.path.join(filing_dir, document.filename)
+            if os.path.exists(path + self._suffix):
+                continue
+            await asyncio.sleep(rate_limiter.reserve())
+            msg, _ = await download_url_async(pool, document.url, path, self.compression)
+            if msg != '200':
+                return msg
+        _complete(sec_file, filing_dir, selected, cache_dir, manifest, self.compression)
+        return '200'
+
+
+def _filing_dir(sec_file: File, output_dir: str) -> str:
+    filing_dir = os.path.join(output_dir, os.path.splitext(sec_file.file_name)[0])
+    os.makedirs(filing_dir, exist_ok=True)
+    return filing_dir
+
+
+def _complete(sec_file: File, filing_dir: str, selected: List[FilingDocument], cache_dir: Optional[str]=None,
+              manifest: Optional[DownloadManifest]=None, compression: Optional[str]=None) -> None:
+    """write documents.json - the directory then counts as a downloaded filing - and record the filing"""
+    record = {'file_name': sec_file.file_name, 'url': sec_file.file_download_url, 'compression': compression,
+              'documents': [document.as_dict() for document in selected]}
+    path = os.path.join(filing_dir, DOCUMENTS_NAME)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as outfile:
+        json.dump(record, outfile, indent=2)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(filing_dir)
+    sec_file.download_file_dir = filing_dir
+    sec_file.checksum = None
+    sec_file.write_log_record(cache_dir, manifest)
+
+
+def read_documents(filing_dir: str) -> Dict[str, object]:
+    """documents.json of a filing downloaded by a DocumentSelector"""
+    with open(os.path.join(filing_dir, DOCUMENTS_NAME), 'r') as infile:
+        return json.load(infile)
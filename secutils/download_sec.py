@@ -6,12 +6,24 @@ from pathlib import Path
 from itertools import product
 from datetime import datetime
 import multiprocessing
-from typing import List
+from typing import List, Optional, Tuple
 
-from tqdm.auto import tqdm
-
-from secutils.edgar import FormIDX, SECContainer, DocumentDownloaderThread
-from secutils.utils import scan_output_dir, _read_cik_config, yaml_config_to_args
+from secutils.utils import _read_cik_config, yaml_config_to_args
+from secutils.manifest import DownloadManifest
+from secutils.ratelimit import RateLimiter, shared_rate_limiter, DEFAULT_MAX_RPS
+from secutils.aio import DEFAULT_MAX_CONNECTIONS
+from secutils.scheduler import PipelineScheduler
+from secutils.dispatch import DownloadJob
+from secutils.retry import DeadLetterFile, RetryPolicy, DEFAULT_MAX_ATTEMPTS
+from secutils.daily import DailyIndexSync, DAILY_SYNC_NAME
+from secutils.index_cache import IndexCache, shared_memory_cache, DEFAULT_MEMORY_CACHE_BYTES
+from secutils.edgar_index import EdgarIndex
+from secutils.parallel import IndexParsePool
+from secutils.prefetch import IndexPrefetcher, DEFAULT_INDEX_WORKERS
+from secutils.coordinator import CoordinatedDownload, WorkQueue, DEFAULT_LEASE_SECONDS
+from secutils.metrics import MetricsReporter, shared_metrics, DEFAULT_METRICS_INTERVAL
+from secutils.profiling import RunProfiler, PROFILE_DIR_PREFIX
+from secutils.documents import DocumentSelector
 
 logger = logging.getLogger(__name__)
 
@@ -30,11 +42,64 @@ def main():
     parser.add_argument('--ciks', nargs='+', type=int, help='List of CIKs to download')
     parser.add_argument('--cik_path', type=str, help='Path to CIK text file')
     parser.add_argument('--config_path', type=str, help='Path to yml config file')
+    parser.add_argument('--max_rps', default=DEFAULT_MAX_RPS, type=float,
+                        help='Maximum requests per second shared across all download workers')
+    parser.add_argument('--engine', default='thread', choices=['thread', 'async'],
+                        help='Download engine - thread pool or single-threaded asyncio with pooled connections')
+    parser.add_argument('--max_connections', default=DEFAULT_MAX_CONNECTIONS, type=int,
+                        help='Size of the keep-alive connection pool used by the async engine')
+    parser.add_argument('--cache_format', default='auto', choices=['auto', 'parquet', 'feather', 'pickle', 'csv'],
+                        help='Storage format of cached index files - auto uses parquet if pyarrow is installed')
+    parser.add_argument('--prefetch_quarters', default=2, type=int,
+                        help='Number of quarterly indices prepared ahead of the downloads')
+    parser.add_argument('--rescan', action='store_true',
+                        help='Rebuild the download manifest by scanning output_dir')
+    parser.add_argument('--parse_workers', default=0, type=int,
+                        help='Processes parsing quarterly indices in parallel - -1 uses every core, 0 parses in-process')
+    parser.add_argument('--max_attempts', default=DEFAULT_MAX_ATTEMPTS, type=int,
+                        help='Attempts per file before it is written to the dead letter file')
+    parser.add_argument('--retry_failed', action='store_true',
+                        help='Only retry the files in output_dir/dead_letter.jsonl - no indices are fetched')
+    parser.add_argument('--memory_cache_mb', default=DEFAULT_MEMORY_CACHE_BYTES // 2 ** 20, type=int,
+                        help='Memory budget of parsed quarterly indices kept in-process - 0 disables it')
+    parser.add_argument('--cache_max_mb', default=None, type=int,
+                        help='Size budget of cache_dir - least recently used quarterly indices are evicted')
+    parser.add_argument('--index_workers', default=DEFAULT_INDEX_WORKERS, type=int,
+                        help='Quarterly index archives missing from cache_dir downloaded concurrently before the run - 0 disables')
+    parser.add_argument('--update_index', action='store_true',
+                        help='Refresh the consolidated cross-quarter index (secutils.edgar_index) in cache_dir after the run')
+    parser.add_argument('--coordinate', action='store_true',
+                        help='Share the work with every other host running with --coordinate and the same filters on '
+                             'the same output_dir through output_dir/work_queue*.sqlite')
+    parser.add_argument('--lease_seconds', default=DEFAULT_LEASE_SECONDS, type=float,
+                        help='Seconds before the files claimed by a crashed --coordinate worker are handed to others')
+    parser.add_argument('--daily', action='store_true',
+                        help='Only fetch daily indices published since the last daily sync and download their new files')
+    parser.add_argument('--metrics_json', type=str, default=None,
+                        help='Write a json snapshot of the pipeline metrics to this path every metrics_interval seconds')
+    parser.add_argument('--metrics_prom', type=str, default=None,
+                        help='Write the pipeline metrics in Prometheus text format to this path every metrics_interval seconds')
+    parser.add_argument('--metrics_interval', default=DEFAULT_METRICS_INTERVAL, type=float,
+                        help='Seconds between metrics snapshots')
+    parser.add_argument('--documents', nargs='+', default=None,
+                        help='Only download the documents of each filing whose type matches one of these patterns, '
+                             'e.g. 10-K EX-21* - saved to <form_type>/<year>/<quarter>/<accession>/')
+    parser.add_argument('--compression', default=None, choices=['gzip', 'zstd'],
+                        help='Store filings compressed as they download, e.g. <accession>.txt.gz - zstd requires zstandard')
+    parser.add_argument('--pack', action='store_true',
+                        help='Append filings to one <form_type>/<year>/<quarter>/filings.pack per quarter with an offset '
+                             'index instead of writing a file each. With --coordinate the output_dir must support flock')
+    parser.add_argument('--profile', action='store_true',
+                        help='Run under cProfile and tracemalloc and write the results to profile-<time> in the '
+                             'working directory')
     args = parser.parse_args()
 
     if args.config_path:
         args = yaml_config_to_args(args)
 
+    if args.pack and args.documents:
+        parser.error('--pack cannot be combined with --documents')
+
     if args.quarters == -1:
         args.quarters = list(range(1, 5))
 
@@ -49,36 +114,124 @@ def main():
     if args.num_workers == -1:
         args.num_workers = multiprocessing.cpu_count()
 
-    # init container
-    sec_container = SECContainer()
-    sec_container.to_visit = set()
-    sec_container.downloaded = set()
-    sec_container.download_error = set()
-    sec_container.last_url_message = '200'
-    # capture seen files to filter out of new files
-    seen_files = scan_output_dir(args.output_dir)
-    logger.info(f'Scanned output dir - located {len(seen_files)} downloaded files')
-    # iterator of years/quarters
-    years = list(range(args.start_year, args.end_year+1))
-    time = list(product(years, args.quarters))
-    for (yr, qtr) in tqdm(time, total=len(time)):
-        sec_container.year = yr
-        sec_container.quarter = qtr
-        logger.info(f'Downloading files - Year: {yr} - Quarter: {qtr}')
-        files = FormIDX(year=yr, quarter=qtr, seen_files=seen_files, cache_dir=args.cache_dir, 
-               form_types=args.form_types, ciks=args.ciks).index_to_files()
-        if len(files) > 0:
-            sec_container.to_visit.update(files)
-            with tqdm(total=len(sec_container.to_visit), desc=f"Downloading: Year: {yr} - Quarter: {qtr}") as pbar:
-                # create threads and distribute downloads
-                sec_container.pbar = pbar
-                logger.info(f'Creating {args.num_workers} download threads')
-                threads = [DocumentDownloaderThread(i, f'thread-{i}', args.output_dir, args.cache_dir) for i in range(args.num_workers)]
-                # start threads
-                [thread.start() for thread in threads]
-                # delay execution of remaining script until all threads complete
-                [thread.join() for thread in threads]
+    profiler = None
+    if args.profile:
+        # never under output_dir, where its .txt reports would be taken for filings
+        profile_dir = os.path.join(os.getcwd(), f'{PROFILE_DIR_PREFIX}{datetime.now():%Y%m%d-%H%M%S}')
+        profiler = RunProfiler(profile_dir).start()
+    try:
+        with MetricsReporter(json_path=args.metrics_json, prometheus_path=args.metrics_prom,
+                             interval=args.metrics_interval):
+            run(args)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    logger.info(f'Pipeline stages:\n{shared_metrics().summary()}')
+
+
+def run(args: argparse.Namespace) -> None:
+    """download the filings selected by the parsed command line arguments"""
+    # process-wide request budget shared by every download thread
+    rate_limiter = shared_rate_limiter(args.max_rps)
+    if args.parse_workers == -1:
+        args.parse_workers = multiprocessing.cpu_count()
+    memory_cache = shared_memory_cache(args.memory_cache_mb * 2 ** 20)
+    cache_max_bytes = args.cache_max_mb * 2 ** 20 if args.cache_max_mb is not None else None
+
+    retry_policy = RetryPolicy(max_attempts=args.max_attempts)
+    # permanently failed files are kept next to the downloads so they can be retried on their own
+    dead_letter = DeadLetterFile.for_output_dir(args.output_dir)
+    # capture seen files to filter out of new files - the manifest is only rebuilt from disk on
+    # first use (migrating an existing archive) or when explicitly requested
+    manifest = DownloadManifest.for_output_dir(args.output_dir, wal=not args.coordinate)
+    selector = DocumentSelector(types=args.documents, compression=args.compression) if args.documents else None
+
+    def run_job(files, name):
+        job = DownloadJob(args.output_dir, cache_dir=args.cache_dir, num_workers=args.num_workers,
+                          engine=args.engine, rate_limiter=rate_limiter, manifest=manifest,
+                          max_connections=args.max_connections, retry_policy=retry_policy,
+                          dead_letter=dead_letter, name=name, selector=selector, compression=args.compression,
+                          pack=args.pack)
+        stats = job.run(files)
+        return stats.num_downloaded, stats.errors
+
+    if args.retry_failed:
+        failed_files = dead_letter.files()
+        logger.info(f'Retrying {len(failed_files)} files from {dead_letter.path}')
+        num_downloaded, download_error = run_job(failed_files, 'retry')
+    else:
+        if args.rescan or manifest.is_new:
+            manifest.rebuild(args.output_dir)
+        seen_files = manifest.seen_files()
+        logger.info(f'Loaded download manifest - located {len(seen_files)} downloaded files')
+        if args.daily:
+            # only daily indices published since the last sync are fetched
+            sync = DailyIndexSync(os.path.join(args.cache_dir or args.output_dir, DAILY_SYNC_NAME),
+                                  cache_dir=args.cache_dir, form_types=args.form_types, ciks=args.ciks,
+                                  seen_files=seen_files, cache_format=args.cache_format, rate_limiter=rate_limiter,
+                                  retry_policy=retry_policy)
+            batch = sync.prepare()
+            logger.info(f'Daily sync found {len(batch)} new files')
+            num_downloaded, download_error = run_job(batch, 'daily')
+            sync.commit()
+        else:
+            # iterator of years/quarters
+            years = list(range(args.start_year, args.end_year+1))
+            time = list(product(years, args.quarters))
+            if args.coordinate:
+                # quarters and files are leased from the queue shared by every host with the same filters - each
+                # index is prepared once
+                with WorkQueue.for_output_dir(args.output_dir, args.form_types, args.ciks, selector,
+                                              lease_seconds=args.lease_seconds) as work_queue:
+                    download = CoordinatedDownload(work_queue, time, args.output_dir, cache_dir=args.cache_dir,
+                                                   form_types=args.form_types, ciks=args.ciks, seen_files=seen_files,
+                                                   num_workers=args.num_workers, engine=args.engine,
+                                                   rate_limiter=rate_limiter, manifest=manifest,
+                                                   cache_format=args.cache_format,
+                                                   max_connections=args.max_connections,
+                                                   retry_policy=retry_policy, dead_letter=dead_letter,
+                                                   selector=selector, compression=args.compression,
+                                                   pack=args.pack)
+                    num_downloaded, download_error = download.run()
+            else:
+                if args.cache_dir and args.index_workers > 0:
+                    # bootstrap the index cache concurrently - the scheduler then reads quarters from disk
+                    prefetch_indices(args, time, rate_limiter, retry_policy, cache_max_bytes)
+                # indices for upcoming quarters are prepared while a persistent worker pool downloads
+                scheduler = PipelineScheduler(time, args.output_dir, cache_dir=args.cache_dir,
+                                              form_types=args.form_types, ciks=args.ciks, seen_files=seen_files,
+                                              num_workers=args.num_workers, engine=args.engine,
+                                              rate_limiter=rate_limiter, manifest=manifest,
+                                              cache_format=args.cache_format, max_connections=args.max_connections,
+                                              prefetch=args.prefetch_quarters, retry_policy=retry_policy,
+                                              dead_letter=dead_letter, parse_workers=args.parse_workers,
+                                              cache_max_bytes=cache_max_bytes, selector=selector,
+                                              compression=args.compression, pack=args.pack)
+                num_downloaded, download_error = scheduler.run()
+    logger.info(f'In-memory index cache - {memory_cache.stats}')
+    if args.update_index and args.cache_dir:
+        with EdgarIndex.for_cache_dir(args.cache_dir) as edgar_index:
+            num_indexed = edgar_index.update(IndexCache(args.cache_dir, args.cache_format))
+        logger.info(f'Updated {num_indexed} quarters of the consolidated index in {edgar_index.path}')
+    # other hosts may still be appending to a shared dead letter file - only a single host rewrites it
+    num_failed = len(dead_letter) if args.coordinate else dead_letter.compact()
+    logger.info(f'Downloaded {num_downloaded} files - {len(download_error)} errors - '
+                f'{num_failed} files in {dead_letter.path}')
 
+def prefetch_indices(args: argparse.Namespace, periods: List[Tuple[int, int]], rate_limiter: RateLimiter,
+                     retry_policy: RetryPolicy, cache_max_bytes: Optional[int]=None) -> None:
+    index_cache = IndexCache(args.cache_dir, args.cache_format, max_bytes=cache_max_bytes)
+    parse_pool = IndexParsePool(args.parse_workers) if args.parse_workers > 0 else None
+    try:
+        with IndexPrefetcher(args.cache_dir, num_workers=args.index_workers, rate_limiter=rate_limiter,
+                             retry_policy=retry_policy, parse_pool=parse_pool, index_cache=index_cache) as prefetcher:
+            results = prefetcher.run(periods)
+    finally:
+        if parse_pool is not None:
+            parse_pool.close()
+    failed = [f'{result.year} Q{result.quarter}' for result in results if result.status == 'failed']
+    if failed:
+        logger.warning(f'Unable to prefetch indices for {failed} - they are retried when the quarter is prepared')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,70 +1,152 @@
 import os
 import io
 import time
-import random
+import csv
 import zipfile
+import tempfile
 import requests
 import threading
 import logging
 import pickle as pkl
 from pathlib import Path
 from datetime import datetime
+from http.client import HTTPException
 from urllib.error import HTTPError, URLError
-from urllib.request import urlretrieve
-from typing import List, Union, Optional
+from urllib.request import Request, urlopen
+from typing import IO, Dict, Hashable, Iterable, Iterator, List, Tuple, Union, Optional
 from urllib.parse import urlparse, urljoin
 
-import ftfy
+import numpy as np
 import pandas as pd
 import validators
 import httplib2
 
 from secutils.utils import (
     _to_quarter, ValidateFields,
-    _remove_bad_bytes, _check_cache_dir
+    _check_cache_dir,
+    _strip_column, decode_text, DecodeStats
+)
+from secutils.ratelimit import RateLimiter, shared_rate_limiter
+from secutils.storage import AtomicDownload, CHUNK_SIZE
+from secutils.packs import PackWriter, shared_pack_writer
+from secutils.manifest import DownloadManifest
+from secutils.retry import RetryPolicy
+from secutils.metrics import shared_metrics, stage_timer, response_status
+from secutils.index_cache import (
+    IndexCache, MemoryIndexCache, OPEN_QUARTER_MAX_AGE, quarter_closed, shared_memory_cache, type_master_index
 )
 
 logger = logging.getLogger(__name__)
 
+# root of every EDGAR request - SECUTILS_EDGAR_URL points a run at a mirror or a local MockEdgarServer
+EDGAR_BASE_URL = os.environ.get('SECUTILS_EDGAR_URL', 'https://www.sec.gov/Archives/')
+
+INDEX_COLUMNS = ['CIK', 'Company Name', 'Form Type', 'Date Filed', 'Filename']
+INDEX_HEADER = '|'.join(INDEX_COLUMNS)
+# daily indices name the last column 'File Name'
+_INDEX_HEADER_PREFIX = '|'.join(INDEX_COLUMNS[:4]) + '|'
+# lines with a stray '|' in a field cannot be split reliably - skip them like the original line filter
+if tuple(int(v) for v in pd.__version__.split('.')[:2]) >= (1, 3):
+    _SKIP_BAD_LINES = {'on_bad_lines': 'skip'}
+else:
+    _SKIP_BAD_LINES = {'error_bad_lines': False, 'warn_bad_lines': False}
+_INDEX_DTYPES = {'CIK': str, 'Company Name': str, 'Form Type': 'category', 'Date Filed': 'category', 'Filename': str}
+
+
 
 class DocumentDownloaderThread(threading.Thread):
     """
-    thread for downloading docs in parallel
-    
+    thread for downloading docs in parallel from the SECContainer singleton - superseded by
+    secutils.dispatch.DownloadJob, which keeps its work queue and stats per job
+
     adapted from: https://github.com/freephys/Learning-Python-Design-Patterns/blob/master/2_singleton/crawler.py
     """
-    def __init__(self, thread_id: int, name: str, output_dir: Path, cache_dir: Optional[str]=None) -> None:
+    def __init__(self, thread_id: int, name: str, output_dir: Path, cache_dir: Optional[str]=None,
+                 rate_limiter: Optional[RateLimiter]=None, manifest: Optional[DownloadManifest]=None) -> None:
         threading.Thread.__init__(self)
         self.name = name
         self.output_dir = output_dir
         self.cache_dir = cache_dir
+        self.rate_limiter = rate_limiter
+        self.manifest = manifest
 
     def run(self):
-        download_docs(self.name, self.output_dir, self.cache_dir)
+        download_docs(self.name, self.output_dir, self.cache_dir, self.rate_limiter, self.manifest)
 
 
-def download_docs(thread_name: str, output_dir: Path, cache_dir: Optional[str]=None) -> None:
+def download_docs(thread_name: str, output_dir: Path, cache_dir: Optional[str]=None,
+                  rate_limiter: Optional[RateLimiter]=None, manifest: Optional[DownloadManifest]=None) -> None:
     sec_container = SECContainer()
+    # every thread shares the same process-wide request budget
+    rate_limiter = rate_limiter or shared_rate_limiter()
     # while we have pages where we have no downloaded docs
-    while sec_container.to_visit:
-        if '429' in sec_container.last_url_message:
-            time.sleep(random.randint(1, 10))
-        else:
+    while True:
+        # another thread may take the last file between an emptiness check and the pop
+        try:
             sec_file = sec_container.to_visit.pop()
-            form_dir = build_dir_structure(output_dir, sec_file)
-            time.sleep(random.randint(1, 10))
-            urlmsg = sec_file.download_file(form_dir, cache_dir)
-            if urlmsg == '200':
-                sec_container.downloaded.add(sec_file)
-                sec_container.pbar.update(1)
+        except KeyError:
+            break
+        urlmsg = download_with_backoff(sec_file, output_dir, cache_dir, rate_limiter, manifest)
+        if urlmsg == '200':
+            sec_container.downloaded.add(sec_file)
+            sec_container.pbar.update(1)
+        else:
+            sec_container.download_error.add(sec_file)
+        sec_container.pbar.set_postfix_str(f"Num success: {len(sec_container.downloaded)} -- Num errors: {len(sec_container.download_error)} -- Num remaining: {len(sec_container.to_visit)}")
+
+
+def download_with_backoff(sec_file: 'File', output_dir: Path, cache_dir: Optional[str]=None,
+                          rate_limiter: Optional[RateLimiter]=None,
+                          manifest: Optional[DownloadManifest]=None,
+                          retry_policy: Optional[RetryPolicy]=None,
+                          selector: Optional['DocumentSelector']=None,
+                          compression: Optional[str]=None, pack: bool=False) -> Union[str, Exception]:
+    """
+    download a single file into build_dir_structure's layout within the shared request budget. Throttled
+    (429/503) responses slow every worker down and the file is retried up to retry_policy's
+    max_throttle_retries times; other retryable errors are retried after retry_policy's jittered backoff.
+    The last error is recorded on sec_file.error_message and returned. With a secutils.documents.DocumentSelector only the selected documents of the filing
+    are downloaded instead of the full submission. With compression the filing is stored compressed, with
+    pack it is appended to its quarter's pack (see secutils.packs).
+    """
+    rate_limiter = rate_limiter or shared_rate_limiter()
+    retry_policy = retry_policy or RetryPolicy()
+    metrics = shared_metrics()
+    form_dir = build_dir_structure(output_dir, sec_file)
+    attempt = throttles = 0
+    while True:
+        rate_limiter.acquire()
+        with metrics.stage('download'):
+            if selector is not None:
+                urlmsg = selector.download(sec_file, form_dir, rate_limiter, cache_dir, manifest)
             else:
-                setattr(sec_file, 'error_message')
-                sec_container.download_error.add(sec_file)
-            sec_container.last_url_message = urlmsg
-            sec_container.pbar.set_postfix_str(f"Num success: {len(sec_container.downloaded)} -- Num errors: {len(sec_container.download_error)} -- Num remaining: {len(sec_container.to_visit)}")
+                urlmsg = sec_file.download_file(form_dir, cache_dir, manifest=manifest, compression=compression,
+                                                pack=pack)
+        metrics.responses.inc('filing', response_status(urlmsg))
+        if urlmsg == '200':
+            rate_limiter.success()
+            metrics.files.inc('downloaded')
+            return urlmsg
+        throttled = retry_policy.is_throttled(urlmsg)
+        if throttled:
+            # throttling is paced by the shared limiter and has its own budget instead of using up attempts
+            throttles += 1
+            if retry_policy.should_retry_throttled(urlmsg, throttles):
+                rate_limiter.backoff(urlmsg.headers.get('Retry-After'))
+                continue
+        else:
+            attempt += 1
+        if throttled or not retry_policy.should_retry(urlmsg, attempt):
+            setattr(sec_file, 'error_message', str(urlmsg))
+            metrics.files.inc('failed')
+            return urlmsg
+        delay = retry_policy.delay(attempt)
+        logger.debug(f'Retrying {sec_file.file_download_url} in {delay:.2f}s after attempt {attempt}: {urlmsg}')
+        time.sleep(delay)
 
 
 class SECContainer(object):
+    """process-wide work set used by download_docs - prefer secutils.dispatch.DownloadJob"""
 
     def __new__(cls):
         if not hasattr(cls, 'instance'):
@@ -72,8 +154,9 @@ class SECContainer(object):
         return cls.instance
 
 class FileUtils(object):
+    __slots__ = ()
 
-    base_url = 'https://www.sec.gov/Archives/'
+    base_url = EDGAR_BASE_URL
 
     def get_response(self, download_url: str) -> Union[str, str]:
         http = httplib2.Http()
@@ -82,11 +165,7 @@ class FileUtils(object):
         except Exception:
             raise RuntimeError(f'Unable to parse download url: {download_url}')
             
-        try:
-            response = response.decode('utf-8')
-        except UnicodeDecodeError:
-            response = ftfy.fix_text(response).decode('utf-8')
-        return status, response
+        return status, decode_text(response)
 
     def parse_url_to_parts(self, path: str) -> Union[str, str]:
         fname = path.split('/')[-1]
@@ -97,7 +176,10 @@ class FileUtils(object):
 
 
 class File(FileUtils, ValidateFields):
-    
+    # millions of these can be alive at once - keep them free of a per-instance __dict__
+    __slots__ = ('form_type', 'company_name', 'cik_number', 'date_filed', 'year', 'quarter',
+                 'file_name', 'file_download_url', 'download_file_dir', 'download_size', 'checksum', 'error_message')
+
     def __init__(self, form_type: str, company_name: str, cik_number: str, 
                 date_filed: str, partial_url: str=None) -> None:
 
@@ -130,20 +212,34 @@ class File(FileUtils, ValidateFields):
             'Download File Path': getattr(self, 'download_file_dir', None)
         }, index=[0])
 
-    def download_file(self, output_dir: str, cache_dir: Optional[str]=None) -> str:
-        download_file_dir = os.path.join(output_dir, self.file_name)
-        try:
-            path, msg = urlretrieve(self.file_download_url, download_file_dir)
-            # TODO do something better with these messages
-            msg = '200'
-            self.download_file_dir = download_file_dir
-            if cache_dir:
-                self.write_log_record(cache_dir)
-        except (HTTPError, URLError) as e:
-            msg = e
+    def download_file(self, output_dir: str, cache_dir: Optional[str]=None, timeout: float=60.0,
+                      manifest: Optional[DownloadManifest]=None, compression: Optional[str]=None,
+                      pack: bool=False) -> str:
+        """
+        stream the filing in fixed-size chunks to a .part file and rename it into place once complete.
+        A partial file left by an interrupted attempt is resumed with an HTTP Range request. With
+        compression ('gzip' or 'zstd') the filing is compressed as it streams and stored with the codec's suffix.
+        With pack the completed filing is appended to output_dir's filings.pack instead (see secutils.packs).
+        """
+        msg, download = download_url(self.file_download_url, os.path.join(output_dir, self.file_name), timeout,
+                                     compression, shared_pack_writer(output_dir) if pack else None)
+        if msg == '200':
+            self._record_download(download, cache_dir, manifest)
         return msg
 
-    def write_log_record(self, cache_dir: str):
+    def _record_download(self, download: AtomicDownload, cache_dir: Optional[str]=None,
+                         manifest: Optional[DownloadManifest]=None) -> None:
+        # the pack holding the filing when packed - download_size is then the filing's size within it
+        self.download_file_dir = download.stored_path
+        self.download_size = download.stored_size
+        self.checksum = download.checksum
+        self.write_log_record(cache_dir, manifest)
+
+    def write_log_record(self, cache_dir: Optional[str]=None, manifest: Optional[DownloadManifest]=None):
+        if manifest is not None:
+            manifest.record_file(self)
+        if not cache_dir:
+            return
         parts = [self.cik_number, self.company_name, self.form_type, self.file_name, self.year, self.quarter, 
                 self.file_download_url, self.download_file_dir]
         parts = list(map(str, parts))
@@ -154,6 +250,220 @@ class File(FileUtils, ValidateFields):
 
 
 
+def download_url(url: str, path: str, timeout: float=60.0, compression: Optional[str]=None,
+                 pack: Optional[PackWriter]=None) -> Tuple[Union[str, Exception], AtomicDownload]:
+    """
+    stream url to path through an AtomicDownload - resumed with a Range request when a partial file
+    exists, compressed when compression is given, appended to pack when given. Returns '200' or the
+    error, and the committed (or abandoned) download.
+    """
+    download = AtomicDownload(path, compression=compression, pack=pack)
+    request = Request(url, headers=download.range_headers())
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            download.start(response.status, response.headers)
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                download.write(chunk)
+        download.commit()
+        msg = '200'
+    except HTTPError as e:
+        msg = e
+        if e.code == 416 and download.range_complete(e.headers):
+            download.commit()
+            msg = '200'
+    except (URLError, HTTPException, OSError, ValueError) as e:
+        msg = e
+    finally:
+        download.close()
+    return msg, download
+
+
+def read_master_zip(content: bytes) -> bytes:
+    """raw master.idx bytes from a downloaded master.zip"""
+    with zipfile.ZipFile(io.BytesIO(content)) as edgarzipfile:
+        return edgarzipfile.open('master.idx').read()
+
+
+def parse_master_zip(source: Union[str, bytes, IO[bytes]]) -> pd.DataFrame:
+    """stream master.idx out of a master.zip - a path, bytes or seekable file - into a typed master index"""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with zipfile.ZipFile(source) as edgarzipfile:
+        with edgarzipfile.open('master.idx') as member:
+            return parse_master_index_stream(member)
+
+
+def spool_response(response: requests.Response, spool_dir: Optional[str]=None) -> str:
+    """write a streamed response body to a temporary master-*.zip.part file and return its path"""
+    with tempfile.NamedTemporaryFile(dir=spool_dir, prefix='master-', suffix='.zip.part', delete=False) as spool:
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            os.remove(spool.name)
+            raise
+    return spool.name
+
+
+def parse_spooled_zip(path: str, parse_pool: Optional['IndexParsePool']=None) -> pd.DataFrame:
+    """parse a spooled master.zip - on the pool when given, which is only sent the path"""
+    if parse_pool is not None:
+        # decode, repair and parse on another core - only the wall time is seen here, as index_parse
+        with stage_timer('index_parse'):
+            return parse_pool.parse_zip(path)
+    return parse_master_zip(path)
+
+
+def parse_master_index(edgarfile: bytes) -> pd.DataFrame:
+    """decode, repair and parse raw master.idx bytes into a typed master index"""
+    return parse_master_index_stream(io.BytesIO(edgarfile))
+
+
+def parse_master_index_stream(stream: IO[bytes], chunk_size: int=CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Decode, repair and parse master.idx read from a binary stream chunk_size bytes at a time. Rows are
+    parsed and typed _INDEX_CHUNK_ROWS at a time, so apart from the typed result memory stays bounded
+    by one chunk rather than growing with the size of the index.
+
+    Args:
+        stream: binary file object positioned at the start of master.idx - e.g. a zip member
+        chunk_size: bytes read from the stream at a time
+    """
+    start = time.perf_counter()
+    stats = DecodeStats()
+    reader = _BlockReader(_iter_index_blocks(stream, stats, chunk_size))
+    master_index = _concat_indices([type_master_index(chunk) for chunk in _read_index_chunks(reader)])
+    # blocks are decoded lazily as the csv reader pulls them - split the time between the two stages
+    metrics = shared_metrics()
+    metrics.observe_stage('index_decode', stats.seconds)
+    metrics.observe_stage('index_parse', time.perf_counter() - start - stats.seconds)
+    if stats.num_checked:
+        logger.info(f'Decoded master.idx - {stats.num_lines} lines - repaired {stats.num_repaired} of '
+                    f'{stats.num_checked} non-ASCII lines - {stats.num_fallback} not UTF-8')
+    return master_index
+
+
+def _concat_indices(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """concatenate typed index chunks keeping categorical columns categorical"""
+    if len(chunks) == 1:
+        return chunks[0]
+    for column in ('Form Type', 'Company Name'):
+        # chunks carry their own categories - concat would fall back to object unless they agree
+        categories = pd.Index(np.concatenate([chunk[column].cat.categories.to_numpy() for chunk in chunks])).unique()
+        for chunk in chunks:
+            chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+# the column header sits within the first few lines - give up looking for it past this
+_PREAMBLE_LIMIT = 1 << 20
+
+
+def _iter_index_blocks(stream: IO[bytes], stats: DecodeStats, chunk_size: int=CHUNK_SIZE) -> Iterator[bytes]:
+    """repaired utf-8 blocks of whole master.idx lines with the preamble removed"""
+    preamble, pending = '', b''
+    header_found = False
+    while True:
+        chunk = stream.read(chunk_size)
+        data = pending + chunk
+        cut = len(data) if not chunk else data.rfind(b'\n') + 1
+        pending = data[cut:]
+        if cut:
+            start = time.perf_counter()
+            text = decode_text(data[:cut], stats)
+            stats.seconds += time.perf_counter() - start
+            if '\t' in text:
+                text = text.replace('\t', '')
+            if not header_found:
+                preamble += text
+                header_start = preamble.find(_INDEX_HEADER_PREFIX)
+                if header_start >= 0:
+                    text = preamble[preamble.find('\n', header_start) + 1:]
+                elif chunk and len(preamble) < _PREAMBLE_LIMIT:
+                    continue
+                else:
+                    # no header line - parse everything
+                    text = preamble
+                header_found, preamble = True, ''
+            yield text.encode('utf-8')
+        if not chunk:
+            return
+
+
+class _BlockReader(object):
+    """minimal binary file object over an iterator of byte blocks for pandas.read_csv"""
+
+    def __init__(self, blocks: Iterable[bytes]) -> None:
+        self._blocks = iter(blocks)
+        self._buffer = b''
+
+    def read(self, size: int=-1) -> bytes:
+        while size is None or size < 0 or len(self._buffer) < size:
+            block = next(self._blocks, None)
+            if block is None:
+                break
+            self._buffer += block
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(io.BytesIO(self.read()))
+
+
+# rows parsed at once by the streaming parser
+_INDEX_CHUNK_ROWS = 100000
+
+
+def _read_index_csv(buffer: IO[bytes], chunksize: Optional[int]=None) -> pd.DataFrame:
+    return pd.read_csv(buffer, sep='|', header=None, names=INDEX_COLUMNS, dtype=_INDEX_DTYPES,
+                       na_filter=False, quoting=csv.QUOTE_NONE, engine='c', encoding='utf-8',
+                       skip_blank_lines=True, chunksize=chunksize, **_SKIP_BAD_LINES)
+
+
+def _read_index_chunks(buffer: IO[bytes], chunksize: Optional[int]=None) -> Iterator[pd.DataFrame]:
+    # TextFileReader is only a context manager from pandas 1.2
+    reader = _read_index_csv(buffer, chunksize=chunksize or _INDEX_CHUNK_ROWS)
+    num_chunks = 0
+    try:
+        for chunk in reader:
+            num_chunks += 1
+            yield _clean_index(chunk)
+    finally:
+        reader.close()
+    if not num_chunks:
+        yield _clean_index(_read_index_csv(io.BytesIO(b'')))
+
+
+def _clean_index(master_index: pd.DataFrame) -> pd.DataFrame:
+    # short lines (e.g. the ---- separator) come back with empty trailing fields
+    master_index = master_index.loc[master_index['Filename'] != ''].reset_index(drop=True)
+    # rpartition of an empty column has no parts to select
+    master_index['fname'] = master_index['Filename'].str.rpartition('/')[2] if len(master_index) else master_index['Filename']
+    return master_index
+
+
+def _parse_index_buffer(text: str) -> pd.DataFrame:
+    """
+    Parse the decoded master.idx in a single vectorized pass with pandas' C csv reader. The preamble
+    up to and including the column header line is skipped; lines without exactly five fields are dropped.
+    Low cardinality columns (form type, filing date) are read as categoricals to save memory.
+
+    Args:
+        text: decoded contents of master.idx
+    """
+    header_start = text.find(_INDEX_HEADER_PREFIX)
+    if header_start >= 0:
+        text = text[text.find('\n', header_start) + 1:]
+    if '\t' in text:
+        text = text.replace('\t', '')
+    # a BytesIO view is a quarter of the size of StringIO's UCS-4 buffer
+    return _clean_index(_read_index_csv(io.BytesIO(text.encode('utf-8'))))
+
+
 class FormIDX(object):
     """
     FormIDX is a utility class to capture master.idx zip files and construct a parsable data structure. 
@@ -166,6 +476,16 @@ class FormIDX(object):
     seen_files: list of files already processed
     cache_dir: directory to cache master.idx files
     form_types: list of form types to download
+    ciks: list of CIKs to download
+    cache_format: storage format of cached indices - auto, parquet, feather, pickle or csv
+    parse_pool: optional secutils.parallel.IndexParsePool that parses the downloaded index in a worker process
+    index_cache: on-disk cache to use instead of one built from cache_dir and cache_format - lets several
+        FormIDX share its size budget and hit/miss/eviction counters
+    memory_cache: in-process LRU of typed indices checked before the on-disk cache - defaults to the
+        process-wide shared_memory_cache()
+    rate_limiter: request budget of the index request - defaults to the process-wide limiter
+    retry_policy: attempts and backoff for a failed index request - defaults to RetryPolicy()
+    timeout: seconds to wait on connect or any single read of master.zip
 
     See Also:
     -------
@@ -183,64 +503,182 @@ class FormIDX(object):
     >>> # 1000112	CHEVY CHASE MASTER CREDIT CARD TRUST II	10-K	1998-03-27	edgar/data/1000112/0000920628-98-000038.txt	0000920628-98-000038.txt
     >>> # 1000179	PARAMOUNT FINANCIAL CORP	10-K	1998-03-30	edgar/data/1000179/0000950120-98-000108.txt	0000950120-98-000108.txt
     """
-    full_index_url = 'https://www.sec.gov/Archives/edgar/full-index/{year}/QTR{quarter}/master.zip'
+    full_index_url = EDGAR_BASE_URL + 'edgar/full-index/{year}/QTR{quarter}/master.zip'
 
     def __init__(self, year: int, quarter: int, seen_files: Optional[List[str]] = None, 
                 cache_dir: Optional[str]=None, form_types: Optional[List[str]]=None, 
-                ciks: Optional[int]=None):
+                ciks: Optional[int]=None, cache_format: str='auto', parse_pool: Optional['IndexParsePool']=None,
+                index_cache: Optional[IndexCache]=None, memory_cache: Optional[MemoryIndexCache]=None,
+                rate_limiter: Optional[RateLimiter]=None, retry_policy: Optional[RetryPolicy]=None,
+                timeout: float=60.0):
         self.year = year
         self.quarter = quarter
         self.download_url = self.full_index_url.format(year=year, quarter=quarter)
         self.seen_files = seen_files
-        self.cache_dir = _check_cache_dir(cache_dir)
+        if index_cache is None and cache_dir:
+            index_cache = IndexCache(cache_dir, cache_format)
+        self.cache_dir = _check_cache_dir(index_cache.cache_dir if index_cache else cache_dir)
+        self.index_cache = index_cache
+        self.memory_cache = memory_cache if memory_cache is not None else shared_memory_cache()
         self.ciks = ciks
-        self.form_name = f"formidx-{self.year}-{self.quarter}.csv"
+        self.form_name = self.index_cache.file_name(year, quarter) if self.index_cache else None
         self.form_types = form_types
+        self.parse_pool = parse_pool
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.timeout = timeout
         self.master_index = self._get_master_zip_index()
 
-    def _get_master_zip_index(self) -> List[List[str]]:
-        """download zip index files from Edgar db"""
-        if self.cache_dir:
-            cache_file = os.path.join(self.cache_dir, self.form_name)
-        if self.cache_dir and os.path.exists(cache_file):
-            master_index = pd.read_csv(cache_file)
-        else:
-            response = requests.get(self.download_url)
-            status_code = response.status_code
-            if status_code == 200:
-                edgarzipfile = zipfile.ZipFile(io.BytesIO(response.content))
-                edgarfile = edgarzipfile.open('master.idx').read()
-                try:
-                    edgarfile = edgarfile.decode('utf-8')
-                    edgarfile = ftfy.fix_text(edgarfile)
-                    lines = edgarfile.split('\n')
-                except UnicodeDecodeError:
-                    lines = edgarfile.split(b'\n')
-                    lines = _remove_bad_bytes(lines)
-                master_index = self._parse_index_lines(lines)
-                if self.cache_dir:
-                    master_index.to_csv(cache_file, index=False)
+    def _get_master_zip_index(self) -> pd.DataFrame:
+        """
+        download zip index files from Edgar db - the in-memory cache is checked first, then the on-disk
+        cache; cached open quarters are revalidated with a conditional GET
+        """
+        master_index = self._from_memory()
+        headers = {}
+        cached = self.index_cache is not None and self.index_cache.exists(self.year, self.quarter)
+        if master_index is None and cached:
+            if self.index_cache.is_closed(self.year, self.quarter):
+                master_index = self._load_cached()
+            else:
+                headers = self.index_cache.conditional_headers(self.year, self.quarter)
+        elif master_index is None and self.index_cache is not None:
+            self.index_cache.stats.record(misses=1)
+        if master_index is None:
+            fetch_start = time.perf_counter()
+            response = self._request_index(headers)
+            status_code = response.status_code if response is not None else None
+            if status_code == 304 and cached:
+                logger.info(f"master index ({self.year}) - ({self.quarter}) not modified - using cache")
+                self.index_cache.touch(self.year, self.quarter)
+                master_index = self._load_cached()
+            elif status_code == 200:
+                master_index = self._parse_streamed_zip(response, fetch_start)
+                if self.index_cache:
+                    self.index_cache.save(self.year, self.quarter, master_index, validators=response.headers)
+                self._to_memory(master_index)
+            elif cached:
+                logger.warning(f"URL returned error ({status_code}) revalidating {self.download_url} - using cache")
+                master_index = self._load_cached()
             else:
                 logger.error(f"URL returned error ({status_code}): {self.year} - {self.quarter} - {self.download_url}")
                 return None
+            if response is not None and status_code != 200:
+                response.close()
         og_shape = master_index.shape[0]
-        master_index = self._filter_form_type(master_index)
-        master_index = self._filter_ciks(master_index)
-        master_index = self._filter_seen_files(master_index)
+        with stage_timer('index_filter'):
+            master_index = self._filter_form_type(master_index)
+            master_index = self._filter_ciks(master_index)
+            master_index = self._filter_seen_files(master_index)
         num_remaining_download = master_index.shape[0]
         msg = f"master index ({self.year}) - ({self.quarter}) - original shape: {og_shape} - remaining download: {num_remaining_download}"
         logger.info(msg)
         return master_index
 
-    def _parse_index_lines(self, lines: List[str]) -> pd.DataFrame:
-        split_line = lambda x: x.replace('\n', '').replace('\r', '').replace('\t', '').split('|')
-        master_index = pd.DataFrame([split_line(line) for line in lines if line.count('|')==4])
-        columns = ['CIK', 'Company Name', 'Form Type', 'Date Filed', 'Filename']
-        master_index.columns = columns
-        master_index = master_index.iloc[1:]
-        master_index['fname'] = master_index['Filename'].apply(lambda x: x.split('/')[-1])
+    def _request_index(self, headers: Dict[str, str]) -> Optional[requests.Response]:
+        """
+        streamed GET of master.zip within the shared request budget. Throttled (429/503) responses back off
+        on the rate limiter up to retry_policy's max_throttle_retries times; other retryable errors are
+        retried after its jittered backoff. Returns the last response - None if no response was received
+        """
+        metrics = shared_metrics()
+        attempt = throttles = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = requests.get(self.download_url, headers=headers, stream=True, timeout=self.timeout)
+            except (requests.RequestException, OSError) as e:
+                response, error = None, URLError(e)
+                metrics.responses.inc('index', response_status(error))
+            else:
+                metrics.responses.inc('index', response.status_code)
+                if response.status_code < 400:
+                    self.rate_limiter.success()
+                    return response
+                error = HTTPError(self.download_url, response.status_code, response.reason, response.headers, None)
+            throttled = self.retry_policy.is_throttled(error)
+            if throttled:
+                # throttling is paced by the shared limiter and has its own budget instead of using up attempts
+                throttles += 1
+                if self.retry_policy.should_retry_throttled(error, throttles):
+                    response.close()
+                    self.rate_limiter.backoff(error.headers.get('Retry-After'))
+                    continue
+            else:
+                attempt += 1
+            if throttled or not self.retry_policy.should_retry(error, attempt):
+                return response
+            if response is not None:
+                response.close()
+            delay = self.retry_policy.delay(attempt)
+            logger.debug(f'Retrying {self.download_url} in {delay:.2f}s after attempt {attempt}: {error}')
+            time.sleep(delay)
+
+    def _parse_streamed_zip(self, response: requests.Response, fetch_start: Optional[float]=None) -> pd.DataFrame:
+        """
+        spool master.zip to disk as it arrives - zip's central directory sits at the end of the archive -
+        then stream master.idx out of the spool, so neither the archive nor the index is held in memory
+        """
+        fetch_start = fetch_start if fetch_start is not None else time.perf_counter()
+        spool_path = spool_response(response, self.index_cache.cache_dir if self.index_cache else None)
+        shared_metrics().observe_stage('index_fetch', time.perf_counter() - fetch_start)
+        try:
+            return parse_spooled_zip(spool_path, self.parse_pool)
+        finally:
+            os.remove(spool_path)
+
+    def _load_cached(self) -> pd.DataFrame:
+        # form type and CIK filters are pushed down to the cache reader - only the matching rows are kept in memory
+        master_index = self.index_cache.load(self.year, self.quarter, form_types=self.form_types,
+                                             ciks=self._validated_ciks())
+        self._to_memory(master_index, self._memory_key())
+        return master_index
+
+    def _memory_key(self) -> Hashable:
+        """in-memory cache key - the full quarter is cached under its url, a filtered one under its filters too"""
+        ciks = self._validated_ciks()
+        if not self.form_types and not ciks:
+            return self.download_url
+        return self.download_url, tuple(sorted(self.form_types or ())), tuple(sorted(ciks or ()))
+
+    def _from_memory(self) -> Optional[pd.DataFrame]:
+        if not self.memory_cache.enabled:
+            return None
+        version = None
+        if self.index_cache is not None:
+            # open quarters are revalidated against EDGAR through the on-disk cache
+            if not self.index_cache.is_closed(self.year, self.quarter):
+                return None
+            version = self.index_cache.version(self.year, self.quarter)
+        key = self._memory_key()
+        if self.download_url in self.memory_cache:
+            # a full quarter serves any filters
+            key = self.download_url
+        master_index = self.memory_cache.get(key, version=version)
+        if master_index is not None:
+            logger.info(f"master index ({self.year}) - ({self.quarter}) - using in-memory cache")
         return master_index
 
+    def _to_memory(self, master_index: pd.DataFrame, key: Optional[Hashable]=None) -> None:
+        if not self.memory_cache.enabled:
+            return
+        if self.index_cache is not None:
+            version, expires_at = self.index_cache.version(self.year, self.quarter), None
+        else:
+            # nothing on disk to revalidate against - an open quarter is simply fetched again later
+            now = time.time()
+            version = None
+            expires_at = None if quarter_closed(self.year, self.quarter, now) else now + OPEN_QUARTER_MAX_AGE
+        # a shallow copy - the filters below replace columns of the frame handed back
+        self.memory_cache.put(key or self.download_url, master_index.copy(deep=False), version=version,
+                              expires_at=expires_at)
+
+    def _parse_index_lines(self, lines: List[str]) -> pd.DataFrame:
+        return self._parse_index_buffer('\n'.join(lines))
+
+    def _parse_index_buffer(self, text: str) -> pd.DataFrame:
+        return _parse_index_buffer(text)
+
     def _filter_form_type(self, master_index: pd.DataFrame) -> pd.DataFrame:
         """
         Filter FormIDX to specific form types. For example, if FormIDX(form_types=['S-1', 'S-1/A'], year=2018, quarter=4), 
@@ -249,7 +687,7 @@ class FormIDX(object):
         Args:
             master_index: input pd.DataFrame containing all FormIDX
         """
-        master_index['Form Type'] = master_index['Form Type'].apply(lambda x: x.strip())
+        master_index['Form Type'] = _strip_column(master_index['Form Type'])
         if self.form_types:
             unique_forms = master_index['Form Type'].unique().tolist()
             form_not_found = [form for form in self.form_types if form not in unique_forms]
@@ -259,9 +697,13 @@ class FormIDX(object):
             master_index = master_index.loc[master_index['Form Type'].isin(self.form_types)]
         return master_index
 
-    def _filter_ciks(self, master_index: pd.DataFrame) -> pd.DataFrame:
+    def _validated_ciks(self) -> Optional[List[int]]:
         if self.ciks:
-            self.ciks = [self.validate_cik(cik) for cik in self.ciks]
+            self.ciks = [ValidateFields.validate_cik(cik) for cik in self.ciks]
+        return self.ciks
+
+    def _filter_ciks(self, master_index: pd.DataFrame) -> pd.DataFrame:
+        if self._validated_ciks():
             master_index = master_index.loc[master_index['CIK'].isin(self.ciks)]
             msg = f"Found {master_index.shape[0]} files for CIK list"
             logger.info(msg)
@@ -276,24 +718,95 @@ class FormIDX(object):
             logger.info(msg)
         return master_index
 
-    def index_to_files(self) -> List[File]:
-        files = []
+    def to_batch(self) -> 'FileBatch':
+        """validated, array-backed view of the remaining files that creates File records lazily"""
         if isinstance(self.master_index, pd.DataFrame):
-            for line in self.master_index.values:
-                cik = line[0]
-                company_name = line[1]
-                form_type = line[2]
-                date_filed = line[3]
-                partial_url = line[4]
-
-                files.append(File(
-                    form_type=form_type,
-                    company_name=company_name,
-                    cik_number=cik,
-                    date_filed=date_filed,
-                    partial_url=partial_url,
-                ))
-        return files
+            return FileBatch(self.master_index)
+        return FileBatch.empty()
+
+    def index_to_files(self) -> List[File]:
+        return list(self.to_batch())
+
+
+class FileBatch(object):
+    """
+    Compact batch of files backed by master index columns. Rows are validated once with vectorized
+    operations (mirroring ValidateFields) and File records are only created as they are consumed, so
+    a quarter with a million rows costs a few numpy arrays rather than a million validated objects.
+
+    Parameters
+    -------
+    master_index: parsed master index - typed with index_cache.type_master_index if it is not already
+
+    Example:
+    --------
+    >>> form = FormIDX(year=2017, quarter=1, form_types=['10-K'])
+    >>> batch = form.to_batch()
+    >>> len(batch)
+    >>> for sec_file in batch: # File records created one at a time
+    ...     sec_file.download_file(output_dir)
+    """
+    base_url = FileUtils.base_url
+
+    def __init__(self, master_index: pd.DataFrame) -> None:
+        if master_index.empty:
+            self._filenames = np.array([], dtype=object)
+            return
+        if not pd.api.types.is_integer_dtype(master_index['CIK']) or \
+                not pd.api.types.is_datetime64_any_dtype(master_index['Date Filed']):
+            master_index = type_master_index(master_index)
+        form_types = master_index['Form Type'].astype('category')
+        company_names = master_index['Company Name'].astype('category')
+        # validate_form_type / validate_company_name - evaluated once per distinct value
+        form_categories = form_types.cat.categories.str.strip()
+        typecheck = form_categories.str.replace(' ', '').str.replace('-', '').str.replace('/', '')
+        valid_form = pd.Series([t.isupper() or t.isdigit() for t in typecheck], dtype=bool).values
+        # validate_form_name
+        filenames = master_index['Filename'].astype(str).str.strip()
+        valid = valid_form[form_types.cat.codes.values] & filenames.str.endswith('txt').values
+        if not valid.all():
+            logger.warning(f'Dropping {int((~valid).sum())} index rows that failed validation: '
+                           f'{filenames[~valid].head().tolist()}')
+        dates = master_index['Date Filed'].values[valid].astype('datetime64[D]')
+        self._cik = master_index['CIK'].values[valid].astype('int64')
+        self._form_codes = form_types.cat.codes.values[valid]
+        self._form_types = list(form_categories)
+        self._company_codes = company_names.cat.codes.values[valid]
+        self._company_names = list(company_names.cat.categories.str.strip().str.upper())
+        self._year = dates.astype('datetime64[Y]').astype(int) + 1970
+        self._month = dates.astype('datetime64[M]').astype(int) % 12 + 1
+        self._day = (dates - dates.astype('datetime64[M]')).astype(int) + 1
+        self._filenames = filenames.values[valid]
+
+    @classmethod
+    def empty(cls) -> 'FileBatch':
+        batch = cls.__new__(cls)
+        batch._filenames = np.array([], dtype=object)
+        return batch
+
+    def __len__(self) -> int:
+        return len(self._filenames)
+
+    def __getitem__(self, i: int) -> File:
+        sec_file = File.__new__(File)
+        sec_file.form_type = self._form_types[self._form_codes[i]]
+        sec_file.company_name = self._company_names[self._company_codes[i]]
+        sec_file.cik_number = int(self._cik[i])
+        sec_file.date_filed = datetime(int(self._year[i]), int(self._month[i]), int(self._day[i]))
+        sec_file.year = sec_file.date_filed.year
+        sec_file.quarter = _to_quarter(sec_file.date_filed.month)
+        partial_url = self._filenames[i]
+        sec_file.file_name = partial_url.rpartition('/')[2]
+        if partial_url.startswith('/') or '..' in partial_url:
+            sec_file.file_download_url = urljoin(self.base_url, partial_url)
+        else:
+            # same result as urljoin for the relative edgar/data/... paths in master.idx, without the parsing
+            sec_file.file_download_url = self.base_url + partial_url
+        return sec_file
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
 def build_dir_structure(output_dir: str, sec_file: File) -> str: 
     # build output dir
@@ -0,0 +1,339 @@
+import os
+import mmap
+import json
+import shutil
+import logging
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from secutils.index_cache import IndexCache
+from secutils.utils import ValidateFields, _strip_column
+
+logger = logging.getLogger(__name__)
+
+EDGAR_INDEX_DIR = 'edgar_index'
+_MANIFEST = 'manifest.json'
+
+DateLike = Union[str, date, datetime, pd.Timestamp]
+DateRange = Tuple[Optional[DateLike], Optional[DateLike]]
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _to_days(value: Optional[DateLike]) -> Optional[int]:
+    """days since the epoch - the partitions' date representation"""
+    if value is None:
+        return None
+    return int(np.datetime64(pd.Timestamp(value).date(), 'D').astype(np.int64))
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """concatenation of arange(start, stop) for every pair, without a Python loop"""
+    lengths = (stops - starts).astype(np.int64)
+    total = int(lengths.sum())
+    if not total:
+        return _EMPTY
+    range_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return np.repeat(starts - range_starts, lengths) + np.arange(total)
+
+
+def _write_strings(path: str, values: pd.Series) -> np.ndarray:
+    """write utf-8 strings back to back - returns the offsets array (len(values) + 1) locating them"""
+    values = values.astype(str)
+    blob = ''.join(values).encode('utf-8')
+    lengths = values.str.len().to_numpy(dtype=np.int64)
+    if len(blob) != lengths.sum():
+        # not pure ASCII - byte lengths differ from character lengths
+        lengths = np.array([len(value.encode('utf-8')) for value in values], dtype=np.int64)
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    with open(path, 'wb') as outfile:
+        outfile.write(blob)
+    return offsets
+
+
+class _Partition(object):
+    """
+    One quarter of the store, memory-mapped. Rows are sorted by CIK (then filing date) so CIK lookups
+    are binary searches; form_order lists the rows of each form type - also in CIK order - between
+    form_offsets[code] and form_offsets[code + 1]. Strings are utf-8 blobs located by offset arrays and
+    only decoded for the rows a query returns.
+    """
+    _ARRAYS = ('cik', 'date', 'form', 'company', 'form_order', 'form_offsets', 'filename_offsets', 'company_offsets')
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        for name in self._ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))
+        with open(os.path.join(path, 'forms.json'), 'r') as infile:
+            self.forms = json.load(infile)
+        self.form_codes = {form: code for code, form in enumerate(self.forms)}
+        self._files = []
+        self.filenames = self._open_blob('filename.bin')
+        self.company_names = self._open_blob('company.bin')
+
+    def _open_blob(self, name: str) -> Union[mmap.mmap, bytes]:
+        infile = open(os.path.join(self.path, name), 'rb')
+        self._files.append(infile)
+        if os.fstat(infile.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def write(path: str, master_index: pd.DataFrame) -> None:
+        """write a typed master index as a partition directory"""
+        os.makedirs(path)
+        master_index = master_index.sort_values(['CIK', 'Date Filed'], kind='stable')
+        form_type = _strip_column(master_index['Form Type'].astype(str)).astype('category')
+        company = master_index['Company Name'].astype(str).astype('category')
+        form = form_type.cat.codes.to_numpy().astype(np.int32)
+        # stable - rows of a form type stay in CIK order
+        form_order = np.argsort(form, kind='stable').astype(np.int64)
+        arrays = {
+            'cik': master_index['CIK'].to_numpy(dtype=np.int64),
+            'date': master_index['Date Filed'].to_numpy().astype('datetime64[D]').astype(np.int32),
+            'form': form,
+            'company': company.cat.codes.to_numpy().astype(np.int32),
+            'form_order': form_order,
+            'form_offsets': np.searchsorted(form[form_order], np.arange(len(form_type.cat.categories) + 1)),
+            'filename_offsets': _write_strings(os.path.join(path, 'filename.bin'), master_index['Filename']),
+            'company_offsets': _write_strings(os.path.join(path, 'company.bin'), pd.Series(company.cat.categories)),
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), values)
+        with open(os.path.join(path, 'forms.json'), 'w') as outfile:
+            json.dump([str(form) for form in form_type.cat.categories], outfile)
+
+    def select(self, ciks: Optional[np.ndarray]=None, forms: Optional[List[str]]=None,
+               start: Optional[int]=None, end: Optional[int]=None) -> np.ndarray:
+        """positions of the rows matching every given condition"""
+        cik_rows = form_rows = None
+        if ciks is not None:
+            lo, hi = np.searchsorted(self.cik, ciks, 'left'), np.searchsorted(self.cik, ciks, 'right')
+            cik_rows = (lo, hi, int((hi - lo).sum()))
+        if forms is not None:
+            codes = np.array([self.form_codes[form] for form in forms if form in self.form_codes], dtype=np.int64)
+            lo, hi = self.form_offsets[codes], self.form_offsets[codes + 1]
+            form_rows = (lo, hi, int((hi - lo).sum()))
+        if cik_rows is not None and (form_rows is None or cik_rows[2] <= form_rows[2]):
+            # expand the smaller posting list and check the other condition on it
+            positions = _ranges(cik_rows[0], cik_rows[1])
+            if form_rows is not None:
+                positions = positions[np.isin(self.form[positions], codes)]
+        elif form_rows is not None:
+            positions = np.sort(self.form_order[_ranges(form_rows[0], form_rows[1])])
+            if cik_rows is not None:
+                positions = positions[np.isin(self.cik[positions], ciks)]
+        else:
+            positions = np.arange(len(self.cik))
+        if start is not None or end is not None:
+            days = self.date[positions]
+            keep = np.ones(len(positions), dtype=bool)
+            if start is not None:
+                keep &= days >= start
+            if end is not None:
+                keep &= days <= end
+            positions = positions[keep]
+        return positions
+
+    @staticmethod
+    def _strings(blob: Union[mmap.mmap, bytes], offsets: np.ndarray, positions: np.ndarray) -> List[str]:
+        starts, stops = offsets[positions].tolist(), offsets[positions + 1].tolist()
+        return [blob[start:stop].decode('utf-8') for start, stop in zip(starts, stops)]
+
+    def rows(self, positions: np.ndarray) -> Dict[str, np.ndarray]:
+        """column arrays of the selected rows - strings decoded, company names once per distinct name"""
+        company_codes, company_inverse = np.unique(self.company[positions], return_inverse=True)
+        company_names = np.array(self._strings(self.company_names, self.company_offsets, company_codes), dtype=object)
+        return {
+            'CIK': np.asarray(self.cik[positions]),
+            'Company Name': company_names[company_inverse.ravel()],
+            'Form Type': np.array(self.forms, dtype=object)[self.form[positions]],
+            'Date Filed': np.asarray(self.date[positions]),
+            'Filename': np.array(self._strings(self.filenames, self.filename_offsets, positions), dtype=object),
+        }
+
+    def close(self) -> None:
+        for blob in (self.filenames, self.company_names):
+            if isinstance(blob, mmap.mmap):
+                blob.close()
+        for infile in self._files:
+            infile.close()
+
+
+class EdgarIndex(object):
+    """
+    Consolidated filing index over every cached quarter, answering CIK / form type / filing date
+    queries by index lookups instead of loading and masking each quarter. The store is partitioned by
+    quarter; each partition holds memory-mapped arrays sorted by CIK with a per form type row list,
+    and partitions outside a date range are skipped from the filing date bounds kept in the manifest.
+    update() adds quarters from an IndexCache and rebuilds those whose cached copy changed - quarters
+    later evicted from the IndexCache stay queryable.
+
+    The store assumes a single writer; readers in other processes keep a consistent view of a
+    partition while it is being replaced.
+
+    Parameters
+    -------
+    path: directory of the store - usually <cache_dir>/edgar_index (EdgarIndex.for_cache_dir)
+
+    Example:
+    --------
+    >>> from secutils.edgar_index import EdgarIndex
+    >>> from secutils.index_cache import IndexCache
+    >>> index = EdgarIndex.for_cache_dir('/mnt/sda/sec/cache')
+    >>> index.update(IndexCache('/mnt/sda/sec/cache'))
+    >>> filings = index.query(ciks=ciks, form_types=['8-K'], date_range=('2005-01-01', '2019-12-31'))
+    >>> batch = FileBatch(filings)
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._manifest = self._load_manifest()
+        self._partitions = {}  # type: Dict[str, _Partition]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_cache_dir(cls, cache_dir: str) -> 'EdgarIndex':
+        return cls(os.path.join(cache_dir, EDGAR_INDEX_DIR))
+
+    @staticmethod
+    def _key(year: int, quarter: int) -> str:
+        return f'{year}-Q{quarter}'
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        try:
+            with open(os.path.join(self.path, _MANIFEST), 'r') as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self) -> None:
+        path = os.path.join(self.path, _MANIFEST)
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as outfile:
+            json.dump(self._manifest, outfile, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    @property
+    def quarters(self) -> List[Tuple[int, int]]:
+        return sorted((entry['year'], entry['quarter']) for entry in self._manifest.values())
+
+    def __len__(self) -> int:
+        return sum(entry['rows'] for entry in self._manifest.values())
+
+    def add_quarter(self, year: int, quarter: int, master_index: pd.DataFrame, version: Optional[list]=None) -> None:
+        """write (or replace) the partition of a typed quarterly master index"""
+        key = self._key(year, quarter)
+        previous = self._manifest.get(key)
+        generation = previous['generation'] + 1 if previous else 0
+        name = f'{key}.{generation}'
+        tmp_path = os.path.join(self.path, f'{name}.tmp-{os.getpid()}')
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        _Partition.write(tmp_path, master_index)
+        os.rename(tmp_path, os.path.join(self.path, name))
+        dates = master_index['Date Filed']
+        self._manifest[key] = {
+            'year': year, 'quarter': quarter, 'dir': name, 'generation': generation, 'rows': len(master_index),
+            'min_date': _to_days(dates.min()) if len(master_index) else None,
+            'max_date': _to_days(dates.max()) if len(master_index) else None,
+            'version': list(version) if version is not None else None,
+        }
+        self._save_manifest()
+        with self._lock:
+            stale = self._partitions.pop(key, None)
+        if stale is not None:
+            stale.close()
+        if previous:
+            shutil.rmtree(os.path.join(self.path, previous['dir']), ignore_errors=True)
+        logger.info(f'Indexed {len(master_index)} filings for {year} Q{quarter}')
+
+    def update(self, index_cache: IndexCache, quarters: Optional[Iterable[Tuple[int, int]]]=None) -> int:
+        """
+        index the cached quarters (all of them by default) that are new or changed since they were
+        last indexed - returns the number of partitions written
+        """
+        num_written = 0
+        for year, quarter in (quarters if quarters is not None else index_cache.quarters()):
+            version = index_cache.version(year, quarter)
+            if version is None:
+                continue
+            entry = self._manifest.get(self._key(year, quarter))
+            if entry is not None and entry['version'] == list(version):
+                continue
+            master_index = index_cache.load(year, quarter)
+            # loading a csv cache migrates it - record the version of the rewritten file
+            self.add_quarter(year, quarter, master_index, version=index_cache.version(year, quarter))
+            num_written += 1
+        return num_written
+
+    def _partition(self, key: str) -> _Partition:
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                partition = _Partition(os.path.join(self.path, self._manifest[key]['dir']))
+                self._partitions[key] = partition
+            return partition
+
+    def query(self, ciks: Optional[Iterable[Union[int, str]]]=None, form_types: Optional[Iterable[str]]=None,
+              date_range: Optional[DateRange]=None) -> pd.DataFrame:
+        """
+        Filings matching every given condition, as a typed master index (the columns FormIDX produces,
+        accepted by FileBatch) ordered by quarter, then CIK and filing date.
+
+        Args:
+            ciks: CIKs to return
+            form_types: form types to return
+            date_range: inclusive (start, end) filing dates - either end may be None
+        """
+        cik_keys = np.unique(np.array([ValidateFields.validate_cik(cik) for cik in ciks], dtype=np.int64)) \
+            if ciks is not None else None
+        forms = sorted({form.strip() for form in form_types}) if form_types is not None else None
+        start, end = (_to_days(date_range[0]), _to_days(date_range[1])) if date_range else (None, None)
+        columns = []
+        for key, entry in sorted(self._manifest.items(), key=lambda item: (item[1]['year'], item[1]['quarter'])):
+            if not entry['rows']:
+                continue
+            # partitions entirely outside the date range are never opened
+            if (start is not None and entry['max_date'] < start) or (end is not None and entry['min_date'] > end):
+                continue
+            partition = self._partition(key)
+            positions = partition.select(cik_keys, forms, start, end)
+            if len(positions):
+                columns.append(partition.rows(positions))
+        return self._frame(columns)
+
+    @staticmethod
+    def _frame(columns: List[Dict[str, np.ndarray]]) -> pd.DataFrame:
+        def concat(name: str, dtype: object) -> np.ndarray:
+            return np.concatenate([part[name] for part in columns]) if columns else np.array([], dtype=dtype)
+
+        filenames = pd.Series(concat('Filename', object), dtype=object)
+        master_index = pd.DataFrame({
+            'CIK': concat('CIK', np.int64),
+            'Company Name': pd.Categorical(concat('Company Name', object)),
+            'Form Type': pd.Categorical(concat('Form Type', object)),
+            'Date Filed': concat('Date Filed', np.int32).astype('datetime64[D]').astype('datetime64[ns]'),
+            'Filename': filenames,
+        })
+        # rpartition of an empty column has no parts to select
+        master_index['fname'] = filenames.str.rpartition('/')[2] if len(filenames) else filenames
+        return master_index
+
+    def close(self) -> None:
+        with self._lock:
+            partitions, self._partitions = list(self._partitions.values()), {}
+        for partition in partitions:
+            partition.close()
+
+    def __enter__(self) -> 'EdgarIndex':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,501 @@
+import os
+import re
+import json
+import time
+import logging
+import calendar
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, List, Mapping, Optional, Tuple
+
+import pandas as pd
+
+from secutils.utils import _strip_column, _check_cache_dir
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
+
+Filters = List[Tuple[str, str, list]]
+
+# filings from a quarter's last days are published shortly after it ends - a quarter cached later
+# than this is closed and never revalidated
+CLOSED_QUARTER_GRACE = timedelta(days=7)
+
+DEFAULT_MEMORY_CACHE_BYTES = 256 * 2 ** 20
+# open quarters held in memory without an on-disk cache to revalidate against are refetched after this
+OPEN_QUARTER_MAX_AGE = 600.0
+
+_CACHE_FILE = re.compile(r'^formidx-(\d{4})-([1-4])\.(parquet|feather|pkl|csv)$')
+
+
+def type_master_index(master_index: pd.DataFrame) -> pd.DataFrame:
+    """
+    cast a parsed master index to its cached types - CIK int64, Date Filed datetime64, Form Type and
+    Company Name categorical. Rows whose CIK or filing date cannot be parsed are dropped.
+    """
+    master_index = master_index.copy()
+    master_index['CIK'] = pd.to_numeric(master_index['CIK'], errors='coerce')
+    date_filed = master_index['Date Filed']
+    if isinstance(date_filed.dtype, pd.CategoricalDtype):
+        # parse each distinct date once
+        dates = _to_datetime(pd.Series(date_filed.cat.categories))
+        date_filed = pd.Series(dates.take(date_filed.cat.codes.values).values, index=master_index.index)
+    master_index['Date Filed'] = _to_datetime(date_filed)
+    invalid = master_index['CIK'].isna() | master_index['Date Filed'].isna()
+    if invalid.any():
+        logger.warning(f'Dropping {int(invalid.sum())} master index rows with invalid CIK or filing date')
+        master_index = master_index.loc[~invalid]
+    master_index['CIK'] = master_index['CIK'].astype('int64')
+    master_index['Form Type'] = _strip_column(master_index['Form Type']).astype('category')
+    master_index['Company Name'] = master_index['Company Name'].astype('category')
+    return master_index.reset_index(drop=True)
+
+
+def _to_datetime(values: pd.Series) -> pd.Series:
+    """parse filing dates - quarterly indices use %Y-%m-%d, daily indices %Y%m%d"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    dates = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+    compact = dates.isna() & values.notna()
+    if compact.any():
+        dates[compact] = pd.to_datetime(values[compact], format='%Y%m%d', errors='coerce')
+    return dates
+
+
+def _filters(form_types: Optional[List[str]]=None, ciks: Optional[List[int]]=None) -> Filters:
+    filters = []
+    if form_types:
+        filters.append(('Form Type', 'in', list(form_types)))
+    if ciks:
+        filters.append(('CIK', 'in', [int(cik) for cik in ciks]))
+    return filters
+
+
+def _apply_filters(master_index: pd.DataFrame, filters: Filters) -> pd.DataFrame:
+    for column, _, values in filters:
+        master_index = master_index.loc[master_index[column].isin(values)]
+    return master_index
+
+
+def quarter_closed(year: int, quarter: int, fetched_at: float) -> bool:
+    """True when an index fetched at fetched_at (epoch seconds) was fetched after the quarter ended"""
+    month = 3 * quarter
+    quarter_end = datetime(year, month, calendar.monthrange(year, month)[1]) + timedelta(days=1)
+    return datetime.fromtimestamp(fetched_at) >= quarter_end + CLOSED_QUARTER_GRACE
+
+
+class CacheStats(object):
+    """hit, miss and eviction counters of a cache tier - safe to update from several threads"""
+    __slots__ = ('hits', 'misses', 'evictions', '_lock')
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def record(self, hits: int=0, misses: int=0, evictions: int=0) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def __repr__(self) -> str:
+        return f'CacheStats(hits={self.hits}, misses={self.misses}, evictions={self.evictions})'
+
+
+class IndexCacheBackend(object):
+    """storage format for cached quarterly indices - subclasses implement read/write"""
+    name = None
+    extension = None
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def write(self, master_index: pd.DataFrame, path: str) -> None:
+        raise NotImplementedError
+
+    def read(self, path: str, filters: Optional[Filters]=None) -> pd.DataFrame:
+        raise NotImplementedError
+
+
+class ParquetBackend(IndexCacheBackend):
+    """parquet via pyarrow - form type and CIK filters are pushed down to the reader"""
+    name = 'parquet'
+    extension = 'parquet'
+
+    @classmethod
+    def available(cls) -> bool:
+        return _HAS_PYARROW
+
+    def write(self, master_index: pd.DataFrame, path: str) -> None:
+        master_index.to_parquet(path, index=False)
+
+    def read(self, path: str, filters: Optional[Filters]=None) -> pd.DataFrame:
+        return pd.read_parquet(path, filters=filters or None)
+
+
+class FeatherBackend(IndexCacheBackend):
+    """feather (arrow ipc) via pyarrow - fastest to load, filters applied after reading"""
+    name = 'feather'
+    extension = 'feather'
+
+    @classmethod
+    def available(cls) -> bool:
+        return _HAS_PYARROW
+
+    def write(self, master_index: pd.DataFrame, path: str) -> None:
+        master_index.reset_index(drop=True).to_feather(path)
+
+    def read(self, path: str, filters: Optional[Filters]=None) -> pd.DataFrame:
+        return _apply_filters(pd.read_feather(path), filters or [])
+
+
+class PickleBackend(IndexCacheBackend):
+    """pickled DataFrame - needs no optional dependencies and keeps all column types"""
+    name = 'pickle'
+    extension = 'pkl'
+
+    def write(self, master_index: pd.DataFrame, path: str) -> None:
+        master_index.to_pickle(path)
+
+    def read(self, path: str, filters: Optional[Filters]=None) -> pd.DataFrame:
+        return _apply_filters(pd.read_pickle(path), filters or [])
+
+
+class CSVBackend(IndexCacheBackend):
+    """original untyped csv cache - kept so existing caches can be read and migrated"""
+    name = 'csv'
+    extension = 'csv'
+
+    def write(self, master_index: pd.DataFrame, path: str) -> None:
+        master_index.to_csv(path, index=False)
+
+    def read(self, path: str, filters: Optional[Filters]=None) -> pd.DataFrame:
+        master_index = pd.read_csv(path, dtype=str, na_filter=False)
+        return _apply_filters(type_master_index(master_index), filters or [])
+
+
+BACKENDS = {backend.name: backend for backend in [ParquetBackend, FeatherBackend, PickleBackend, CSVBackend]}
+
+
+def get_backend(name: str='auto') -> IndexCacheBackend:
+    """return the named backend - 'auto' picks parquet when pyarrow is installed, otherwise pickle"""
+    if name == 'auto':
+        name = 'parquet' if ParquetBackend.available() else 'pickle'
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown index cache format: {name} - expected one of {["auto"] + list(BACKENDS)}')
+    backend = BACKENDS[name]
+    if not backend.available():
+        raise ImportError(f'Index cache format {name} requires pyarrow - pip install pyarrow')
+    return backend()
+
+
+class IndexCache(object):
+    """
+    On-disk cache of parsed, typed quarterly master indices stored as formidx-{year}-{quarter}.{ext}.
+    Caches written by earlier versions as csv are read, typed and rewritten in the configured format.
+    The ETag and Last-Modified of the downloaded master.zip are kept in formidx-{year}-{quarter}.meta.json
+    so open quarters can be revalidated with a conditional request; quarters cached after they
+    closed are final.
+
+    With max_bytes set the cached quarters are kept under that size - the least recently loaded ones
+    are evicted after each save.
+
+    Parameters
+    -------
+    cache_dir: directory holding cached indices
+    cache_format: one of auto, parquet, feather, pickle or csv
+    max_bytes: size budget of the cached index files - unbounded by default
+
+    Example:
+    --------
+    >>> from secutils.index_cache import IndexCache
+    >>> cache = IndexCache('/mnt/sda/sec/cache', max_bytes=2 * 2 ** 30)
+    >>> master_index = cache.load(2017, 1, form_types=['10-K'], ciks=[1000230])
+    >>> cache.stats
+    CacheStats(hits=1, misses=0, evictions=0)
+    """
+
+    def __init__(self, cache_dir: str, cache_format: str='auto', max_bytes: Optional[int]=None) -> None:
+        self.cache_dir = _check_cache_dir(cache_dir)
+        self.backend = get_backend(cache_format)
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+    def file_name(self, year: int, quarter: int, backend: Optional[IndexCacheBackend]=None) -> str:
+        backend = backend or self.backend
+        return f'formidx-{year}-{quarter}.{backend.extension}'
+
+    def path(self, year: int, quarter: int, backend: Optional[IndexCacheBackend]=None) -> str:
+        return os.path.join(self.cache_dir, self.file_name(year, quarter, backend))
+
+    def exists(self, year: int, quarter: int) -> bool:
+        return os.path.exists(self.path(year, quarter)) or os.path.exists(self.path(year, quarter, CSVBackend()))
+
+    def meta_path(self, year: int, quarter: int) -> str:
+        return os.path.join(self.cache_dir, f'formidx-{year}-{quarter}.meta.json')
+
+    def load_meta(self, year: int, quarter: int) -> Dict[str, object]:
+        """ETag, Last-Modified and fetch time of a cached quarter - empty if never recorded"""
+        try:
+            with open(self.meta_path(year, quarter), 'r') as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self, year: int, quarter: int, meta: Dict[str, object]) -> None:
+        path = self.meta_path(year, quarter)
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as outfile:
+            json.dump(meta, outfile)
+        os.replace(tmp_path, path)
+
+    def fetched_at(self, year: int, quarter: int) -> Optional[float]:
+        """when the cached quarter was downloaded - the cache file's mtime for caches without metadata"""
+        meta = self.load_meta(year, quarter)
+        if 'fetched_at' in meta:
+            return meta['fetched_at']
+        for path in (self.path(year, quarter), self.path(year, quarter, CSVBackend())):
+            if os.path.exists(path):
+                return os.path.getmtime(path)
+        return None
+
+    def is_closed(self, year: int, quarter: int) -> bool:
+        """True when the cached quarter was downloaded after the quarter ended - no revalidation needed"""
+        fetched_at = self.fetched_at(year, quarter)
+        return fetched_at is not None and quarter_closed(year, quarter, fetched_at)
+
+    def version(self, year: int, quarter: int) -> Optional[Tuple[float, int]]:
+        """
+        fetch time and file modification time of the cached quarter - changes whenever it is downloaded
+        again or rewritten, so copies held elsewhere (MemoryIndexCache) can tell they are stale
+        """
+        for path in (self.path(year, quarter), self.path(year, quarter, CSVBackend())):
+            try:
+                return self.fetched_at(year, quarter), os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+        return None
+
+    def conditional_headers(self, year: int, quarter: int) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since headers revalidating the cached quarter"""
+        meta = self.load_meta(year, quarter)
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def touch(self, year: int, quarter: int) -> None:
+        """record a successful revalidation (304 Not Modified)"""
+        meta = self.load_meta(year, quarter)
+        meta['fetched_at'] = time.time()
+        self._save_meta(year, quarter, meta)
+
+    def save(self, year: int, quarter: int, master_index: pd.DataFrame,
+             validators: Optional[Mapping[str, str]]=None, fetched_at: Optional[float]=None) -> str:
+        """
+        write a typed master index - written to a temp file and renamed so readers never see a partial cache.
+        validators are the response headers of a fresh download; without them the recorded fetch time is kept.
+        """
+        if validators is not None or fetched_at is not None:
+            validators = validators or {}
+            meta = {'etag': validators.get('ETag'), 'last_modified': validators.get('Last-Modified'),
+                    'fetched_at': fetched_at or time.time()}
+        else:
+            meta = self.load_meta(year, quarter)
+            if 'fetched_at' not in meta and self.exists(year, quarter):
+                # rewriting the file would otherwise make a stale cache look freshly downloaded
+                meta['fetched_at'] = self.fetched_at(year, quarter)
+        path = self.path(year, quarter)
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        self.backend.write(master_index, tmp_path)
+        os.replace(tmp_path, path)
+        if meta:
+            self._save_meta(year, quarter, meta)
+        if self.max_bytes is not None:
+            self._enforce_budget(keep=path)
+        return path
+
+    def load(self, year: int, quarter: int, form_types: Optional[List[str]]=None,
+             ciks: Optional[List[int]]=None) -> Optional[pd.DataFrame]:
+        """load a cached master index with the form type and CIK filters applied - None on a cache miss"""
+        filters = _filters(form_types, ciks)
+        path = self.path(year, quarter)
+        if os.path.exists(path):
+            self.stats.record(hits=1)
+            _mark_used(path)
+            return self.backend.read(path, filters)
+        legacy_path = self.path(year, quarter, CSVBackend())
+        if self.backend.name != 'csv' and os.path.exists(legacy_path):
+            logger.info(f'Migrating cached index {legacy_path} to {self.backend.name}')
+            self.stats.record(hits=1)
+            master_index = CSVBackend().read(legacy_path)
+            self.save(year, quarter, master_index)
+            return _apply_filters(master_index, filters)
+        self.stats.record(misses=1)
+        return None
+
+    def _cache_files(self) -> List[os.DirEntry]:
+        return [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and _CACHE_FILE.match(entry.name)]
+
+    def quarters(self) -> List[Tuple[int, int]]:
+        """(year, quarter) of every cached index - including csv caches not yet migrated"""
+        extensions = {self.backend.extension, CSVBackend.extension}
+        quarters = set()
+        for entry in self._cache_files():
+            match = _CACHE_FILE.match(entry.name)
+            if match.group(3) in extensions:
+                quarters.add((int(match.group(1)), int(match.group(2))))
+        return sorted(quarters)
+
+    def size(self) -> int:
+        """bytes taken by the cached index files"""
+        return sum(entry.stat().st_size for entry in self._cache_files())
+
+    def _enforce_budget(self, keep: Optional[str]=None) -> None:
+        """evict the least recently loaded quarters until the cache fits in max_bytes"""
+        with self._lock:
+            entries = [(entry.stat().st_atime_ns, entry.stat().st_size, entry.path) for entry in self._cache_files()]
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if keep is not None and os.path.samefile(path, keep):
+                    continue
+                self._evict(path)
+                total -= size
+                logger.info(f'Evicted cached index {path} - cache size {total / 2 ** 20:.1f} MiB')
+
+    def _evict(self, path: str) -> None:
+        meta_path = path[:path.rindex('.')] + '.meta.json'
+        for evicted in (path, meta_path):
+            try:
+                os.remove(evicted)
+            except FileNotFoundError:
+                pass
+        self.stats.record(evictions=1)
+
+
+def _mark_used(path: str) -> None:
+    # eviction order follows access time - set it explicitly as relatime/noatime mounts may not, and
+    # keep the modification time, which stands in for the fetch time of caches without metadata
+    try:
+        # time.time_ns needs Python 3.7
+        os.utime(path, ns=(int(time.time() * 1e9), os.stat(path).st_mtime_ns))
+    except OSError:
+        pass
+
+
+class MemoryIndexCache(object):
+    """
+    In-process LRU of parsed, typed quarterly indices kept under a memory budget, in front of the
+    on-disk IndexCache. Entries carry a version - the on-disk cache's IndexCache.version - and an
+    optional expiry; a lookup with a different version or after the expiry is a miss, so an entry
+    never outlives a newer download or rewrite of the quarter. Indices larger than the whole budget
+    are not kept. FormIDX uses the process-wide shared_memory_cache() unless given one.
+
+    Parameters
+    -------
+    max_bytes: memory budget of the cached indices (DataFrame.memory_usage(deep=True)) - 0 disables the cache
+
+    Example:
+    --------
+    >>> from secutils.index_cache import MemoryIndexCache
+    >>> memory_cache = MemoryIndexCache(max_bytes=512 * 2 ** 20)
+    >>> form = FormIDX(year=2017, quarter=1, form_types=['10-K'], memory_cache=memory_cache)
+    >>> form = FormIDX(year=2017, quarter=1, form_types=['8-K'], memory_cache=memory_cache)
+    >>> memory_cache.stats
+    CacheStats(hits=1, misses=1, evictions=0)
+    """
+
+    def __init__(self, max_bytes: int=DEFAULT_MEMORY_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self.nbytes = 0
+        # key -> (master index, size, version, expires_at)
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: Hashable, version: Optional[Hashable]=None) -> Optional[pd.DataFrame]:
+        """the cached index - a shallow copy, so adding or replacing columns leaves the cache intact"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                master_index, size, entry_version, expires_at = entry
+                if entry_version == version and (expires_at is None or time.time() < expires_at):
+                    self._entries.move_to_end(key)
+                    self.stats.record(hits=1)
+                    return master_index.copy(deep=False)
+                # stale - superseded on disk or expired
+                del self._entries[key]
+                self.nbytes -= size
+            self.stats.record(misses=1)
+            return None
+
+    def put(self, key: Hashable, master_index: pd.DataFrame, version: Optional[Hashable]=None,
+            expires_at: Optional[float]=None) -> bool:
+        """cache a typed index, evicting the least recently used ones to stay within max_bytes"""
+        size = int(master_index.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            while self._entries and self.nbytes + size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted[1]
+                self.stats.record(evictions=1)
+                logger.debug(f'Evicted {evicted_key} from the in-memory index cache')
+            self._entries[key] = (master_index, size, version, expires_at)
+            self.nbytes += size
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+
+_shared_memory_cache = None
+_shared_lock = threading.Lock()
+
+
+def shared_memory_cache(max_bytes: Optional[int]=None) -> MemoryIndexCache:
+    """
+    return the process-wide MemoryIndexCache, creating it on first use. Passing max_bytes replaces the
+    shared cache with a new budget.
+    """
+    global _shared_memory_cache
+    with _shared_lock:
+        if _shared_memory_cache is None or (max_bytes is not None and max_bytes != _shared_memory_cache.max_bytes):
+            _shared_memory_cache = MemoryIndexCache(DEFAULT_MEMORY_CACHE_BYTES if max_bytes is None else max_bytes)
+        return _shared_memory_cache
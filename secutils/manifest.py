@@ -0,0 +1,193 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from secutils.storage import DOCUMENTS_NAME
+from secutils.compression import strip_compression_suffix
+from secutils.packs import PACK_INDEX_NAME, PACK_NAME, read_pack_index
+from secutils.profiling import PROFILE_DIR_PREFIX
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.sqlite'
+STATUS_COMPLETE = 'complete'
+
+
+def accession_from_name(file_name: str) -> str:
+    """0001437749-17-020936.txt -> 0001437749-17-020936"""
+    return os.path.splitext(os.path.basename(file_name))[0]
+
+
+class DownloadManifest(object):
+    """
+    Persistent SQLite index of downloaded filings keyed by accession number, recording path, size,
+    checksum and status. Downloads update it one row at a time as they complete, so startup loads the
+    set of seen files in time proportional to the manifest instead of walking the whole output tree.
+    rebuild() recreates it from disk when the output directory was modified outside of secutils.
+
+    Parameters
+    -------
+    path: path of the sqlite database - usually <output_dir>/manifest.sqlite
+    wal: use write-ahead logging - disable it when processes on several hosts share the database
+
+    Example:
+    --------
+    >>> from secutils.manifest import DownloadManifest
+    >>> manifest = DownloadManifest('/mnt/sda/sec/manifest.sqlite')
+    >>> if manifest.is_new:
+    ...     manifest.rebuild('/mnt/sda/sec')
+    >>> seen_files = manifest.seen_files()
+    """
+    columns = ('accession', 'file_name', 'cik', 'form_type', 'year', 'quarter', 'path',
+               'size', 'checksum', 'status', 'updated_at')
+
+    def __init__(self, path: str, wal: bool=True) -> None:
+        self.path = path
+        self.is_new = not os.path.exists(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL needs shared memory between the processes - it does not work across hosts on a network filesystem
+        self._conn.execute(f'PRAGMA journal_mode={"WAL" if wal else "DELETE"}')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS filings (
+                accession TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                cik INTEGER,
+                form_type TEXT,
+                year INTEGER,
+                quarter TEXT,
+                path TEXT,
+                size INTEGER,
+                checksum TEXT,
+                status TEXT NOT NULL,
+                updated_at REAL
+            )""")
+        self._conn.commit()
+
+    @classmethod
+    def for_output_dir(cls, output_dir: str, wal: bool=True) -> 'DownloadManifest':
+        os.makedirs(output_dir, exist_ok=True)
+        return cls(os.path.join(output_dir, MANIFEST_NAME), wal=wal)
+
+    def record(self, file_name: str, path: Optional[str], status: str=STATUS_COMPLETE,
+               cik: Optional[int]=None, form_type: Optional[str]=None, year: Optional[int]=None,
+               quarter: Optional[str]=None, size: Optional[int]=None, checksum: Optional[str]=None) -> None:
+        """insert or replace the row for a single filing"""
+        if size is None and path and os.path.exists(path):
+            size = _path_size(path)
+        row = (accession_from_name(file_name), file_name, cik, form_type, year, quarter, path,
+               size, checksum, status, time.time())
+        with self._lock:
+            self._conn.execute(f'INSERT OR REPLACE INTO filings VALUES ({",".join("?" * len(row))})', row)
+            self._conn.commit()
+
+    def record_file(self, sec_file, status: str=STATUS_COMPLETE) -> None:
+        """record a secutils.edgar.File after it has been downloaded"""
+        self.record(
+            file_name=sec_file.file_name,
+            path=getattr(sec_file, 'download_file_dir', None),
+            status=status,
+            cik=sec_file.cik_number,
+            form_type=sec_file.form_type,
+            year=sec_file.year,
+            quarter=sec_file.quarter,
+            size=getattr(sec_file, 'download_size', None),
+            checksum=getattr(sec_file, 'checksum', None),
+        )
+
+    def seen_files(self) -> Set[str]:
+        """file names of every completed download"""
+        with self._lock:
+            rows = self._conn.execute('SELECT file_name FROM filings WHERE status = ?', (STATUS_COMPLETE,))
+            return {row[0] for row in rows}
+
+    def get(self, accession: str) -> Optional[Dict[str, object]]:
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM filings WHERE accession = ?', (accession,)).fetchone()
+        return dict(zip(self.columns, row)) if row else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM filings').fetchone()[0]
+
+    def __contains__(self, accession: str) -> bool:
+        return self.get(accession) is not None
+
+    def rebuild(self, output_dir: str) -> int:
+        """
+        replace the manifest with the filings found on disk under output_dir. Checksums of files whose
+        size is unchanged are carried over.
+
+        Returns:
+            number of filings recorded
+        """
+        with self._lock:
+            checksums = dict(((row[0], row[1]), row[2]) for row in self._conn.execute(
+                'SELECT accession, size, checksum FROM filings WHERE checksum IS NOT NULL'))
+        now = time.time()
+        rows = []
+        for path, file_name, size, parts in _walk_filings(output_dir):
+            accession = accession_from_name(file_name)
+            form_type, year, quarter = parts
+            rows.append((accession, file_name, None, form_type, year, quarter, path, size,
+                         checksums.get((accession, size)), STATUS_COMPLETE, now))
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM filings')
+                self._conn.executemany(f'INSERT OR REPLACE INTO filings VALUES ({",".join("?" * len(self.columns))})', rows)
+        self.is_new = False
+        logger.info(f'Rebuilt download manifest from {output_dir} - {len(rows)} files')
+        return len(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _path_size(path: str) -> int:
+    """size of a file, or of the files in a directory of selected documents"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def _walk_filings(output_dir: str) -> Iterator[Tuple[str, str, int, Tuple[Optional[str], Optional[int], Optional[str]]]]:
+    """
+    yield (path, file_name, size, (form_type, year, quarter)) for every downloaded filing under output_dir.
+    A directory of selected documents (secutils.documents) is one filing named after its full submission,
+    and every filing in a quarter's pack (secutils.packs) is yielded with the pack as its path.
+    """
+    stack = [(output_dir, ())]
+    while stack:
+        root, rel = stack.pop()
+        try:
+            entries = list(os.scandir(root))
+        except OSError:
+            continue
+        # build_dir_structure layout is <form_type>/<year>/<quarter>/<file>
+        if len(rel) == 3 and rel[1].isdigit():
+            parts = (rel[0], int(rel[1]), rel[2])
+        else:
+            parts = (None, None, None)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name.startswith(PROFILE_DIR_PREFIX):
+                    # profiler output of a run started inside output_dir
+                    continue
+                if os.path.exists(os.path.join(entry.path, DOCUMENTS_NAME)):
+                    yield entry.path, entry.name + '.txt', _path_size(entry.path), parts
+                else:
+                    stack.append((entry.path, rel + (entry.name,)))
+            elif entry.name == PACK_INDEX_NAME:
+                pack_path = os.path.join(root, PACK_NAME)
+                for member in read_pack_index(entry.path):
+                    yield pack_path, member.file_name, member.size, parts
+            else:
+                # compressed filings are recorded under their uncompressed name
+                file_name = strip_compression_suffix(entry.name)
+                if file_name.endswith('.txt') or file_name.endswith('.html'):
+                    yield entry.path, file_name, entry.stat(follow_symlinks=False).st_size, parts
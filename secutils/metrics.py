@@ -0,0 +1,385 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds - spans a cached index lookup up to a slow quarterly archive
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 120.0)
+DEFAULT_METRICS_INTERVAL = 30.0
+
+# stages timed by secutils.metrics.stage_timer / observe_stage
+STAGES = ('index_fetch', 'index_decode', 'index_parse', 'index_filter', 'rate_limit_wait', 'connect',
+          'download', 'write')
+
+
+def _label_text(label_names: Tuple[str, ...], label_values: Tuple[str, ...]) -> str:
+    """stage="download",status="200" - as used in the prometheus exposition and json keys"""
+    return ','.join(f'{name}="{value}"' for name, value in zip(label_names, label_values))
+
+
+class _Metric(object):
+    kind = None  # type: str
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str]=()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, label_values: Tuple) -> Tuple[str, ...]:
+        if len(label_values) != len(self.label_names):
+            raise ValueError(f'{self.name} takes labels {self.label_names} - got {label_values}')
+        return tuple(str(value) for value in label_values)
+
+
+class Counter(_Metric):
+    """monotonically increasing count per label combination"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str]=()) -> None:
+        super(Counter, self).__init__(name, help, label_names)
+        self._values = {}  # type: Dict[Tuple[str, ...], float]
+
+    def inc(self, *label_values, amount: float=1.0) -> None:
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(self._key(label_values), 0.0)
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], float]]:
+        with self._lock:
+            return [('', key, value) for key, value in sorted(self._values.items())]
+
+    def as_dict(self) -> Dict[str, float]:
+        return {_label_text(self.label_names, key): value for _, key, value in self.samples()}
+
+
+class Gauge(_Metric):
+    """current value per label combination - either set directly or read from a callback when collected"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str]=()) -> None:
+        super(Gauge, self).__init__(name, help, label_names)
+        self._values = {}  # type: Dict[Tuple[str, ...], float]
+        self._functions = {}  # type: Dict[Tuple[str, ...], Callable[[], float]]
+
+    def set(self, value: float, *label_values) -> None:
+        key = self._key(label_values)
+        with self._lock:
+            self._functions.pop(key, None)
+            self._values[key] = float(value)
+
+    def set_function(self, function: Callable[[], float], *label_values) -> None:
+        key = self._key(label_values)
+        with self._lock:
+            self._functions[key] = function
+
+    def value(self, *label_values) -> float:
+        key = self._key(label_values)
+        function = self._functions.get(key)
+        return float(function()) if function is not None else self._values.get(key, 0.0)
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], float]]:
+        with self._lock:
+            keys = sorted(set(self._values) | set(self._functions))
+        return [('', key, self.value(*key)) for key in keys]
+
+    def as_dict(self) -> Dict[str, float]:
+        return {_label_text(self.label_names, key): value for _, key, value in self.samples()}
+
+
+class Histogram(_Metric):
+    """
+    count of observations per bucket per label combination - quantiles are interpolated within the
+    bucket they fall in, so they are estimates bounded by the bucket widths
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str]=(),
+                 buckets: Iterable[float]=DEFAULT_BUCKETS) -> None:
+        super(Histogram, self).__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # per label combination: [count per bucket (+inf last), sum]
+        self._values = {}  # type: Dict[Tuple[str, ...], List]
+
+    def observe(self, value: float, *label_values) -> None:
+        key = self._key(label_values)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _entry(self, key: Tuple[str, ...]) -> Tuple[List[int], float]:
+        with self._lock:
+            counts, total = self._values.get(key, [[0] * (len(self.buckets) + 1), 0.0])
+            return list(counts), total
+
+    def count(self, *label_values) -> int:
+        return sum(self._entry(self._key(label_values))[0])
+
+    def sum(self, *label_values) -> float:
+        return self._entry(self._key(label_values))[1]
+
+    def quantile(self, q: float, *label_values) -> Optional[float]:
+        counts, _ = self._entry(self._key(label_values))
+        return self._quantile(counts, q)
+
+    def _quantile(self, counts: List[int], q: float) -> Optional[float]:
+        total = sum(counts)
+        if not total:
+            return None
+        rank, seen = q * total, 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    # beyond the last bucket - its bound is the best estimate available
+                    return self.buckets[-1]
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], float]]:
+        with self._lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', key + ('+Inf' if bound == float('inf') else repr(bound),), cumulative))
+            samples.append(('_sum', key, total))
+            samples.append(('_count', key, cumulative))
+        return samples
+
+    def summaries(self) -> Dict[Tuple[str, ...], Dict[str, Optional[float]]]:
+        """count, sum, mean and p50/p90/p99 per label combination"""
+        with self._lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        summaries = {}
+        for key, counts, total in items:
+            count = sum(counts)
+            summaries[key] = {'count': count, 'sum': total, 'mean': total / count if count else None,
+                              'p50': self._quantile(counts, 0.5), 'p90': self._quantile(counts, 0.9),
+                              'p99': self._quantile(counts, 0.99)}
+        return summaries
+
+    def as_dict(self) -> Dict[str, Dict[str, Optional[float]]]:
+        return {_label_text(self.label_names, key): summary for key, summary in self.summaries().items()}
+
+
+class _StageTimer(object):
+    """context manager observing the seconds spent in its block"""
+    __slots__ = ('histogram', 'stage', 'start')
+
+    def __init__(self, histogram: Histogram, stage: str) -> None:
+        self.histogram = histogram
+        self.stage = stage
+
+    def __enter__(self) -> '_StageTimer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, self.stage)
+
+
+class MetricsRegistry(object):
+    """
+    Process-wide counters, gauges and latency histograms of the download pipeline, exported as
+    Prometheus text or a json snapshot. Every stage of the pipeline - index fetch, decode, parse and
+    filter, rate limiter waits, connects, file downloads and disk writes - is timed into one
+    histogram labelled by stage; responses are counted by status code and kind (index or filing),
+    and download queues report their depth. Recording takes one short lock per metric, so the
+    instrumentation stays on in every run.
+
+    Example:
+    --------
+    >>> from secutils.metrics import shared_metrics
+    >>> metrics = shared_metrics()
+    >>> with metrics.stage('index_parse'):
+    ...     master_index = parse_master_index(raw)
+    >>> metrics.responses.inc('filing', 429)
+    >>> print(metrics.to_prometheus())
+    """
+
+    def __init__(self, namespace: str='secutils') -> None:
+        self.namespace = namespace
+        self._metrics = {}  # type: Dict[str, _Metric]
+        self._lock = threading.Lock()
+        self.created_at = time.time()
+        self.stages = self.histogram('stage_seconds', 'seconds spent in each pipeline stage', ['stage'])
+        self.responses = self.counter('http_responses_total', 'responses by kind (index or filing) and status',
+                                      ['kind', 'status'])
+        self.files = self.counter('files_total', 'files finished by result (downloaded or failed)', ['result'])
+        self.bytes = self.counter('downloaded_bytes_total', 'filing bytes written to disk')
+        self.queue_depth = self.gauge('queue_depth', 'files waiting for a download worker', ['job'])
+
+    def _register(self, cls, name: str, help: str, label_names: Iterable[str], **kwargs) -> _Metric:
+        name = f'{self.namespace}_{name}'
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, label_names, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'{name} is already registered as a {metric.kind}')
+            return metric
+
+    def counter(self, name: str, help: str, label_names: Iterable[str]=()) -> Counter:
+        return self._register(Counter, name, help, label_names)
+
+    def gauge(self, name: str, help: str, label_names: Iterable[str]=()) -> Gauge:
+        return self._register(Gauge, name, help, label_names)
+
+    def histogram(self, name: str, help: str, label_names: Iterable[str]=(),
+                  buckets: Iterable[float]=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, label_names, buckets=buckets)
+
+    def stage(self, stage: str) -> _StageTimer:
+        """time a block as one observation of stage"""
+        return _StageTimer(self.stages, stage)
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        self.stages.observe(seconds, stage)
+
+    def metrics(self) -> List[_Metric]:
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, key, value in metric.samples():
+                names = metric.label_names + ('le',) if suffix == '_bucket' else metric.label_names
+                labels = _label_text(names, key)
+                lines.append(f'{metric.name}{suffix}{{{labels}}} {value!r}' if labels else
+                             f'{metric.name}{suffix} {value!r}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, object]:
+        """json-serializable view - histograms are summarized by count, sum, mean and p50/p90/p99"""
+        snapshot = {'timestamp': time.time(), 'uptime_seconds': time.time() - self.created_at}
+        for metric in self.metrics():
+            snapshot.setdefault(f'{metric.kind}s', {})[metric.name] = metric.as_dict()
+        return snapshot
+
+    def summary(self) -> str:
+        """one line per timed stage - count, total and p50/p99 seconds"""
+        return '\n'.join(f'{stage}: {stats["count"]} x - {stats["sum"]:.1f}s - p50 {stats["p50"]:.4f}s - '
+                         f'p99 {stats["p99"]:.4f}s' for (stage,), stats in self.stages.summaries().items())
+
+    def write_prometheus(self, path: str) -> None:
+        _atomic_write(path, self.to_prometheus())
+
+    def write_json(self, path: str) -> None:
+        _atomic_write(path, json.dumps(self.snapshot(), indent=2))
+
+
+def _atomic_write(path: str, text: str) -> None:
+    # scrapers and tail -f never see a half written file
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as outfile:
+        outfile.write(text)
+    os.replace(tmp_path, path)
+
+
+class MetricsReporter(object):
+    """
+    Writes the registry to a json snapshot and/or a Prometheus text file every interval seconds and
+    once more when stopped. The text file suits the node_exporter textfile collector.
+
+    Parameters
+    -------
+    registry: metrics to export - defaults to the process-wide registry
+    json_path: path of the json snapshot
+    prometheus_path: path of the Prometheus text file - usually ending in .prom
+    interval: seconds between writes
+
+    Example:
+    --------
+    >>> from secutils.metrics import MetricsReporter
+    >>> with MetricsReporter(json_path='/mnt/sda/sec/metrics.json', interval=10):
+    ...     scheduler.run()
+    """
+
+    def __init__(self, registry: Optional[MetricsRegistry]=None, json_path: Optional[str]=None,
+                 prometheus_path: Optional[str]=None, interval: float=DEFAULT_METRICS_INTERVAL) -> None:
+        self.registry = registry or shared_metrics()
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def write(self) -> None:
+        try:
+            if self.json_path:
+                self.registry.write_json(self.json_path)
+            if self.prometheus_path:
+                self.registry.write_prometheus(self.prometheus_path)
+        except OSError as e:
+            logger.warning(f'Unable to write metrics: {e}')
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self) -> 'MetricsReporter':
+        if self._thread is None and (self.json_path or self.prometheus_path):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='metrics-reporter', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.write()
+
+    def __enter__(self) -> 'MetricsReporter':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+_shared_metrics = None
+_shared_lock = threading.Lock()
+
+
+def shared_metrics() -> MetricsRegistry:
+    """return the process-wide MetricsRegistry, creating it on first use"""
+    global _shared_metrics
+    with _shared_lock:
+        if _shared_metrics is None:
+            _shared_metrics = MetricsRegistry()
+        return _shared_metrics
+
+
+def stage_timer(stage: str) -> _StageTimer:
+    """time a block as one observation of stage in the process-wide registry"""
+    return shared_metrics().stage(stage)
+
+
+def response_status(urlmsg) -> str:
+    """status label of a download result - the HTTP code, or the exception type of a transport failure"""
+    if urlmsg == '200':
+        return '200'
+    code = getattr(urlmsg, 'code', None)
+    return str(code) if isinstance(code, int) else type(urlmsg).__name__
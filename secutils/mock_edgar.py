@@ -0,0 +1,309 @@
+import io
+import re
+import time
+import random
+import hashlib
+import logging
+import zipfile
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+_FULL_INDEX = re.compile(r'^/Archives/edgar/full-index/(\d{4})/QTR([1-4])/master\.zip$')
+# /Archives/edgar/data/<cik>/<accession without dashes>/<accession>-index.htm and the documents beside it
+_FILING_INDEX = re.compile(r'^/Archives/edgar/data/(\d+)/(\d{18})/([\d\-]+)-index\.htm$')
+_FILING_DOCUMENT = re.compile(r'^/Archives/edgar/data/\d+/\d{18}/[^/]+$')
+# same columns as a real master.idx - duplicated so the mock does not import the parsing stack
+_INDEX_HEADER = 'CIK|Company Name|Form Type|Date Filed|Filename'
+
+
+def synthetic_filing(path: str, size: int) -> bytes:
+    """deterministic filing body of exactly size bytes for a given url path"""
+    header = f'<SEC-DOCUMENT>{path}\n'.encode('utf-8')
+    seed = hashlib.md5(path.encode('utf-8')).hexdigest().encode('ascii') + b'\n'
+    body = header + seed * (size // len(seed) + 1)
+    return body[:size]
+
+
+def synthetic_master_zip(year: int, quarter: int, num_rows: int, form_types: Sequence[str]=('10-K', '10-Q', '8-K')) -> bytes:
+    """deterministic master.zip of a quarter whose num_rows filings all live under /Archives/edgar/data/"""
+    lines = ['Description:           Master Index of EDGAR Dissemination Feed', '', _INDEX_HEADER, '-' * 80]
+    for i in range(num_rows):
+        cik = 1000 + i % 5000
+        month = 3 * quarter - 2 + i % 3
+        lines.append(f'{cik}|COMPANY {cik}|{form_types[i % len(form_types)]}|{year}-{month:02d}-{1 + i % 28:02d}|'
+                     f'edgar/data/{cik}/{cik:010d}-{year % 100:02d}-{quarter}{i:06d}.txt')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as outfile:
+        outfile.writestr('master.idx', ('\n'.join(lines) + '\n').encode('utf-8'))
+    return buffer.getvalue()
+
+
+def synthetic_filing_index(cik: str, folder: str, accession: str) -> bytes:
+    """
+    <accession>-index.htm page laid out like EDGAR's - a 10-K whose primary document is linked through the
+    inline XBRL viewer, an EX-21 and a GRAPHIC, followed by the complete submission text file
+    """
+    base = f'/Archives/edgar/data/{cik}/{folder}/'
+    documents = [('1', '10-K', 'form10-k.htm', f'/ix?doc={base}form10-k.htm'),
+                 ('2', 'EX-21.1', 'ex21-1.htm', base + 'ex21-1.htm'),
+                 ('3', 'GRAPHIC', 'logo.jpg', base + 'logo.jpg'),
+                 ('', 'Complete submission text file', f'{accession}.txt', base + f'{accession}.txt')]
+    rows = ''.join(f'<tr><td scope="row">{seq}</td><td scope="row">{doc_type}</td>'
+                   f'<td scope="row"><a href="{href}">{name}</a>{" iXBRL" if "ix?doc" in href else ""}</td>'
+                   f'<td scope="row">{doc_type if seq else ""}</td><td scope="row">2048</td></tr>\n'
+                   for seq, doc_type, name, href in documents)
+    return (f'<html><body><div id="formName"><strong>Form 10-K</strong></div>\n'
+            f'<table class="tableFile" summary="Document Format Files">\n'
+            f'<tr><th scope="col">Seq</th><th scope="col">Description</th><th scope="col">Document</th>'
+            f'<th scope="col">Type</th><th scope="col">Size</th></tr>\n{rows}</table></body></html>\n').encode('utf-8')
+
+
+def _is_filing(path: str) -> bool:
+    return path.startswith('/Archives/edgar/data/')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+class _MockEdgarHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes - avoid Nagle/delayed-ACK stalls on reused connections
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.mock._count('num_connections')
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        mock = self.server.mock
+        mock._count('num_requests')
+        path = self.path.split('?')[0]
+        mock.requested(path)
+        if mock.latency:
+            time.sleep(mock.latency)
+        status = mock.next_error(path)
+        if status is not None:
+            self._send(status, b'Injected error')
+            return
+        if mock.throttled():
+            headers = {'Retry-After': mock.retry_after} if mock.retry_after is not None else None
+            self._send(429, b'Too Many Requests', headers)
+            return
+        body = mock.get_content(path)
+        if body is None:
+            self._send(404, b'Not Found')
+            return
+        validators = mock.validators(path, body)
+        # If-None-Match takes precedence over If-Modified-Since
+        if 'If-None-Match' in self.headers:
+            not_modified = self.headers['If-None-Match'] == validators.get('ETag')
+        else:
+            not_modified = self.headers.get('If-Modified-Since') == validators.get('Last-Modified', '')
+        if validators and not_modified:
+            mock._count('num_not_modified')
+            self._send(304, b'', validators)
+            return
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match:
+            mock._count('num_range_requests')
+            start = int(match.group(1))
+            if start >= len(body):
+                self._send(416, b'', {'Content-Range': f'bytes */{len(body)}'})
+                return
+            headers = {'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'}
+            self._send(206, body[start:], headers, mock.truncate.pop(path, None))
+        else:
+            self._send(200, body, validators, truncate=mock.truncate.pop(path, None))
+
+    def _send(self, status: int, body: bytes, headers: Optional[Dict[str, str]]=None,
+              truncate: Optional[int]=None) -> None:
+        mock = self.server.mock
+        if status in (200, 206) and truncate is None:
+            # counted before the body goes out - a client that has read it must see the filing recorded
+            mock.sent(self.path.split('?')[0], len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if truncate is not None:
+            # advertise the full body but drop the connection part way through
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:truncate])
+            self.close_connection = True
+        elif mock.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            step = max(1, len(body) // 3)
+            for i in range(0, len(body), step):
+                chunk = body[i:i + step]
+                self.wfile.write(f'{len(chunk):x}\r\n'.encode('ascii') + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+class MockEdgarServer(object):
+    """
+    Local stand-in for www.sec.gov that serves synthetic filings over keep-alive HTTP/1.1 so the
+    download engines can be tested and benchmarked offline. Any path under /Archives/edgar/data/
+    ending in .txt returns a deterministic body of file_size bytes, as does any document inside a
+    filing's accession folder, whose <accession>-index.htm lists a 10-K, an EX-21 and a GRAPHIC.
+    Extra paths can be registered on the files dict. Range requests are honored, and paths registered on the truncate dict have
+    their next response cut off after the given number of bytes to simulate interrupted transfers.
+    Paths registered on the errors dict answer with the listed status codes, one per request, before
+    serving the file normally. Files registered on the files dict carry an ETag and Last-Modified
+    header and answer conditional requests with 304 Not Modified.
+
+    For benchmarks, every request can be delayed by latency seconds and answered with 429 at
+    throttle_rate, and with index_rows set any quarter's full-index master.zip is a synthetic index
+    of that many filings on this server. The server records each filing's latency from its first
+    request until its body starts going out, so throttled and retried requests count toward it.
+
+    Parameters
+    -------
+    file_size: size in bytes of every synthetic filing
+    chunked: send bodies with chunked transfer encoding instead of Content-Length
+    host: interface to bind
+    port: port to bind - 0 picks a free port
+    latency: seconds every response is delayed by
+    throttle_rate: fraction of requests answered with 429 Too Many Requests
+    retry_after: Retry-After header sent with those 429s - None sends none
+    index_rows: filings in each synthetic quarterly master.zip - 0 serves no full-index
+    index_form_types: form types cycled through by the synthetic index rows
+    seed: seed of the throttling decisions
+
+    Example:
+    --------
+    >>> from secutils.mock_edgar import MockEdgarServer
+    >>> with MockEdgarServer(file_size=4096) as server:
+    ...     url = server.base_url + 'edgar/data/1000230/0001437749-17-020936.txt'
+    """
+
+    def __init__(self, file_size: int=2048, chunked: bool=False, host: str='127.0.0.1', port: int=0,
+                 latency: float=0.0, throttle_rate: float=0.0, retry_after: Optional[str]='0',
+                 index_rows: int=0, index_form_types: Sequence[str]=('10-K', '10-Q', '8-K'), seed: int=0) -> None:
+        self.file_size = file_size
+        self.chunked = chunked
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.index_rows = index_rows
+        self.index_form_types = tuple(index_form_types)
+        self.files = {}  # type: Dict[str, bytes]
+        self.truncate = {}  # type: Dict[str, int]
+        self.errors = {}  # type: Dict[str, List[int]]
+        self.last_modified = 'Mon, 02 Jan 2017 00:00:00 GMT'
+        self.num_not_modified = 0
+        self.num_requests = 0
+        self.num_range_requests = 0
+        self.num_connections = 0
+        self.num_throttled = 0
+        self.num_filing_bytes = 0
+        # seconds from a filing's first request until its body is sent
+        self.latencies = []  # type: List[float]
+        self.first_filing_at = None  # type: Optional[float]
+        self.last_filing_at = None  # type: Optional[float]
+        self._first_request = {}  # type: Dict[str, float]
+        self._indices = {}  # type: Dict[str, bytes]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = _ThreadingHTTPServer((host, port), _MockEdgarHandler)
+        self._httpd.mock = self
+        self._thread = None  # type: Optional[threading.Thread]
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/Archives/'
+
+    def _count(self, attr: str) -> None:
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def next_error(self, path: str) -> Optional[int]:
+        with self._lock:
+            statuses = self.errors.get(path)
+            return statuses.pop(0) if statuses else None
+
+    def throttled(self) -> bool:
+        if not self.throttle_rate:
+            return False
+        with self._lock:
+            if self._random.random() >= self.throttle_rate:
+                return False
+            self.num_throttled += 1
+        return True
+
+    def requested(self, path: str) -> None:
+        if _is_filing(path):
+            now = time.perf_counter()
+            with self._lock:
+                self._first_request.setdefault(path, now)
+                if self.first_filing_at is None:
+                    self.first_filing_at = now
+
+    def sent(self, path: str, num_bytes: int) -> None:
+        if not _is_filing(path):
+            return
+        now = time.perf_counter()
+        with self._lock:
+            self.num_filing_bytes += num_bytes
+            start = self._first_request.pop(path, None)
+            if start is not None:
+                self.latencies.append(now - start)
+                self.last_filing_at = now
+
+    def validators(self, path: str, body: bytes) -> Dict[str, str]:
+        if path not in self.files:
+            return {}
+        return {'ETag': f'"{hashlib.md5(body).hexdigest()}"', 'Last-Modified': self.last_modified}
+
+    def get_content(self, path: str) -> Optional[bytes]:
+        if path in self.files:
+            return self.files[path]
+        if _is_filing(path) and path.endswith('.txt'):
+            return synthetic_filing(path, self.file_size)
+        match = _FILING_INDEX.match(path)
+        if match:
+            return synthetic_filing_index(*match.groups())
+        if _FILING_DOCUMENT.match(path):
+            return synthetic_filing(path, self.file_size)
+        match = _FULL_INDEX.match(path)
+        if match and self.index_rows:
+            with self._lock:
+                if path not in self._indices:
+                    self._indices[path] = synthetic_master_zip(int(match.group(1)), int(match.group(2)),
+                                                               self.index_rows, self.index_form_types)
+                return self._indices[path]
+        return None
+
+    def start(self) -> 'MockEdgarServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'MockEdgarServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,283 @@
+import io
+import os
+import json
+import mmap
+import struct
+import shutil
+import logging
+import threading
+from typing import IO, Dict, Iterator, List, Optional, Tuple, Union
+
+from secutils.storage import CHUNK_SIZE, _fsync_dir
+from secutils.compression import CompressedReader, codec_for_path, strip_compression_suffix
+
+try:
+    import fcntl
+except ImportError:
+    # no cross-process locking - a pack is then only safe to share between the threads of one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# written into build_dir_structure's <form_type>/<year>/<quarter>/ directory in place of one file per filing
+PACK_NAME = 'filings.pack'
+PACK_INDEX_NAME = 'filings.pack.idx'
+# every record starts with magic, name length and body length so a pack can be streamed without its index
+_RECORD_HEADER = struct.Struct('<4sHQ')
+_RECORD_MAGIC = b'SPK1'
+
+
+class PackEntry(object):
+    """a filing stored in a pack - offset and size of its body within the pack file"""
+    __slots__ = ('name', 'offset', 'size', 'checksum')
+
+    def __init__(self, name: str, offset: int, size: int, checksum: Optional[str]=None) -> None:
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.checksum = checksum
+
+    @property
+    def file_name(self) -> str:
+        """name of the filing - without the suffix of a compressed body"""
+        return strip_compression_suffix(self.name)
+
+    @property
+    def accession(self) -> str:
+        return os.path.splitext(self.file_name)[0]
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    def __repr__(self) -> str:
+        return f'PackEntry(name={self.name!r}, offset={self.offset}, size={self.size})'
+
+    def as_dict(self) -> Dict[str, object]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _parse_index(lines: Iterator[str]) -> List[PackEntry]:
+    entries = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # a torn final line from an interrupted append
+            continue
+        entries.append(PackEntry(entry['name'], entry['offset'], entry['size'], entry.get('checksum')))
+    return entries
+
+
+def read_pack_index(index_path: str) -> List[PackEntry]:
+    """entries of a filings.pack.idx in the order they were appended"""
+    with open(index_path, 'r') as infile:
+        return _parse_index(infile)
+
+
+def pack_dir(output_dir: str, form_type: str, year: int, quarter: Union[int, str]) -> str:
+    """build_dir_structure's <form_type>/<year>/<quarter> directory holding a quarter's pack"""
+    quarter = f'Q{quarter}' if isinstance(quarter, int) else quarter
+    return os.path.join(output_dir, form_type.replace('/', ''), str(year), quarter)
+
+
+class PackWriter(object):
+    """
+    Appends filings to one <form_type>/<year>/<quarter>/filings.pack instead of writing a file each, so a
+    quarter of 8-Ks or Form 4s is two files rather than hundreds of thousands. Each filing is copied in
+    from its completed download, fsynced, and only then added to filings.pack.idx - a JSON line with its
+    name, body offset, size and checksum. The index is the source of truth: bytes after the last indexed
+    filing (an append cut short by a crash) are truncated by the next append.
+
+    Appends are serialized by a lock within the process and by flock on the index across processes on the
+    same host. Network filesystems without working flock should not share a pack between hosts.
+
+    Parameters
+    -------
+    directory: the quarter's directory - created if needed
+
+    Example:
+    --------
+    >>> from secutils.packs import shared_pack_writer
+    >>> writer = shared_pack_writer('/mnt/sda/sec/8-K/2017/Q1')
+    >>> writer.append_file('0001437749-17-020936.txt', '/tmp/0001437749-17-020936.txt.part')
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.path = os.path.join(directory, PACK_NAME)
+        self.index_path = os.path.join(directory, PACK_INDEX_NAME)
+        self._lock = threading.Lock()
+        self._entries = {}  # type: Dict[str, PackEntry]
+        self._end = 0
+        # bytes of the index read so far - other processes append after it
+        self._index_size = 0
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._entries
+
+    def _refresh(self, index_file: IO[str]) -> None:
+        """read the entries other writers appended since the last refresh - the caller holds the lock"""
+        index_file.seek(0, os.SEEK_END)
+        index_size = index_file.tell()
+        if index_size == self._index_size:
+            return
+        index_file.seek(self._index_size)
+        text = index_file.read()
+        complete = text.rfind('\n') + 1
+        if complete < len(text):
+            # drop the torn line of an append cut short - the next entry would otherwise be glued to it
+            index_file.truncate(self._index_size + len(text[:complete].encode('utf-8')))
+        for entry in _parse_index(text[:complete].splitlines()):
+            self._entries[entry.name] = entry
+            self._end = max(self._end, entry.end)
+        index_file.seek(0, os.SEEK_END)
+        self._index_size = index_file.tell()
+
+    def append_file(self, name: str, path: str, checksum: Optional[str]=None) -> PackEntry:
+        """
+        copy the file at path into the pack as name - a name already in the pack is not appended again
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        created = not os.path.exists(self.index_path)
+        with self._lock, open(self.index_path, 'a+', encoding='utf-8') as index_file:
+            if fcntl is not None:
+                # released when the index is closed
+                fcntl.flock(index_file.fileno(), fcntl.LOCK_EX)
+            self._refresh(index_file)
+            if name in self._entries:
+                logger.debug(f'{name} is already in {self.path}')
+                return self._entries[name]
+            encoded = name.encode('utf-8')
+            size = os.path.getsize(path)
+            with open(self.path, 'a+b') as pack, open(path, 'rb') as infile:
+                pack.truncate(self._end)
+                pack.write(_RECORD_HEADER.pack(_RECORD_MAGIC, len(encoded), size) + encoded)
+                shutil.copyfileobj(infile, pack, CHUNK_SIZE)
+                pack.flush()
+                os.fsync(pack.fileno())
+            entry = PackEntry(name, self._end + _RECORD_HEADER.size + len(encoded), size, checksum)
+            index_file.write(json.dumps(entry.as_dict()) + '\n')
+            index_file.flush()
+            os.fsync(index_file.fileno())
+            self._index_size = index_file.tell()
+            self._entries[name] = entry
+            self._end = entry.end
+        if created:
+            _fsync_dir(self.directory)
+        return entry
+
+
+_shared_writers = {}  # type: Dict[str, PackWriter]
+_shared_lock = threading.Lock()
+
+
+def shared_pack_writer(directory: str) -> PackWriter:
+    """return the process-wide PackWriter of a quarter's directory, creating it on first use"""
+    directory = os.path.abspath(directory)
+    with _shared_lock:
+        if directory not in _shared_writers:
+            _shared_writers[directory] = PackWriter(directory)
+        return _shared_writers[directory]
+
+
+class PackReader(object):
+    """
+    Random access to the filings of a quarter's pack through its index, and iteration over all of them in
+    the order they are stored - a single sequential read of the pack. Filings can be looked up by stored
+    name, by filing name or by accession number; compressed filings (see secutils.compression) are
+    decompressed by read() and open().
+
+    Parameters
+    -------
+    directory: the quarter's directory, or the path of its filings.pack
+
+    Example:
+    --------
+    >>> from secutils.packs import PackReader, pack_dir
+    >>> with PackReader(pack_dir('/mnt/sda/sec', '8-K', 2017, 1)) as pack:
+    ...     text = pack.read('0001437749-17-020936').decode('utf-8')
+    ...     for entry, content in pack:
+    ...         pass
+    """
+
+    def __init__(self, directory: str) -> None:
+        if os.path.basename(directory) == PACK_NAME:
+            directory = os.path.dirname(directory)
+        self.directory = directory
+        self.path = os.path.join(directory, PACK_NAME)
+        self.entries = sorted(read_pack_index(os.path.join(directory, PACK_INDEX_NAME)), key=lambda e: e.offset)
+        self._by_key = {}  # type: Dict[str, PackEntry]
+        for entry in self.entries:
+            self._by_key[entry.accession] = self._by_key[entry.file_name] = self._by_key[entry.name] = entry
+        self._file = open(self.path, 'rb')
+        try:
+            # empty files cannot be mapped
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._data = b''
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._by_key
+
+    def entry(self, key: str) -> PackEntry:
+        """entry of a stored name, filing name or accession number - KeyError when not in the pack"""
+        return self._by_key[key]
+
+    def read_raw(self, key: str) -> bytes:
+        """the stored bytes - compressed for compressed filings"""
+        entry = self.entry(key)
+        return self._data[entry.offset:entry.end]
+
+    def open(self, key: str) -> IO[bytes]:
+        """seekable binary file of a filing's content"""
+        entry = self.entry(key)
+        raw = io.BytesIO(self.read_raw(key))
+        codec = codec_for_path(entry.name)
+        if codec is None:
+            return raw
+        return io.BufferedReader(CompressedReader(raw, codec))
+
+    def read(self, key: str) -> bytes:
+        with self.open(key) as infile:
+            return infile.read()
+
+    def __iter__(self) -> Iterator[Tuple[PackEntry, bytes]]:
+        """(entry, content) of every filing in storage order"""
+        for entry in self.entries:
+            yield entry, self.read(entry.name)
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self) -> 'PackReader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def iter_pack_records(infile: IO[bytes]) -> Iterator[Tuple[str, bytes]]:
+    """
+    (stored name, stored bytes) of every record of a pack read front to back without its index - e.g.
+    from a pipe or a pack whose index was lost. Stops at a torn record.
+    """
+    while True:
+        header = infile.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            return
+        magic, name_size, size = _RECORD_HEADER.unpack(header)
+        if magic != _RECORD_MAGIC:
+            logger.warning(f'Unexpected record header in pack - stopping')
+            return
+        name = infile.read(name_size)
+        body = infile.read(size)
+        if len(name) < name_size or len(body) < size:
+            return
+        yield name.decode('utf-8'), body
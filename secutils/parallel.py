@@ -0,0 +1,119 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from secutils.edgar import parse_master_zip
+
+logger = logging.getLogger(__name__)
+
+PackedIndex = Dict[str, object]
+
+# index fields never contain a newline - master.idx is split on them
+_SEP = '\n'
+
+
+def _pack_strings(values: Iterable[str]) -> str:
+    # one str pickles as a single utf-8 buffer instead of an object per value
+    return _SEP.join(values)
+
+
+def _unpack_strings(packed: str, num_values: int) -> np.ndarray:
+    if num_values == 0:
+        return np.array([], dtype=object)
+    return np.array(packed.split(_SEP), dtype=object)
+
+
+def pack_index(master_index: pd.DataFrame) -> PackedIndex:
+    """
+    encode a typed master index as numpy arrays plus newline joined strings, so handing it between
+    processes pickles a handful of buffers rather than a DataFrame of Python objects
+    """
+    form_type = master_index['Form Type'].astype('category')
+    company_name = master_index['Company Name'].astype('category')
+    return {
+        'num_rows': len(master_index),
+        'cik': master_index['CIK'].to_numpy(dtype=np.int64),
+        'date_filed': master_index['Date Filed'].to_numpy().astype('datetime64[D]').astype(np.int32),
+        'form_codes': form_type.cat.codes.to_numpy(),
+        'form_categories': _pack_strings(form_type.cat.categories),
+        'num_forms': len(form_type.cat.categories),
+        'company_codes': company_name.cat.codes.to_numpy(),
+        'company_categories': _pack_strings(company_name.cat.categories),
+        'num_companies': len(company_name.cat.categories),
+        'filename': _pack_strings(master_index['Filename']),
+    }
+
+
+def unpack_index(packed: PackedIndex) -> pd.DataFrame:
+    """rebuild the typed master index written by pack_index"""
+    num_rows = packed['num_rows']
+    form_types = _unpack_strings(packed['form_categories'], packed['num_forms'])
+    companies = _unpack_strings(packed['company_categories'], packed['num_companies'])
+    filename = pd.Series(_unpack_strings(packed['filename'], num_rows), dtype=object)
+    master_index = pd.DataFrame({
+        'CIK': packed['cik'],
+        'Company Name': pd.Categorical.from_codes(packed['company_codes'], categories=companies),
+        'Form Type': pd.Categorical.from_codes(packed['form_codes'], categories=form_types),
+        'Date Filed': packed['date_filed'].astype('datetime64[D]').astype('datetime64[ns]'),
+        'Filename': filename,
+    })
+    # rpartition of an empty column has no parts to select
+    master_index['fname'] = filename.str.rpartition('/')[2] if num_rows else filename
+    return master_index
+
+
+def _parse_zip_worker(source: Union[str, bytes]) -> PackedIndex:
+    return pack_index(parse_master_zip(source))
+
+
+class IndexParsePool(object):
+    """
+    Process pool for the CPU bound parts of index preparation - unzipping, decoding, ftfy repair and
+    parsing master.idx - so several quarters are prepared on separate cores. Results come back packed
+    (pack_index) rather than as pickled DataFrames. map_files runs any picklable function over
+    downloaded filings on the same pool.
+
+    Parameters
+    -------
+    max_workers: number of worker processes - defaults to the number of cores
+
+    Example:
+    --------
+    >>> from secutils.parallel import IndexParsePool
+    >>> with IndexParsePool() as pool:
+    ...     form = FormIDX(year=2017, quarter=1, form_types=['10-K'], parse_pool=pool)
+    """
+
+    def __init__(self, max_workers: Optional[int]=None) -> None:
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # spawn - forking a process that is running download threads can deadlock the children
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+
+    def submit_zip(self, source: Union[str, bytes]) -> Future:
+        """
+        parse a downloaded master.zip in a worker - the future resolves to a packed index. Passing the
+        path of a spooled archive rather than its bytes keeps the payload out of the pickled call
+        """
+        return self._executor.submit(_parse_zip_worker, source)
+
+    def parse_zip(self, source: Union[str, bytes]) -> pd.DataFrame:
+        return unpack_index(self.submit_zip(source).result())
+
+    def map_files(self, func: Callable, paths: Iterable[str], chunksize: int=16) -> Iterator:
+        """apply func to every downloaded filing path across the pool - results are yielded in order"""
+        return self._executor.map(func, paths, chunksize=chunksize)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> 'IndexParsePool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
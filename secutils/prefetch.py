@@ -0,0 +1,210 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from secutils.edgar import FormIDX, parse_spooled_zip, spool_response
+from secutils.index_cache import IndexCache
+from secutils.ratelimit import RateLimiter, shared_rate_limiter
+from secutils.retry import RetryPolicy
+from secutils.metrics import shared_metrics, response_status
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_WORKERS = 4
+
+
+class QuarterFetch(object):
+    """
+    outcome and timings of prefetching one quarterly index - status is one of fetched, cached,
+    missing (404 - e.g. a quarter that has not started) or failed
+    """
+    __slots__ = ('year', 'quarter', 'status', 'num_rows', 'num_bytes', 'attempts', 'throttles', 'download_seconds',
+                 'parse_seconds', 'error')
+
+    def __init__(self, year: int, quarter: int) -> None:
+        self.year = year
+        self.quarter = quarter
+        self.status = None  # type: Optional[str]
+        self.num_rows = 0
+        self.num_bytes = 0
+        self.attempts = 0
+        # throttled responses - paced by the rate limiter and not counted as attempts
+        self.throttles = 0
+        self.download_seconds = 0.0
+        self.parse_seconds = 0.0
+        self.error = None  # type: Optional[str]
+
+    @property
+    def latency(self) -> float:
+        """seconds from the first request until the quarter was parsed and cached"""
+        return self.download_seconds + self.parse_seconds
+
+    def as_dict(self) -> Dict[str, object]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return (f'QuarterFetch({self.year} Q{self.quarter} {self.status} - {self.num_rows} rows - '
+                f'{self.num_bytes / 2 ** 20:.1f} MiB - {self.download_seconds:.2f}s download - '
+                f'{self.parse_seconds:.2f}s parse)')
+
+
+class IndexPrefetcher(object):
+    """
+    Downloads the quarterly master.zip archives missing from the index cache concurrently, so a new
+    machine's cache is bootstrapped in one pass rather than one quarter at a time. Archives are pulled
+    by num_workers threads over one pooled keep-alive session, paced by the shared RateLimiter and
+    retried per the RetryPolicy; each is spooled to disk, parsed (on parse_pool when given) and saved
+    with its validators like FormIDX does. Every quarter reports its download and parse latency.
+
+    Parameters
+    -------
+    cache_dir: index cache directory the archives are parsed into
+    cache_format: index cache storage format
+    num_workers: number of archives downloaded at once
+    rate_limiter: shared request budget - defaults to the process-wide limiter
+    retry_policy: attempts and backoff for failed archive downloads
+    parse_pool: optional secutils.parallel.IndexParsePool parsing the archives in worker processes
+    index_cache: on-disk cache to use instead of one built from cache_dir and cache_format
+    timeout: seconds to wait on connect or any single read
+    user_agent: User-Agent header sent with every request
+
+    Example:
+    --------
+    >>> from itertools import product
+    >>> from secutils.prefetch import IndexPrefetcher
+    >>> prefetcher = IndexPrefetcher('/mnt/sda/sec/cache', num_workers=8)
+    >>> results = prefetcher.run(product(range(1995, 2020), [1, 2, 3, 4]))
+    >>> prefetcher.close()
+    """
+    full_index_url = FormIDX.full_index_url
+
+    def __init__(self, cache_dir: str, cache_format: str='auto', num_workers: int=DEFAULT_INDEX_WORKERS,
+                 rate_limiter: Optional[RateLimiter]=None, retry_policy: Optional[RetryPolicy]=None,
+                 parse_pool: Optional['IndexParsePool']=None, index_cache: Optional[IndexCache]=None,
+                 timeout: float=60.0, user_agent: str='secutils') -> None:
+        self.index_cache = index_cache or IndexCache(cache_dir, cache_format)
+        self.num_workers = max(1, num_workers)
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.parse_pool = parse_pool
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent
+        # one keep-alive connection per worker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.num_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def missing(self, periods: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """quarters without a cached index"""
+        return [(year, quarter) for year, quarter in periods if not self.index_cache.exists(year, quarter)]
+
+    def _get(self, url: str) -> requests.Response:
+        """streamed GET - failures are raised as HTTPError / URLError so the RetryPolicy can classify them"""
+        try:
+            response = self.session.get(url, stream=True, timeout=self.timeout)
+        except (requests.RequestException, OSError) as e:
+            raise URLError(e)
+        if response.status_code != 200:
+            response.close()
+            raise HTTPError(url, response.status_code, response.reason, response.headers, None)
+        return response
+
+    def fetch(self, year: int, quarter: int) -> QuarterFetch:
+        """download, parse and cache one quarter"""
+        result = QuarterFetch(year, quarter)
+        url = self.full_index_url.format(year=year, quarter=quarter)
+        metrics = shared_metrics()
+        start = time.perf_counter()
+        spool_path = None
+        while spool_path is None:
+            self.rate_limiter.acquire()
+            response = None
+            try:
+                response = self._get(url)
+                metrics.responses.inc('index', response.status_code)
+                spool_path = spool_response(response, self.index_cache.cache_dir)
+            except (HTTPError, URLError, requests.RequestException, OSError) as e:
+                error = e if isinstance(e, (HTTPError, URLError)) else URLError(e)
+                if response is None:
+                    metrics.responses.inc('index', response_status(error))
+                code = getattr(error, 'code', None)
+                throttled = self.retry_policy.is_throttled(error)
+                if throttled:
+                    # throttling is paced by the shared limiter and has its own budget instead of using up attempts
+                    result.throttles += 1
+                    if self.retry_policy.should_retry_throttled(error, result.throttles):
+                        self.rate_limiter.backoff(error.headers.get('Retry-After'))
+                        continue
+                else:
+                    result.attempts += 1
+                if code == 404 or throttled or not self.retry_policy.should_retry(error, result.attempts):
+                    result.status = 'missing' if code == 404 else 'failed'
+                    result.error = str(error)
+                    result.download_seconds = time.perf_counter() - start
+                    return result
+                time.sleep(self.retry_policy.delay(result.attempts))
+            else:
+                result.attempts += 1
+        self.rate_limiter.success()
+        result.download_seconds = time.perf_counter() - start
+        metrics.observe_stage('index_fetch', result.download_seconds)
+        result.num_bytes = os.path.getsize(spool_path)
+        start = time.perf_counter()
+        try:
+            master_index = parse_spooled_zip(spool_path, self.parse_pool)
+            self.index_cache.save(year, quarter, master_index, validators=response.headers)
+        except Exception as e:
+            result.status, result.error = 'failed', f'unable to parse {url}: {e}'
+            return result
+        finally:
+            os.remove(spool_path)
+            result.parse_seconds = time.perf_counter() - start
+        result.status = 'fetched'
+        result.num_rows = len(master_index)
+        return result
+
+    def _fetch_logged(self, period: Tuple[int, int]) -> QuarterFetch:
+        result = self.fetch(*period)
+        log = logger.warning if result.status == 'failed' else logger.info
+        log(f'Prefetched index {result}' + (f' - {result.error}' if result.error else ''))
+        return result
+
+    def run(self, periods: Iterable[Tuple[int, int]]) -> List[QuarterFetch]:
+        """prefetch the quarters that are not cached yet - results are returned in period order"""
+        periods = list(periods)
+        missing = set(self.missing(periods))
+        results = {}
+        if missing:
+            logger.info(f'Prefetching {len(missing)} quarterly indices with {self.num_workers} workers')
+            with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='index-prefetch') as executor:
+                ordered = [period for period in dict.fromkeys(periods) if period in missing]
+                for period, result in zip(ordered, executor.map(self._fetch_logged, ordered)):
+                    results[period] = result
+        for period in periods:
+            if period not in results:
+                results[period] = QuarterFetch(*period)
+                results[period].status = 'cached'
+        fetched = [results[period] for period in periods if results[period].status == 'fetched']
+        if fetched:
+            latency = np.array([result.latency for result in fetched])
+            logger.info(f'Prefetched {len(fetched)} indices - '
+                        f'{sum(result.num_bytes for result in fetched) / 2 ** 20:.0f} MiB - latency '
+                        f'p50 {np.percentile(latency, 50):.2f}s - max {latency.max():.2f}s')
+        return [results[period] for period in periods]
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> 'IndexPrefetcher':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
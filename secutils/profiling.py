@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+from typing import List, Optional
+
+from secutils.metrics import MetricsRegistry, shared_metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TOP = 60
+# download_sec --profile writes profile-<time>/ - never scanned as filings
+PROFILE_DIR_PREFIX = 'profile-'
+TRACEMALLOC_FRAMES = 10
+
+
+class RunProfiler(object):
+    """
+    cProfile and tracemalloc over a whole run. Every thread started while the profiler is running is
+    profiled on its own and the results are merged, so the download workers and index preparation
+    show up next to the main thread. stop() writes to output_dir:
+
+        cprofile.pstats - merged profile, e.g. for snakeviz or pstats.Stats
+        cprofile.txt - top functions by cumulative and by own time
+        tracemalloc.txt - peak traced memory and the lines holding the most memory at the end
+        metrics.json - secutils.metrics snapshot at the end of the run
+
+    Parse pool processes are not profiled. Both profilers slow the run down - --profile is opt-in.
+
+    Parameters
+    -------
+    output_dir: directory the results are written to - created on stop
+    registry: metrics snapshotted with the profile - defaults to the process-wide registry
+    tracemalloc_frames: frames recorded per allocation
+
+    Example:
+    --------
+    >>> from secutils.profiling import RunProfiler
+    >>> with RunProfiler('/mnt/sda/sec/profile'):
+    ...     scheduler.run()
+    """
+
+    def __init__(self, output_dir: str, registry: Optional[MetricsRegistry]=None,
+                 tracemalloc_frames: int=TRACEMALLOC_FRAMES) -> None:
+        self.output_dir = output_dir
+        self.registry = registry or shared_metrics()
+        self.tracemalloc_frames = tracemalloc_frames
+        self._profiles = []  # type: List[cProfile.Profile]
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+        self.start_time = None  # type: Optional[float]
+
+    def _new_profile(self) -> Optional[cProfile.Profile]:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already active in this interpreter
+            return None
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def _profile_thread(self, frame, event, arg) -> None:
+        # installed by threading.setprofile - runs once as each new thread starts and hands over to cProfile
+        sys.setprofile(None)
+        self._new_profile()
+
+    def start(self) -> 'RunProfiler':
+        self.start_time = time.time()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            self._started_tracemalloc = True
+        threading.setprofile(self._profile_thread)
+        self._new_profile()
+        return self
+
+    def stop(self) -> str:
+        """stop profiling and write the results - returns output_dir"""
+        threading.setprofile(None)
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        for profile in profiles:
+            profile.disable()
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        current, peak = tracemalloc.get_traced_memory()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(os.path.join(self.output_dir, 'cprofile.pstats'))
+            with open(os.path.join(self.output_dir, 'cprofile.txt'), 'w') as outfile:
+                outfile.write(f'{len(profiles)} threads profiled over {time.time() - self.start_time:.1f}s\n')
+                stats.stream = outfile
+                stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+                stats.sort_stats('tottime').print_stats(PROFILE_TOP)
+        if snapshot is not None:
+            with open(os.path.join(self.output_dir, 'tracemalloc.txt'), 'w') as outfile:
+                outfile.write(f'peak traced memory: {peak / 2 ** 20:.1f} MiB - '
+                              f'at the end of the run: {current / 2 ** 20:.1f} MiB\n\n')
+                for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+                    outfile.write(f'{stat}\n')
+        self.registry.write_json(os.path.join(self.output_dir, 'metrics.json'))
+        logger.info(f'Wrote profile of {len(profiles)} threads to {self.output_dir} - '
+                    f'peak traced memory {peak / 2 ** 20:.1f} MiB')
+        return self.output_dir
+
+    def __enter__(self) -> 'RunProfiler':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,147 @@
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Union
+
+from secutils.metrics import shared_metrics
+
+logger = logging.getLogger(__name__)
+
+# SEC fair access policy allows up to 10 requests per second
+DEFAULT_MAX_RPS = 10.0
+# status codes that signal we are being throttled
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+def parse_retry_after(retry_after: Optional[Union[str, int, float]]) -> Optional[float]:
+    """parse Retry-After header (delta seconds or HTTP-date) into seconds to wait"""
+    if retry_after is None:
+        return None
+    if isinstance(retry_after, (int, float)):
+        return max(0.0, float(retry_after))
+    retry_after = retry_after.strip()
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateLimiter(object):
+    """
+    Thread-safe token bucket shared by every download worker in the process. Each request claims a
+    token and waits until the bucket can pay for it, so all workers combined never exceed max_rps.
+
+    On a throttled response (429/503) the limiter halves its current rate and pauses every worker for
+    the Retry-After duration (or an exponentially growing penalty if no header is sent). Each successful
+    request then additively raises the rate back toward max_rps.
+
+    Parameters
+    -------
+    max_rps: maximum requests per second across all workers
+    burst: number of requests that may be issued back to back - defaults to max_rps
+    min_rps: floor for the adaptive rate after repeated throttling
+    recovery_rps: rate increase applied after every successful request
+
+    Example:
+    --------
+    >>> from secutils.ratelimit import RateLimiter
+    >>> limiter = RateLimiter(max_rps=10)
+    >>> limiter.acquire() # blocks until a request may be issued
+    >>> limiter.backoff(retry_after='5') # pause all workers for 5 seconds
+    """
+    max_penalty = 60.0
+
+    def __init__(self, max_rps: float=DEFAULT_MAX_RPS, burst: Optional[int]=None,
+                 min_rps: float=0.5, recovery_rps: float=0.1) -> None:
+        if max_rps <= 0:
+            raise ValueError(f'max_rps must be positive - got {max_rps}')
+        self.max_rps = float(max_rps)
+        self.min_rps = min(float(min_rps), self.max_rps)
+        self.recovery_rps = recovery_rps
+        self.burst = float(burst or max(1, int(max_rps)))
+        self.rate = self.max_rps
+        self.num_throttled = 0
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._consecutive_backoffs = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now > self._last:
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+    def reserve(self) -> float:
+        """claim a token and return the number of seconds to wait before issuing the request"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            # _last sits in the future while the limiter is paused by a backoff
+            wait = max(0.0, self._last - now)
+            if self._tokens < 0:
+                wait += -self._tokens / self.rate
+        shared_metrics().observe_stage('rate_limit_wait', wait)
+        return wait
+
+    def acquire(self) -> None:
+        """block the calling thread until a request may be issued"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def success(self) -> None:
+        """record a successful request and recover toward max_rps"""
+        with self._lock:
+            self._consecutive_backoffs = 0
+            if self.rate < self.max_rps:
+                self.rate = min(self.max_rps, self.rate + self.recovery_rps)
+
+    def backoff(self, retry_after: Optional[Union[str, int, float]]=None) -> float:
+        """
+        record a throttled request - lowers the rate and pauses all workers
+
+        Args:
+            retry_after: value of the Retry-After response header if present
+        Returns:
+            seconds every worker is paused for
+        """
+        delay = parse_retry_after(retry_after)
+        with self._lock:
+            self.num_throttled += 1
+            self._consecutive_backoffs += 1
+            if delay is None:
+                delay = min(self.max_penalty, 2.0 ** (self._consecutive_backoffs - 1))
+            self.rate = max(self.min_rps, self.rate / 2)
+            now = time.monotonic()
+            self._refill(now)
+            # drop any saved burst and stop refilling until the pause is over
+            self._tokens = min(self._tokens, 0.0)
+            self._last = max(self._last, now + delay)
+        logger.warning(f'Throttled by server - pausing {delay:.1f}s - rate lowered to {self.rate:.2f} req/s')
+        return delay
+
+
+_shared_rate_limiter = None
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter(max_rps: Optional[float]=None) -> RateLimiter:
+    """
+    return the process-wide RateLimiter, creating it on first use. Passing max_rps replaces the
+    shared limiter with a new budget.
+    """
+    global _shared_rate_limiter
+    with _shared_lock:
+        if _shared_rate_limiter is None or (max_rps is not None and max_rps != _shared_rate_limiter.max_rps):
+            _shared_rate_limiter = RateLimiter(max_rps=max_rps or DEFAULT_MAX_RPS)
+        return _shared_rate_limiter
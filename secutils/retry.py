@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from http.client import HTTPException
+from urllib.error import URLError
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from secutils.manifest import accession_from_name
+from secutils.ratelimit import THROTTLE_STATUS_CODES
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_NAME = 'dead_letter.jsonl'
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_MAX_THROTTLE_RETRIES = 20
+# single codes or whole status classes ('5xx')
+DEFAULT_RETRYABLE_STATUS = (408, 429, '5xx')
+# transport failures worth another attempt - a ValueError is a truncated body that resumes from the .part file
+RETRYABLE_ERRORS = (URLError, HTTPException, ConnectionError, TimeoutError, asyncio.TimeoutError, EOFError, ValueError)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed download is attempted again and how long to wait first. Waits grow
+    exponentially from base_delay up to max_delay with full jitter, so workers that failed together
+    do not retry in lockstep. Throttled responses (429/503) are paced by the RateLimiter and do not use up
+    attempts - they have their own budget of max_throttle_retries, after which the file fails like any other.
+
+    Parameters
+    -------
+    max_attempts: total attempts per file, including the first
+    base_delay: wait in seconds before the first retry
+    max_delay: upper bound of any single wait in seconds
+    retryable_status: HTTP status codes (e.g. 429) or classes (e.g. '5xx') that are retried
+    jitter: randomize each wait between 0 and the exponential delay
+    max_throttle_retries: throttled responses per file retried after the RateLimiter's pause
+
+    Example:
+    --------
+    >>> from secutils.retry import RetryPolicy
+    >>> policy = RetryPolicy(max_attempts=5, retryable_status=(429, '5xx'))
+    >>> policy.should_retry(error, attempt=1)
+    """
+
+    def __init__(self, max_attempts: int=DEFAULT_MAX_ATTEMPTS, base_delay: float=1.0, max_delay: float=60.0,
+                 retryable_status: Iterable[Union[int, str]]=DEFAULT_RETRYABLE_STATUS, jitter: bool=True,
+                 max_throttle_retries: int=DEFAULT_MAX_THROTTLE_RETRIES) -> None:
+        if max_attempts < 1:
+            raise ValueError(f'max_attempts must be at least 1 - got {max_attempts}')
+        if max_throttle_retries < 0:
+            raise ValueError(f'max_throttle_retries must not be negative - got {max_throttle_retries}')
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_throttle_retries = max_throttle_retries
+        self.retryable_codes = {int(status) for status in retryable_status if not isinstance(status, str)}
+        self.retryable_classes = {int(status[0]) for status in retryable_status if isinstance(status, str)}
+
+    def is_retryable(self, error) -> bool:
+        code = getattr(error, 'code', None)
+        if isinstance(code, int):
+            return code in self.retryable_codes or code // 100 in self.retryable_classes
+        return isinstance(error, RETRYABLE_ERRORS)
+
+    def should_retry(self, error, attempt: int) -> bool:
+        """attempt is the number of attempts made so far"""
+        return attempt < self.max_attempts and self.is_retryable(error)
+
+    def is_throttled(self, error) -> bool:
+        """a retryable throttling response - paced by the RateLimiter rather than by delay()"""
+        return getattr(error, 'code', None) in THROTTLE_STATUS_CODES and self.is_retryable(error)
+
+    def should_retry_throttled(self, error, throttles: int) -> bool:
+        """throttles is the number of throttled responses received so far"""
+        return throttles <= self.max_throttle_retries and self.is_throttled(error)
+
+    def delay(self, attempt: int) -> float:
+        """seconds to wait after the given failed attempt"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+class DeadLetterFile(object):
+    """
+    Append-only json lines record of filings that failed permanently, with the reason and status of
+    their last attempt. Entries are keyed by accession number and resolved (tombstoned) when the filing
+    is later downloaded, so download_sec --retry_failed can reprocess exactly this list without
+    fetching any indices.
+
+    Parameters
+    -------
+    path: path of the dead letter file - usually <output_dir>/dead_letter.jsonl
+
+    Example:
+    --------
+    >>> from secutils.retry import DeadLetterFile
+    >>> dead_letter = DeadLetterFile.for_output_dir('/mnt/sda/sec')
+    >>> failed_files = dead_letter.files()
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._replay()
+
+    @classmethod
+    def for_output_dir(cls, output_dir: str) -> 'DeadLetterFile':
+        os.makedirs(output_dir, exist_ok=True)
+        return cls(os.path.join(output_dir, DEAD_LETTER_NAME))
+
+    def _replay(self) -> Dict[str, Dict[str, object]]:
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r') as infile:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a torn final line from an interrupted run
+                    continue
+                if entry.get('resolved'):
+                    entries.pop(entry['accession'], None)
+                else:
+                    entries[entry['accession']] = entry
+        return entries
+
+    def _append(self, entry: Dict[str, object]) -> None:
+        with open(self.path, 'a') as outfile:
+            outfile.write(json.dumps(entry) + '\n')
+
+    def record(self, sec_file, reason: str, status: Optional[int]=None) -> None:
+        """add or replace the entry of a permanently failed file"""
+        entry = {
+            'accession': accession_from_name(sec_file.file_name),
+            'file_name': sec_file.file_name,
+            'url': sec_file.file_download_url,
+            'form_type': sec_file.form_type,
+            'company_name': sec_file.company_name,
+            'cik': int(sec_file.cik_number),
+            'date_filed': sec_file.date_filed.strftime('%Y-%m-%d'),
+            'status': status,
+            'reason': reason,
+            'failed_at': time.time(),
+        }
+        with self._lock:
+            self._entries[entry['accession']] = entry
+            self._append(entry)
+
+    def resolve(self, sec_file) -> bool:
+        """drop a file that has since been downloaded - returns False if it was not dead lettered"""
+        accession = accession_from_name(sec_file.file_name)
+        with self._lock:
+            if self._entries.pop(accession, None) is None:
+                return False
+            self._append({'accession': accession, 'resolved': True})
+        return True
+
+    def entries(self) -> List[Dict[str, object]]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def files(self) -> List:
+        """File objects for every outstanding entry"""
+        from secutils.edgar import File
+        files = []
+        for entry in self.entries():
+            sec_file = File(form_type=entry['form_type'], company_name=entry['company_name'],
+                            cik_number=str(entry['cik']), date_filed=entry['date_filed'],
+                            partial_url=entry['file_name'])
+            sec_file.file_download_url = entry['url']
+            files.append(sec_file)
+        return files
+
+    def compact(self) -> int:
+        """rewrite the file with only the outstanding entries - returns the number kept"""
+        with self._lock:
+            tmp_path = f'{self.path}.tmp-{os.getpid()}'
+            with open(tmp_path, 'w') as outfile:
+                for entry in self._entries.values():
+                    outfile.write(json.dumps(entry) + '\n')
+            os.replace(tmp_path, self.path)
+            return len(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, accession: str) -> bool:
+        return accession in self._entries
+
+
+def error_status(error) -> Tuple[Optional[int], str]:
+    """(http status or None, reason) of a failed download result"""
+    code = getattr(error, 'code', None)
+    return (code if isinstance(code, int) else None), str(error)
@@ -0,0 +1,209 @@
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Set, Tuple
+
+from tqdm.auto import tqdm
+
+from secutils.edgar import File, FileBatch, FormIDX
+from secutils.aio import DEFAULT_MAX_CONNECTIONS
+from secutils.dispatch import DownloadJob
+from secutils.retry import DeadLetterFile, RetryPolicy
+from secutils.parallel import IndexParsePool
+from secutils.index_cache import IndexCache
+from secutils.manifest import DownloadManifest
+from secutils.ratelimit import RateLimiter, shared_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the file stream for a consumer
+_DONE = None
+
+
+class PipelineScheduler(object):
+    """
+    Producer/consumer download pipeline across (year, quarter) periods. An index thread fetches and
+    parses FormIDX batches for upcoming quarters into a bounded queue while a feeder thread streams
+    their files into a DownloadJob, so index preparation overlaps with downloads. The job's persistent
+    download workers (or the asyncio engine) drain files across quarter boundaries, so no quarter
+    waits on the previous quarter's stragglers.
+
+    Parameters
+    -------
+    periods: (year, quarter) pairs to download, in order
+    output_dir: root download directory
+    cache_dir: index cache directory
+    form_types: form types to download
+    ciks: CIKs to download
+    seen_files: file names already downloaded
+    num_workers: number of download threads (thread engine)
+    engine: thread or async
+    rate_limiter: shared request budget - defaults to the process-wide limiter
+    manifest: download manifest updated as files complete
+    cache_format: index cache storage format
+    max_connections: keep-alive connection pool size (async engine)
+    prefetch: number of parsed quarters allowed to wait ahead of the downloads
+    index_factory: callable building a FormIDX-like object with a to_batch() method
+    retry_policy: attempts and backoff for failed downloads
+    dead_letter: records files that failed permanently
+    parse_workers: number of processes parsing indices - quarters are then prepared concurrently.
+        0 parses on the index thread
+    cache_max_bytes: size budget of the on-disk index cache - least recently used quarters are evicted
+    selector: optional secutils.documents.DocumentSelector - only its documents of each filing are downloaded
+    compression: optional 'gzip' or 'zstd' - filings are stored compressed (see secutils.compression)
+    pack: append filings to per-quarter packs instead of a file each (see secutils.packs)
+
+    Example:
+    --------
+    >>> from itertools import product
+    >>> from secutils.scheduler import PipelineScheduler
+    >>> periods = list(product(range(1995, 2020), [1, 2, 3, 4]))
+    >>> scheduler = PipelineScheduler(periods, output_dir='/mnt/sda/sec', form_types=['10-K'], num_workers=8)
+    >>> num_downloaded, download_error = scheduler.run()
+    """
+
+    def __init__(self, periods: List[Tuple[int, int]], output_dir: Path, cache_dir: Optional[str]=None,
+                 form_types: Optional[List[str]]=None, ciks: Optional[List[int]]=None,
+                 seen_files: Optional[Set[str]]=None, num_workers: int=4, engine: str='thread',
+                 rate_limiter: Optional[RateLimiter]=None, manifest: Optional[DownloadManifest]=None,
+                 cache_format: str='auto', max_connections: int=DEFAULT_MAX_CONNECTIONS, prefetch: int=2,
+                 index_factory: Callable=FormIDX, show_progress: bool=True,
+                 retry_policy: Optional[RetryPolicy]=None, dead_letter: Optional[DeadLetterFile]=None,
+                 parse_workers: int=0, cache_max_bytes: Optional[int]=None,
+                 selector: Optional['DocumentSelector']=None, compression: Optional[str]=None,
+                 pack: bool=False) -> None:
+        if engine not in ('thread', 'async'):
+            raise ValueError(f'Unknown download engine: {engine}')
+        self.periods = list(periods)
+        self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.form_types = form_types
+        self.ciks = ciks
+        self.seen_files = seen_files
+        self.num_workers = num_workers
+        self.engine = engine
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.manifest = manifest
+        self.cache_format = cache_format
+        # one on-disk cache for every quarter so its size budget and counters span the run
+        self.index_cache = IndexCache(cache_dir, cache_format, max_bytes=cache_max_bytes) if cache_dir else None
+        self.max_connections = max_connections
+        self.index_factory = index_factory
+        self.parse_workers = parse_workers
+        self.parse_pool = None  # type: Optional[IndexParsePool]
+        self._batches = queue.Queue(maxsize=max(1, prefetch))
+        # set once the download job has failed - no further quarters are prepared
+        self._stop = threading.Event()
+        self.job = DownloadJob(output_dir, cache_dir=cache_dir, num_workers=num_workers, engine=engine,
+                               rate_limiter=self.rate_limiter, manifest=manifest, max_connections=max_connections,
+                               on_result=self._record, name='download', retry_policy=retry_policy,
+                               dead_letter=dead_letter, selector=selector, compression=compression,
+                               pack=pack)
+        self._lock = threading.Lock()
+        self._pbar = tqdm(total=0, desc='Downloading', disable=not show_progress)
+
+    def _prepare(self, period: Tuple[int, int]) -> Optional[FileBatch]:
+        yr, qtr = period
+        logger.info(f'Preparing index - Year: {yr} - Quarter: {qtr}')
+        kwargs = {'parse_pool': self.parse_pool} if self.parse_pool is not None else {}
+        # index requests share the download job's request budget and retry policy
+        kwargs.update(rate_limiter=self.job.rate_limiter, retry_policy=self.job.retry_policy)
+        if self.index_cache is not None:
+            kwargs['index_cache'] = self.index_cache
+        try:
+            return self.index_factory(year=yr, quarter=qtr, seen_files=self.seen_files, cache_dir=self.cache_dir,
+                                      form_types=self.form_types, ciks=self.ciks, cache_format=self.cache_format,
+                                      **kwargs).to_batch()
+        except Exception as e:
+            logger.error(f'Unable to prepare index - Year: {yr} - Quarter: {qtr}: {e}')
+            return None
+
+    def _produce_indices(self) -> None:
+        """fetch and parse indices ahead of the downloads - blocks once prefetch quarters are waiting"""
+        try:
+            if self.parse_pool is None:
+                prepared = ((period, self._prepare(period)) for period in self.periods)
+            else:
+                prepared = self._prepare_parallel()
+            for period, batch in prepared:
+                if self._stop.is_set():
+                    break
+                if batch is not None and len(batch) > 0:
+                    self._batches.put((period, batch))
+        finally:
+            self._batches.put(_DONE)
+
+    def _prepare_parallel(self) -> Iterator[Tuple[Tuple[int, int], Optional[FileBatch]]]:
+        """prepare up to parse_workers quarters at once - yielded in period order"""
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.parse_pool.max_workers, thread_name_prefix='index') as executor:
+            for period in self.periods:
+                pending.append((period, executor.submit(self._prepare, period)))
+                if len(pending) >= self.parse_pool.max_workers:
+                    period, future = pending.popleft()
+                    yield period, future.result()
+            while pending:
+                period, future = pending.popleft()
+                yield period, future.result()
+
+    def _feed_files(self) -> None:
+        """stream files of each prepared quarter into the download job"""
+        try:
+            while True:
+                item = self._batches.get()
+                if item is _DONE:
+                    break
+                if self._stop.is_set():
+                    # drained so the producer is not left blocked on the prefetch queue
+                    continue
+                (yr, qtr), batch = item
+                with self._lock:
+                    self._pbar.total += len(batch)
+                    self._pbar.set_description(f'Downloading: Year: {yr} - Quarter: {qtr}')
+                try:
+                    self.job.submit_many(batch)
+                except RuntimeError as e:
+                    logger.error(f'Stopped queueing files: {e}')
+                    self._stop.set()
+        finally:
+            self.job.close()
+
+    def _record(self, sec_file: File, urlmsg) -> None:
+        # called from the job's workers - counts live in the job's per-worker stats
+        with self._lock:
+            if urlmsg == '200':
+                self._pbar.update(1)
+            self._pbar.set_postfix_str(f'Queued: {self.job.queue_depth}', refresh=False)
+
+    def run(self) -> Tuple[int, List[File]]:
+        """
+        run the pipeline to completion - raises RuntimeError if the download workers died
+
+        Returns:
+            tuple of (number of files downloaded, files that errored)
+        """
+        if self.parse_workers > 0:
+            logger.info(f'Starting {self.parse_workers} index parsing processes')
+            self.parse_pool = IndexParsePool(self.parse_workers)
+        producers = [threading.Thread(target=self._produce_indices, name='index-producer', daemon=True),
+                     threading.Thread(target=self._feed_files, name='file-feeder', daemon=True)]
+        logger.info(f'Starting {self.job.num_consumers} {self.engine} download workers')
+        self.job.start()
+        [thread.start() for thread in producers]
+        try:
+            stats = self.job.join()
+            [thread.join() for thread in producers]
+        finally:
+            self._pbar.close()
+            if self.parse_pool is not None:
+                self.parse_pool.close()
+                self.parse_pool = None
+        if self.index_cache is not None:
+            logger.info(f'On-disk index cache - {self.index_cache.stats}')
+        if self.job.error is not None:
+            error = self.job.error
+            raise RuntimeError(f'Download workers failed after {stats.num_downloaded} files: {error}') from error
+        return stats.num_downloaded, stats.errors
@@ -0,0 +1,215 @@
+import os
+import re
+import time
+import hashlib
+import logging
+from typing import Dict, Optional
+
+from secutils.metrics import shared_metrics
+from secutils.compression import FrameWriter, get_codec, scan_frames
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = '.part'
+# written last into <form>/<year>/<quarter>/<accession>/ when only selected documents of a filing are
+# downloaded (secutils.documents) - a directory without it is incomplete
+DOCUMENTS_NAME = 'documents.json'
+
+_content_range = re.compile(r'bytes\s+(\d+|\*)(?:-(\d+))?/(\d+|\*)')
+
+
+def _parse_content_range(value: Optional[str]):
+    """parse Content-Range header into (start, total) - either may be None"""
+    match = _content_range.match(value or '')
+    if not match:
+        return None, None
+    start, _, total = match.groups()
+    return (None if start == '*' else int(start)), (None if total == '*' else int(total))
+
+
+def _fsync_dir(path: str) -> None:
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class AtomicDownload(object):
+    """
+    Stream a download into a temporary <file>.part next to its final path and atomically rename it
+    into place once complete. An interrupted transfer leaves only the .part file behind, which
+    scan_output_dir never reports as seen, and the next attempt resumes it with an HTTP Range request.
+
+    With compression the body is compressed on the fly into frames (see secutils.compression) and the
+    codec's suffix is appended to final_path. An interrupted compressed download keeps every complete
+    frame and is resumed from the end of the last one.
+
+    With a pack (secutils.packs.PackWriter) the completed download is appended to the quarter's pack
+    instead of being renamed into place - the partial file lives next to the pack until then.
+
+    Parameters
+    -------
+    final_path: destination path of the completed download
+    resume: pick up from an existing partial file instead of starting over
+    compression: optional codec name - 'gzip' or 'zstd'
+    pack: optional secutils.packs.PackWriter the completed download is appended to
+
+    Example:
+    --------
+    >>> download = AtomicDownload('/mnt/sda/sec/10-K/2017/Q1/0001437749-17-020936.txt')
+    >>> headers = download.range_headers() # {'Range': 'bytes=1048576-'} if a partial exists
+    >>> download.start(response.status, response.headers)
+    >>> for chunk in chunks:
+    ...     download.write(chunk)
+    >>> download.commit()
+    """
+
+    def __init__(self, final_path: str, resume: bool=True, compression: Optional[str]=None, pack=None) -> None:
+        self.codec = get_codec(compression) if compression else None
+        self.final_path = final_path + (self.codec.suffix if self.codec else '')
+        self.partial_path = self.final_path + PARTIAL_SUFFIX
+        self.pack = pack
+        # where the committed download ended up - final_path, or the pack holding it - and its stored size
+        self.stored_path = None  # type: Optional[str]
+        self.stored_size = None  # type: Optional[int]
+        self.offset = 0
+        # complete frames of a compressed partial file - (frames, compressed size, md5 of their content)
+        self._resumed = None
+        if resume and os.path.exists(self.partial_path):
+            if self.codec is None:
+                self.offset = os.path.getsize(self.partial_path)
+            else:
+                resumed_hash = hashlib.md5()
+                frames, self.offset, compressed_size = scan_frames(self.partial_path, self.codec, resumed_hash)
+                self._resumed = (frames, compressed_size, resumed_hash)
+        self.bytes_written = 0
+        # time spent writing chunks - reported with the commit as the write stage
+        self.write_seconds = 0.0
+        self.expected_size = None
+        self._hash = hashlib.md5()
+        self._started = False
+        self._outfile = None
+        self._writer = None  # type: Optional[FrameWriter]
+
+    def range_headers(self) -> Dict[str, str]:
+        """request headers needed to resume from the existing partial file"""
+        if self.offset:
+            return {'Range': f'bytes={self.offset}-'}
+        return {}
+
+    def start(self, status: int, headers) -> None:
+        """open the partial file for a 200 (full body) or 206 (resumed body) response"""
+        self._started = True
+        if status == 206:
+            start, self.expected_size = _parse_content_range(headers.get('Content-Range'))
+            if start != self.offset:
+                self.discard()
+                raise ValueError(f'Unexpected Content-Range {headers.get("Content-Range")} resuming from {self.offset}')
+            logger.debug(f'Resuming {self.final_path} from byte {self.offset}')
+            if self.codec is not None:
+                self._resume_frames()
+                return
+            # seed the running checksum with the bytes already on disk
+            with open(self.partial_path, 'rb') as infile:
+                for chunk in iter(lambda: infile.read(CHUNK_SIZE), b''):
+                    self._hash.update(chunk)
+            self._outfile = open(self.partial_path, 'ab')
+        elif status == 200:
+            # server ignored (or was not sent) a Range request - start from scratch
+            self.offset = 0
+            self._resumed = None
+            content_length = headers.get('Content-Length')
+            self.expected_size = int(content_length) if content_length is not None else None
+            self._outfile = open(self.partial_path, 'wb')
+            if self.codec is not None:
+                self._writer = FrameWriter(self._outfile, self.codec)
+        else:
+            raise ValueError(f'Cannot write response with status {status} to {self.final_path}')
+
+    def _resume_frames(self) -> None:
+        """append frames after the complete frames of the partial file - a torn last frame is cut off"""
+        frames, compressed_size, resumed_hash = self._resumed
+        self._hash = resumed_hash.copy()
+        self._outfile = open(self.partial_path, 'r+b')
+        self._outfile.truncate(compressed_size)
+        self._outfile.seek(compressed_size)
+        self._writer = FrameWriter(self._outfile, self.codec, frames=frames, size=self.offset,
+                                   compressed_size=compressed_size)
+
+    def range_complete(self, headers) -> bool:
+        """for a 416 response - True when the partial file already holds the full body"""
+        _, total = _parse_content_range(headers.get('Content-Range'))
+        if self.offset and total == self.offset:
+            return True
+        self.discard()
+        return False
+
+    def write(self, chunk: bytes) -> None:
+        start = time.perf_counter()
+        (self._writer or self._outfile).write(chunk)
+        self._hash.update(chunk)
+        self.bytes_written += len(chunk)
+        self.write_seconds += time.perf_counter() - start
+
+    @property
+    def checksum(self) -> Optional[str]:
+        """md5 of the full body - None when a complete partial file was committed without a body"""
+        if not self._started:
+            return None
+        return self._hash.hexdigest()
+
+    def commit(self) -> str:
+        """flush and fsync the partial file then atomically rename it to the final path - or append it to the pack"""
+        start = time.perf_counter()
+        size = self.offset + self.bytes_written
+        complete = self.expected_size is None or size == self.expected_size
+        if self._outfile is None and self.codec is not None and self._resumed is not None and complete:
+            # a complete compressed partial file committed without a body still needs its seek index
+            self._resume_frames()
+        if self._writer is not None:
+            if complete:
+                self._writer.finish()
+            else:
+                self._writer.flush_frame()
+            self._writer = None
+        if self._outfile is not None:
+            self._outfile.flush()
+            os.fsync(self._outfile.fileno())
+            self._outfile.close()
+            self._outfile = None
+        if not complete:
+            # keep the partial file so the next attempt resumes where this one stopped
+            raise ValueError(f'Incomplete download of {self.final_path}: {size} of {self.expected_size} bytes')
+        if self.pack is not None:
+            entry = self.pack.append_file(os.path.basename(self.final_path), self.partial_path, self.checksum)
+            os.remove(self.partial_path)
+            self.stored_path, self.stored_size = self.pack.path, entry.size
+        else:
+            os.replace(self.partial_path, self.final_path)
+            _fsync_dir(os.path.dirname(os.path.abspath(self.final_path)))
+            self.stored_path, self.stored_size = self.final_path, os.path.getsize(self.final_path)
+        metrics = shared_metrics()
+        metrics.observe_stage('write', self.write_seconds + time.perf_counter() - start)
+        metrics.bytes.inc(amount=self.bytes_written)
+        return self.stored_path
+
+    def close(self) -> None:
+        """close without committing - the partial file is kept so a later attempt can resume"""
+        if self._writer is not None:
+            # keep what was received as complete frames
+            self._writer.flush_frame()
+            self._writer = None
+        if self._outfile is not None:
+            self._outfile.close()
+            self._outfile = None
+
+    def discard(self) -> None:
+        self.close()
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+        self.offset = 0
+        self._resumed = None
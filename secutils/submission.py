@@ -0,0 +1,286 @@
+import re
+import mmap
+import binascii
+import fnmatch
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+from secutils.utils import decode_text
+from secutils.storage import CHUNK_SIZE
+from secutils.compression import codec_for_path, open_filing
+
+logger = logging.getLogger(__name__)
+
+# metadata tags between <DOCUMENT> and <TEXT> - <TYPE>10-K, <SEQUENCE>1, <FILENAME>..., <DESCRIPTION>...
+_DOCUMENT_TAG = re.compile(rb'<(TYPE|SEQUENCE|FILENAME|DESCRIPTION)>([^\r\n]*)')
+# top level header lines - 'ACCESSION NUMBER:\t\t0001437749-17-020936' or '<ACCEPTANCE-DATETIME>20171220161544'
+_HEADER_FIELD = re.compile(r'^(?:([A-Z][A-Z0-9 \-]*):[ \t]*(.*)|<([A-Z][A-Z0-9\-]*)>(.*))$')
+
+
+class Document(object):
+    """
+    One <DOCUMENT> of a full-submission .txt - its metadata and the byte offsets of its body within the
+    submission. The body is only read and decoded when accessed.
+
+    Attributes:
+        type: document type, e.g. 10-K, EX-21.1 or GRAPHIC
+        sequence: position of the document within the submission - the primary document is 1
+        filename: file name the filer gave the document
+        description: optional description
+        start, end: offsets of <DOCUMENT> and the end of </DOCUMENT>
+        body_start, body_end: offsets of the content between <TEXT> and </TEXT>
+    """
+    __slots__ = ('_submission', 'type', 'sequence', 'filename', 'description', 'start', 'end',
+                 'body_start', 'body_end')
+
+    def __init__(self, submission: 'Submission', type: str, sequence: Optional[int], filename: Optional[str],
+                 description: Optional[str], start: int, end: int, body_start: int, body_end: int) -> None:
+        self._submission = submission
+        self.type = type
+        self.sequence = sequence
+        self.filename = filename
+        self.description = description
+        self.start = start
+        self.end = end
+        self.body_start = body_start
+        self.body_end = body_end
+
+    def __repr__(self) -> str:
+        return (f'Document(type={self.type!r}, sequence={self.sequence}, filename={self.filename!r}, '
+                f'size={self.size})')
+
+    @property
+    def size(self) -> int:
+        """bytes of the body"""
+        return self.body_end - self.body_start
+
+    def view(self) -> memoryview:
+        """zero-copy view of the body - release it before closing the submission"""
+        return self._submission._view(self.body_start, self.body_end)
+
+    def raw(self) -> bytes:
+        """body bytes - only this document is read"""
+        return self._submission._read(self.body_start, self.body_end)
+
+    def text(self) -> str:
+        """body decoded and repaired like the rest of secutils (see secutils.utils.decode_text)"""
+        return decode_text(self.raw())
+
+    def iter_raw(self, chunk_size: int=CHUNK_SIZE) -> Iterator[bytes]:
+        """body bytes chunk_size at a time - memory stays bounded for bodies of any size"""
+        for start in range(self.body_start, self.body_end, chunk_size):
+            yield self._submission._read(start, min(start + chunk_size, self.body_end))
+
+    @property
+    def is_uuencoded(self) -> bool:
+        """True for binary documents (graphics, PDFs, zips) embedded as uuencoded text"""
+        head = self._submission._read(self.body_start, min(self.body_start + 256, self.body_end))
+        return re.match(rb'\s*(?:<PDF>\s*)?begin [0-7]{3} ', head) is not None
+
+    def content(self) -> bytes:
+        """the document as its filer submitted it - uudecoded for binary documents, the raw body otherwise"""
+        if not self.is_uuencoded:
+            return self.raw()
+        return _uudecode(self.iter_lines())
+
+    def iter_lines(self) -> Iterator[bytes]:
+        """body lines without line endings, read a chunk at a time"""
+        pending = b''
+        for chunk in self.iter_raw():
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b'\r')
+        if pending:
+            yield pending.rstrip(b'\r')
+
+    def matches(self, types: Optional[Iterable[str]]=None, filenames: Optional[Iterable[str]]=None) -> bool:
+        """
+        True when the document's type matches one of types and its file name one of filenames - both are
+        case-insensitive glob patterns, e.g. ['10-K', 'EX-21*'] or ['*.htm']. None matches everything.
+        """
+        if types is not None and not _match_any(self.type, types):
+            return False
+        if filenames is not None and not _match_any(self.filename or '', filenames):
+            return False
+        return True
+
+
+def _match_any(value: str, patterns: Iterable[str]) -> bool:
+    value = value.upper()
+    return any(fnmatch.fnmatchcase(value, pattern.upper()) for pattern in patterns)
+
+
+def _uudecode(lines: Iterable[bytes]) -> bytes:
+    """decode the first uuencoded block of lines - tolerant of the padding quirks found in EDGAR filings"""
+    out, started = [], False
+    for line in lines:
+        if not started:
+            started = line.startswith(b'begin ')
+            continue
+        if line.strip() in (b'end', b'</PDF>'):
+            break
+        if not line:
+            continue
+        try:
+            out.append(binascii.a2b_uu(line))
+        except binascii.Error:
+            # trailing garbage after the encoded bytes - decode only the length the line announces
+            num_chars = (((line[0] - 32) & 63) * 4 + 5) // 3
+            out.append(binascii.a2b_uu(line[:num_chars]))
+    return b''.join(out)
+
+
+class Submission(object):
+    """
+    Lazy reader of an EDGAR full-submission .txt - the SEC header followed by every document of the
+    filing (main document, exhibits, XBRL, uuencoded graphics). The file is memory-mapped and scanned
+    for <DOCUMENT> boundaries as documents are requested; only the few metadata lines of each document
+    are parsed and bodies are read when accessed, so pulling the main document or a single exhibit out
+    of a 200 MB submission touches only those pages. Compressed submissions (.txt.gz, .txt.zst) are
+    decompressed into memory instead.
+
+    Parameters
+    -------
+    path: path of the full-submission .txt, e.g. <output_dir>/10-K/2017/Q4/0001437749-17-020936.txt
+
+    Example:
+    --------
+    >>> from secutils.submission import Submission
+    >>> with Submission('/mnt/sda/sec/10-K/2017/Q4/0001437749-17-020936.txt') as submission:
+    ...     print(submission.header_fields()['CONFORMED SUBMISSION TYPE'])
+    ...     main = submission.primary_document()
+    ...     subsidiaries = submission.get('EX-21*')
+    ...     text = subsidiaries.text() if subsidiaries else None
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open_filing(path)
+        if codec_for_path(path) is not None:
+            self._data = self._file.read()
+        else:
+            self._map()
+        self._documents = []  # type: List[Document]
+        self._pos = 0
+        self._exhausted = False
+
+    def _map(self) -> None:
+        try:
+            # empty files cannot be mapped
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._data = b''
+
+    def __len__(self) -> int:
+        """number of documents - scans the whole submission"""
+        return len(self.documents())
+
+    def __iter__(self) -> Iterator[Document]:
+        i = 0
+        while True:
+            if i < len(self._documents):
+                yield self._documents[i]
+                i += 1
+            elif self._next_document() is None:
+                return
+
+    def documents(self) -> List[Document]:
+        return [document for document in self]
+
+    def select(self, types: Optional[Iterable[str]]=None,
+               filenames: Optional[Iterable[str]]=None) -> Iterator[Document]:
+        """documents matching the type and file name patterns - see Document.matches"""
+        types = [types] if isinstance(types, str) else types
+        filenames = [filenames] if isinstance(filenames, str) else filenames
+        return (document for document in self if document.matches(types, filenames))
+
+    def get(self, type: str) -> Optional[Document]:
+        """first document whose type matches the pattern - scanning stops there"""
+        return next(self.select(types=[type]), None)
+
+    def primary_document(self) -> Optional[Document]:
+        return next(iter(self), None)
+
+    def header(self) -> str:
+        """the <SEC-HEADER> block - empty when the submission has none"""
+        start = self._data.find(b'<SEC-HEADER>')
+        if start < 0:
+            return ''
+        end = self._data.find(b'</SEC-HEADER>', start)
+        end = end if end >= 0 else self._find_document(start)
+        return decode_text(self._read(start, end))
+
+    def header_fields(self) -> Dict[str, str]:
+        """
+        top level fields of the header, e.g. ACCESSION NUMBER, CONFORMED SUBMISSION TYPE and
+        FILED AS OF DATE. The indented sections (FILER, COMPANY DATA, ...) are left in header().
+        """
+        fields = {}
+        for line in self.header().splitlines()[1:]:
+            match = _HEADER_FIELD.match(line.rstrip())
+            if match is None:
+                continue
+            name, value = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+            if value:
+                fields.setdefault(name, value.strip())
+        return fields
+
+    def _find_document(self, pos: int) -> int:
+        found = self._data.find(b'<DOCUMENT>', pos)
+        return found if found >= 0 else len(self._data)
+
+    def _next_document(self) -> Optional[Document]:
+        """parse the document following the last one found"""
+        if self._exhausted:
+            return None
+        start = self._data.find(b'<DOCUMENT>', self._pos)
+        if start < 0:
+            self._exhausted = True
+            return None
+        next_start = self._find_document(start + len(b'<DOCUMENT>'))
+        text_start = self._data.find(b'<TEXT>', start, next_start)
+        meta_end = text_start if text_start >= 0 else next_start
+        tags = {name.decode('ascii'): value.strip().decode('utf-8', errors='replace')
+                for name, value in _DOCUMENT_TAG.findall(self._read(start, meta_end))}
+        if text_start >= 0:
+            body_start = text_start + len(b'<TEXT>')
+            # the body starts on the line after <TEXT>
+            if self._data[body_start:body_start + 2] == b'\r\n':
+                body_start += 2
+            elif self._data[body_start:body_start + 1] == b'\n':
+                body_start += 1
+            body_end = self._data.find(b'</TEXT>', body_start, next_start)
+            body_end = body_end if body_end >= 0 else next_start
+        else:
+            body_start = body_end = meta_end
+        end = self._data.find(b'</DOCUMENT>', body_end, next_start)
+        end = end + len(b'</DOCUMENT>') if end >= 0 else next_start
+        sequence = tags.get('SEQUENCE')
+        document = Document(self, tags.get('TYPE', ''), int(sequence) if sequence and sequence.isdigit() else None,
+                            tags.get('FILENAME'), tags.get('DESCRIPTION'), start, end, body_start, body_end)
+        self._documents.append(document)
+        self._pos = end
+        return document
+
+    def _read(self, start: int, end: int) -> bytes:
+        return self._data[start:end]
+
+    def _view(self, start: int, end: int) -> memoryview:
+        return memoryview(self._data)[start:end]
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self) -> 'Submission':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_submission(path: Union[str, 'File']) -> Submission:
+    """open a full-submission .txt by path or as a downloaded secutils.edgar.File"""
+    return Submission(getattr(path, 'download_file_dir', path))
@@ -0,0 +1,111 @@
+import os
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+from secutils.edgar import File
+from secutils.ratelimit import RateLimiter
+from secutils.retry import RetryPolicy
+from secutils.storage import PARTIAL_SUFFIX
+from secutils.mock_edgar import MockEdgarServer, synthetic_filing
+from secutils.aio import AsyncConnectionPool, download_docs_async
+
+
+def make_files(base_url, n):
+    files = []
+    for i in range(n):
+        partial_url = f'edgar/data/{1000 + i}/0001000{i:03d}-17-000001.txt'
+        f = File(form_type='10-K', company_name='MAGIC COMPANY', cik_number=str(1000 + i),
+                 date_filed='2017-2-9', partial_url=partial_url)
+        f.file_download_url = base_url + partial_url
+        files.append(f)
+    return files
+
+
+class TestAio(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _fetch_all(self, server, paths, max_connections):
+        async def fetch():
+            pool = AsyncConnectionPool(max_connections=max_connections)
+            async def get(path):
+                response = await pool.request(server.base_url + path)
+                return response.status, await response.read()
+            results = await asyncio.gather(*[get(p) for p in paths])
+            await pool.close()
+            return pool, results
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(fetch())
+        finally:
+            loop.close()
+
+    def test_pool_reuses_connections(self):
+        paths = [f'edgar/data/1/{i}.txt' for i in range(50)]
+        with MockEdgarServer(file_size=1000) as server:
+            pool, results = self._fetch_all(server, paths, max_connections=4)
+        msg = f"Expected at most 4 connections for 50 requests - got {pool.num_connects}"
+        self.assertLessEqual(pool.num_connects, 4, msg)
+        self.assertEqual(server.num_connections, pool.num_connects)
+        bodies = [body for _, body in results]
+        self.assertListEqual(bodies, [synthetic_filing('/Archives/' + p, 1000) for p in paths])
+
+    def test_chunked_responses(self):
+        paths = [f'edgar/data/1/{i}.txt' for i in range(5)]
+        with MockEdgarServer(file_size=777, chunked=True) as server:
+            pool, results = self._fetch_all(server, paths, max_connections=1)
+        self.assertEqual(pool.num_connects, 1)
+        self.assertTrue(all(len(body) == 777 for _, body in results))
+
+    def test_not_found(self):
+        with MockEdgarServer() as server:
+            pool, results = self._fetch_all(server, ['missing.html'], max_connections=1)
+        self.assertEqual(results[0][0], 404)
+
+    def test_download_docs_async(self):
+        with MockEdgarServer(file_size=4096) as server:
+            files = make_files(server.base_url, 20)
+            downloaded, errors = download_docs_async(files, self.tmpdir, self.tmpdir,
+                                                     rate_limiter=RateLimiter(max_rps=1000),
+                                                     max_connections=4)
+        msg = f"Expected 20 downloads and no errors - got {len(downloaded)} and {len(errors)}"
+        self.assertEqual((len(downloaded), len(errors)), (20, 0), msg)
+        sizes = [os.path.getsize(f.download_file_dir) for f in downloaded]
+        self.assertTrue(all(size == 4096 for size in sizes))
+        with open(os.path.join(self.tmpdir, 'success.txt')) as infile:
+            self.assertEqual(len(infile.readlines()), 20)
+
+    def test_download_docs_async_errors(self):
+        with MockEdgarServer() as server:
+            files = make_files(server.base_url, 2)
+            files[0].file_download_url = server.base_url + 'missing.html'
+            downloaded, errors = download_docs_async(files, self.tmpdir,
+                                                     rate_limiter=RateLimiter(max_rps=1000))
+        self.assertEqual(len(downloaded), 1)
+        self.assertIn('404', errors[0].error_message)
+
+    def test_download_docs_async_resumes(self):
+        with MockEdgarServer(file_size=200000) as server:
+            files = make_files(server.base_url, 1)
+            path = files[0].file_download_url[len(server.base_url) - len('/Archives/'):]
+            server.truncate[path] = 50000
+            limiter = RateLimiter(max_rps=1000)
+            # a single attempt so the interrupted transfer is resumed by the next run
+            _, errors = download_docs_async(files, self.tmpdir, rate_limiter=limiter,
+                                            retry_policy=RetryPolicy(max_attempts=1))
+            self.assertEqual(len(errors), 1)
+            downloaded, _ = download_docs_async(files, self.tmpdir, rate_limiter=limiter)
+            self.assertEqual(server.num_range_requests, 1)
+        with open(downloaded[0].download_file_dir, 'rb') as infile:
+            self.assertEqual(infile.read(), synthetic_filing(path, 200000))
+        self.assertFalse(os.path.exists(downloaded[0].download_file_dir + PARTIAL_SUFFIX))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import os
+import gzip
+import shutil
+import hashlib
+import tempfile
+import unittest
+from email.message import Message
+from urllib.parse import urlsplit
+
+from secutils.compression import (CompressedReader, FrameWriter, ZstdCodec, get_codec, open_filing, scan_frames,
+                                  strip_compression_suffix)
+from secutils.dispatch import DownloadJob
+from secutils.edgar import File
+from secutils.manifest import DownloadManifest
+from secutils.mock_edgar import MockEdgarServer, synthetic_filing
+from secutils.ratelimit import RateLimiter
+from secutils.storage import AtomicDownload, PARTIAL_SUFFIX
+from secutils.submission import Submission
+from secutils.utils import scan_output_dir
+from secutils.test.test_aio import make_files
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def write_frames(path, data, codec, frame_size, chunk_size=1000):
+    with open(path, 'wb') as outfile:
+        writer = FrameWriter(outfile, codec, frame_size=frame_size)
+        for start in range(0, len(data), chunk_size):
+            writer.write(data[start:start + chunk_size])
+        writer.finish()
+    return writer
+
+
+class TestCompressedFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = b''.join(f'line {i} of a filing\n'.encode('ascii') for i in range(20000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_random_access(self, codec):
+        path = os.path.join(self.tmpdir, 'filing.txt' + codec.suffix)
+        writer = write_frames(path, self.data, codec, frame_size=64 * 1024)
+        self.assertEqual(len(writer.frames), len(self.data) // (64 * 1024) + 1, msg="Expected one frame per 64 KiB")
+        with CompressedReader(path) as reader:
+            self.assertEqual(reader.size, len(self.data))
+            self.assertEqual(len(reader.frames), len(writer.frames), msg="Expected the frames read from the index")
+            for offset in (0, 64 * 1024 - 5, 200000, len(self.data) - 3):
+                reader.seek(offset)
+                self.assertEqual(reader.read(10), self.data[offset:offset + 10], msg=f"Expected bytes at {offset}")
+            reader.seek(-4, os.SEEK_END)
+            self.assertEqual(reader.read(), self.data[-4:])
+        with open_filing(path) as infile:
+            self.assertEqual(infile.read(), self.data, msg="Expected the whole filing read back")
+
+    def test_gzip_random_access(self):
+        self._check_random_access(get_codec('gzip'))
+
+    @unittest.skipUnless(ZstdCodec.available(), 'zstandard not installed')
+    def test_zstd_random_access(self):
+        self._check_random_access(get_codec('zstd'))
+
+    def test_gzip_readable_by_standard_tools(self):
+        path = os.path.join(self.tmpdir, 'filing.txt.gz')
+        write_frames(path, self.data, get_codec('gzip'), frame_size=64 * 1024)
+        with gzip.open(path, 'rb') as infile:
+            self.assertEqual(infile.read(), self.data, msg="Expected frames and seek index to be valid gzip members")
+
+    def test_file_without_index_is_scanned(self):
+        path = os.path.join(self.tmpdir, 'filing.txt.gz')
+        with open(path, 'wb') as outfile:
+            outfile.write(gzip.compress(self.data[:1000]) + gzip.compress(self.data[1000:]))
+        with CompressedReader(path) as reader:
+            self.assertEqual(reader.frames, [(0, 0), (1000, os.path.getsize(path) - len(gzip.compress(self.data[1000:])))])
+            reader.seek(999)
+            self.assertEqual(reader.read(2), self.data[999:1001])
+
+    def test_scan_stops_at_torn_frame(self):
+        path = os.path.join(self.tmpdir, 'filing.txt.gz')
+        codec = get_codec('gzip')
+        with open(path, 'wb') as outfile:
+            writer = FrameWriter(outfile, codec, frame_size=1000)
+            writer.write(self.data[:2500])
+            writer.flush_frame()
+            outfile.write(codec.compress_frame(self.data[2500:3500])[:-6])
+        md5 = hashlib.md5()
+        frames, size, compressed_size = scan_frames(path, codec, md5)
+        self.assertEqual((len(frames), size), (3, 2500), msg="Expected only complete frames")
+        self.assertEqual(compressed_size, writer.compressed_size)
+        self.assertEqual(md5.hexdigest(), hashlib.md5(self.data[:2500]).hexdigest())
+
+    def test_names(self):
+        self.assertEqual(strip_compression_suffix('0001437749-17-020936.txt.gz'), '0001437749-17-020936.txt')
+        self.assertEqual(strip_compression_suffix('0001437749-17-020936.txt.zst'), '0001437749-17-020936.txt')
+        self.assertEqual(strip_compression_suffix('0001437749-17-020936.txt.gz.part'), '0001437749-17-020936.txt.gz.part')
+        with self.assertRaises(ValueError):
+            get_codec('bz2')
+
+    def test_compressed_submission(self):
+        source = os.path.join(DATA_DIR, '0001493152-18-008297.txt')
+        with open(source, 'rb') as infile:
+            data = infile.read()
+        path = os.path.join(self.tmpdir, '0001493152-18-008297.txt.gz')
+        write_frames(path, data, get_codec('gzip'), frame_size=256 * 1024, chunk_size=64 * 1024)
+        self.assertLess(os.path.getsize(path), len(data) / 4, msg="Expected EDGAR text to compress well")
+        with Submission(path) as submission, Submission(source) as expected:
+            self.assertEqual(len(submission), 52)
+            self.assertEqual(submission.get('EX-21*').raw(), expected.get('EX-21*').raw())
+
+
+def _headers(**kwargs):
+    headers = Message()
+    for key, value in kwargs.items():
+        headers[key.replace('_', '-')] = value
+    return headers
+
+
+class TestCompressedDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.partial_url = 'edgar/data/1000230/0001437749-17-020936.txt'
+        self.file = File(form_type='10-K', company_name='OPTICAL CABLE CORP', cik_number='1000230',
+                         date_filed='2017-12-20', partial_url=self.partial_url)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_interrupted_download_resumes_from_last_frame(self):
+        with MockEdgarServer(file_size=3 * 2 ** 20) as server:
+            path = '/Archives/' + self.partial_url
+            server.truncate[path] = 2 ** 20 + 1000
+            self.file.file_download_url = server.base_url + self.partial_url
+            self.assertNotEqual(self.file.download_file(self.tmpdir, compression='gzip'), '200')
+            final_path = os.path.join(self.tmpdir, self.file.file_name + '.gz')
+            self.assertTrue(os.path.exists(final_path + PARTIAL_SUFFIX), msg="Expected the partial file kept")
+            self.assertEqual(AtomicDownload(os.path.join(self.tmpdir, self.file.file_name), compression='gzip').offset,
+                             2 ** 20 + 1000, msg="Expected every received byte kept in complete frames")
+            self.assertEqual(self.file.download_file(self.tmpdir, compression='gzip'), '200')
+            self.assertEqual(server.num_range_requests, 1, msg="Expected the download resumed with a Range request")
+        body = synthetic_filing(path, 3 * 2 ** 20)
+        self.assertEqual(self.file.download_file_dir, final_path)
+        self.assertEqual(self.file.checksum, hashlib.md5(body).hexdigest(), msg="Expected the md5 of the uncompressed body")
+        with open_filing(final_path) as infile:
+            self.assertEqual(infile.read(), body)
+        self.assertEqual(scan_output_dir(self.tmpdir), [self.file.file_name], msg="Expected the uncompressed name seen")
+
+    def test_complete_partial_is_committed_with_index(self):
+        final_path = os.path.join(self.tmpdir, self.file.file_name)
+        download = AtomicDownload(final_path, compression='gzip')
+        download.start(200, _headers(Content_Length='5000'))
+        download.write(b'x' * 5000)
+        download.close()
+        download = AtomicDownload(final_path, compression='gzip')
+        self.assertTrue(download.range_complete(_headers(Content_Range='bytes */5000')))
+        download.commit()
+        with CompressedReader(final_path + '.gz') as reader:
+            self.assertEqual(len(reader.frames), 1, msg="Expected the seek index written on commit")
+            self.assertEqual(reader.read(), b'x' * 5000)
+
+    def test_job_engines_store_compressed(self):
+        for engine in ('thread', 'async'):
+            output_dir = os.path.join(self.tmpdir, engine)
+            with MockEdgarServer(file_size=5000) as server:
+                files = make_files(server.base_url, 3)
+                stats = DownloadJob(output_dir, num_workers=2, engine=engine, rate_limiter=RateLimiter(max_rps=1000),
+                                    compression='gzip').run(files)
+            self.assertEqual(stats.num_downloaded, 3, msg=f"{engine}: {stats.errors}")
+            for sec_file in files:
+                self.assertTrue(sec_file.download_file_dir.endswith('.txt.gz'), msg=sec_file.download_file_dir)
+                with open_filing(sec_file.download_file_dir) as infile:
+                    self.assertEqual(infile.read(), synthetic_filing(urlsplit(sec_file.file_download_url).path, 5000))
+            self.assertEqual(sorted(scan_output_dir(output_dir)), sorted(f.file_name for f in files))
+
+    def test_manifest_rebuild_uses_uncompressed_names(self):
+        form_dir = os.path.join(self.tmpdir, '10-K', '2017', 'Q4')
+        os.makedirs(form_dir)
+        download = AtomicDownload(os.path.join(form_dir, self.file.file_name), compression='gzip')
+        download.start(200, _headers())
+        download.write(b'filing')
+        download.commit()
+        manifest = DownloadManifest(os.path.join(self.tmpdir, 'manifest.sqlite'))
+        try:
+            self.assertEqual(manifest.rebuild(self.tmpdir), 1)
+            self.assertEqual(manifest.seen_files(), {self.file.file_name})
+            row = manifest.get('0001437749-17-020936')
+            self.assertEqual((row['path'], row['size']), (download.final_path, os.path.getsize(download.final_path)))
+        finally:
+            manifest.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from secutils.edgar import FileBatch, FormIDX
+from secutils.coordinator import CoordinatedDownload, WorkQueue, MAX_PERIOD_ATTEMPTS, queue_signature
+from secutils.index_cache import OPEN_QUARTER_MAX_AGE
+from secutils.mock_edgar import MockEdgarServer
+from secutils.ratelimit import RateLimiter
+from secutils.test.test_scheduler import FakeIndex, FailingIndex
+
+
+class FormsIndex(FakeIndex):
+    """a quarter of 10-Ks and 8-Ks filtered by form_types like FormIDX"""
+
+    def __init__(self, year, quarter, form_types=None, **kwargs):
+        FakeIndex.calls.append(((year, quarter), time.monotonic()))
+        lines = [f'{1000 + i}|COMPANY {i}|{form_type}|{year}-{quarter * 3:02d}-01|'
+                 f'edgar/data/{1000 + i}/{year}{quarter}-{form_type.replace("-", "")}-{i:04d}.txt'
+                 for form_type in ('10-K', '8-K') for i in range(3)]
+        master_index = FormIDX.__new__(FormIDX)._parse_index_lines(lines)
+        self.master_index = master_index[master_index['Form Type'].isin(form_types)] if form_types else master_index
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queues = []
+        FakeIndex.base_url = FileBatch.base_url
+
+    def tearDown(self):
+        for work_queue in self.queues:
+            work_queue.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _queue(self, **kwargs):
+        work_queue = WorkQueue.for_output_dir(self.tmpdir, **kwargs)
+        self.queues.append(work_queue)
+        return work_queue
+
+    def _expand(self, work_queue, num_files=40):
+        work_queue.add_periods([(2017, 1)])
+        period = work_queue.claim_period()
+        return work_queue.expand_period(period, FakeIndex(*period, num_files=num_files).to_batch())
+
+    def test_periods_are_expanded_once(self):
+        first, second = self._queue(), self._queue()
+        self.assertEqual(first.add_periods([(2017, 1), (2017, 2)]), 2)
+        self.assertEqual(second.add_periods([(2017, 1), (2017, 2)]), 0, 'known quarters should not be added again')
+        self.assertEqual(first.claim_period(), (2017, 1))
+        self.assertEqual(second.claim_period(), (2017, 2), 'a leased quarter should not be handed out twice')
+        self.assertIsNone(first.claim_period())
+        self.assertEqual(first.expand_period((2017, 1), FakeIndex(2017, 1).to_batch()), 5)
+        self.assertEqual(second.expand_period((2017, 2), FakeIndex(2017, 2).to_batch()), 5)
+        self.assertTrue(first.add_periods([(2017, 1)]) == 0 and first.claim_period() is None,
+                        'closed quarters should stay expanded')
+        self.assertEqual(first.counts(), {'pending': 10})
+
+    def test_failed_period_is_retried_then_given_up(self):
+        work_queue = self._queue()
+        work_queue.add_periods([(2017, 1)])
+        for attempt in range(1, MAX_PERIOD_ATTEMPTS + 1):
+            period = work_queue.claim_period()
+            self.assertEqual(period, (2017, 1))
+            self.assertEqual(work_queue.release_period(period, 'index unavailable'), attempt == MAX_PERIOD_ATTEMPTS)
+        self.assertIsNone(work_queue.claim_period())
+        self.assertTrue(work_queue.is_idle())
+
+    def test_claims_are_disjoint(self):
+        self._expand(self._queue(), num_files=200)
+        claimed = []
+
+        def claim_all(work_queue):
+            while True:
+                files = work_queue.claim(7)
+                if not files:
+                    return
+                claimed.extend(sec_file.file_name for sec_file in files)
+
+        threads = [threading.Thread(target=claim_all, args=(self._queue(),)) for _ in range(4)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        self.assertEqual(len(claimed), 200)
+        self.assertEqual(len(set(claimed)), 200, 'no file should be claimed by two workers')
+
+    def test_expired_leases_are_taken_over(self):
+        crashed = self._queue(lease_seconds=0.2)
+        self._expand(crashed, num_files=10)
+        claimed = {sec_file.file_name for sec_file in crashed.claim(4)}
+        alive = self._queue(lease_seconds=0.2, heartbeat_interval=0.05).start_heartbeat()
+        kept = {sec_file.file_name for sec_file in alive.claim(3)}
+        survivor = self._queue()
+        self.assertEqual(len(survivor.claim(10)), 3, 'live leases should not be handed out')
+        time.sleep(0.3)
+        taken_over = {sec_file.file_name for sec_file in survivor.claim(10)}
+        self.assertSetEqual(taken_over, claimed, 'expired leases should be claimable again')
+        self.assertEqual(survivor.num_reclaimed, 4)
+        self.assertFalse(taken_over & kept, 'leases renewed by a heartbeat should be kept')
+
+    def test_acks_and_release(self):
+        work_queue = self._queue()
+        self._expand(work_queue, num_files=6)
+        files = work_queue.claim(6)
+        work_queue.ack(files[0], ok=True)
+        work_queue.ack(files[1], ok=False, error='HTTP Error 404')
+        self.assertEqual(work_queue.flush(), 2)
+        self.assertEqual(work_queue.counts(), {'done': 1, 'failed': 1, 'leased': 4})
+        work_queue.close()
+        self.queues.remove(work_queue)
+        self.assertEqual(self._queue().counts(), {'done': 1, 'failed': 1, 'pending': 4},
+                         'unfinished leases should be released on close')
+
+    def test_open_quarter_reopened(self):
+        work_queue = self._queue()
+        year = time.localtime().tm_year
+        work_queue.add_periods([(year, 4), (2017, 1)])
+        for _ in range(2):
+            period = work_queue.claim_period()
+            work_queue.expand_period(period, [])
+        self.assertEqual(work_queue.add_periods([(year, 4), (2017, 1)]), 0, 'a fresh expansion should be kept')
+        work_queue._conn.execute('UPDATE periods SET expanded_at = ?', (time.time() - 2 * OPEN_QUARTER_MAX_AGE,))
+        self.assertEqual(work_queue.add_periods([(year, 4), (2017, 1)]), 1)
+        self.assertEqual(work_queue.claim_period(), (year, 4), 'the open quarter should be expanded again')
+
+
+class TestCoordinatedDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.periods = [(2017, 1), (2017, 2), (2017, 3), (2017, 4)]
+        FakeIndex.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _download(self, server, index_factory=FakeIndex, **kwargs):
+        FakeIndex.base_url = server.base_url
+        work_queue = WorkQueue.for_output_dir(self.tmpdir, **kwargs)
+        return CoordinatedDownload(work_queue, self.periods, self.tmpdir, num_workers=2, batch_size=3,
+                                   rate_limiter=RateLimiter(max_rps=1000), index_factory=index_factory,
+                                   poll_interval=0.05, show_progress=False)
+
+    def test_nodes_share_the_work(self):
+        results = []
+        with MockEdgarServer(file_size=500) as server:
+            nodes = [self._download(server) for _ in range(3)]
+            threads = [threading.Thread(target=lambda node=node: results.append(node.run())) for node in nodes]
+            [thread.start() for thread in threads]
+            [thread.join() for thread in threads]
+            num_requests = server.num_requests
+        [node.work_queue.close() for node in nodes]
+        self.assertEqual(sum(num_downloaded for num_downloaded, _ in results), 20)
+        self.assertEqual(num_requests, 20, 'no filing should be downloaded twice')
+        self.assertEqual(sorted(period for period, _ in FakeIndex.calls), self.periods, 'each index should be prepared once')
+        for quarter in ['Q1', 'Q2', 'Q3', 'Q4']:
+            self.assertEqual(len(os.listdir(os.path.join(self.tmpdir, '10-K', '2017', quarter))), 5)
+        self.assertEqual(WorkQueue.for_output_dir(self.tmpdir).counts(), {'done': 20})
+
+    def test_crashed_worker_is_recovered(self):
+        with MockEdgarServer(file_size=500) as server:
+            FakeIndex.base_url = server.base_url
+            crashed = WorkQueue.for_output_dir(self.tmpdir, lease_seconds=0.2)
+            crashed.add_periods(self.periods[:1])
+            crashed.expand_period(crashed.claim_period(), FakeIndex(2017, 1).to_batch())
+            self.assertEqual(len(crashed.claim(10)), 5)
+            # the crashed worker never heartbeats or releases its leases
+            node = self._download(server)
+            num_downloaded, errors = node.run()
+            node.work_queue.close()
+        self.assertEqual((num_downloaded, len(errors)), (20, 0))
+        self.assertEqual(node.work_queue.num_reclaimed, 5)
+
+    def test_runs_with_different_filters_use_separate_queues(self):
+        self.assertIsNone(queue_signature())
+        self.assertEqual(queue_signature(['8-K', '10-K'], [2, 1]), queue_signature(['10-K', '8-K'], ['1', '2']))
+        self.assertNotEqual(queue_signature(['10-K']), queue_signature(['8-K']))
+        with MockEdgarServer(file_size=500) as server:
+            FakeIndex.base_url = server.base_url
+            for form_type in ('10-K', '8-K'):
+                work_queue = WorkQueue.for_output_dir(self.tmpdir, form_types=[form_type])
+                node = CoordinatedDownload(work_queue, self.periods[:2], self.tmpdir, form_types=[form_type],
+                                           num_workers=2, rate_limiter=RateLimiter(max_rps=1000),
+                                           index_factory=FormsIndex, poll_interval=0.05, show_progress=False)
+                num_downloaded, errors = node.run()
+                work_queue.close()
+                self.assertEqual((num_downloaded, len(errors)), (6, 0),
+                                 msg=f"{form_type}: expected the quarters expanded again for different form types")
+        for form_type in ('10-K', '8-K'):
+            self.assertEqual(len(os.listdir(os.path.join(self.tmpdir, form_type, '2017', 'Q1'))), 3, msg=form_type)
+
+    def test_index_failure_gives_up_on_quarter(self):
+        with MockEdgarServer(file_size=500) as server:
+            node = self._download(server, index_factory=FailingIndex)
+            num_downloaded, _ = node.run()
+            node.work_queue.close()
+        self.assertEqual(num_downloaded, 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
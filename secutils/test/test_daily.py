@@ -0,0 +1,143 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from secutils.daily import DailyIndexSync, _quarters_between
+from secutils.dispatch import DownloadJob
+from secutils.edgar import FileBatch
+from secutils.index_cache import IndexCache, type_master_index
+from secutils.ratelimit import RateLimiter
+from secutils.retry import RetryPolicy
+from secutils.mock_edgar import MockEdgarServer
+from secutils.test.test_index_cache import parsed_index
+
+DAILY_HEADER = 'Description:           Daily Index of EDGAR Dissemination Feed by Company Name\n\n' \
+               'CIK|Company Name|Form Type|Date Filed|File Name\n' + '-' * 80 + '\n'
+
+
+def daily_index(day, rows):
+    lines = [f'{cik}|COMPANY {cik}|{form}|{day}|edgar/data/{cik}/{cik:010d}-17-{day}.txt' for cik, form in rows]
+    return (DAILY_HEADER + '\n'.join(lines) + '\n').encode('utf-8')
+
+
+class TestDailyIndexSync(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        os.makedirs(self.cache_dir)
+        self.state_path = os.path.join(self.cache_dir, 'daily_sync.json')
+        self.server = MockEdgarServer(file_size=200).start()
+        self.days = {'20170103': [(1000230, '10-K'), (1000015, '8-K')],
+                     '20170104': [(1000112, '10-K')],
+                     '20170105': [(1000179, '10-K'), (1000230, '8-K')]}
+        self._publish(2017, 1, self.days)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _publish(self, year, quarter, days):
+        base = f'/Archives/edgar/daily-index/{year}/QTR{quarter}/'
+        items = [{'name': 'form.20170103.idx', 'type': 'file'}]
+        for day, rows in days.items():
+            self.server.files[base + f'master.{day}.idx'] = daily_index(day, rows)
+            items.append({'name': f'master.{day}.idx', 'type': 'file'})
+        self.server.files[base + 'index.json'] = json.dumps({'directory': {'item': items}}).encode('utf-8')
+
+    def _sync(self, **kwargs):
+        kwargs.setdefault('start_date', date(2017, 1, 1))
+        kwargs.setdefault('retry_policy', RetryPolicy(max_attempts=2, base_delay=0.01))
+        rate_limiter = RateLimiter(max_rps=1000)
+        rate_limiter.max_penalty = 0.01
+        sync = DailyIndexSync(self.state_path, rate_limiter=rate_limiter, **kwargs)
+        sync.daily_index_url = self.server.base_url + 'edgar/daily-index/{year}/QTR{quarter}/'
+        return sync
+
+    def test_incremental_sync(self):
+        sync = self._sync(form_types=['10-K'])
+        batch = sync.prepare(today=date(2017, 1, 4))
+        self.assertListEqual(sorted(f.cik_number for f in batch), [1000112, 1000230])
+        sync.commit()
+        self.assertEqual(sync.high_water_mark, date(2017, 1, 4))
+
+        # the next run only fetches the listing and the newer daily file
+        num_requests = self.server.num_requests
+        sync = self._sync(form_types=['10-K'])
+        batch = sync.prepare(today=date(2017, 1, 31))
+        self.assertListEqual([f.cik_number for f in batch], [1000179])
+        self.assertEqual(self.server.num_requests - num_requests, 2)
+        self.assertEqual(batch[0].date_filed.strftime('%Y-%m-%d'), '2017-01-05')
+
+    def test_mark_not_advanced_without_commit(self):
+        sync = self._sync()
+        self.assertEqual(len(sync.prepare(today=date(2017, 1, 31))), 5)
+        self.assertIsNone(sync.high_water_mark)
+        self.assertEqual(len(self._sync().prepare(today=date(2017, 1, 31))), 5)
+
+    def test_filters_and_seen_files(self):
+        sync = self._sync(ciks=['1000230'], seen_files={'0001000230-17-20170103.txt'})
+        batch = sync.prepare(today=date(2017, 1, 31))
+        self.assertListEqual([f.file_name for f in batch], ['0001000230-17-20170105.txt'])
+
+    def test_merges_into_cached_quarter(self):
+        cache = IndexCache(self.cache_dir, 'pickle')
+        cache.save(2017, 1, type_master_index(parsed_index()))
+        num_cached = len(cache.load(2017, 1))
+        self._sync(cache_dir=self.cache_dir, cache_format='pickle').prepare(today=date(2017, 1, 31))
+        merged = cache.load(2017, 1)
+        self.assertEqual(len(merged), num_cached + 5)
+        self.assertEqual(str(merged['Date Filed'].max().date()), '2017-01-05')
+        # quarters that were never cached are left alone
+        self.assertFalse(cache.exists(2017, 2))
+
+    def test_downloads_into_quarter_layout(self):
+        sync = self._sync(form_types=['10-K'])
+        batch = sync.prepare(today=date(2017, 1, 31))
+        batch.base_url = self.server.base_url
+        stats = DownloadJob(self.tmpdir, num_workers=2, rate_limiter=RateLimiter(max_rps=1000)).run(batch)
+        self.assertEqual(stats.num_downloaded, 3)
+        self.assertEqual(len(os.listdir(os.path.join(self.tmpdir, '10-K', '2017', 'Q1'))), 3)
+
+    def test_throttled_index_requests_are_retried(self):
+        base = '/Archives/edgar/daily-index/2017/QTR1/'
+        self.server.errors[base + 'index.json'] = [429, 503]
+        self.server.errors[base + 'master.20170104.idx'] = [429, 500]
+        sync = self._sync()
+        self.assertEqual(len(sync.prepare(today=date(2017, 1, 31))), 5)
+        self.assertListEqual(sync.failures, [])
+
+    def test_failed_daily_index_is_fetched_by_next_sync(self):
+        base = '/Archives/edgar/daily-index/2017/QTR1/'
+        self.server.errors[base + 'master.20170104.idx'] = [500, 500]
+        sync = self._sync()
+        batch = sync.prepare(today=date(2017, 1, 31))
+        msg = "Expected the other daily indices synced"
+        self.assertListEqual(sorted(f.file_name[-12:-4] for f in batch), ['20170103', '20170103', '20170105',
+                                                                          '20170105'], msg)
+        self.assertEqual([(f['date'], f['status']) for f in sync.failures], [('2017-01-04', 500)])
+        sync.commit()
+        self.assertEqual(sync.high_water_mark, date(2017, 1, 3), msg="Expected the mark to stop short of the failure")
+        with open(self.state_path, 'r') as infile:
+            self.assertEqual(len(json.load(infile)['failed']), 1)
+        sync = self._sync()
+        batch = sync.prepare(today=date(2017, 1, 31))
+        self.assertListEqual(sorted(f.cik_number for f in batch), [1000112, 1000179, 1000230])
+        sync.commit()
+        self.assertEqual(sync.high_water_mark, date(2017, 1, 5))
+
+    def test_quarters_between(self):
+        self.assertListEqual(_quarters_between(date(2016, 12, 30), date(2017, 4, 2)),
+                             [(2016, 4), (2017, 1), (2017, 2)])
+
+    def test_empty(self):
+        batch = self._sync(start_date=date(2017, 1, 6)).prepare(today=date(2017, 1, 31))
+        self.assertIsInstance(batch, FileBatch)
+        self.assertEqual(len(batch), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
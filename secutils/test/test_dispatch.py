@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from secutils import aio
+from secutils.dispatch import DownloadJob, WorkerStats
+from secutils.ratelimit import RateLimiter
+from secutils.mock_edgar import MockEdgarServer
+from secutils.test.test_aio import make_files
+
+
+class TestDownloadJob(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rate_limiter = RateLimiter(max_rps=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _job(self, output_dir, **kwargs):
+        return DownloadJob(output_dir, num_workers=3, rate_limiter=self.rate_limiter, **kwargs)
+
+    def test_run_thread_engine(self):
+        with MockEdgarServer(file_size=300) as server:
+            stats = self._job(self.tmpdir).run(make_files(server.base_url, 12))
+        self.assertEqual((stats.num_downloaded, stats.num_errors), (12, 0))
+        self.assertEqual(len(os.listdir(os.path.join(self.tmpdir, '10-K', '2017', 'Q1'))), 12)
+
+    def test_run_async_engine(self):
+        with MockEdgarServer(file_size=300) as server:
+            stats = self._job(self.tmpdir, engine='async').run(make_files(server.base_url, 12))
+        self.assertEqual((stats.num_downloaded, stats.num_errors), (12, 0))
+
+    def test_errors_collected_per_worker(self):
+        with MockEdgarServer(file_size=300) as server:
+            files = make_files(server.base_url, 6)
+            for sec_file in files[:2]:
+                sec_file.file_download_url = server.base_url + 'missing/' + sec_file.file_name
+            job = self._job(self.tmpdir)
+            stats = job.run(files)
+        self.assertEqual((stats.num_downloaded, stats.num_errors), (4, 2))
+        self.assertSetEqual({f.file_name for f in stats.errors}, {f.file_name for f in files[:2]})
+        self.assertTrue(all('404' in f.error_message for f in stats.errors))
+        msg = "Expected one stats object per worker"
+        self.assertEqual(len(job._worker_stats), 3, msg)
+
+    def test_concurrent_jobs_are_isolated(self):
+        results = {}
+        with MockEdgarServer(file_size=300) as server:
+            files = make_files(server.base_url, 20)
+            jobs = {'a': self._job(os.path.join(self.tmpdir, 'a'), name='a'),
+                    'b': self._job(os.path.join(self.tmpdir, 'b'), name='b')}
+            threads = [threading.Thread(target=lambda k, fs: results.__setitem__(k, jobs[k].run(fs)), args=(k, fs))
+                       for k, fs in [('a', files[:8]), ('b', files[8:])]]
+            [thread.start() for thread in threads]
+            [thread.join() for thread in threads]
+        self.assertEqual(results['a'].num_downloaded, 8)
+        self.assertEqual(results['b'].num_downloaded, 12)
+        self.assertEqual(len(os.listdir(os.path.join(self.tmpdir, 'b', '10-K', '2017', 'Q1'))), 12)
+
+    def test_on_result_and_closed_submit(self):
+        seen = []
+        with MockEdgarServer(file_size=300) as server:
+            job = self._job(self.tmpdir, on_result=lambda sec_file, urlmsg: seen.append(urlmsg))
+            job.run(make_files(server.base_url, 5))
+            with self.assertRaises(RuntimeError):
+                job.submit(make_files(server.base_url, 1)[0])
+        self.assertListEqual(seen, ['200'] * 5)
+
+    def test_async_engine_survives_unexpected_errors(self):
+        download_file_async = aio.download_file_async
+
+        async def flaky(pool, sec_file, *args):
+            if sec_file.file_name == files[0].file_name:
+                raise KeyError('unexpected')
+            return await download_file_async(pool, sec_file, *args)
+
+        with MockEdgarServer(file_size=300) as server:
+            files = make_files(server.base_url, 6)
+            with mock.patch.object(aio, 'download_file_async', flaky):
+                stats = self._job(self.tmpdir, engine='async').run(files)
+        self.assertEqual((stats.num_downloaded, stats.num_errors), (5, 1), msg="Expected only the failing file lost")
+        self.assertIn('unexpected', stats.errors[0].error_message)
+
+    def _run_in_thread(self, job, files):
+        # a hung job must fail the test instead of the test run
+        results = {}
+        thread = threading.Thread(target=lambda: results.__setitem__('stats', job.run(files)), daemon=True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), msg="Expected the job to finish")
+        return results['stats']
+
+    def test_raising_on_result_loses_no_files(self):
+        calls = []
+
+        def on_result(sec_file, urlmsg):
+            calls.append(sec_file.file_name)
+            if len(calls) == 1:
+                raise OSError('dead letter file not writable')
+
+        for engine in ('thread', 'async'):
+            del calls[:]
+            with MockEdgarServer(file_size=300) as server:
+                # fewer files than the work queue holds
+                files = make_files(server.base_url, 5)
+                stats = self._run_in_thread(self._job(os.path.join(self.tmpdir, engine), engine=engine,
+                                                      on_result=on_result), files)
+            self.assertEqual((stats.num_downloaded, stats.num_errors), (5, 0), msg=engine)
+            self.assertEqual(sorted(calls), sorted(f.file_name for f in files),
+                             msg=f"{engine}: expected every file recorded after the callback failed")
+
+    def test_dead_async_engine_fails_taken_and_queued_files(self):
+        def download_docs_async(files, *args, **kwargs):
+            async def take_one():
+                async for _ in files:
+                    raise OSError('event loop died')
+            aio.asyncio.new_event_loop().run_until_complete(take_one())
+
+        with MockEdgarServer(file_size=300) as server:
+            files = make_files(server.base_url, 5)
+            job = self._job(self.tmpdir, engine='async')
+            with mock.patch('secutils.dispatch.download_docs_async', download_docs_async):
+                stats = self._run_in_thread(job, files)
+        self.assertEqual((stats.num_downloaded, stats.num_errors), (0, 5), msg="Expected no file lost")
+        self.assertTrue(all('event loop died' in f.error_message for f in stats.errors))
+        self.assertIsNotNone(job.error)
+
+    def test_worker_stats_sum(self):
+        a, b = WorkerStats(), WorkerStats()
+        a.record('f1', '200', 1.0)
+        b.record('f2', RuntimeError('boom'), 0.5)
+        total = sum([a, b], WorkerStats())
+        self.assertEqual((total.num_downloaded, total.num_errors, total.busy_seconds), (1, 1, 1.5))
+        self.assertListEqual(total.errors, ['f2'])
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            DownloadJob(self.tmpdir, engine='fork')
+
+
+if __name__ == '__main__':
+    unittest.main()
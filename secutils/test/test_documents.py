@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from secutils.documents import DocumentSelector, FilingDocument, filing_index_url, parse_filing_index, read_documents
+from secutils.dispatch import DownloadJob
+from secutils.manifest import DownloadManifest
+from secutils.mock_edgar import MockEdgarServer, synthetic_filing_index
+from secutils.ratelimit import RateLimiter
+from secutils.storage import DOCUMENTS_NAME
+from secutils.utils import scan_output_dir
+from secutils.test.test_aio import make_files
+
+
+def documents(*rows):
+    return [FilingDocument(sequence, '', filename, doc_type, None, filename) for sequence, doc_type, filename in rows]
+
+
+class TestFilingIndex(unittest.TestCase):
+
+    def test_parse_index_page(self):
+        index_url = 'https://www.sec.gov/Archives/edgar/data/1000/000100000017000001/0001000000-17-000001-index.htm'
+        parsed = parse_filing_index(synthetic_filing_index('1000', '000100000017000001', '0001000000-17-000001').decode(),
+                                    index_url)
+        self.assertEqual([(d.sequence, d.type, d.filename) for d in parsed],
+                         [(1, '10-K', 'form10-k.htm'), (2, 'EX-21.1', 'ex21-1.htm'), (3, 'GRAPHIC', 'logo.jpg'),
+                          (None, '', '0001000000-17-000001.txt')], msg=str(parsed))
+        self.assertEqual(parsed[0].url, 'https://www.sec.gov/Archives/edgar/data/1000/000100000017000001/form10-k.htm',
+                         msg="Expected the inline XBRL viewer link resolved to the document itself")
+        self.assertEqual(parsed[1].size, 2048)
+
+    def test_filing_index_url(self):
+        sec_file = make_files('https://www.sec.gov/Archives/', 1)[0]
+        self.assertEqual(filing_index_url(sec_file),
+                         'https://www.sec.gov/Archives/edgar/data/1000/000100000017000001/0001000000-17-000001-index.htm')
+
+    def test_select(self):
+        parsed = documents((1, '10-K', 'form10-k.htm'), (2, 'EX-21.1', 'ex21-1.htm'), (3, 'GRAPHIC', 'logo.jpg'))
+        self.assertEqual([d.sequence for d in DocumentSelector().select(parsed)], [1],
+                         msg="Expected only the primary document without patterns")
+        self.assertEqual([d.sequence for d in DocumentSelector(types=['10-k', 'EX-21*']).select(parsed)], [1, 2],
+                         msg="Expected case-insensitive type patterns")
+        self.assertEqual([d.sequence for d in DocumentSelector(filenames='*.jpg').select(parsed)], [3])
+        self.assertEqual(DocumentSelector(types=['10-K'], filenames=['*.txt']).select(parsed), [],
+                         msg="Expected both patterns to have to match")
+
+
+class TestDocumentDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _download(self, engine):
+        manifest = DownloadManifest.for_output_dir(self.tmpdir)
+        with MockEdgarServer(file_size=500) as server:
+            files = make_files(server.base_url, 3)
+            job = DownloadJob(self.tmpdir, num_workers=2, engine=engine, rate_limiter=RateLimiter(max_rps=1000),
+                              manifest=manifest, selector=DocumentSelector(types=['10-K', 'EX-21*']))
+            stats = job.run(files)
+            num_requests = server.num_requests
+        self.assertEqual((stats.num_downloaded, len(stats.errors)), (3, 0), msg=str(stats.errors))
+        self.assertEqual(num_requests, 9, msg="Expected the index page and two documents of each filing")
+        filing_dir = os.path.join(self.tmpdir, '10-K', '2017', 'Q1', '0001000000-17-000001')
+        self.assertEqual(sorted(os.listdir(filing_dir)), [DOCUMENTS_NAME, 'ex21-1.htm', 'form10-k.htm'],
+                         msg="Expected the selected documents in the filing's directory")
+        record = read_documents(filing_dir)
+        self.assertEqual([d['type'] for d in record['documents']], ['10-K', 'EX-21.1'], msg=str(record))
+        names = {f'0001000{i:03d}-17-000001.txt' for i in range(3)}
+        self.assertEqual(set(scan_output_dir(self.tmpdir)), names, msg="Expected filings seen under their submission name")
+        self.assertEqual(manifest.seen_files(), names)
+        row = manifest.get('0001000000-17-000001')
+        self.assertEqual((row['path'], row['size']), (filing_dir, sum(
+            os.path.getsize(os.path.join(filing_dir, name)) for name in os.listdir(filing_dir))), msg=str(row))
+        self.assertEqual(manifest.rebuild(self.tmpdir), 3)
+        self.assertEqual(manifest.get('0001000000-17-000001')['size'], row['size'], msg="Expected the same size on rebuild")
+        self.assertEqual(manifest.get('0001000000-17-000001')['quarter'], 'Q1')
+        self.assertEqual(manifest.seen_files(), names, msg="Expected the rebuilt manifest to see the same filings")
+        manifest.close()
+
+    def test_thread_engine(self):
+        self._download('thread')
+
+    def test_async_engine(self):
+        self._download('async')
+
+    def test_retry_skips_completed_documents(self):
+        with MockEdgarServer(file_size=500) as server:
+            sec_file = make_files(server.base_url, 1)[0]
+            exhibit = '/Archives/edgar/data/1000/000100000017000001/ex21-1.htm'
+            server.errors[exhibit] = [404]
+            job = DownloadJob(self.tmpdir, num_workers=1, rate_limiter=RateLimiter(max_rps=1000),
+                              selector=DocumentSelector(types=['10-K', 'EX-21*']))
+            stats = job.run([sec_file])
+            self.assertEqual(len(stats.errors), 1, msg="Expected a filing with a missing document to fail")
+            filing_dir = os.path.join(self.tmpdir, '10-K', '2017', 'Q1', '0001000000-17-000001')
+            self.assertFalse(os.path.exists(os.path.join(filing_dir, DOCUMENTS_NAME)),
+                             msg="Expected an incomplete filing not to be marked complete")
+            self.assertEqual(scan_output_dir(self.tmpdir), [], msg="Expected an incomplete filing not to be seen")
+            num_requests = server.num_requests
+            stats = DownloadJob(self.tmpdir, num_workers=1, rate_limiter=RateLimiter(max_rps=1000),
+                                selector=DocumentSelector(types=['10-K', 'EX-21*'])).run([sec_file])
+            self.assertEqual(stats.num_downloaded, 1, msg=str(stats.errors))
+            self.assertEqual(server.num_requests - num_requests, 2, msg="Expected only the index and the missing exhibit")
+        self.assertEqual(scan_output_dir(self.tmpdir), ['0001000000-17-000001.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
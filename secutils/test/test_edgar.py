@@ -1,12 +1,17 @@
+import io
 import os
 import random
+import zipfile
 import unittest
+from unittest import mock
 
 import pandas as pd
 
 from secutils.edgar import (FileUtils, File, 
                        FormIDX, build_dir_structure, 
-                       download_docs, SECContainer)
+                       download_docs, SECContainer, _strip_column,
+                       FileBatch, parse_master_index, parse_master_index_stream,
+                       parse_master_zip)
 
 
 class TestEdgar(unittest.TestCase):
@@ -86,5 +91,123 @@ class TestEdgar(unittest.TestCase):
         msg = f"Multiple SECContainers not equal: container1: {container1.to_download} - container2: {container2.to_download}"
         self.assertSetEqual(container1.to_download, container2.to_download, msg)
 
+
+class TestIndexParser(unittest.TestCase):
+
+    preamble = '\n'.join([
+        'Description:           Master Index of EDGAR Dissemination Feed',
+        'Last Data Received:    June 30, 2017',
+        '',
+        'CIK|Company Name|Form Type|Date Filed|Filename',
+        '--------------------------------------------------------------------------------',
+    ])
+
+    def setUp(self):
+        # parser does not depend on the downloaded index
+        self.form = FormIDX.__new__(FormIDX)
+
+    def test_parse_index_buffer(self):
+        text = self.preamble + '\r\n'.join([
+            '',
+            '1000015|META GROUP INC|10-K|1998-03-31|edgar/data/1000015/0001000015-98-000009.txt',
+            '1000112|CHEVY "CHASE" MASTER\tTRUST|10-K |1998-03-27|edgar/data/1000112/0000920628-98-000038.txt',
+            '1000179|BAD|PIPE CORP|10-K|1998-03-30|edgar/data/1000179/0000950120-98-000108.txt',
+            '',
+        ])
+        master_index = self.form._parse_index_buffer(text)
+        msg = f"Expected 2 parsed rows w/header and malformed line dropped - got {master_index.values.tolist()}"
+        self.assertEqual(master_index.shape, (2, 6), msg)
+        self.assertListEqual(master_index['CIK'].tolist(), ['1000015', '1000112'], msg)
+        self.assertEqual(master_index['Company Name'].iloc[1], 'CHEVY "CHASE" MASTERTRUST')
+        self.assertListEqual(master_index['fname'].tolist(),
+                             ['0001000015-98-000009.txt', '0000920628-98-000038.txt'])
+
+    def test_strip_categorical_column(self):
+        column = pd.Series(['10-K ', '10-K', ' 8-K', '10-K '], dtype='category')
+        stripped = _strip_column(column)
+        self.assertListEqual(stripped.tolist(), ['10-K', '10-K', '8-K', '10-K'])
+        self.assertEqual(len(stripped.cat.categories), 2)
+
+    def test_parse_index_lines_without_header(self):
+        lines = [
+            '90810312|MAGIC COMPANY|10-K|2017-2-9|/edgar/data/08912031231.txt',
+            '32472152|MAGICAL COMPANY|10-K|2015-2-9|/edgar/data/32472152.txt',
+        ]
+        master_index = self.form._parse_index_lines(lines)
+        self.assertEqual(master_index.shape[0], 2)
+
+
+    def _index_bytes(self, num_lines=200):
+        lines = [f'{1000000 + i}|COMPANY {i}{" CAFÉ" if i % 7 == 0 else ""}|{"10-K" if i % 2 else "8-K"}|'
+                 f'1998-03-{1 + i % 28:02d}|edgar/data/{1000000 + i}/0001000015-98-{i:06d}.txt' for i in range(num_lines)]
+        return (self.preamble + '\n' + '\n'.join(lines) + '\n').encode('utf-8')
+
+    def test_stream_matches_buffer_parse(self):
+        raw = self._index_bytes()
+        expected = parse_master_index(raw)
+        self.assertEqual(len(expected), 200)
+        # chunks far smaller than a line - the header and most lines straddle chunk boundaries
+        for chunk_size in (7, 64, 1 << 20):
+            result = parse_master_index_stream(io.BytesIO(raw), chunk_size=chunk_size)
+            msg = f"Streamed parse with chunk_size={chunk_size} differs from the in-memory parse"
+            self.assertListEqual(result.astype(str).values.tolist(), expected.astype(str).values.tolist(), msg)
+
+    def test_stream_row_chunks_stay_categorical(self):
+        raw = self._index_bytes()
+        with mock.patch('secutils.edgar._INDEX_CHUNK_ROWS', 30):
+            master_index = parse_master_index_stream(io.BytesIO(raw), chunk_size=256)
+        expected = parse_master_index(raw)
+        self.assertIsInstance(master_index['Company Name'].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(master_index['Form Type'].dtype, pd.CategoricalDtype)
+        self.assertListEqual(master_index.astype(str).values.tolist(), expected.astype(str).values.tolist())
+
+    def test_stream_without_header_or_trailing_newline(self):
+        raw = b'90810312|MAGIC COMPANY|10-K|2017-02-09|edgar/data/08912031231.txt\n' \
+              b'32472152|MAGICAL COMPANY|10-K|2015-02-09|edgar/data/32472152.txt'
+        master_index = parse_master_index_stream(io.BytesIO(raw), chunk_size=16)
+        self.assertListEqual(master_index['fname'].tolist(), ['08912031231.txt', '32472152.txt'])
+
+    def test_parse_master_zip(self):
+        raw = self._index_bytes(50)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as outfile:
+            outfile.writestr('master.idx', raw)
+        master_index = parse_master_zip(buffer.getvalue())
+        self.assertEqual(len(master_index), 50)
+        self.assertEqual(master_index['Company Name'].iloc[0], 'COMPANY 0 CAFÉ')
+
+
+class TestFileBatch(unittest.TestCase):
+
+    lines = [
+        '1000015|META GROUP INC|10-K|1998-03-31|edgar/data/1000015/0001000015-98-000009.txt',
+        '1000112|chevy chase trust |10-K |1998-3-2|edgar/data/1000112/0000920628-98-000038.txt',
+        '1000179|PARAMOUNT FINANCIAL CORP|10k|1998-03-30|edgar/data/1000179/0000950120-98-000108.txt',
+        '1000180|SANDISK CORP|S-1/A|1998-11-11|edgar/data/1000180/0000891618-98-000563.html',
+    ]
+
+    def setUp(self):
+        self.master_index = FormIDX.__new__(FormIDX)._parse_index_lines(self.lines)
+
+    def test_records_match_validated_files(self):
+        batch = FileBatch(self.master_index)
+        msg = f"Expected rows failing validation to be dropped - got {len(batch)} rows"
+        self.assertEqual(len(batch), 2, msg)
+        expected = [File(*[line.split('|')[i] for i in (2, 1, 0, 3, 4)]) for line in self.lines[:2]]
+        for record, sec_file in zip(batch, expected):
+            for attr in ['form_type', 'company_name', 'cik_number', 'date_filed', 'year', 'quarter',
+                         'file_name', 'file_download_url']:
+                self.assertEqual(getattr(record, attr), getattr(sec_file, attr), attr)
+
+    def test_records_are_slotted(self):
+        record = FileBatch(self.master_index)[0]
+        self.assertIsInstance(record, File)
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_empty_batch(self):
+        self.assertEqual(len(FileBatch.empty()), 0)
+        self.assertListEqual(list(FileBatch.empty()), [])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
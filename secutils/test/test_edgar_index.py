@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from secutils.edgar import FileBatch, parse_master_index, INDEX_HEADER
+from secutils.edgar_index import EdgarIndex, _ranges
+from secutils.index_cache import IndexCache, _apply_filters, _filters
+
+FORM_TYPES = ['10-K', '10-Q', '8-K', 'SC 13G']
+
+
+def quarter_index(year, quarter, num_rows=60):
+    lines = [INDEX_HEADER, '-' * 80]
+    for i in range(num_rows):
+        cik = 1000000 + (i * 7919 + quarter) % 40
+        name = f'CAFÉ {cik}' if cik % 5 == 0 else f'COMPANY {cik}'
+        lines.append(f'{cik}|{name}|{FORM_TYPES[i % len(FORM_TYPES)]} |{year}-{3 * quarter:02d}-{1 + i % 28:02d}|'
+                     f'edgar/data/{cik}/{cik:010d}-{year % 100:02d}-{quarter}{i:05d}.txt')
+    return parse_master_index(('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+class TestEdgarIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = IndexCache(self.tmpdir, 'pickle')
+        self.periods = [(2005, 4), (2006, 1), (2006, 2)]
+        for year, quarter in self.periods:
+            self.cache.save(year, quarter, quarter_index(year, quarter))
+        self.index = EdgarIndex.for_cache_dir(self.tmpdir)
+        self.index.update(self.cache)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self, form_types=None, ciks=None, start=None, end=None):
+        frames = [_apply_filters(self.cache.load(year, quarter), _filters(form_types, ciks)) for year, quarter in self.periods]
+        master_index = pd.concat(frames, ignore_index=True)
+        if start is not None:
+            master_index = master_index.loc[master_index['Date Filed'] >= start]
+        if end is not None:
+            master_index = master_index.loc[master_index['Date Filed'] <= end]
+        return sorted(master_index['Filename'].tolist())
+
+    def test_queries_match_masking(self):
+        ciks = [1000000, 1000013, '1000025', 1999999]
+        cases = [
+            dict(ciks=ciks),
+            dict(form_types=['8-K', 'SC 13G']),
+            dict(ciks=ciks, form_types=['10-K']),
+            dict(form_types=['10-Q'], date_range=('2006-01-01', '2006-03-10')),
+            dict(ciks=ciks[:1], form_types=FORM_TYPES, date_range=(None, '2005-12-31')),
+        ]
+        for case in cases:
+            result = self.index.query(**case)
+            start, end = case.get('date_range', (None, None))
+            expected = self.expected(case.get('form_types'), [int(cik) for cik in case.get('ciks', [])] or None,
+                                     pd.Timestamp(start) if start else None, pd.Timestamp(end) if end else None)
+            self.assertListEqual(sorted(result['Filename'].tolist()), expected, f'query {case} differs from masking')
+
+    def test_result_is_a_typed_master_index(self):
+        result = self.index.query(ciks=[1000000])
+        self.assertListEqual(list(result.columns), ['CIK', 'Company Name', 'Form Type', 'Date Filed', 'Filename', 'fname'])
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(result['Date Filed']))
+        self.assertEqual(set(result['Company Name']), {'CAFÉ 1000000'})
+        self.assertTrue(result['Form Type'].isin(FORM_TYPES).all(), 'form types should be stored stripped')
+        self.assertListEqual([f.file_name for f in FileBatch(result)], result['fname'].tolist())
+        self.assertEqual(len(self.index.query(ciks=[1], form_types=['NOPE'])), 0)
+
+    def test_date_range_prunes_partitions(self):
+        self.index.close()
+        result = self.index.query(form_types=['10-K'], date_range=('2006-04-01', '2006-06-30'))
+        self.assertTrue((result['Date Filed'].dt.quarter == 2).all())
+        self.assertListEqual(list(self.index._partitions), ['2006-Q2'], 'only overlapping partitions should be opened')
+
+    def test_update_rebuilds_changed_quarters(self):
+        self.assertEqual(self.index.update(self.cache), 0, 'unchanged quarters should not be rebuilt')
+        self.index.query(ciks=[1000000])
+        self.cache.save(2006, 1, self.cache.load(2006, 1).iloc[:3], fetched_at=1.0)
+        self.assertEqual(self.index.update(self.cache), 1)
+        reopened = EdgarIndex.for_cache_dir(self.tmpdir)
+        self.assertEqual(len(reopened), 60 + 3 + 60)
+        self.assertEqual(len(reopened.query(date_range=('2006-01-01', '2006-03-31'))), 3)
+        reopened.close()
+        partitions = sorted(name for name in os.listdir(self.index.path) if name.startswith('2006-Q1'))
+        self.assertListEqual(partitions, ['2006-Q1.1'], 'replaced partitions should be removed')
+
+    def test_ranges(self):
+        self.assertListEqual(_ranges(np.array([2, 7, 9]), np.array([4, 7, 11])).tolist(), [2, 3, 9, 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,303 @@
+import io
+import os
+import time
+import shutil
+import zipfile
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime
+
+import pandas as pd
+
+from secutils.edgar import FormIDX, INDEX_HEADER
+from secutils.index_cache import (IndexCache, MemoryIndexCache, type_master_index, get_backend,
+                                  ParquetBackend)
+from secutils.mock_edgar import MockEdgarServer
+from secutils.ratelimit import RateLimiter
+from secutils.retry import RetryPolicy
+
+LINES = [
+    '1000015|META GROUP INC|10-K|1998-03-31|edgar/data/1000015/0001000015-98-000009.txt',
+    '1000112|CHEVY CHASE MASTER CREDIT CARD TRUST II|10-K |1998-03-27|edgar/data/1000112/0000920628-98-000038.txt',
+    '1000179|PARAMOUNT FINANCIAL CORP|8-K|1998-3-30|edgar/data/1000179/0000950120-98-000108.txt',
+    '1000180|SANDISK CORP|10-Q|1998-02-11|edgar/data/1000180/0000891618-98-000563.txt',
+]
+
+
+def parsed_index():
+    text = INDEX_HEADER + '\n' + '-' * 80 + '\n' + '\n'.join(LINES)
+    return FormIDX.__new__(FormIDX)._parse_index_buffer(text)
+
+
+class TestIndexCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_type_master_index(self):
+        master_index = type_master_index(parsed_index())
+        self.assertEqual(master_index['CIK'].dtype, 'int64')
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(master_index['Date Filed']))
+        self.assertIsInstance(master_index['Form Type'].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(master_index['Company Name'].dtype, pd.CategoricalDtype)
+        msg = f"Expected stripped form types - got {master_index['Form Type'].tolist()}"
+        self.assertListEqual(master_index['Form Type'].tolist(), ['10-K', '10-K', '8-K', '10-Q'], msg)
+
+    def _check_roundtrip(self, cache_format):
+        cache = IndexCache(self.tmpdir, cache_format)
+        master_index = type_master_index(parsed_index())
+        self.assertIsNone(cache.load(1998, 1))
+        cache.save(1998, 1, master_index)
+        loaded = cache.load(1998, 1)
+        pd.testing.assert_frame_equal(loaded.reset_index(drop=True), master_index, check_categorical=False)
+        filtered = cache.load(1998, 1, form_types=['10-K', '10-Q'], ciks=[1000015, 1000180])
+        self.assertListEqual(sorted(filtered['CIK'].tolist()), [1000015, 1000180])
+
+    def test_pickle_roundtrip(self):
+        self._check_roundtrip('pickle')
+
+    @unittest.skipUnless(ParquetBackend.available(), 'pyarrow not installed')
+    def test_parquet_roundtrip(self):
+        self._check_roundtrip('parquet')
+
+    @unittest.skipUnless(ParquetBackend.available(), 'pyarrow not installed')
+    def test_feather_roundtrip(self):
+        self._check_roundtrip('feather')
+
+    def test_legacy_csv_migrated(self):
+        parsed_index().to_csv(os.path.join(self.tmpdir, 'formidx-1998-1.csv'), index=False)
+        cache = IndexCache(self.tmpdir, 'pickle')
+        master_index = cache.load(1998, 1, form_types=['8-K'])
+        self.assertListEqual(master_index['CIK'].tolist(), [1000179])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'formidx-1998-1.pkl')))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_backend('xlsx')
+
+    def test_meta_and_closed_quarters(self):
+        cache = IndexCache(self.tmpdir, 'pickle')
+        cache.save(1998, 1, type_master_index(parsed_index()), validators={'ETag': '"abc"', 'Last-Modified': 'Tue'})
+        self.assertDictEqual(cache.conditional_headers(1998, 1), {'If-None-Match': '"abc"', 'If-Modified-Since': 'Tue'})
+        self.assertTrue(cache.is_closed(1998, 1), 'quarter downloaded long after it ended should be closed')
+        # fetched while the quarter was still open
+        in_quarter = datetime(1998, 3, 15).timestamp()
+        cache.save(1998, 1, type_master_index(parsed_index()), validators={'ETag': '"abc"'}, fetched_at=in_quarter)
+        self.assertFalse(cache.is_closed(1998, 1))
+        # rewriting without validators (e.g. merging daily rows) keeps the fetch time
+        cache.save(1998, 1, type_master_index(parsed_index()))
+        self.assertEqual(cache.fetched_at(1998, 1), in_quarter)
+        cache.touch(1998, 1)
+        self.assertTrue(cache.is_closed(1998, 1))
+        self.assertEqual(cache.conditional_headers(1998, 1), {'If-None-Match': '"abc"'})
+
+    def test_disk_budget_evicts_least_recently_used(self):
+        master_index = type_master_index(parsed_index())
+        cache = IndexCache(self.tmpdir, 'pickle')
+        file_size = os.path.getsize(cache.save(1998, 1, master_index))
+        cache = IndexCache(self.tmpdir, 'pickle', max_bytes=2 * file_size)
+        cache.save(1998, 2, master_index, validators={})
+        self.assertTrue(os.path.exists(cache.meta_path(1998, 2)))
+        # Q1 was loaded more recently than Q2
+        for quarter, used_at in ((1, 200), (2, 100)):
+            os.utime(cache.path(1998, quarter), (used_at, time.time()))
+        cache.save(1998, 3, master_index, validators={})
+        msg = f'Expected the least recently used quarter to be evicted - cached: {sorted(os.listdir(self.tmpdir))}'
+        self.assertTrue(cache.exists(1998, 1), msg)
+        self.assertFalse(cache.exists(1998, 2), msg)
+        self.assertTrue(cache.exists(1998, 3), msg)
+        self.assertFalse(os.path.exists(cache.meta_path(1998, 2)), 'evicted quarters should drop their metadata')
+        self.assertLessEqual(cache.size(), 2 * file_size)
+        cache.load(1998, 1)
+        cache.load(1998, 2)
+        self.assertEqual(cache.stats.as_dict(), {'hits': 1, 'misses': 1, 'evictions': 1})
+
+    def test_version_changes_on_rewrite(self):
+        cache = IndexCache(self.tmpdir, 'pickle')
+        self.assertIsNone(cache.version(1998, 1))
+        cache.save(1998, 1, type_master_index(parsed_index()), fetched_at=100.0)
+        version = cache.version(1998, 1)
+        cache.load(1998, 1)
+        self.assertEqual(cache.version(1998, 1), version, 'loading should not change the version')
+        path = cache.path(1998, 1)
+        os.utime(path, ns=(int(time.time() * 1e9), os.stat(path).st_mtime_ns - 10 ** 9))
+        self.assertNotEqual(cache.version(1998, 1), version)
+
+    def test_legacy_migration_keeps_fetch_time(self):
+        legacy_path = os.path.join(self.tmpdir, 'formidx-1998-1.csv')
+        parsed_index().to_csv(legacy_path, index=False)
+        in_quarter = datetime(1998, 2, 1).timestamp()
+        os.utime(legacy_path, (in_quarter, in_quarter))
+        cache = IndexCache(self.tmpdir, 'pickle')
+        cache.load(1998, 1)
+        self.assertEqual(cache.fetched_at(1998, 1), in_quarter)
+        self.assertFalse(cache.is_closed(1998, 1), 'a csv cached mid-quarter must still be revalidated')
+
+
+class TestMemoryIndexCache(unittest.TestCase):
+
+    def setUp(self):
+        self.master_index = type_master_index(parsed_index())
+        self.size = int(self.master_index.memory_usage(deep=True).sum())
+
+    def test_lru_eviction_within_budget(self):
+        cache = MemoryIndexCache(max_bytes=2 * self.size)
+        cache.put('q1', self.master_index)
+        cache.put('q2', self.master_index)
+        self.assertIsNotNone(cache.get('q1'))
+        cache.put('q3', self.master_index)
+        self.assertListEqual([key in cache for key in ('q1', 'q2', 'q3')], [True, False, True],
+                             'the least recently used index should be evicted')
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        self.assertIsNone(cache.get('q2'))
+        self.assertEqual(cache.stats.as_dict(), {'hits': 1, 'misses': 1, 'evictions': 1})
+
+    def test_stale_versions_and_expiry_miss(self):
+        cache = MemoryIndexCache()
+        cache.put('q1', self.master_index, version=(1.0, 10))
+        self.assertIsNone(cache.get('q1', version=(1.0, 11)))
+        self.assertNotIn('q1', cache, 'stale entries should be dropped')
+        cache.put('q2', self.master_index, expires_at=time.time() - 1)
+        self.assertIsNone(cache.get('q2'))
+        self.assertEqual((cache.stats.misses, cache.nbytes), (2, 0))
+
+    def test_oversized_and_disabled(self):
+        self.assertFalse(MemoryIndexCache(max_bytes=self.size - 1).put('q1', self.master_index))
+        self.assertFalse(MemoryIndexCache(max_bytes=0).enabled)
+
+    def test_copies_handed_out(self):
+        cache = MemoryIndexCache()
+        cache.put('q1', self.master_index)
+        master_index = cache.get('q1')
+        master_index['Form Type'] = 'changed'
+        self.assertListEqual(cache.get('q1')['Form Type'].tolist(), self.master_index['Form Type'].tolist())
+
+
+def master_zip(text):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as outfile:
+        outfile.writestr('master.idx', text.encode('utf-8'))
+    return buffer.getvalue()
+
+
+class TestIndexRevalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = MockEdgarServer().start()
+        self.zip_path = '/Archives/edgar/full-index/1998/QTR1/master.zip'
+        self.server.files[self.zip_path] = master_zip(INDEX_HEADER + '\n' + '-' * 80 + '\n' + '\n'.join(LINES))
+
+        class MockFormIDX(FormIDX):
+            full_index_url = self.server.base_url + 'edgar/full-index/{year}/QTR{quarter}/master.zip'
+        self.form_idx = MockFormIDX
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _form(self, **kwargs):
+        kwargs.setdefault('memory_cache', MemoryIndexCache(max_bytes=0))
+        kwargs.setdefault('cache_dir', self.tmpdir)
+        return self.form_idx(year=1998, quarter=1, cache_format='pickle', **kwargs)
+
+    def _reopen_quarter(self):
+        # pretend the cache was downloaded while the quarter was still open
+        cache = IndexCache(self.tmpdir, 'pickle')
+        meta = cache.load_meta(1998, 1)
+        meta['fetched_at'] = datetime(1998, 3, 15).timestamp()
+        cache._save_meta(1998, 1, meta)
+
+    def test_not_modified_uses_cache(self):
+        first = self._form(form_types=['10-K'])
+        self.assertEqual(self.server.num_requests, 1)
+        self._reopen_quarter()
+        second = self._form(form_types=['10-K'])
+        self.assertEqual((self.server.num_requests, self.server.num_not_modified), (2, 1))
+        self.assertListEqual(second.master_index['CIK'].tolist(), first.master_index['CIK'].tolist())
+
+    def test_modified_refetched(self):
+        self._form()
+        self._reopen_quarter()
+        text = INDEX_HEADER + '\n' + '\n'.join(LINES + ['1000190|NEW CO|10-K|1998-03-31|edgar/data/1000190/x.txt'])
+        self.server.files[self.zip_path] = master_zip(text)
+        form = self._form()
+        self.assertEqual(self.server.num_not_modified, 0)
+        self.assertIn(1000190, form.master_index['CIK'].tolist())
+        self.assertIn(1000190, IndexCache(self.tmpdir, 'pickle').load(1998, 1)['CIK'].tolist())
+
+    def test_closed_quarter_not_requested(self):
+        self._form()
+        form = self._form(ciks=[1000179])
+        self.assertEqual(self.server.num_requests, 1, 'closed quarters should not be revalidated')
+        self.assertListEqual(form.master_index['CIK'].tolist(), [1000179])
+
+    def test_memory_tier(self):
+        memory_cache = MemoryIndexCache()
+        index_cache = IndexCache(self.tmpdir, 'pickle')
+        self._form(memory_cache=memory_cache, index_cache=index_cache)
+        form = self._form(memory_cache=memory_cache, index_cache=index_cache, form_types=['8-K'])
+        self.assertListEqual(form.master_index['CIK'].tolist(), [1000179])
+        self.assertEqual(self.server.num_requests, 1)
+        self.assertEqual((memory_cache.stats.hits, index_cache.stats.hits, index_cache.stats.misses), (1, 0, 1),
+                         'a closed quarter held in memory should not be loaded from disk')
+        # the unfiltered quarter stays cached
+        self.assertEqual(len(self._form(memory_cache=memory_cache, index_cache=index_cache).master_index), len(LINES))
+        # rewriting the quarter on disk (e.g. a daily sync merge) supersedes the copy in memory
+        time.sleep(0.01)
+        index_cache.save(1998, 1, index_cache.load(1998, 1).iloc[:2])
+        form = self._form(memory_cache=memory_cache, index_cache=index_cache)
+        self.assertEqual(len(form.master_index), 2)
+        self.assertEqual(index_cache.stats.hits, 2)
+
+    def test_filters_pushed_down_with_memory_tier(self):
+        # fills the disk cache only
+        self._form()
+        memory_cache = MemoryIndexCache()
+        index_cache = IndexCache(self.tmpdir, 'pickle')
+        with mock.patch.object(index_cache, 'load', wraps=index_cache.load) as load:
+            form = self._form(memory_cache=memory_cache, index_cache=index_cache, form_types=['8-K'])
+            self.assertEqual(load.call_args[1]['form_types'], ['8-K'], 'the form type filter should reach the cache')
+            self.assertListEqual(form.master_index['CIK'].tolist(), [1000179])
+            self.assertEqual(len(memory_cache), 1)
+            self.assertNotIn(form.download_url, memory_cache, 'only the filtered rows should be held in memory')
+            form = self._form(memory_cache=memory_cache, index_cache=index_cache, form_types=['8-K'])
+            self.assertEqual(load.call_count, 1, 'the filtered quarter should be served from memory')
+        self.assertListEqual(form.master_index['CIK'].tolist(), [1000179])
+        self.assertEqual(self.server.num_requests, 1)
+
+    def test_memory_tier_without_disk_cache(self):
+        memory_cache = MemoryIndexCache()
+        self._form(memory_cache=memory_cache, cache_dir=None)
+        form = self._form(memory_cache=memory_cache, cache_dir=None, ciks=[1000015])
+        self.assertEqual(self.server.num_requests, 1)
+        self.assertListEqual(form.master_index['CIK'].tolist(), [1000015])
+
+    def test_streamed_archive_spool_removed(self):
+        form = self._form()
+        self.assertEqual(len(form.master_index), len(LINES))
+        leftovers = [name for name in os.listdir(self.tmpdir) if name.endswith('.zip.part')]
+        self.assertListEqual(leftovers, [], 'master.zip spool should be removed once parsed')
+
+    def test_throttled_index_request_backs_off(self):
+        rate_limiter = RateLimiter(max_rps=1000)
+        rate_limiter.max_penalty = 0.01
+        self.server.errors[self.zip_path] = [429, 503, 500]
+        form = self._form(rate_limiter=rate_limiter, retry_policy=RetryPolicy(max_attempts=2, base_delay=0.01))
+        self.assertEqual(len(form.master_index), len(LINES))
+        self.assertEqual(self.server.num_requests, 4, 'throttled and failed index requests should be retried')
+
+    def test_error_falls_back_to_cache(self):
+        self._form()
+        self._reopen_quarter()
+        self.server.errors[self.zip_path] = [503]
+        form = self._form(retry_policy=RetryPolicy(max_attempts=1, max_throttle_retries=0))
+        self.assertEqual(len(form.master_index), len(LINES))
+
+
+if __name__ == '__main__':
+    unittest.main()
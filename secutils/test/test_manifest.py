@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from secutils.edgar import File, build_dir_structure
+from secutils.manifest import DownloadManifest, accession_from_name
+from secutils.mock_edgar import MockEdgarServer
+from secutils.utils import scan_output_dir
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.manifest = DownloadManifest.for_output_dir(self.tmpdir)
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_accession_from_name(self):
+        self.assertEqual(accession_from_name('0001437749-17-020936.txt'), '0001437749-17-020936')
+
+    def test_record_and_reload(self):
+        self.assertTrue(self.manifest.is_new)
+        self.manifest.record('0001437749-17-020936.txt', path=None, cik=1000230, size=10, checksum='abc')
+        self.manifest.close()
+        self.manifest = DownloadManifest.for_output_dir(self.tmpdir)
+        msg = "Manifest should persist records between runs"
+        self.assertFalse(self.manifest.is_new, msg)
+        self.assertSetEqual(self.manifest.seen_files(), {'0001437749-17-020936.txt'}, msg)
+        row = self.manifest.get('0001437749-17-020936')
+        self.assertEqual((row['cik'], row['size'], row['checksum']), (1000230, 10, 'abc'))
+
+    def test_shared_manifest_without_wal(self):
+        self.manifest.close()
+        self.manifest = DownloadManifest.for_output_dir(self.tmpdir, wal=False)
+        mode = self.manifest._conn.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'delete', 'a manifest shared between hosts should not use WAL')
+
+    def test_rebuild_from_disk(self):
+        form_dir = os.path.join(self.tmpdir, '10-K', '2017', 'Q1')
+        os.makedirs(form_dir)
+        for name in ['a.txt', 'b.html', 'c.txt.part']:
+            with open(os.path.join(form_dir, name), 'w') as outfile:
+                outfile.write('data')
+        num_files = self.manifest.rebuild(self.tmpdir)
+        self.assertEqual(num_files, 2)
+        self.assertSetEqual(self.manifest.seen_files(), {'a.txt', 'b.html'})
+        row = self.manifest.get('a')
+        self.assertEqual((row['form_type'], row['year'], row['quarter'], row['size']), ('10-K', 2017, 'Q1', 4))
+
+    def test_profile_output_not_seen(self):
+        form_dir = os.path.join(self.tmpdir, '10-K', '2017', 'Q1')
+        profile_dir = os.path.join(self.tmpdir, 'profile-20190101-000000')
+        for directory, name in [(form_dir, 'a.txt'), (profile_dir, 'cprofile.txt'), (profile_dir, 'tracemalloc.txt')]:
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, name), 'w') as outfile:
+                outfile.write('data')
+        msg = "Expected --profile output not taken for filings"
+        self.assertEqual(self.manifest.rebuild(self.tmpdir), 1, msg)
+        self.assertSetEqual(self.manifest.seen_files(), {'a.txt'}, msg)
+        self.assertEqual(scan_output_dir(self.tmpdir), ['a.txt'], msg)
+
+    def test_download_updates_manifest(self):
+        partial_url = 'edgar/data/1000230/0001437749-17-020936.txt'
+        sec_file = File(form_type='10-K', company_name='OPTICAL CABLE CORP', cik_number='1000230',
+                        date_filed='2017-12-20', partial_url=partial_url)
+        with MockEdgarServer(file_size=5000) as server:
+            sec_file.file_download_url = server.base_url + partial_url
+            msg = sec_file.download_file(build_dir_structure(self.tmpdir, sec_file), manifest=self.manifest)
+        self.assertEqual(msg, '200')
+        row = self.manifest.get('0001437749-17-020936')
+        self.assertEqual(row['size'], 5000)
+        self.assertEqual(row['path'], sec_file.download_file_dir)
+        self.assertEqual(len(row['checksum']), 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from urllib.parse import urlsplit
+
+from secutils.edgar import download_with_backoff
+from secutils.metrics import MetricsRegistry, MetricsReporter, shared_metrics, response_status
+from secutils.profiling import RunProfiler
+from secutils.ratelimit import RateLimiter
+from secutils.retry import RetryPolicy
+from secutils.dispatch import DownloadJob
+from secutils.mock_edgar import MockEdgarServer
+from secutils.test.test_aio import make_files
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_counter_and_gauge(self):
+        metrics = MetricsRegistry()
+        metrics.responses.inc('filing', 200)
+        metrics.responses.inc('filing', 429, amount=2)
+        self.assertEqual(metrics.responses.value('filing', 429), 2.0, msg="Expected the amount to be added")
+        self.assertEqual(metrics.responses.value('index', 200), 0.0, msg="Expected unseen labels to read 0")
+        depth = [5]
+        metrics.queue_depth.set_function(lambda: depth[0], 'job')
+        depth[0] = 7
+        self.assertEqual(metrics.queue_depth.value('job'), 7.0, msg="Expected the gauge to read its callback")
+        metrics.queue_depth.set(0, 'job')
+        self.assertEqual(metrics.queue_depth.value('job'), 0.0, msg="Expected set to replace the callback")
+        with self.assertRaises(ValueError, msg="Expected a wrong number of labels to be rejected"):
+            metrics.responses.inc('filing')
+
+    def test_histogram_quantiles(self):
+        metrics = MetricsRegistry()
+        histogram = metrics.histogram('test_seconds', 'test', buckets=(1.0, 2.0, 4.0))
+        for value in (0.5, 1.5, 1.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual((histogram.count(), histogram.sum()), (4, 6.5), msg="Expected count and sum of observations")
+        self.assertAlmostEqual(histogram.quantile(0.5), 1.5, msg="Expected p50 interpolated within (1, 2]")
+        self.assertAlmostEqual(histogram.quantile(0.99), 3.92, msg="Expected p99 within (2, 4]")
+        histogram.observe(100.0)
+        self.assertEqual(histogram.quantile(1.0), 4.0, msg="Expected observations past the last bucket to report its bound")
+        self.assertIsNone(metrics.histogram('empty_seconds', 'test').quantile(0.5), msg="Expected no quantile without data")
+        self.assertIs(metrics.histogram('test_seconds', 'test'), histogram, msg="Expected metrics to be registered once")
+        with self.assertRaises(ValueError, msg="Expected a name registered as another kind to be rejected"):
+            metrics.counter('test_seconds', 'test')
+
+    def test_prometheus_format(self):
+        metrics = MetricsRegistry()
+        with metrics.stage('download'):
+            pass
+        metrics.bytes.inc(amount=10)
+        text = metrics.to_prometheus()
+        self.assertIn('# TYPE secutils_stage_seconds histogram\n', text, msg=text)
+        self.assertIn('secutils_stage_seconds_bucket{stage="download",le="+Inf"} 1\n', text, msg=text)
+        self.assertIn('secutils_stage_seconds_count{stage="download"} 1\n', text, msg=text)
+        self.assertIn('secutils_downloaded_bytes_total 10.0\n', text, msg=text)
+        buckets = [line for line in text.splitlines() if line.startswith('secutils_stage_seconds_bucket')]
+        counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+        self.assertEqual(counts, sorted(counts), msg="Expected cumulative bucket counts")
+
+    def test_snapshot_and_reporter(self):
+        metrics = MetricsRegistry()
+        metrics.observe_stage('write', 0.003)
+        metrics.files.inc('downloaded')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            json_path, prom_path = os.path.join(tmpdir, 'metrics.json'), os.path.join(tmpdir, 'metrics.prom')
+            with MetricsReporter(metrics, json_path=json_path, prometheus_path=prom_path, interval=60):
+                pass
+            with open(json_path, 'r') as infile:
+                snapshot = json.load(infile)
+            with open(prom_path, 'r') as infile:
+                self.assertEqual(infile.read(), metrics.to_prometheus(), msg="Expected the text file on stop")
+            self.assertEqual(len(os.listdir(tmpdir)), 2, msg="Expected no temporary files left behind")
+        finally:
+            shutil.rmtree(tmpdir)
+        stage = snapshot['histograms']['secutils_stage_seconds']['stage="write"']
+        self.assertEqual(stage['count'], 1, msg=f"Expected one write observation - got {stage}")
+        self.assertEqual(snapshot['counters']['secutils_files_total'], {'result="downloaded"': 1.0}, msg=str(snapshot))
+
+    def test_response_status(self):
+        self.assertEqual(response_status('200'), '200', msg="Expected successful downloads labelled 200")
+        self.assertEqual(response_status(ValueError('truncated')), 'ValueError', msg="Expected the exception type")
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.metrics = shared_metrics()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _counts(self):
+        stages = {stage: self.metrics.stages.count(stage) for stage in ('download', 'write', 'rate_limit_wait')}
+        return stages, self.metrics.responses.value('filing', 500), self.metrics.files.value('downloaded')
+
+    def test_download_records_stages_and_statuses(self):
+        (stages, num_500, num_downloaded), num_bytes = self._counts(), self.metrics.bytes.value()
+        with MockEdgarServer(file_size=300) as server:
+            sec_file = make_files(server.base_url, 1)[0]
+            server.errors[urlsplit(sec_file.file_download_url).path] = [500]
+            urlmsg = download_with_backoff(sec_file, self.tmpdir, rate_limiter=RateLimiter(max_rps=1000),
+                                           retry_policy=RetryPolicy(base_delay=0.01))
+        self.assertEqual(urlmsg, '200')
+        after, after_500, after_downloaded = self._counts()
+        self.assertEqual(after['download'] - stages['download'], 2, msg="Expected both attempts timed")
+        self.assertEqual(after['rate_limit_wait'] - stages['rate_limit_wait'], 2, msg="Expected both waits timed")
+        self.assertEqual(after['write'] - stages['write'], 1, msg="Expected the committed write timed")
+        self.assertEqual((after_500 - num_500, after_downloaded - num_downloaded), (1, 1), msg="Expected statuses counted")
+        self.assertEqual(self.metrics.bytes.value() - num_bytes, 300, msg="Expected the written bytes counted")
+
+    def test_job_queue_depth(self):
+        with MockEdgarServer(file_size=300) as server:
+            job = DownloadJob(self.tmpdir, num_workers=2, rate_limiter=RateLimiter(max_rps=1000), name='depth-test')
+            job.run(make_files(server.base_url, 4))
+        self.assertIn('job="depth-test"', self.metrics.queue_depth.as_dict(), msg="Expected the job's gauge registered")
+        self.assertEqual(self.metrics.queue_depth.value('depth-test'), 0.0, msg="Expected an empty queue once joined")
+
+
+class TestRunProfiler(unittest.TestCase):
+
+    def test_profile_written(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            output_dir = os.path.join(tmpdir, 'profile')
+            with MockEdgarServer(file_size=300) as server, RunProfiler(output_dir):
+                DownloadJob(os.path.join(tmpdir, 'out'), num_workers=2, rate_limiter=RateLimiter(max_rps=1000),
+                            name='profiled').run(make_files(server.base_url, 4))
+            files = sorted(os.listdir(output_dir))
+            self.assertEqual(files, ['cprofile.pstats', 'cprofile.txt', 'metrics.json', 'tracemalloc.txt'], msg=str(files))
+            with open(os.path.join(output_dir, 'cprofile.txt'), 'r') as infile:
+                text = infile.read()
+            self.assertIn('download_with_backoff', text, msg="Expected the worker threads to be profiled")
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from secutils.edgar import FormIDX, parse_master_zip
+from secutils.index_cache import MemoryIndexCache
+from secutils.mock_edgar import MockEdgarServer, synthetic_master_zip
+
+
+class TestMockEdgarServer(unittest.TestCase):
+
+    def test_synthetic_master_zip(self):
+        master_index = parse_master_zip(synthetic_master_zip(2017, 2, 30, form_types=['10-K', '8-K']))
+        self.assertEqual(len(master_index), 30)
+        self.assertSetEqual(set(master_index['Form Type']), {'10-K', '8-K'})
+        self.assertTrue(master_index['Date Filed'].dt.quarter.eq(2).all(), 'rows should fall in their quarter')
+        self.assertTrue(master_index['fname'].is_unique)
+
+    def test_serves_index_and_filings(self):
+        with MockEdgarServer(file_size=300, index_rows=12) as server:
+            with mock.patch.object(FormIDX, 'full_index_url', server.base_url + 'edgar/full-index/{year}/QTR{quarter}/master.zip'):
+                form = FormIDX(year=2017, quarter=3, memory_cache=MemoryIndexCache(max_bytes=0))
+            files = form.index_to_files()
+            for sec_file in files:
+                sec_file.file_download_url = server.base_url + sec_file.file_download_url.split('/Archives/')[1]
+                with urlopen(sec_file.file_download_url) as response:
+                    self.assertEqual(len(response.read()), 300)
+            self.assertEqual(len(files), 12)
+            self.assertEqual(len(server.latencies), 12, 'every filing should record its latency')
+            self.assertEqual(server.num_filing_bytes, 12 * 300, 'the index should not count as filing bytes')
+
+    def test_latency_and_throttling(self):
+        with MockEdgarServer(latency=0.05, throttle_rate=0.5, retry_after='2', seed=1) as server:
+            url = server.base_url + 'edgar/data/1000/0000001000-17-000001.txt'
+            statuses = []
+            for _ in range(10):
+                try:
+                    with urlopen(url) as response:
+                        response.read()
+                        statuses.append(response.status)
+                except HTTPError as e:
+                    self.assertEqual(e.headers['Retry-After'], '2')
+                    statuses.append(e.code)
+        self.assertEqual(server.num_throttled, statuses.count(429))
+        self.assertTrue(0 < server.num_throttled < 10)
+        self.assertGreaterEqual(server.latencies[0], 0.05, 'latency should include the delay and throttled attempts')
+
+    def test_edgar_url_from_environment(self):
+        code = 'from secutils.edgar import FileUtils, FormIDX; print(FileUtils.base_url); print(FormIDX.full_index_url)'
+        env = dict(os.environ, SECUTILS_EDGAR_URL='http://127.0.0.1:8000/Archives/')
+        output = subprocess.check_output([sys.executable, '-c', code], env=env).decode().split()
+        self.assertListEqual(output, ['http://127.0.0.1:8000/Archives/',
+                                      'http://127.0.0.1:8000/Archives/edgar/full-index/{year}/QTR{quarter}/master.zip'])
+
+
+if __name__ == '__main__':
+    unittest.main()
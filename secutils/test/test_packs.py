@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+from urllib.parse import urlsplit
+
+from secutils.dispatch import DownloadJob
+from secutils.documents import DocumentSelector
+from secutils.manifest import DownloadManifest
+from secutils.mock_edgar import MockEdgarServer, synthetic_filing
+from secutils.packs import (PACK_INDEX_NAME, PACK_NAME, PackReader, PackWriter, iter_pack_records, pack_dir,
+                            read_pack_index)
+from secutils.ratelimit import RateLimiter
+from secutils.utils import scan_output_dir
+from secutils.test.test_aio import make_files
+
+
+class TestPacks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmpdir, '8-K', '2017', 'Q1')
+        self.bodies = {f'0001000{i:03d}-17-000001.txt': f'filing {i}\n'.encode('ascii') * (i + 1) for i in range(5)}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _append(self, writer, name, body):
+        path = os.path.join(self.tmpdir, name + '.part')
+        with open(path, 'wb') as outfile:
+            outfile.write(body)
+        return writer.append_file(name, path)
+
+    def test_append_and_read(self):
+        writer = PackWriter(self.directory)
+        for name, body in self.bodies.items():
+            self._append(writer, name, body)
+        self._append(writer, '0001000000-17-000001.txt', b'duplicate')
+        self.assertEqual(sorted(os.listdir(self.directory)), [PACK_NAME, PACK_INDEX_NAME])
+        with PackReader(pack_dir(self.tmpdir, '8-K', 2017, 1)) as pack:
+            self.assertEqual(len(pack), 5, msg="Expected a name already in the pack not to be appended again")
+            self.assertEqual(pack.read('0001000003-17-000001'), self.bodies['0001000003-17-000001.txt'],
+                             msg="Expected lookup by accession number")
+            self.assertIn('0001000004-17-000001.txt', pack)
+            self.assertEqual([(entry.name, content) for entry, content in pack], list(self.bodies.items()),
+                             msg="Expected iteration in the order filings were appended")
+        with open(os.path.join(self.directory, PACK_NAME), 'rb') as infile:
+            self.assertEqual(list(iter_pack_records(infile)), list(self.bodies.items()),
+                             msg="Expected the pack readable front to back without its index")
+
+    def test_torn_append_is_truncated(self):
+        writer = PackWriter(self.directory)
+        self._append(writer, '0001000000-17-000001.txt', self.bodies['0001000000-17-000001.txt'])
+        # a crash after part of a record and part of its index line were written
+        with open(writer.path, 'ab') as pack:
+            pack.write(b'SPK1 torn record')
+        with open(writer.index_path, 'a') as index:
+            index.write('{"name": "0001000001-17')
+        writer = PackWriter(self.directory)
+        entry = self._append(writer, '0001000002-17-000001.txt', self.bodies['0001000002-17-000001.txt'])
+        self.assertEqual([e.name for e in read_pack_index(writer.index_path)],
+                         ['0001000000-17-000001.txt', '0001000002-17-000001.txt'], msg="Expected the torn line dropped")
+        self.assertEqual(os.path.getsize(writer.path), entry.end, msg="Expected the torn record overwritten")
+        with PackReader(self.directory) as pack:
+            self.assertEqual(pack.read('0001000002-17-000001.txt'), self.bodies['0001000002-17-000001.txt'])
+
+    def test_writers_share_a_pack(self):
+        # separate writers stand in for separate processes - the index is re-read under flock on every append
+        writers = [PackWriter(self.directory), PackWriter(self.directory)]
+        threads = [threading.Thread(target=self._append, args=(writers[i % 2], name, body))
+                   for i, (name, body) in enumerate(self.bodies.items())]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with PackReader(self.directory) as pack:
+            self.assertEqual({entry.name: content for entry, content in pack}, self.bodies)
+
+
+class TestPackedDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_job_engines_pack_filings(self):
+        for engine, compression in (('thread', None), ('async', 'gzip')):
+            output_dir = os.path.join(self.tmpdir, engine)
+            manifest = DownloadManifest.for_output_dir(output_dir)
+            with MockEdgarServer(file_size=5000) as server:
+                files = make_files(server.base_url, 3)
+                stats = DownloadJob(output_dir, num_workers=2, engine=engine, rate_limiter=RateLimiter(max_rps=1000),
+                                    manifest=manifest, compression=compression, pack=True).run(files)
+            self.assertEqual(stats.num_downloaded, 3, msg=f"{engine}: {stats.errors}")
+            directory = pack_dir(output_dir, '10-K', 2017, 1)
+            self.assertEqual(sorted(os.listdir(directory)), [PACK_NAME, PACK_INDEX_NAME],
+                             msg="Expected no file per filing")
+            with PackReader(directory) as pack:
+                for sec_file in files:
+                    self.assertEqual(sec_file.download_file_dir, pack.path)
+                    self.assertEqual(pack.read(sec_file.file_name),
+                                     synthetic_filing(urlsplit(sec_file.file_download_url).path, 5000))
+                    self.assertEqual(manifest.get(os.path.splitext(sec_file.file_name)[0])['size'],
+                                     pack.entry(sec_file.file_name).size, msg="Expected the filing's size in the pack")
+            names = {f.file_name for f in files}
+            self.assertEqual(set(scan_output_dir(output_dir)), names, msg="Expected packed filings seen")
+            self.assertEqual(manifest.rebuild(output_dir), 3)
+            self.assertEqual(manifest.seen_files(), names, msg="Expected the rebuilt manifest to see packed filings")
+            manifest.close()
+
+    def test_pack_rejects_selected_documents(self):
+        with self.assertRaises(ValueError):
+            DownloadJob(self.tmpdir, selector=DocumentSelector(), pack=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
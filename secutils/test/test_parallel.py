@@ -0,0 +1,95 @@
+import io
+import os
+import pickle
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import pandas as pd
+
+from secutils.edgar import INDEX_HEADER, parse_master_index
+from secutils.parallel import IndexParsePool, pack_index, unpack_index
+
+INDEX_TEXT = '\n'.join([
+    'Description:           Master Index of EDGAR Dissemination Feed',
+    '',
+    INDEX_HEADER,
+    '-' * 80,
+    '1000015|META GROUP INC|10-K|1998-03-31|edgar/data/1000015/0001000015-98-000009.txt',
+    '1000112|CHEVY CHASE MASTER CREDIT CARD TRUST II|10-K|1998-03-27|edgar/data/1000112/0000920628-98-000038.txt',
+    '1000179|PARAMOUNT FINANCIAL CORP|8-K|1998-03-30|edgar/data/1000179/0000950120-98-000108.txt',
+    '1000230|CAFÉ HOLDINGS|10-Q |1998-02-11|edgar/data/1000230/0001437749-98-020936.txt',
+]) + '\n'
+
+
+def master_zip(text):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as outfile:
+        outfile.writestr('master.idx', text.encode('utf-8'))
+    return buffer.getvalue()
+
+
+class TestPackIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.master_index = parse_master_index(INDEX_TEXT.encode('utf-8'))
+
+    def assertIndexEqual(self, result, expected):
+        self.assertListEqual(list(result.columns), list(expected.columns))
+        for column in expected.columns:
+            self.assertListEqual(result[column].astype(str).tolist(), expected[column].astype(str).tolist(),
+                                 f'column {column} differs after unpacking')
+        self.assertIsInstance(result['Form Type'].dtype, pd.CategoricalDtype)
+
+    def test_round_trip(self):
+        self.assertIndexEqual(unpack_index(pack_index(self.master_index)), self.master_index)
+
+    def test_empty_round_trip(self):
+        empty = self.master_index.iloc[:0]
+        result = unpack_index(pack_index(empty))
+        self.assertEqual(len(result), 0)
+        self.assertListEqual(list(result.columns), list(empty.columns))
+
+    def test_packed_smaller_than_dataframe(self):
+        master_index = pd.concat([self.master_index] * 2000, ignore_index=True)
+        packed_size = len(pickle.dumps(pack_index(master_index)))
+        frame_size = len(pickle.dumps(master_index))
+        msg = f'Expected packed index ({packed_size} bytes) to pickle smaller than the DataFrame ({frame_size} bytes)'
+        self.assertLess(packed_size, frame_size, msg)
+
+
+class TestIndexParsePool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = IndexParsePool(max_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_parse_zip_matches_in_process(self):
+        expected = parse_master_index(INDEX_TEXT.encode('utf-8'))
+        result = self.pool.parse_zip(master_zip(INDEX_TEXT))
+        TestPackIndex.assertIndexEqual(self, result, expected)
+
+    def test_parse_zip_concurrently(self):
+        futures = [self.pool.submit_zip(master_zip(INDEX_TEXT)) for _ in range(4)]
+        self.assertListEqual([future.result()['num_rows'] for future in futures], [4] * 4)
+
+    def test_map_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for i in range(5):
+                paths.append(os.path.join(tmpdir, f'{i}.txt'))
+                with open(paths[-1], 'wb') as outfile:
+                    outfile.write(b'x' * i)
+            self.assertListEqual(list(self.pool.map_files(os.path.getsize, paths, chunksize=2)), list(range(5)))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
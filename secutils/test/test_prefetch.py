@@ -0,0 +1,99 @@
+import shutil
+import tempfile
+import unittest
+
+from secutils.edgar import FormIDX, INDEX_HEADER
+from secutils.index_cache import IndexCache, MemoryIndexCache
+from secutils.mock_edgar import MockEdgarServer
+from secutils.prefetch import IndexPrefetcher
+from secutils.ratelimit import RateLimiter
+from secutils.retry import RetryPolicy
+from secutils.test.test_index_cache import master_zip
+
+
+def quarter_text(year, quarter, num_rows=3):
+    lines = [f'{1000000 + i}|COMPANY {i}|10-K|{year}-{3 * quarter:02d}-1{i}|edgar/data/{1000000 + i}/{year}-{quarter}-{i}.txt'
+             for i in range(num_rows)]
+    return INDEX_HEADER + '\n' + '-' * 80 + '\n' + '\n'.join(lines) + '\n'
+
+
+class TestIndexPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = MockEdgarServer().start()
+        self.periods = [(1998, 1), (1998, 2), (1998, 3), (1998, 4)]
+        for year, quarter in self.periods[:3]:
+            self.server.files[self.zip_path(year, quarter)] = master_zip(quarter_text(year, quarter, num_rows=quarter))
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def zip_path(year, quarter):
+        return f'/Archives/edgar/full-index/{year}/QTR{quarter}/master.zip'
+
+    def _prefetcher(self, **kwargs):
+        kwargs.setdefault('retry_policy', RetryPolicy(max_attempts=2, base_delay=0.01))
+        kwargs.setdefault('rate_limiter', RateLimiter(max_rps=1000))
+        prefetcher = IndexPrefetcher(self.tmpdir, cache_format='pickle', num_workers=3, **kwargs)
+        prefetcher.full_index_url = self.server.base_url + 'edgar/full-index/{year}/QTR{quarter}/master.zip'
+        return prefetcher
+
+    def test_prefetch_missing_quarters(self):
+        self.server.errors[self.zip_path(1998, 2)] = [500]
+        with self._prefetcher() as prefetcher:
+            results = prefetcher.run(self.periods)
+        self.assertListEqual([result.status for result in results], ['fetched', 'fetched', 'fetched', 'missing'])
+        self.assertListEqual([result.num_rows for result in results], [1, 2, 3, 0])
+        self.assertEqual(results[1].attempts, 2, 'a 500 should be retried')
+        self.assertTrue(all(result.latency > 0 and result.num_bytes > 0 for result in results[:3]))
+        cache = IndexCache(self.tmpdir, 'pickle')
+        self.assertListEqual(cache.quarters(), self.periods[:3])
+        self.assertIn('If-None-Match', cache.conditional_headers(1998, 3), 'validators should be kept')
+
+    def test_cached_quarters_skipped(self):
+        with self._prefetcher() as prefetcher:
+            prefetcher.run(self.periods[:2])
+            num_requests = self.server.num_requests
+            results = prefetcher.run(self.periods[:3])
+        self.assertListEqual([result.status for result in results], ['cached', 'cached', 'fetched'])
+        self.assertEqual(self.server.num_requests - num_requests, 1)
+        # FormIDX then reads the prefetched quarter without another request
+        form = FormIDX(year=1998, quarter=3, cache_dir=self.tmpdir, cache_format='pickle',
+                       memory_cache=MemoryIndexCache(max_bytes=0))
+        self.assertEqual(len(form.master_index), 3)
+        self.assertEqual(self.server.num_requests - num_requests, 1)
+
+    def test_throttling_does_not_use_attempts(self):
+        self.server.errors[self.zip_path(1998, 1)] = [429, 429]
+        limiter = RateLimiter(max_rps=1000)
+        limiter.max_penalty = 0.01
+        with self._prefetcher(retry_policy=RetryPolicy(max_attempts=1), rate_limiter=limiter) as prefetcher:
+            result = prefetcher.fetch(1998, 1)
+        self.assertEqual((result.status, result.attempts, result.throttles), ('fetched', 1, 2))
+        self.assertEqual(limiter.num_throttled, 2)
+
+    def test_throttle_retries_are_capped(self):
+        self.server.errors[self.zip_path(1998, 1)] = [503] * 50
+        limiter = RateLimiter(max_rps=1000)
+        limiter.max_penalty = 0.01
+        with self._prefetcher(retry_policy=RetryPolicy(max_attempts=2, max_throttle_retries=3),
+                              rate_limiter=limiter) as prefetcher:
+            result = prefetcher.fetch(1998, 1)
+        self.assertEqual((result.status, result.throttles), ('failed', 4), msg="Expected a quarter throttled for good to fail")
+        self.assertEqual(self.server.num_requests, 4)
+        self.assertIn('503', result.error)
+
+    def test_failed_after_attempts(self):
+        self.server.errors[self.zip_path(1998, 1)] = [500, 500, 500]
+        with self._prefetcher() as prefetcher:
+            result = prefetcher.fetch(1998, 1)
+        self.assertEqual((result.status, result.attempts), ('failed', 2))
+        self.assertIn('500', result.error)
+        self.assertFalse(IndexCache(self.tmpdir, 'pickle').exists(1998, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import time
+import unittest
+import threading
+
+from secutils.ratelimit import RateLimiter, parse_retry_after, shared_rate_limiter
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_burst_is_free(self):
+        limiter = RateLimiter(max_rps=5)
+        waits = [limiter.reserve() for _ in range(5)]
+        msg = f"Expected no wait within the burst - got {waits}"
+        self.assertTrue(all(w == 0 for w in waits), msg)
+
+    def test_rate_is_enforced_across_threads(self):
+        limiter = RateLimiter(max_rps=50, burst=1)
+        def worker():
+            for _ in range(5):
+                limiter.acquire()
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        start = time.monotonic()
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        elapsed = time.monotonic() - start
+        # 20 requests at 50 req/s with a single token of burst needs at least 19/50 seconds
+        msg = f"Expected at least 0.38s for 20 requests at 50 req/s - took {elapsed:.3f}s"
+        self.assertGreaterEqual(elapsed, 0.37, msg)
+
+    def test_backoff_honors_retry_after(self):
+        limiter = RateLimiter(max_rps=10)
+        delay = limiter.backoff(retry_after='2')
+        wait = limiter.reserve()
+        msg = f"Expected workers paused for Retry-After - got delay {delay} and wait {wait}"
+        self.assertEqual(delay, 2.0, msg)
+        self.assertGreaterEqual(wait, 1.9, msg)
+        self.assertEqual(limiter.rate, 5.0)
+
+    def test_backoff_without_header_grows(self):
+        limiter = RateLimiter(max_rps=10, min_rps=1)
+        delays = [limiter.backoff() for _ in range(4)]
+        msg = f"Expected exponentially growing penalty - got {delays}"
+        self.assertListEqual(delays, [1.0, 2.0, 4.0, 8.0], msg)
+        self.assertEqual(limiter.rate, 1.0)
+
+    def test_success_recovers_rate(self):
+        limiter = RateLimiter(max_rps=10, recovery_rps=1)
+        limiter.backoff(retry_after=0)
+        for _ in range(10):
+            limiter.success()
+        msg = f"Expected rate to recover to max_rps - got {limiter.rate}"
+        self.assertEqual(limiter.rate, 10.0, msg)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120.0)
+        self.assertIsNone(parse_retry_after('not a date'))
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+
+    def test_shared_rate_limiter(self):
+        limiter1 = shared_rate_limiter(7)
+        limiter2 = shared_rate_limiter()
+        self.assertIs(limiter1, limiter2)
+        self.assertEqual(limiter2.max_rps, 7.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from urllib.error import HTTPError, URLError
+
+from secutils.edgar import download_with_backoff
+from secutils.dispatch import DownloadJob
+from secutils.ratelimit import RateLimiter
+from secutils.retry import RetryPolicy, DeadLetterFile, DEAD_LETTER_NAME
+from secutils.mock_edgar import MockEdgarServer
+from secutils.test.test_aio import make_files
+
+
+def http_error(code):
+    return HTTPError('http://example.com', code, 'error', {}, None)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_retryable_status_classes(self):
+        policy = RetryPolicy(retryable_status=(408, '5xx'))
+        self.assertTrue(policy.is_retryable(http_error(503)))
+        self.assertTrue(policy.is_retryable(http_error(500)))
+        self.assertTrue(policy.is_retryable(http_error(408)))
+        self.assertFalse(policy.is_retryable(http_error(404)), 'client errors are permanent')
+        self.assertTrue(policy.is_retryable(URLError('connection refused')))
+        self.assertTrue(policy.is_retryable(ValueError('truncated')))
+        self.assertFalse(policy.is_retryable(PermissionError('read-only')))
+
+    def test_should_retry_until_max_attempts(self):
+        policy = RetryPolicy(max_attempts=3)
+        self.assertTrue(policy.should_retry(http_error(500), 2))
+        self.assertFalse(policy.should_retry(http_error(500), 3))
+
+    def test_delay_exponential_with_cap_and_jitter(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=False)
+        self.assertListEqual([policy.delay(attempt) for attempt in range(1, 5)], [1.0, 2.0, 4.0, 5.0])
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+        delays = [policy.delay(3) for _ in range(100)]
+        self.assertTrue(all(0 <= delay <= 4.0 for delay in delays))
+        self.assertGreater(len(set(delays)), 1, 'jittered delays should differ')
+
+    def test_invalid_max_attempts(self):
+        with self.assertRaises(ValueError):
+            RetryPolicy(max_attempts=0)
+        with self.assertRaises(ValueError):
+            RetryPolicy(max_throttle_retries=-1)
+
+    def test_throttle_retries_are_capped(self):
+        policy = RetryPolicy(max_attempts=1, max_throttle_retries=2)
+        self.assertTrue(policy.is_throttled(http_error(503)))
+        self.assertFalse(policy.is_throttled(http_error(500)))
+        self.assertTrue(policy.should_retry_throttled(http_error(429), 2), 'throttles do not use up attempts')
+        self.assertFalse(policy.should_retry_throttled(http_error(429), 3))
+
+
+class TestDeadLetter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rate_limiter = RateLimiter(max_rps=1000)
+        self.policy = RetryPolicy(max_attempts=3, base_delay=0.001)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_transient_error_retried(self):
+        with MockEdgarServer(file_size=300) as server:
+            sec_file = make_files(server.base_url, 1)[0]
+            server.errors['/Archives/' + sec_file.file_download_url.split('/Archives/')[1]] = [500, 502]
+            urlmsg = download_with_backoff(sec_file, self.tmpdir, rate_limiter=self.rate_limiter,
+                                           retry_policy=self.policy)
+            self.assertEqual(urlmsg, '200')
+            self.assertEqual(server.num_requests, 3)
+
+    def test_permanent_error_not_retried(self):
+        with MockEdgarServer(file_size=300) as server:
+            sec_file = make_files(server.base_url, 1)[0]
+            sec_file.file_download_url = server.base_url + 'missing/' + sec_file.file_name
+            urlmsg = download_with_backoff(sec_file, self.tmpdir, rate_limiter=self.rate_limiter,
+                                           retry_policy=self.policy)
+            self.assertEqual(urlmsg.code, 404)
+            self.assertEqual(server.num_requests, 1)
+            self.assertIn('404', sec_file.error_message)
+
+    def test_dead_letter_round_trip(self):
+        dead_letter = DeadLetterFile.for_output_dir(self.tmpdir)
+        with MockEdgarServer(file_size=300) as server:
+            files = make_files(server.base_url, 4)
+            for sec_file in files[:2]:
+                server.errors['/Archives/' + sec_file.file_download_url.split('/Archives/')[1]] = [500] * 3
+            stats = DownloadJob(self.tmpdir, num_workers=2, rate_limiter=self.rate_limiter, retry_policy=self.policy,
+                                dead_letter=dead_letter).run(files)
+            self.assertEqual((stats.num_downloaded, stats.num_errors), (2, 2))
+
+            # persisted with reasons and reloaded from disk
+            reloaded = DeadLetterFile(os.path.join(self.tmpdir, DEAD_LETTER_NAME))
+            self.assertEqual(len(reloaded), 2)
+            entry = reloaded.entries()[0]
+            self.assertEqual(entry['status'], 500)
+            self.assertIn('500', entry['reason'])
+
+            # retry_failed - the server has recovered
+            retry_files = reloaded.files()
+            self.assertSetEqual({f.file_download_url for f in retry_files},
+                                {f.file_download_url for f in files[:2]})
+            stats = DownloadJob(self.tmpdir, num_workers=2, rate_limiter=self.rate_limiter, retry_policy=self.policy,
+                                dead_letter=reloaded).run(retry_files)
+        self.assertEqual(stats.num_downloaded, 2)
+        self.assertEqual(len(reloaded), 0)
+        self.assertEqual(reloaded.compact(), 0)
+        self.assertEqual(len(DeadLetterFile(reloaded.path)), 0)
+
+    def test_permanently_throttled_file_dead_lettered(self):
+        policy = RetryPolicy(max_attempts=2, base_delay=0.001, max_throttle_retries=3)
+        for engine in ('thread', 'async'):
+            output_dir = os.path.join(self.tmpdir, engine)
+            dead_letter = DeadLetterFile.for_output_dir(output_dir)
+            # every request is answered with 429 and Retry-After: 0
+            with MockEdgarServer(file_size=300, throttle_rate=1.0) as server:
+                files = make_files(server.base_url, 1)
+                stats = DownloadJob(output_dir, num_workers=1, engine=engine, rate_limiter=RateLimiter(max_rps=1000),
+                                    retry_policy=policy, dead_letter=dead_letter).run(files)
+                num_requests = server.num_requests
+            self.assertEqual(stats.num_errors, 1, msg=engine)
+            self.assertEqual(num_requests, 4, msg=f"{engine}: expected the first request and 3 throttle retries")
+            self.assertEqual([entry['status'] for entry in DeadLetterFile(dead_letter.path).entries()], [429],
+                             msg=f"{engine}: expected the throttled file dead lettered")
+
+    def test_torn_line_ignored(self):
+        path = os.path.join(self.tmpdir, DEAD_LETTER_NAME)
+        with open(path, 'w') as outfile:
+            outfile.write(json.dumps({'accession': 'a', 'file_name': 'a.txt'}) + '\n')
+            outfile.write('{"accession": "b", "file_')
+        self.assertEqual(len(DeadLetterFile(path)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from secutils.edgar import FormIDX, FileBatch
+from secutils.ratelimit import RateLimiter
+from secutils.scheduler import PipelineScheduler
+from secutils.mock_edgar import MockEdgarServer
+
+
+class FakeIndex(object):
+    """stands in for FormIDX - builds a small quarter pointing at the mock server"""
+    base_url = None
+    calls = []
+    delay = 0.0
+
+    def __init__(self, year, quarter, num_files=5, **kwargs):
+        time.sleep(self.delay)
+        FakeIndex.calls.append(((year, quarter), time.monotonic()))
+        lines = [f'{1000 + i}|COMPANY {i}|10-K|{year}-{quarter * 3:02d}-01|edgar/data/{1000 + i}/{year}{quarter}-{i:04d}.txt'
+                 for i in range(num_files)]
+        self.master_index = FormIDX.__new__(FormIDX)._parse_index_lines(lines)
+
+    def to_batch(self):
+        batch = FileBatch(self.master_index)
+        batch.base_url = self.base_url
+        return batch
+
+
+class FailingIndex(FakeIndex):
+
+    def __init__(self, year, quarter, **kwargs):
+        if quarter == 2:
+            raise RuntimeError('index unavailable')
+        super(FailingIndex, self).__init__(year, quarter, **kwargs)
+
+
+class TestPipelineScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        FakeIndex.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, engine, index_factory=FakeIndex, periods=None, parse_workers=0):
+        periods = periods or [(2017, 1), (2017, 2), (2017, 3), (2017, 4)]
+        with MockEdgarServer(file_size=500) as server:
+            FakeIndex.base_url = server.base_url
+            scheduler = PipelineScheduler(periods, self.tmpdir, num_workers=3, engine=engine,
+                                          rate_limiter=RateLimiter(max_rps=1000), index_factory=index_factory,
+                                          show_progress=False, parse_workers=parse_workers)
+            return scheduler.run()
+
+    def test_thread_engine_spans_quarters(self):
+        num_threads = threading.active_count()
+        num_downloaded, errors = self._run('thread')
+        self.assertEqual((num_downloaded, len(errors)), (20, 0))
+        for quarter in ['Q1', 'Q2', 'Q3', 'Q4']:
+            self.assertEqual(len(os.listdir(os.path.join(self.tmpdir, '10-K', '2017', quarter))), 5)
+        self.assertEqual(threading.active_count(), num_threads)
+
+    def test_async_engine_spans_quarters(self):
+        num_downloaded, errors = self._run('async')
+        self.assertEqual((num_downloaded, len(errors)), (20, 0))
+
+    def test_index_failure_skips_quarter(self):
+        num_downloaded, errors = self._run('thread', index_factory=FailingIndex)
+        msg = f"Expected 3 quarters downloaded when one index fails - got {num_downloaded} files"
+        self.assertEqual(num_downloaded, 15, msg)
+
+    def test_failed_async_worker_fails_the_run(self):
+        results = []
+
+        def run():
+            try:
+                results.append(self._run('async', periods=[(2017, 1), (2017, 2), (2017, 3), (2017, 4), (2018, 1)]))
+            except RuntimeError as e:
+                results.append(e)
+
+        # more files than the job's bounded queue holds - the feeder used to block on it forever
+        with mock.patch('secutils.dispatch.download_docs_async', side_effect=OSError('event loop died')):
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            thread.join(30)
+        self.assertFalse(thread.is_alive(), msg="Expected the run to end when its only download worker dies")
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertIn('event loop died', str(results[0]))
+
+    def test_indices_prepared_in_order(self):
+        FakeIndex.delay = 0.05
+        try:
+            self._run('thread')
+        finally:
+            FakeIndex.delay = 0.0
+        periods = [period for period, _ in FakeIndex.calls]
+        self.assertListEqual(periods, [(2017, 1), (2017, 2), (2017, 3), (2017, 4)])
+
+    def test_parallel_index_preparation(self):
+        FakeIndex.delay = 0.2
+        try:
+            start = time.monotonic()
+            num_downloaded, errors = self._run('thread', parse_workers=4)
+        finally:
+            FakeIndex.delay = 0.0
+        self.assertEqual((num_downloaded, len(errors)), (20, 0))
+        msg = 'Expected quarters to be prepared concurrently'
+        self.assertLess(max(t for _, t in FakeIndex.calls) - start, 0.6, msg)
+        self.assertListEqual(sorted(os.listdir(os.path.join(self.tmpdir, '10-K', '2017'))), ['Q1', 'Q2', 'Q3', 'Q4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
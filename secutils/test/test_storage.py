@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+from email.message import Message
+
+from secutils.edgar import File
+from secutils.utils import scan_output_dir
+from secutils.storage import AtomicDownload, PARTIAL_SUFFIX
+from secutils.mock_edgar import MockEdgarServer, synthetic_filing
+
+
+def _headers(**kwargs):
+    headers = Message()
+    for key, value in kwargs.items():
+        headers[key.replace('_', '-')] = value
+    return headers
+
+
+class TestAtomicDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, '0001437749-17-020936.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_commit_renames_into_place(self):
+        download = AtomicDownload(self.path)
+        download.start(200, _headers())
+        download.write(b'abc')
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.exists(self.path + PARTIAL_SUFFIX))
+        download.commit()
+        self.assertFalse(os.path.exists(self.path + PARTIAL_SUFFIX))
+        with open(self.path, 'rb') as infile:
+            self.assertEqual(infile.read(), b'abc')
+
+    def test_resume_appends(self):
+        with open(self.path + PARTIAL_SUFFIX, 'wb') as outfile:
+            outfile.write(b'abc')
+        download = AtomicDownload(self.path)
+        self.assertDictEqual(download.range_headers(), {'Range': 'bytes=3-'})
+        download.start(206, _headers(Content_Range='bytes 3-5/6'))
+        download.write(b'def')
+        download.commit()
+        with open(self.path, 'rb') as infile:
+            self.assertEqual(infile.read(), b'abcdef')
+
+    def test_mismatched_range_discards_partial(self):
+        with open(self.path + PARTIAL_SUFFIX, 'wb') as outfile:
+            outfile.write(b'abc')
+        download = AtomicDownload(self.path)
+        with self.assertRaises(ValueError):
+            download.start(206, _headers(Content_Range='bytes 0-5/6'))
+        self.assertFalse(os.path.exists(self.path + PARTIAL_SUFFIX))
+
+    def test_partial_not_seen(self):
+        with open(self.path + PARTIAL_SUFFIX, 'wb') as outfile:
+            outfile.write(b'abc')
+        msg = "Partial downloads should not be reported as seen files"
+        self.assertListEqual(scan_output_dir(self.tmpdir), [], msg)
+
+
+class TestFileDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.partial_url = 'edgar/data/1000230/0001437749-17-020936.txt'
+        self.file = File(form_type='10-K', company_name='OPTICAL CABLE CORP', cik_number='1000230',
+                         date_filed='2017-12-20', partial_url=self.partial_url)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_interrupted_download_resumes(self):
+        with MockEdgarServer(file_size=300000) as server:
+            path = '/Archives/' + self.partial_url
+            server.truncate[path] = 100000
+            self.file.file_download_url = server.base_url + self.partial_url
+            first = self.file.download_file(self.tmpdir)
+            final_path = os.path.join(self.tmpdir, self.file.file_name)
+            self.assertNotEqual(first, '200')
+            self.assertFalse(os.path.exists(final_path))
+            self.assertEqual(os.path.getsize(final_path + PARTIAL_SUFFIX), 100000)
+            second = self.file.download_file(self.tmpdir)
+            self.assertEqual(second, '200')
+            self.assertEqual(server.num_range_requests, 1)
+        with open(final_path, 'rb') as infile:
+            self.assertEqual(infile.read(), synthetic_filing(path, 300000))
+
+    def test_complete_partial_is_committed(self):
+        with MockEdgarServer(file_size=1000) as server:
+            path = '/Archives/' + self.partial_url
+            with open(os.path.join(self.tmpdir, self.file.file_name) + PARTIAL_SUFFIX, 'wb') as outfile:
+                outfile.write(synthetic_filing(path, 1000))
+            self.file.file_download_url = server.base_url + self.partial_url
+            msg = self.file.download_file(self.tmpdir)
+        self.assertEqual(msg, '200')
+        self.assertTrue(os.path.exists(self.file.download_file_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import io
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+import tracemalloc
+
+from secutils.submission import Submission, open_submission
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def write_submission(path, documents, header='ACCESSION NUMBER:\t\t0000000000-17-000001\nCONFORMED SUBMISSION TYPE:\t10-K\n'):
+    """write a full-submission .txt holding (type, filename, body bytes) documents"""
+    with open(path, 'wb') as outfile:
+        outfile.write(b'<SEC-DOCUMENT>0000000000-17-000001.txt : 20170101\n'
+                      b'<SEC-HEADER>0000000000-17-000001.hdr.sgml : 20170101\n' + header.encode('ascii') +
+                      b'\nFILER:\n\tCOMPANY DATA:\t\n\t\tCENTRAL INDEX KEY:\t\t\t0000001000\n</SEC-HEADER>\n')
+        for i, (doc_type, filename, body) in enumerate(documents):
+            outfile.write(f'<DOCUMENT>\n<TYPE>{doc_type}\n<SEQUENCE>{i + 1}\n<FILENAME>{filename}\n<TEXT>\n'.encode('ascii'))
+            outfile.write(body)
+            outfile.write(b'</TEXT>\n</DOCUMENT>\n')
+        outfile.write(b'</SEC-DOCUMENT>\n')
+
+
+class TestSubmission(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_documents_of_real_submission(self):
+        with Submission(os.path.join(DATA_DIR, '0001493152-18-008297.txt')) as submission:
+            fields = submission.header_fields()
+            self.assertEqual(fields['ACCESSION NUMBER'], '0001493152-18-008297', msg=str(fields))
+            self.assertEqual(fields['CONFORMED SUBMISSION TYPE'], 'S-1', msg=str(fields))
+            self.assertNotIn('CENTRAL INDEX KEY', fields, msg="Expected nested sections left out of the fields")
+            self.assertIn('CENTRAL INDEX KEY', submission.header(), msg="Expected the whole header text")
+            documents = submission.documents()
+            self.assertEqual(len(documents), 52, msg=f"Expected every <DOCUMENT> - got {len(documents)}")
+            main = submission.primary_document()
+            self.assertEqual((main.type, main.sequence, main.filename), ('S-1', 1, 'forms-1.htm'), msg=repr(main))
+            text = main.text()
+            self.assertTrue(text.startswith('<HTML>') and text.rstrip().endswith('</HTML>'), msg=text[:100])
+            self.assertNotIn('<TEXT>', text, msg="Expected the body without its tags")
+
+    def test_binary_documents_decoded(self):
+        with Submission(os.path.join(DATA_DIR, '0001493152-18-008297.txt')) as submission:
+            logo = submission.get('graphic')
+            self.assertTrue(logo.is_uuencoded, msg=repr(logo))
+            self.assertTrue(logo.content().startswith(b'\xff\xd8') and logo.content().endswith(b'\xff\xd9'),
+                            msg="Expected a complete jpeg")
+            xbrl = next(submission.select(filenames='*-xbrl.zip'))
+            with zipfile.ZipFile(io.BytesIO(xbrl.content())) as archive:
+                self.assertIn('ntva-20180331.xml', archive.namelist(), msg=str(archive.namelist()))
+            exhibit = submission.get('EX-21*')
+            self.assertFalse(exhibit.is_uuencoded, msg=repr(exhibit))
+            self.assertEqual(exhibit.content(), exhibit.raw(), msg="Expected text documents returned as is")
+
+    def test_scan_stops_at_requested_document(self):
+        with Submission(os.path.join(DATA_DIR, '0001493152-18-008297.txt')) as submission:
+            self.assertEqual(submission.get('EX-21*').sequence, 3)
+            self.assertEqual(len(submission._documents), 3, msg="Expected later documents not to be scanned yet")
+            # iterating again reuses the documents found so far and continues the scan
+            self.assertEqual([d.sequence for d in submission.select(types=['EX-23*', 'EX-5*'])], [2, 4])
+            self.assertEqual(len(submission), 52)
+
+    def test_bodies_read_only_when_accessed(self):
+        path = os.path.join(self.tmpdir, 'large.txt')
+        body = b'A' * 79 + b'\n'
+        write_submission(path, [('10-K', 'main.htm', body * 100000), ('EX-21', 'ex21.htm', b'SUBSIDIARIES\n')])
+        tracemalloc.start()
+        try:
+            with Submission(path) as submission:
+                exhibit = submission.get('EX-21')
+                self.assertEqual(exhibit.text(), 'SUBSIDIARIES\n')
+                main = submission.primary_document()
+                self.assertEqual(sum(len(chunk) for chunk in main.iter_raw()), main.size)
+                self.assertEqual(main.size, len(body) * 100000)
+                view = main.view()
+                self.assertEqual(bytes(view[:80]), body)
+                view.release()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 1 << 20, msg=f"Expected an 8 MB body not to be loaded - peak {peak} bytes")
+
+    def test_crlf_and_truncated_submission(self):
+        path = os.path.join(self.tmpdir, 'truncated.txt')
+        with open(path, 'wb') as outfile:
+            outfile.write(b'<SEC-DOCUMENT>x.txt\r\n<DOCUMENT>\r\n<TYPE>8-K\r\n<SEQUENCE>1\r\n<TEXT>\r\nbody\r\n</TEXT>\r\n'
+                          b'</DOCUMENT>\r\n<DOCUMENT>\r\n<TYPE>EX-99.1\r\n<TEXT>\r\ncut off')
+        with Submission(path) as submission:
+            first, second = submission.documents()
+            self.assertEqual((first.type, first.raw()), ('8-K', b'body\r\n'), msg=repr(first))
+            self.assertEqual((second.type, second.sequence, second.raw()), ('EX-99.1', None, b'cut off'), msg=repr(second))
+            self.assertEqual(submission.header_fields(), {}, msg="Expected no fields without a header")
+
+    def test_empty_file(self):
+        path = os.path.join(self.tmpdir, 'empty.txt')
+        open(path, 'wb').close()
+        with open_submission(path) as submission:
+            self.assertEqual((submission.documents(), submission.header()), ([], ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,8 @@ from datetime import datetime
 
 from secutils.utils import (scan_output_dir, _remove_bad_bytes, 
                             _to_quarter, ValidateFields, 
-                            _read_cik_config, generate_config)
+                            _read_cik_config, generate_config,
+                            decode_text, DecodeStats)
 
 class TestUtils(unittest.TestCase):
 
@@ -75,7 +76,32 @@ class TestUtils(unittest.TestCase):
         text_files = list(filter(lambda x: x.endswith('txt'), os.listdir(scan_dir)))
         msg = f"Expected files to be found - got {len(seen_files)} when expected {len(text_files)}"
         self.assertSequenceEqual(seen_files, text_files, msg)
-    
+
+    def test_decode_text_ascii_fast_path(self):
+        stats = DecodeStats()
+        text = decode_text(b'1000015|META GROUP INC|10-K\n1000112|CHEVY CHASE|10-K\n', stats)
+        self.assertEqual(text, '1000015|META GROUP INC|10-K\n1000112|CHEVY CHASE|10-K\n')
+        msg = f"ASCII input should not be checked by ftfy - got {stats}"
+        self.assertEqual((stats.num_lines, stats.num_checked, stats.num_repaired), (2, 0, 0), msg)
+
+    def test_decode_text_repairs_only_broken_lines(self):
+        stats = DecodeStats()
+        raw = 'A|PLAIN CO\nB|CAFÃ© HOLDINGS\nC|NAÏVE CORP\nD|PLAIN CO\n'.encode('utf-8')
+        text = decode_text(raw, stats)
+        self.assertEqual(text, 'A|PLAIN CO\nB|CAFé HOLDINGS\nC|NAÏVE CORP\nD|PLAIN CO\n')
+        msg = f"Expected two non-ASCII lines checked and one repaired - got {stats}"
+        self.assertEqual((stats.num_checked, stats.num_repaired, stats.num_fallback), (2, 1, 0), msg)
+
+    def test_decode_text_invalid_utf8_falls_back(self):
+        stats = DecodeStats()
+        text = decode_text(b'A|CAF\xc9 CORP\nB|PLAIN CO', stats)
+        self.assertEqual(text, 'A|CAFÉ CORP\nB|PLAIN CO')
+        self.assertEqual((stats.num_checked, stats.num_fallback), (1, 1))
+
+    def test_remove_bad_bytes(self):
+        lines = _remove_bad_bytes([b'PLAIN CO \n', b'CAF\xc9', 'CAFÃ©'.encode('utf-8')])
+        self.assertListEqual(lines, ['PLAIN CO', 'CAFé'])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,4 +1,6 @@
 import os
+import re
+import numbers
 import argparse
 from pathlib import Path
 from typing import Union, List, Optional
@@ -6,6 +8,12 @@ from datetime import datetime
 
 import ftfy
 import yaml
+import pandas as pd
+
+from secutils.storage import DOCUMENTS_NAME
+from secutils.compression import strip_compression_suffix
+from secutils.packs import PACK_INDEX_NAME, read_pack_index
+from secutils.profiling import PROFILE_DIR_PREFIX
 
 
 def generate_config(fpath: Optional[str]=None) -> str:
@@ -24,7 +32,23 @@ def generate_config(fpath: Optional[str]=None) -> str:
         ciks=[129012312, 123219041, 120831241],
         start_year=1995,
         end_year=2019,
-        quarters=-1
+        quarters=-1,
+        max_rps=10,
+        engine='thread',
+        max_connections=10,
+        cache_format='auto',
+        max_attempts=4,
+        memory_cache_mb=256,
+        cache_max_mb=None,
+        index_workers=4,
+        coordinate=False,
+        lease_seconds=300,
+        metrics_json=None,
+        metrics_prom=None,
+        metrics_interval=30,
+        documents=None,
+        compression=None,
+        pack=False
     )
 
     with open(full_fpath, 'w') as outfile:
@@ -44,6 +68,22 @@ def yaml_config_to_args(args: argparse.Namespace) -> argparse.Namespace:
         start_year = config.get('start_year', None)
         end_year = config.get('end_year', None)
         quarters = config.get('quarters', None)
+        max_rps = config.get('max_rps', None)
+        engine = config.get('engine', None)
+        max_connections = config.get('max_connections', None)
+        cache_format = config.get('cache_format', None)
+        max_attempts = config.get('max_attempts', None)
+        memory_cache_mb = config.get('memory_cache_mb', None)
+        cache_max_mb = config.get('cache_max_mb', None)
+        index_workers = config.get('index_workers', None)
+        coordinate = config.get('coordinate', None)
+        lease_seconds = config.get('lease_seconds', None)
+        metrics_json = config.get('metrics_json', None)
+        metrics_prom = config.get('metrics_prom', None)
+        metrics_interval = config.get('metrics_interval', None)
+        documents = config.get('documents', None)
+        compression = config.get('compression', None)
+        pack = config.get('pack', None)
         
         if log_level:
             args.log_level = log_level  
@@ -61,13 +101,57 @@ def yaml_config_to_args(args: argparse.Namespace) -> argparse.Namespace:
             args.end_year = end_year
         if quarters:
             args.quarters = quarters
+        if max_rps:
+            args.max_rps = max_rps
+        if engine:
+            args.engine = engine
+        if max_connections:
+            args.max_connections = max_connections
+        if cache_format:
+            args.cache_format = cache_format
+        if max_attempts:
+            args.max_attempts = max_attempts
+        # 0 is a valid budget - it disables the in-memory cache
+        if memory_cache_mb is not None:
+            args.memory_cache_mb = memory_cache_mb
+        if cache_max_mb is not None:
+            args.cache_max_mb = cache_max_mb
+        if index_workers is not None:
+            args.index_workers = index_workers
+        if coordinate is not None:
+            args.coordinate = coordinate
+        if lease_seconds is not None:
+            args.lease_seconds = lease_seconds
+        if metrics_json:
+            args.metrics_json = metrics_json
+        if metrics_prom:
+            args.metrics_prom = metrics_prom
+        if metrics_interval:
+            args.metrics_interval = metrics_interval
+        if documents:
+            args.documents = documents
+        if compression:
+            args.compression = compression
+        if pack is not None:
+            args.pack = pack
             
     return args
 
 def scan_output_dir(output_dir: Path) -> List[str]:
     seen_files = []
-    for root, dirs, files in os.walk(output_dir, topdown=False):
+    for root, dirs, files in os.walk(output_dir):
+        # profiler output of a run started inside output_dir
+        dirs[:] = [name for name in dirs if not name.startswith(PROFILE_DIR_PREFIX)]
+        if DOCUMENTS_NAME in files:
+            # documents selected from a single filing - seen under the name of its full submission
+            seen_files.append(os.path.basename(root) + '.txt')
+            continue
+        if PACK_INDEX_NAME in files:
+            # one index instead of a file per filing - see secutils.packs
+            seen_files.extend(entry.file_name for entry in read_pack_index(os.path.join(root, PACK_INDEX_NAME)))
         for name in files:
+            # compressed filings are seen under their uncompressed name
+            name = strip_compression_suffix(name)
             if name.endswith('.txt') or name.endswith('.html'):
                 seen_files.append(name)
     return seen_files
@@ -84,18 +168,93 @@ def _read_cik_config(cik_path: str) -> List[int]:
         ciks = [ValidateFields.validate_cik(cik.replace('\n', '')) for cik in lines]
     return ciks
 
+# any character outside ASCII - includes the lone surrogates standing in for undecodable bytes
+_NON_ASCII = re.compile('[^\x00-\x7f]')
+
 def _remove_bad_bytes(lines: List[bytes]) -> List[str]:
     cleanlines = []
     for l in lines:
         try:
             l = l.decode('utf-8')
-            l = ftfy.fix_text(l).replace('\n', '').strip()
-            cleanlines.append(l)
         except UnicodeDecodeError:
             continue
+        # plain ASCII has nothing for ftfy to repair
+        if _NON_ASCII.search(l):
+            l = ftfy.fix_text(l)
+        cleanlines.append(l.replace('\n', '').strip())
     return cleanlines
 
 
+class DecodeStats(object):
+    """line counters updated by decode_text - seconds is accumulated by callers timing their decodes"""
+    __slots__ = ('num_lines', 'num_checked', 'num_repaired', 'num_fallback', 'seconds')
+
+    def __init__(self) -> None:
+        self.num_lines = 0
+        self.num_checked = 0
+        self.num_repaired = 0
+        self.num_fallback = 0
+        self.seconds = 0.0
+
+    def __repr__(self) -> str:
+        return (f'DecodeStats(num_lines={self.num_lines}, num_checked={self.num_checked}, '
+                f'num_repaired={self.num_repaired}, num_fallback={self.num_fallback})')
+
+
+def decode_text(raw: bytes, stats: Optional[DecodeStats]=None) -> str:
+    """
+    Tiered decode of downloaded text. Pure ASCII is decoded directly; otherwise only the lines holding
+    non-ASCII characters go through ftfy. Lines that are not valid UTF-8 are read as latin-1 before
+    repair rather than dropped.
+
+    Args:
+        raw: downloaded bytes
+        stats: optional DecodeStats updated with line, repair and fallback counts
+    """
+    stats = stats if stats is not None else DecodeStats()
+    # a trailing newline ends the last line rather than starting another - blocks of whole lines add up
+    stats.num_lines += raw.count(b'\n') + (not raw.endswith(b'\n'))
+    try:
+        # pure ASCII - bytes.isascii needs Python 3.7
+        return raw.decode('ascii')
+    except UnicodeDecodeError:
+        pass
+    text = raw.decode('utf-8', errors='surrogateescape')
+    pieces, pos, end = [], 0, 0
+    for match in _NON_ASCII.finditer(text):
+        if match.start() < end:
+            # on a line that was already repaired
+            continue
+        start = text.rfind('\n', 0, match.start()) + 1
+        end = text.find('\n', match.start())
+        end = len(text) if end < 0 else end
+        line = text[start:end]
+        stats.num_checked += 1
+        try:
+            line.encode('utf-8')
+        except UnicodeEncodeError:
+            line = line.encode('utf-8', errors='surrogateescape').decode('latin-1')
+            stats.num_fallback += 1
+        fixed = ftfy.fix_text(line)
+        if fixed != line:
+            stats.num_repaired += 1
+        pieces.append(text[pos:start])
+        pieces.append(fixed)
+        pos = end
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+
+def _strip_column(column: pd.Series) -> pd.Series:
+    """strip whitespace - categoricals are stripped once per category instead of once per row"""
+    if not isinstance(column.dtype, pd.CategoricalDtype):
+        return column.str.strip()
+    stripped = column.cat.categories.str.strip()
+    categories = stripped.unique()
+    codes = categories.get_indexer(stripped)[column.cat.codes.values]
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=column.index, name=column.name)
+
+
 def _to_quarter(month: int) -> str:
     if month > 0 and month <= 3:
         quarter = 'Q1'
@@ -109,9 +268,13 @@ def _to_quarter(month: int) -> str:
 
 
 class ValidateFields(object):
+    __slots__ = ()
 
     @staticmethod
     def validate_date_filed(date_filed: str) -> datetime:
+        if isinstance(date_filed, datetime):
+            # typed indices hold pd.Timestamp values
+            return datetime(date_filed.year, date_filed.month, date_filed.day)
         date_filed = date_filed.strip()
         try:
             date_filed = datetime.strptime(date_filed, '%Y-%m-%d')
@@ -127,6 +290,8 @@ class ValidateFields(object):
                 cik = int(cik)
             except ValueError:
                 raise ValueError(f'VALIDATION ERROR: cik: {cik} is not integers')
+        elif isinstance(cik, numbers.Integral):
+            cik = int(cik)
         assert isinstance(cik, int)
         return cik
 